@@ -0,0 +1,72 @@
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlsplit
+
+from lib._utils import db_connect, db_connect_read, json_response, get_bearer_token, get_user_by_token, cors_preflight
+from lib._metrics import MetricsMixin
+from lib import _analytics
+
+
+class handler(MetricsMixin, BaseHTTPRequestHandler):
+    def _route(self):
+        # /api/admin/<route> is rewritten to /api/admin?route=<route>
+        return (parse_qs(urlsplit(self.path).query).get('route', [''])[0] or '').strip('/').lower()
+
+    def _admin(self):
+        token = get_bearer_token(self)
+        user = get_user_by_token(token) if token else None
+        return user if user and user.get('is_admin') else None
+
+    def _ensure_views(self):
+        conn = db_connect()
+        if not conn:
+            return False
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    _analytics.ensure_analytics_schema(cur)
+            return True
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def do_GET(self):
+        route = self._route()
+        if not route.startswith('stats/'):
+            return json_response(self, 404, { 'ok': False, 'error': 'Unknown admin route' })
+        name = route[len('stats/'):]
+        if name not in _analytics.STATS:
+            return json_response(self, 404, { 'ok': False, 'error': 'Unknown stat' })
+        if not self._admin():
+            return json_response(self, 403, { 'ok': False, 'error': 'Admin authorization required' })
+        try:
+            params = _analytics.stat_params(parse_qs(urlsplit(self.path).query))
+        except ValueError:
+            return json_response(self, 400, { 'ok': False, 'error': 'limit and days must be integers' })
+        if not self._ensure_views():
+            return json_response(self, 503, { 'ok': False, 'error': 'Database connection failed' })
+        conn = db_connect_read()
+        if not conn:
+            return json_response(self, 503, { 'ok': False, 'error': 'Database connection failed' })
+        try:
+            body = _analytics.read_stat(conn, name, params)
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        return json_response(self, 200, body, { 'Cache-Control': 'private, max-age=30' })
+
+    def do_POST(self):
+        # No background thread on Vercel: an admin (or a scheduled job) refreshes explicitly
+        if self._route() != 'stats/refresh':
+            return json_response(self, 404, { 'ok': False, 'error': 'Unknown admin route' })
+        if not self._admin():
+            return json_response(self, 403, { 'ok': False, 'error': 'Admin authorization required' })
+        if not self._ensure_views():
+            return json_response(self, 503, { 'ok': False, 'error': 'Database connection failed' })
+        return json_response(self, 200, { 'ok': True, 'refreshed': _analytics.refresh(db_connect) })
+
+    def do_OPTIONS(self):
+        return cors_preflight(self)
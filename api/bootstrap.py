@@ -0,0 +1,48 @@
+from http.server import BaseHTTPRequestHandler
+import json
+from urllib.parse import parse_qs, urlsplit
+
+from lib._utils import db_connect, json_response, get_bearer_token, cors_preflight
+from lib._schema import ensure_schema
+from lib._metrics import MetricsMixin
+from lib import _bootstrap
+from lib import _grading
+
+
+class handler(MetricsMixin, BaseHTTPRequestHandler):
+    def do_GET(self):
+        ensure_schema()
+        token = get_bearer_token(self)
+        query = parse_qs(urlsplit(self.path).query)
+        names = _bootstrap.requested(query, bool(token))
+        # No in-process catalog cache here: session, position and modules share one connection
+        conn = db_connect()
+        if not conn:
+            return json_response(self, 503, { 'ok': False, 'error': 'Database connection failed' })
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    user, position = _bootstrap.fetch(cur, token) if token else (None, None)
+                    mods = None
+                    if 'catalog' in names:
+                        cur.execute("SELECT data FROM module_store WHERE id = %s", ('custom_modules',))
+                        row = cur.fetchone()
+                        if row and row[0] is not None:
+                            mods = row[0] if isinstance(row[0], (list, dict)) else json.loads(row[0])
+        except Exception:
+            return json_response(self, 503, { 'ok': False, 'error': 'Database query failed' })
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        if token and not user:
+            return json_response(self, 401, { 'ok': False, 'error': 'Unauthorized' })
+        body = _bootstrap.build(
+            names, _bootstrap.known_etags(self.headers.get('If-None-Match')), user, position,
+            _grading.Catalog(mods) if 'catalog' in names else None,
+        )
+        return json_response(self, 200, body, { 'Cache-Control': 'no-store' })
+
+    def do_OPTIONS(self):
+        return cors_preflight(self)
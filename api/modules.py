@@ -1,12 +1,19 @@
 from http.server import BaseHTTPRequestHandler
 import json
+from urllib.parse import parse_qs, urlsplit
 
-from lib._utils import db_connect, json_response, get_bearer_token, get_user_by_token, cors_preflight
+from lib._utils import db_connect, db_connect_read, json_response, get_bearer_token, get_user_by_token, cors_preflight
 from lib._schema import ensure_schema
+from lib._metrics import MetricsMixin
+from lib import _dbroute
+from lib import _deadline
+from lib import _grading
+from lib import _invalidation
+from lib import _notify
 
 
-def _fetch_modules():
-    conn = db_connect()
+def _fetch_modules(read_only=True):
+    conn = db_connect_read(_dbroute.MODULES) if read_only else db_connect()
     if not conn:
         return None
     try:
@@ -26,7 +33,7 @@ def _fetch_modules():
             pass
 
 
-def _upsert_modules(mods):
+def _upsert_modules(mods, added=()):
     conn = db_connect()
     if not conn:
         return False
@@ -41,6 +48,8 @@ def _upsert_modules(mods):
                     """,
                     ('custom_modules', json.dumps(mods))
                 )
+                _invalidation.modules_changed(cur)
+                _notify.announce_modules(cur, list(added))
                 return True
     except Exception:
         return False
@@ -51,7 +60,7 @@ def _upsert_modules(mods):
             pass
 
 
-class handler(BaseHTTPRequestHandler):
+class handler(MetricsMixin, BaseHTTPRequestHandler):
     def do_GET(self):
         # Ensure schema exists for module_store
         ensure_schema()
@@ -59,11 +68,24 @@ class handler(BaseHTTPRequestHandler):
         data = _fetch_modules()
         if data is None:
             return json_response(self, 503, { 'ok': False, 'error': 'Database unavailable' })
-        return json_response(self, 200, data if isinstance(data, list) else [])
+        mods = data if isinstance(data, list) else []
+        params = parse_qs(urlsplit(self.path).query)
+        if params.get('full', [''])[0] in ('1', 'true'):
+            # Admin editor needs the answers to re-publish them
+            token = get_bearer_token(self)
+            user = get_user_by_token(token) if token else None
+            if not user or not user.get('is_admin'):
+                return json_response(self, 403, { 'ok': False, 'error': 'Admin required' })
+            return json_response(self, 200, mods)
+        return json_response(self, 200, _grading.strip_answers(mods))
 
     def do_POST(self):
         # Ensure schema exists for module_store
         ensure_schema()
+        # /api/modules/<id>/submit is rewritten to /api/modules?submit=<id>
+        submit_id = parse_qs(urlsplit(self.path).query).get('submit', [''])[0]
+        if submit_id:
+            return self._submit(submit_id.lower())
         # Require admin via Bearer token, then upsert modules array
         token = get_bearer_token(self)
         user = get_user_by_token(token) if token else None
@@ -80,8 +102,54 @@ class handler(BaseHTTPRequestHandler):
         if not isinstance(payload, list):
             return json_response(self, 400, { 'ok': False, 'error': 'Expected an array of modules' })
 
-        ok = _upsert_modules(payload)
-        return json_response(self, 200 if ok else 503, { 'ok': ok })
+        previous = _fetch_modules(read_only=False)
+        added = _notify.new_module_ids(previous if isinstance(previous, list) else [], payload)
+        ok = _upsert_modules(payload, added)
+        body = { 'ok': ok }
+        if ok and added:
+            # No background threads here: spend a bounded slice of the request on
+            # the queued fan-out; /api/notifications/fanout (cron) resumes the rest
+            body['fanout_pending'] = _notify.fan_out_pending(db_connect, _deadline.timeout(_notify.NOTIFY_REQUEST_SECONDS))
+        return json_response(self, 200 if ok else 503, body)
+
+    def _submit(self, module_id):
+        token = get_bearer_token(self)
+        user = get_user_by_token(token) if token else None
+        if not user:
+            return json_response(self, 401, { 'ok': False, 'error': 'Unauthorized' })
+        try:
+            length = int(self.headers.get('Content-Length', '0'))
+            raw = self.rfile.read(length)
+            answers = json.loads(raw.decode('utf-8') or '{}')
+        except Exception as e:
+            return json_response(self, 400, { 'ok': False, 'error': f'Invalid JSON: {e}' })
+        if not isinstance(answers, dict):
+            return json_response(self, 400, { 'ok': False, 'error': 'Expected an object of answers' })
+
+        entry = _grading.build_answer_index(_fetch_modules() or []).get(module_id)
+        if not entry:
+            return json_response(self, 404, { 'ok': False, 'error': 'Unknown module' })
+        graded = _grading.grade(entry, answers)
+        body = { 'ok': True, 'complete': graded['complete'], 'results': graded['results'], 'awarded': None }
+        if graded['complete'] and answers.get('finish'):
+            conn = db_connect()
+            if not conn:
+                return json_response(self, 503, { 'ok': False, 'error': 'Database connection failed' })
+            try:
+                award = _grading.award_completion(conn, user['id'], module_id, entry)
+            except Exception:
+                return json_response(self, 503, { 'ok': False, 'error': 'Could not record completion' })
+            finally:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            if award:
+                body['awarded'] = { 'xp': award['xp'], 'coins': award['coins'] }
+                body['user'] = { k: award[k] for k in ('xp_total', 'level_idx', 'xp_in_level', 'wallet') }
+            else:
+                body['already_completed'] = True
+        return json_response(self, 200, body)
 
     def do_PUT(self):
         # Method not allowed
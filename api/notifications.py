@@ -0,0 +1,91 @@
+from http.server import BaseHTTPRequestHandler
+import hmac
+import json
+import os
+from urllib.parse import parse_qs, urlsplit
+
+from lib._utils import db_connect, db_connect_read, json_response, get_bearer_token, get_user_by_token, cors_preflight
+from lib._schema import ensure_schema
+from lib._metrics import MetricsMixin
+from lib import _deadline
+from lib import _notify
+
+
+class handler(MetricsMixin, BaseHTTPRequestHandler):
+    def _route(self):
+        # /api/notifications/<route> is rewritten to /api/notifications?route=<route>
+        return (parse_qs(urlsplit(self.path).query).get('route', [''])[0] or '').strip('/').lower()
+
+    def _user(self):
+        token = get_bearer_token(self)
+        return get_user_by_token(token) if token else None
+
+    def _fanout(self):
+        # Vercel Cron sends `Authorization: Bearer $CRON_SECRET`; admins may call it too
+        token = get_bearer_token(self)
+        secret = os.environ.get('CRON_SECRET') or ''
+        if not token or not (secret and hmac.compare_digest(token, secret)):
+            user = get_user_by_token(token) if token else None
+            if not user or not user.get('is_admin'):
+                return json_response(self, 403, { 'ok': False, 'error': 'Admin required' })
+        pending = _notify.fan_out_pending(db_connect, _deadline.timeout(_notify.NOTIFY_REQUEST_SECONDS))
+        return json_response(self, 200, { 'ok': True, 'pending': pending }, { 'Cache-Control': 'no-store' })
+
+    def do_GET(self):
+        ensure_schema()
+        if self._route() == 'fanout':
+            return self._fanout()
+        user = self._user()
+        if not user:
+            return json_response(self, 401, { 'ok': False, 'error': 'Unauthorized' })
+        params = parse_qs(urlsplit(self.path).query)
+        try:
+            cursor = int(params.get('cursor', ['0'])[0] or 0)
+            limit = int(params.get('limit', [str(_notify.PAGE_SIZE)])[0])
+        except ValueError:
+            return json_response(self, 400, { 'ok': False, 'error': 'cursor and limit must be integers' })
+        conn = db_connect_read(user['id'])
+        if not conn:
+            return json_response(self, 503, { 'ok': False, 'error': 'Database connection failed' })
+        try:
+            if self._route() == 'unread':
+                body = { 'unread': _notify.unread_count(conn, user['id']) }
+            else:
+                body = _notify.feed(conn, user['id'], cursor or None, limit)
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        return json_response(self, 200, body, { 'Cache-Control': 'no-store' })
+
+    def do_POST(self):
+        if self._route() != 'read':
+            return json_response(self, 404, { 'ok': False, 'error': 'Unknown notifications route' })
+        ensure_schema()
+        user = self._user()
+        if not user:
+            return json_response(self, 401, { 'ok': False, 'error': 'Unauthorized' })
+        try:
+            length = int(self.headers.get('Content-Length', '0'))
+            raw = self.rfile.read(length)
+            payload = json.loads(raw.decode('utf-8') or '{}')
+        except Exception as e:
+            return json_response(self, 400, { 'ok': False, 'error': f'Invalid JSON: {e}' })
+        ids = None if payload.get('all') is True else payload.get('ids', [])
+        if ids is not None and not isinstance(ids, list):
+            return json_response(self, 400, { 'ok': False, 'error': 'ids must be a list' })
+        conn = db_connect()
+        if not conn:
+            return json_response(self, 503, { 'ok': False, 'error': 'Database connection failed' })
+        try:
+            unread = _notify.mark_read(conn, user['id'], ids)
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        return json_response(self, 200, { 'ok': True, 'unread': unread })
+
+    def do_OPTIONS(self):
+        return cors_preflight(self)
@@ -0,0 +1,82 @@
+from http.server import BaseHTTPRequestHandler
+import json
+from urllib.parse import parse_qs, urlsplit
+
+from lib._utils import db_connect, db_connect_read, json_response, get_bearer_token, get_user_by_token, cors_preflight
+from lib._schema import ensure_schema
+from lib._metrics import MetricsMixin
+from lib import _wallet
+
+
+class handler(MetricsMixin, BaseHTTPRequestHandler):
+    def _route(self):
+        # /api/rewards/<route> is rewritten to /api/rewards?route=<route>
+        return (parse_qs(urlsplit(self.path).query).get('route', [''])[0] or '').strip('/').lower()
+
+    def do_GET(self):
+        route = self._route()
+        if route == 'history':
+            token = get_bearer_token(self)
+            user = get_user_by_token(token) if token else None
+            if not user:
+                return json_response(self, 401, { 'ok': False, 'error': 'Unauthorized' })
+            try:
+                limit = int(parse_qs(urlsplit(self.path).query).get('limit', ['50'])[0])
+            except ValueError:
+                limit = 50
+            conn = db_connect_read(user['id'])
+            if not conn:
+                return json_response(self, 503, { 'ok': False, 'error': 'Database connection failed' })
+            try:
+                entries = _wallet.history(conn, user['id'], limit)
+            finally:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            return json_response(self, 200, { 'wallet': user.get('wallet', 0), 'entries': entries })
+        items = sorted(_wallet.get_rewards(db_connect_read).values(), key=lambda r: (r['cost'], r['id']))
+        return json_response(self, 200, { 'rewards': items })
+
+    def do_POST(self):
+        if self._route() != 'redeem':
+            return json_response(self, 404, { 'ok': False, 'error': 'Unknown rewards route' })
+        ensure_schema()
+        token = get_bearer_token(self)
+        user = get_user_by_token(token) if token else None
+        if not user:
+            return json_response(self, 401, { 'ok': False, 'error': 'Unauthorized' })
+        try:
+            length = int(self.headers.get('Content-Length', '0'))
+            raw = self.rfile.read(length)
+            payload = json.loads(raw.decode('utf-8') or '{}')
+            reward_id = (payload.get('reward_id') or '').strip()
+            key = (self.headers.get('Idempotency-Key') or payload.get('idempotency_key') or '').strip()
+        except Exception as e:
+            return json_response(self, 400, { 'ok': False, 'error': f'Invalid JSON: {e}' })
+        if not reward_id:
+            return json_response(self, 400, { 'ok': False, 'error': 'Provide reward_id' })
+        if not _wallet.valid_client_key(key):
+            return json_response(self, 400, { 'ok': False, 'error': 'Provide an Idempotency-Key of 1-128 letters, digits, ".", "_" or "-"' })
+
+        reward = _wallet.get_rewards(db_connect).get(reward_id)
+        if not reward:
+            return json_response(self, 404, { 'ok': False, 'error': 'Unknown reward' })
+        conn = db_connect()
+        if not conn:
+            return json_response(self, 503, { 'ok': False, 'error': 'Database connection failed' })
+        try:
+            redemption, replayed = _wallet.redeem(conn, user['id'], reward, key)
+        except _wallet.InsufficientFunds as e:
+            return json_response(self, 409, { 'ok': False, 'error': 'Not enough coins', 'wallet': e.balance })
+        except _wallet.KeyReused:
+            return json_response(self, 422, { 'ok': False, 'error': 'Idempotency-Key already used for another reward' })
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        return json_response(self, 200, { 'ok': True, 'replayed': replayed, 'redemption': redemption, 'wallet': redemption['balance'] })
+
+    def do_OPTIONS(self):
+        return cors_preflight(self)
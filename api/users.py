@@ -4,6 +4,7 @@ from lib.users.verify import handler as verify_handler
 from lib.users.verify.start import handler as verify_start_handler
 from lib.users.me import handler as me_handler
 from lib.users.progress import handler as progress_handler
+from lib.users.sync import handler as sync_handler
 
 def handler(request):
     route = None
@@ -44,6 +45,8 @@ def handler(request):
             return me_handler(request)
         if route == 'progress':
             return progress_handler(request)
+        if route == 'sync':
+            return sync_handler(request)
 
         return {
             'statusCode': 404,
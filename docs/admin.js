@@ -0,0 +1,525 @@
+// TOPCIT Quest - Admin page: module list, publishing and the content editor
+// Simple admin gate using localStorage
+const ADMIN_SESSION_KEY = 'topcit_admin_session';
+const STORAGE_KEY = 'topcit_admin_modules';
+const PUBLISH_KEY = 'topcit_custom_modules';
+
+function isAdmin(){
+  try{
+    const uRaw = localStorage.getItem('topcit_user');
+    const u = uRaw ? JSON.parse(uRaw) : null;
+    if(u && u.is_admin) return true;
+    return false;
+  }catch(_){ return false; }
+}
+function readModules(){ try{ return JSON.parse(localStorage.getItem(STORAGE_KEY) || '[]'); }catch(_){ return []; } }
+function saveModules(mods){ try{ localStorage.setItem(STORAGE_KEY, JSON.stringify(mods)); }catch(_){} }
+async function publishModules(){
+  const mods = readModules();
+  // Always keep localStorage for offline fallback
+  try{ localStorage.setItem(PUBLISH_KEY, JSON.stringify(mods)); }catch(_){}
+  // Attempt to publish to backend API if available
+  try{
+    let authHeader = {};
+    try{
+      const raw = localStorage.getItem('topcit_user');
+      const u = raw ? JSON.parse(raw) : null;
+      if(u && u.token){ authHeader = { 'Authorization': `Bearer ${u.token}` } }
+    }catch(_){ /* no-op */ }
+    const res = await fetch('/api/modules', {
+      method: 'POST',
+      headers: Object.assign({ 'Content-Type': 'application/json' }, authHeader),
+      body: JSON.stringify(mods)
+    });
+    if(res.ok){
+      const info = await res.json().catch(()=>({ok:true}));
+      console.log('Published to API:', info);
+      // notify
+      const toast = document.getElementById('toast-container');
+      if(toast){
+        const el = document.createElement('div');
+        el.className = 'toast success';
+        el.textContent = 'Published quests to server.';
+        toast.appendChild(el);
+        setTimeout(()=>{ el.remove(); }, 2500);
+      }
+    }else{
+      console.warn('API publish failed:', res.status);
+    }
+  }catch(err){ console.warn('API publish error:', err); }
+}
+
+function slugify(str){ return (str||'').toLowerCase().trim().replace(/[^a-z0-9]+/g,'-').replace(/^-+|-+$/g,''); }
+
+function renderModules(){
+  const list = document.getElementById('modules-list');
+  const mods = readModules();
+  list.innerHTML = '';
+  if(mods.length === 0){
+    const p = document.createElement('p');
+    p.className = 'muted';
+    p.textContent = 'No modules yet.';
+    list.appendChild(p);
+    return;
+  }
+  // Map difficulty label to CSS chip class used across the site
+  const diffClassFor = (label)=>{
+    const k = String(label||'').toLowerCase();
+    if(k.includes('impossible')) return 'diff-impossible';
+    if(k.includes('expert')) return 'diff-expert';
+    if(k.includes('advanced')) return 'diff-advanced';
+    if(k.includes('intermediate')) return 'diff-intermediate';
+    return 'diff-beginner';
+  };
+  mods.forEach((m, idx)=>{
+    const card = document.createElement('article');
+    card.className = 'card module-card';
+    const c = m.content || {};
+    const quiz = c.quiz || {};
+    const bullets = Array.isArray(c.bullets) ? c.bullets.join('\n') : '';
+    const refl = c.reflection || '';
+    const ctf = c.ctf || {};
+    const code = c.codeFill || {};
+    const diffCls = diffClassFor(m.difficulty||'Beginner');
+    card.innerHTML = `
+      <div class="thumb-wrap"><img class="learn-thumb" src="${m.image||'images/topics/programming.svg'}" alt="${m.title} thumbnail"></div>
+      <h4>${m.title}</h4>
+      <p>${m.description||''}</p>
+      <div class="meta"><span class="chip ${diffCls}" data-difficulty>${m.difficulty||'Beginner'}</span><span class="chip blue">XP ${m.xp||0}</span><span class="chip orange">Coins ${m.coins||0}</span></div>
+      <div class="course-actions">
+        <button class="btn" data-delete="${idx}">Delete</button>
+        <button class="btn" data-publish="${idx}">Publish to Learn</button>
+        <button class="btn primary" data-edit="${idx}">Edit Content</button>
+      </div>
+    `;
+    list.appendChild(card);
+  });
+  // Bind delete buttons
+  list.querySelectorAll('[data-delete]').forEach(btn=>{
+    btn.addEventListener('click', ()=>{
+      const idx = parseInt(btn.getAttribute('data-delete'),10);
+      const mods = readModules();
+      mods.splice(idx,1);
+      saveModules(mods);
+      renderModules();
+    });
+  });
+  // Bind per-module Publish
+  list.querySelectorAll('[data-publish]').forEach(btn=>{
+    btn.addEventListener('click', ()=>{
+      publishModules();
+      const chip = document.createElement('span');
+      chip.className = 'chip green';
+      chip.textContent = 'Published! Check Learn page.';
+      btn.parentElement?.appendChild(chip);
+      setTimeout(()=> chip.remove(), 3000);
+    });
+  });
+  // Bind modal editor open
+  list.querySelectorAll('[data-edit]').forEach(btn=>{
+    btn.addEventListener('click', ()=>{
+      const idx = parseInt(btn.getAttribute('data-edit'),10);
+      openContentEditor(idx);
+    });
+  });
+}
+
+function showBuilder(){
+  const login = document.getElementById('admin-login');
+  const builder = document.getElementById('admin-builder');
+  const stats = document.getElementById('admin-stats');
+  login.style.display = 'none';
+  login.setAttribute('aria-hidden','true');
+  builder.style.display = '';
+  builder.setAttribute('aria-hidden','false');
+  stats.style.display = '';
+  stats.setAttribute('aria-hidden','false');
+  loadStats();
+}
+
+// ---- Analytics (GET /api/admin/stats/*) ----
+function authHeaders(){
+  try{
+    const u = JSON.parse(localStorage.getItem('topcit_user') || 'null');
+    return (u && u.token) ? { 'Authorization': `Bearer ${u.token}` } : {};
+  }catch(_){ return {}; }
+}
+function statAge(seconds){
+  if(seconds == null) return 'Not refreshed yet';
+  if(seconds < 90) return 'Updated just now';
+  if(seconds < 5400) return `Updated ${Math.round(seconds/60)} min ago`;
+  return `Updated ${Math.round(seconds/3600)} h ago`;
+}
+function statCell(text, cls){
+  const td = document.createElement('td');
+  if(cls) td.className = cls;
+  td.textContent = text;
+  return td;
+}
+function barCell(value, max){
+  const td = document.createElement('td');
+  const bar = document.createElement('div');
+  bar.className = 'stat-bar';
+  bar.style.width = `${max ? Math.round(100 * value / max) : 0}%`;
+  td.appendChild(bar);
+  return td;
+}
+function renderStat(name, body){
+  const age = document.querySelector(`[data-stat-age="${name}"]`);
+  if(age) age.textContent = statAge(body.age_seconds);
+  const tbody = document.getElementById(`stat-${name}`);
+  if(!tbody) return;
+  tbody.innerHTML = '';
+  const rows = body.rows || [];
+  const max = Math.max(0, ...rows.map(r => r.learners || 0));
+  rows.forEach(r => {
+    const tr = document.createElement('tr');
+    if(name === 'modules'){
+      tr.append(statCell(r.course_id), statCell(String(r.learners), 'num'), statCell(String(r.completions), 'num'));
+    }else if(name === 'active'){
+      tr.append(statCell(r.day), barCell(r.learners, max), statCell(String(r.learners), 'num'));
+    }else{
+      tr.append(statCell(`${r.xp_from}–${r.xp_to - 1} XP`), barCell(r.learners, max), statCell(String(r.learners), 'num'));
+    }
+    tbody.appendChild(tr);
+  });
+  if(!rows.length){
+    const tr = document.createElement('tr');
+    tr.appendChild(statCell('No data yet.'));
+    tbody.appendChild(tr);
+  }
+}
+async function loadStats(){
+  const query = { modules: '?limit=20', active: '?days=30', xp: '' };
+  await Promise.all(Object.keys(query).map(async name => {
+    try{
+      const res = await fetch(`/api/admin/stats/${name}${query[name]}`, { headers: authHeaders() });
+      if(res.ok) renderStat(name, await res.json());
+    }catch(_){ /* offline or static host: leave the panel empty */ }
+  }));
+}
+async function refreshStats(){
+  const btn = document.getElementById('stats-refresh');
+  if(btn) btn.disabled = true;
+  try{
+    await fetch('/api/admin/stats/refresh', { method: 'POST', headers: authHeaders() });
+    await loadStats();
+  }catch(_){ /* no-op */ }
+  finally{ if(btn) btn.disabled = false; }
+}
+function showLogin(){
+  const login = document.getElementById('admin-login');
+  const builder = document.getElementById('admin-builder');
+  builder.style.display = 'none';
+  builder.setAttribute('aria-hidden','true');
+  login.style.display = '';
+  login.setAttribute('aria-hidden','false');
+}
+
+function setBanner(msg){
+  const b = document.getElementById('admin-banner');
+  if(!b) return;
+  if(msg){ b.textContent = msg; b.style.display = 'inline-flex'; }
+  else { b.style.display = 'none'; b.textContent = ''; }
+}
+
+window.addEventListener('load', ()=>{
+  // Gate + banners
+  try{
+    const raw = localStorage.getItem('topcit_user');
+    const u = raw ? JSON.parse(raw) : null;
+    // Redirect to general login when not logged in
+    if(!u){ window.location.href = 'login.html'; return; }
+    if(u && u.email_verified === false){ setBanner('Your email is not verified. Some actions may be restricted.'); }
+    else { setBanner(''); }
+    if(isAdmin()) showBuilder(); else {
+      if(u && !u.is_admin){ setBanner('You are not an admin. Access is limited to module viewing only.'); }
+      showLogin();
+    }
+  }catch(_){ if(isAdmin()) showBuilder(); else showLogin(); }
+
+  // Admin login removed — use general login page
+
+  const statsBtn = document.getElementById('stats-refresh');
+  if(statsBtn) statsBtn.addEventListener('click', refreshStats);
+
+  // Builder form
+  const form = document.getElementById('module-form');
+  const tEl = document.getElementById('mod-title');
+  const idEl = document.getElementById('mod-id');
+  const dEl = document.getElementById('mod-desc');
+  const xpEl = document.getElementById('mod-xp');
+  const cEl = document.getElementById('mod-coins');
+  const imgFileEl = document.getElementById('mod-image-file');
+
+  const THUMB_W = 640; // standard width for course thumbnails
+  const THUMB_H = 360; // standard height (16:9)
+
+  function resizeImageToStandard(file){
+    return new Promise((resolve, reject)=>{
+      const img = new Image();
+      img.onload = ()=>{
+        const canvas = document.createElement('canvas');
+        canvas.width = THUMB_W; canvas.height = THUMB_H;
+        const ctx = canvas.getContext('2d');
+        const srcW = img.naturalWidth || img.width;
+        const srcH = img.naturalHeight || img.height;
+        const scale = Math.max(THUMB_W/srcW, THUMB_H/srcH);
+        const drawW = srcW * scale;
+        const drawH = srcH * scale;
+        const dx = (THUMB_W - drawW)/2;
+        const dy = (THUMB_H - drawH)/2;
+        ctx.imageSmoothingQuality = 'high';
+        ctx.drawImage(img, dx, dy, drawW, drawH);
+        canvas.toBlob((blob)=>{
+          if(blob) resolve(blob); else reject(new Error('toBlob failed'));
+        }, 'image/webp', 0.9);
+      };
+      img.onerror = ()=> reject(new Error('Image load failed'));
+      img.src = URL.createObjectURL(file);
+    });
+  }
+
+  async function uploadImage(file, suggestedName){
+    const resized = await resizeImageToStandard(file);
+    const fd = new FormData();
+    const base = (suggestedName||'image').toLowerCase().replace(/[^a-z0-9]+/g,'-').replace(/^-+|-+$/g,'');
+    const now = Date.now();
+    fd.append('file', resized, `${base}-${now}.webp`);
+    // Detect static hosting (GitHub Pages) and gracefully fallback to Data URL
+    const isStaticHost = /github\.io$/i.test(location.hostname) || /githubpages/i.test(location.hostname);
+    if(!isStaticHost){
+      try{
+        const res = await fetch('/upload', { method: 'POST', body: fd });
+        if(res.ok){ const data = await res.json(); return data.path || data.url || ''; }
+      }catch(_){ /* ignore and fallback */ }
+    }
+    // Fallback: embed image as Data URL (works on static hosts)
+    const dataUrl = await new Promise((resolve, reject)=>{
+      try{
+        const fr = new FileReader();
+        fr.onload = ()=> resolve(String(fr.result||''));
+        fr.onerror = ()=> reject(new Error('DataURL failed'));
+        fr.readAsDataURL(resized);
+      }catch(err){ reject(err); }
+    });
+    return dataUrl;
+  }
+
+  // Auto-slug from title
+  tEl.addEventListener('input', ()=>{ if(!idEl.value){ idEl.value = slugify(tEl.value); } });
+
+  // Image quick picks
+  // Removed quick-pick thumbnails; upload is required.
+
+  if(form){
+    form.addEventListener('submit', async (e)=>{
+      e.preventDefault();
+      const title = (tEl.value||'').trim();
+      const id = slugify((idEl.value||title));
+      const description = (dEl.value||'').trim();
+      const difficultyEl = document.getElementById('mod-difficulty');
+      const difficulty = (difficultyEl && difficultyEl.value) ? difficultyEl.value : 'Beginner';
+      const xp = parseInt(xpEl.value||'0',10)||0;
+      const coins = parseInt(cEl.value||'0',10)||0;
+      const file = imgFileEl && imgFileEl.files ? imgFileEl.files[0] : null;
+      if(!file){
+        alert('Please upload an image for the module.');
+        return;
+      }
+      let image = '';
+      try { image = await uploadImage(file, id || title || 'course'); } catch(_){ alert('Upload failed. Try again.'); return; }
+      if(!title || !description){ return; }
+      const mods = readModules();
+      mods.push({ id, title, description, xp, coins, image, difficulty });
+      saveModules(mods);
+      tEl.value = ''; idEl.value = ''; dEl.value = ''; xpEl.value=''; cEl.value='';
+      if(imgFileEl) imgFileEl.value = '';
+      if(difficultyEl) difficultyEl.value = 'Beginner';
+      renderModules();
+    });
+  }
+
+  // global publish removed in favor of per-card publish
+
+  renderModules();
+});
+
+// Full-page editor for module content (replaces modal)
+function openContentEditor(idx){
+  const mods = readModules();
+  const m = mods[idx]; if(!m) return;
+  const c = m.content || {};
+  const quiz = c.quiz || {}; const options = quiz.options || [];
+  const bullets = Array.isArray(c.bullets) ? c.bullets.join('\n') : '';
+  const phased = c.phased || null;
+  const orient = phased ? 'phased' : 'default';
+  const main = document.querySelector('main');
+  const builder = document.getElementById('admin-builder');
+  if(builder) builder.style.display = 'none';
+  const page = document.createElement('section');
+  page.id = 'content-editor';
+  page.className = 'card';
+  page.style.marginTop = '16px';
+  page.innerHTML = `
+    <div class="card-head" style="display:flex;align-items:center;justify-content:space-between;gap:8px">
+      <h3>Edit Content — ${m.title}</h3>
+      <div style="display:flex;gap:8px">
+        <button class="btn" data-back>Back to Modules</button>
+      </div>
+    </div>
+    <div class="card-body" style="display:grid;gap:12px">
+      <label>
+        <div class="topic-title">Course Orientation</div>
+        <select class="text-input" data-e-orient>
+          <option value="default" ${orient==='default'?'selected':''}>Default tasks (Read, Quiz, Reflection, etc.)</option>
+          <option value="phased" ${orient==='phased'?'selected':''}>Phased: Review → Quiz → Answers</option>
+        </select>
+      </label>
+
+      <div data-default-editor style="display:${orient==='default'?'grid':'none'};gap:10px">
+        <label><div class="topic-title">Quiz question</div><input type="text" class="text-input" data-e-quiz-q value="${quiz.question||''}"></label>
+        <div class="row">
+          <label><div class="topic-title">Option 1</div><input type="text" class="text-input" data-e-quiz-o1 value="${options[0]||''}"></label>
+          <label><div class="topic-title">Option 2</div><input type="text" class="text-input" data-e-quiz-o2 value="${options[1]||''}"></label>
+        </div>
+        <div class="row">
+          <label><div class="topic-title">Option 3</div><input type="text" class="text-input" data-e-quiz-o3 value="${options[2]||''}"></label>
+          <label><div class="topic-title">Option 4</div><input type="text" class="text-input" data-e-quiz-o4 value="${options[3]||''}"></label>
+        </div>
+        <label><div class="topic-title">Correct option (1-4)</div><input type="number" min="1" max="4" class="text-input" data-e-quiz-c value="${Number.isFinite(quiz.correctIndex)?(quiz.correctIndex+1):''}"></label>
+        <label><div class="topic-title">Read bullets (one per line)</div><textarea class="text-input" rows="4" data-e-bullets>${bullets}</textarea></label>
+        <label><div class="topic-title">Reflection prompt</div><textarea class="text-input" rows="2" data-e-refl>${c.reflection||''}</textarea></label>
+        <div class="row">
+          <label><div class="topic-title">CTF prompt</div><input type="text" class="text-input" data-e-ctf-p value="${(c.ctf||{}).prompt||''}"></label>
+          <label><div class="topic-title">CTF flag</div><input type="text" class="text-input" data-e-ctf-f value="${(c.ctf||{}).flag||''}"></label>
+        </div>
+        <label><div class="topic-title">Code snippet</div><textarea class="text-input" rows="4" data-e-code-sn>${(c.codeFill||{}).snippet||''}</textarea></label>
+        <label><div class="topic-title">Code answer</div><input type="text" class="text-input" data-e-code-ans value="${(c.codeFill||{}).answer||''}"></label>
+      </div>
+
+      <div data-phased-editor style="display:${orient==='phased'?'grid':'none'};gap:10px">
+        <div class="muted">Phase 1: Review materials</div>
+        <label><div class="topic-title">Materials (one per line)</div><textarea class="text-input" rows="4" data-p-review>${Array.isArray(phased?.review)?phased.review.join('\n'):''}</textarea></label>
+        <div class="muted">Phase 2: Quiz / Exam maker</div>
+        <div style="display:flex;justify-content:space-between;align-items:center;gap:8px">
+          <div class="topic-title">Questions</div>
+          <div style="display:flex;gap:8px">
+            <button class="btn small" data-add-q type="button">Add question</button>
+          </div>
+        </div>
+        <div data-p-quiz-list style="display:grid;gap:10px"></div>
+        <div class="muted">Phase 3: Review of answers is generated automatically from correct answers.</div>
+      </div>
+    </div>
+    <div class="card-actions" style="display:flex;gap:8px;justify-content:flex-end;margin-top:12px">
+      <button class="btn" data-cancel>Cancel</button>
+      <button class="btn primary" data-save>Save</button>
+    </div>`;
+  main.appendChild(page);
+  const gv = (sel)=>{ const el = page.querySelector(sel); return el ? (el instanceof HTMLInputElement || el instanceof HTMLTextAreaElement ? el.value : '') : ''; };
+  const goBack = ()=>{ page.remove(); if(builder) builder.style.display = ''; renderModules(); };
+  page.querySelector('[data-back]')?.addEventListener('click', goBack);
+  page.querySelector('[data-cancel]')?.addEventListener('click', (e)=>{ e.preventDefault(); goBack(); });
+  // Orientation toggle
+  const orientSel = page.querySelector('[data-e-orient]');
+  const defaultEditor = page.querySelector('[data-default-editor]');
+  const phasedEditor = page.querySelector('[data-phased-editor]');
+  orientSel?.addEventListener('change', ()=>{
+    const val = orientSel.value;
+    if(val === 'phased'){ defaultEditor.style.display = 'none'; phasedEditor.style.display = 'grid'; }
+    else { defaultEditor.style.display = 'grid'; phasedEditor.style.display = 'none'; }
+  });
+
+  // Phased quiz builder state and renderer
+  let pq = Array.isArray(phased?.quiz?.questions) && phased.quiz.questions.length
+    ? phased.quiz.questions.map(q=>({ question:q.question||'', options:Array.isArray(q.options)?q.options.slice(0):[], correctIndex:Number.isFinite(q.correctIndex)?q.correctIndex:0, explanation:q.explanation||'' }))
+    : [{ question:'', options:['',''], correctIndex:0, explanation:'' }];
+  const quizList = page.querySelector('[data-p-quiz-list]');
+  function renderPQ(){
+    if(!quizList) return;
+    quizList.innerHTML = pq.map((q,qi)=>{
+      const opts = (Array.isArray(q.options)?q.options:[]).map((opt,oi)=>{
+        return `<div class="row" data-pq-opt-row>
+          <label style="flex:1"><div class="topic-title">Option ${oi+1}</div><input type="text" class="text-input" data-pq-opt data-qi="${qi}" data-oi="${oi}" value="${opt||''}"></label>
+          <label style="width:160px"><div class="topic-title">Correct?</div><input type="radio" name="correct-${qi}" value="${oi}" ${q.correctIndex===oi?'checked':''}></label>
+        </div>`;
+      }).join('');
+      return `<div class="task" data-pq-item data-qi="${qi}">
+        <label><div class="topic-title">Question ${qi+1}</div><input type="text" class="text-input" data-pq-q data-qi="${qi}" value="${q.question||''}"></label>
+        ${opts}
+        <div class="row" style="justify-content:flex-end;gap:8px">
+          <button class="btn small" type="button" data-add-opt data-qi="${qi}">Add option</button>
+          <button class="btn small" type="button" data-remove-q data-qi="${qi}">Remove question</button>
+        </div>
+        <label><div class="topic-title">Explanation (optional)</div><input type="text" class="text-input" data-pq-expl data-qi="${qi}" value="${q.explanation||''}"></label>
+      </div>`;
+    }).join('');
+    // Bind dynamic inputs
+    Array.from(quizList.querySelectorAll('[data-pq-q]')).forEach(inp=>{
+      inp.addEventListener('input', ()=>{ const qi = parseInt(inp.getAttribute('data-qi'),10); pq[qi].question = inp.value; });
+    });
+    Array.from(quizList.querySelectorAll('[data-pq-expl]')).forEach(inp=>{
+      inp.addEventListener('input', ()=>{ const qi = parseInt(inp.getAttribute('data-qi'),10); pq[qi].explanation = inp.value; });
+    });
+    Array.from(quizList.querySelectorAll('[data-pq-opt]')).forEach(inp=>{
+      inp.addEventListener('input', ()=>{ const qi = parseInt(inp.getAttribute('data-qi'),10); const oi = parseInt(inp.getAttribute('data-oi'),10); if(!Array.isArray(pq[qi].options)) pq[qi].options=[]; pq[qi].options[oi] = inp.value; });
+    });
+    Array.from(quizList.querySelectorAll(`input[type="radio"]`)).forEach(r=>{
+      r.addEventListener('change', ()=>{ const qi = parseInt(r.name.replace('correct-',''),10); pq[qi].correctIndex = parseInt(r.value,10)||0; });
+    });
+    Array.from(quizList.querySelectorAll('[data-add-opt]')).forEach(btn=>{
+      btn.addEventListener('click', ()=>{ const qi = parseInt(btn.getAttribute('data-qi'),10); if(!Array.isArray(pq[qi].options)) pq[qi].options=[]; pq[qi].options.push(''); renderPQ(); });
+    });
+    Array.from(quizList.querySelectorAll('[data-remove-q]')).forEach(btn=>{
+      btn.addEventListener('click', ()=>{ const qi = parseInt(btn.getAttribute('data-qi'),10); pq.splice(qi,1); if(pq.length===0) pq.push({ question:'', options:['',''], correctIndex:0, explanation:'' }); renderPQ(); });
+    });
+  }
+  renderPQ();
+  page.querySelector('[data-add-q]')?.addEventListener('click', ()=>{ pq.push({ question:'', options:['',''], correctIndex:0, explanation:'' }); renderPQ(); });
+
+  page.querySelector('[data-save]')?.addEventListener('click', ()=>{
+    const currentOrient = (orientSel?.value||'default');
+    if(currentOrient === 'phased'){
+      const bulletsRaw = gv('[data-p-review]');
+      const bulletsArr = bulletsRaw.split(/\r?\n/).map(s=>s.trim()).filter(Boolean);
+      const qs = pq.map(q=>{
+        const opts = (Array.isArray(q.options)?q.options:[]).map(s=>String(s||'').trim()).filter(Boolean);
+        const has = String(q.question||'').trim() && opts.length >= 2;
+        return has ? { question:String(q.question).trim(), options:opts, correctIndex: Math.max(0, Math.min(q.correctIndex||0, opts.length-1)), explanation: String(q.explanation||'').trim() } : null;
+      }).filter(Boolean);
+      const content = { phased: { review: bulletsArr, quiz: { questions: qs } } };
+      m.content = content;
+    }else{
+      const q = gv('[data-e-quiz-q]').trim();
+      const o1 = gv('[data-e-quiz-o1]').trim();
+      const o2 = gv('[data-e-quiz-o2]').trim();
+      const o3 = gv('[data-e-quiz-o3]').trim();
+      const o4 = gv('[data-e-quiz-o4]').trim();
+      const cidxRaw = gv('[data-e-quiz-c]').trim();
+      const opts = [o1,o2,o3,o4].filter(Boolean);
+      const hasQuiz = q && opts.length >= 2 && cidxRaw;
+      let correctIndex = null;
+      if(hasQuiz){ const n = parseInt(cidxRaw,10); correctIndex = (Number.isFinite(n) ? Math.min(Math.max(n,1),opts.length) : 1) - 1; }
+      const bulletsRaw = gv('[data-e-bullets]');
+      const bulletsArr = bulletsRaw.split(/\r?\n/).map(s=>s.trim()).filter(Boolean);
+      const refl = gv('[data-e-refl]').trim();
+      const ctfP = gv('[data-e-ctf-p]').trim();
+      const ctfF = gv('[data-e-ctf-f]').trim();
+      const codeSn = gv('[data-e-code-sn]').trim();
+      const codeAns = gv('[data-e-code-ans]').trim();
+      const content = {};
+      if(hasQuiz){ content.quiz = { question: q, options: opts, correctIndex }; }
+      if(bulletsArr.length){ content.bullets = bulletsArr; }
+      if(refl){ content.reflection = refl; }
+      if(ctfP || ctfF){ content.ctf = { prompt: ctfP, flag: ctfF }; }
+      if(codeSn || codeAns){ content.codeFill = { snippet: codeSn, answer: codeAns }; }
+      m.content = content;
+    }
+    saveModules(mods);
+    // Auto-publish to Learn after save
+    publishModules();
+    // Return to list
+    goBack();
+  });
+}
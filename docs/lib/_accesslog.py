@@ -0,0 +1,163 @@
+"""Structured JSON access log with a non-blocking writer.
+
+Request threads only build a dict and `put_nowait` it on a bounded queue; a
+single daemon thread drains the queue in batches and appends JSON lines to
+ACCESS_LOG_PATH (size-rotated) or stderr. When the queue is full the entry is
+dropped and counted rather than blocking the request.
+"""
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from typing import Optional
+
+
+ACCESS_LOG_PATH = (os.environ.get('ACCESS_LOG_PATH') or '').strip()
+ACCESS_LOG_MAX_BYTES = int(os.environ.get('ACCESS_LOG_MAX_BYTES') or str(10 * 1024 * 1024))
+ACCESS_LOG_BACKUPS = int(os.environ.get('ACCESS_LOG_BACKUPS') or '5')
+# Fraction of successful static-file hits to log; API requests and errors are always logged
+ACCESS_LOG_STATIC_SAMPLE = float(os.environ.get('ACCESS_LOG_STATIC_SAMPLE') or '0.1')
+ACCESS_LOG_QUEUE_SIZE = int(os.environ.get('ACCESS_LOG_QUEUE_SIZE') or '10000')
+
+
+class _RotatingWriter:
+    def __init__(self, path: str, max_bytes: int, backups: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._fh = None
+        self._size = 0
+
+    def _open(self):
+        d = os.path.dirname(self.path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._fh = open(self.path, 'a', encoding='utf-8')
+        self._size = self._fh.tell()
+
+    def _rotate(self):
+        self._fh.close()
+        for i in range(self.backups - 1, 0, -1):
+            src = f'{self.path}.{i}'
+            if os.path.exists(src):
+                os.replace(src, f'{self.path}.{i + 1}')
+        if self.backups > 0:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def write(self, text: str):
+        if self._fh is None:
+            self._open()
+        self._fh.write(text)
+        self._fh.flush()
+        self._size += len(text.encode('utf-8'))
+        if self.max_bytes > 0 and self._size >= self.max_bytes:
+            self._rotate()
+
+
+class _StreamWriter:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text: str):
+        self.stream.write(text)
+        self.stream.flush()
+
+
+class AccessLog:
+    def __init__(self, path: str = ACCESS_LOG_PATH, static_sample: float = ACCESS_LOG_STATIC_SAMPLE,
+                 queue_size: int = ACCESS_LOG_QUEUE_SIZE):
+        self.static_sample = static_sample
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        if path:
+            self._writer = _RotatingWriter(path, ACCESS_LOG_MAX_BYTES, ACCESS_LOG_BACKUPS)
+        else:
+            self._writer = _StreamWriter(sys.stderr)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='access-log-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < 256:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                self._writer.write(''.join(json.dumps(e, default=str) + '\n' for e in batch))
+            except Exception:
+                # Never let a bad disk take the writer thread down
+                pass
+            for _ in batch:
+                self._queue.task_done()
+
+    def emit(self, entry: dict):
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def after_fork(self):
+        """Call in a forked child: the writer thread (and any lock it held) stayed in the parent."""
+        self._queue = queue.Queue(maxsize=self._queue.maxsize)
+        self._lock = threading.Lock()
+        self._thread = None
+        if isinstance(self._writer, _RotatingWriter):
+            self._writer._fh = None
+
+    def should_log(self, route: str, status: int) -> bool:
+        if route != 'static' or status >= 400:
+            return True
+        return self.static_sample >= 1.0 or random.random() < self.static_sample
+
+    def flush(self, timeout: float = 2.0):
+        """Wait (bounded) for queued entries to be written; used at shutdown."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+
+ACCESS_LOG = AccessLog()
+
+
+def new_request_id(incoming: Optional[str] = None) -> str:
+    incoming = (incoming or '').strip()
+    if incoming and len(incoming) <= 128:
+        return incoming
+    return uuid.uuid4().hex
+
+
+def log_access(ctx: dict, request_id: str, user_id: Optional[str], nbytes: Optional[int], client: str = ''):
+    status = int(ctx.get('status') or 0)
+    if not ACCESS_LOG.should_log(ctx['route'], status):
+        return
+    ACCESS_LOG.emit({
+        'ts': time.time(), 'type': 'access', 'request_id': request_id,
+        'method': ctx['method'], 'route': ctx['route'], 'path': ctx.get('path'),
+        'status': status, 'bytes': nbytes, 'duration_ms': round(ctx['duration'] * 1000, 3),
+        'user_id': user_id, 'client': client,
+    })
+
+
+def log_event(kind: str, message: str, **fields):
+    """Structured replacement for ad-hoc print() diagnostics."""
+    entry = {'ts': time.time(), 'type': kind, 'message': message}
+    entry.update(fields)
+    ACCESS_LOG.emit(entry)
@@ -0,0 +1,183 @@
+"""Admin analytics served from materialized views.
+
+Dashboards read small pre-aggregated views instead of scanning
+`activity_logs` and `users`:
+
+    mv_module_completions  completions, learners and XP per module
+    mv_daily_active        active learners and events per UTC day (last year)
+    mv_xp_distribution     learners per XP_BUCKET-wide band of xp_total
+
+A background thread refreshes them CONCURRENTLY (readers are never blocked)
+every ANALYTICS_REFRESH seconds. `analytics_refresh` records when each view
+was last refreshed, which is how other instances skip a view that is already
+fresh and how every response reports its age.
+"""
+import os
+import threading
+import time
+
+from . import _prepared
+from ._accesslog import log_event
+
+
+ANALYTICS_REFRESH = float(os.environ.get('ANALYTICS_REFRESH') or '300')
+XP_BUCKET = 500
+MAX_ROWS = 1000
+MAX_DAYS = 365
+
+VIEWS = {
+    'mv_module_completions': """
+        SELECT course_id,
+               COUNT(DISTINCT user_id) AS learners,
+               COUNT(*) AS completions,
+               COALESCE(SUM(xp_awarded), 0) AS xp_awarded,
+               MAX(created_at) AS last_completed_at
+        FROM activity_logs
+        WHERE event_type = 'course_completed' AND course_id IS NOT NULL
+        GROUP BY course_id
+    """,
+    'mv_daily_active': """
+        SELECT (created_at AT TIME ZONE 'UTC')::date AS day,
+               COUNT(DISTINCT user_id) AS learners,
+               COUNT(*) AS events
+        FROM activity_logs
+        WHERE created_at >= NOW() - INTERVAL '365 days'
+        GROUP BY 1
+    """,
+    'mv_xp_distribution': f"""
+        SELECT (xp_total / {XP_BUCKET}) * {XP_BUCKET} AS xp_from, COUNT(*) AS learners
+        FROM users
+        GROUP BY 1
+    """,
+}
+
+# REFRESH ... CONCURRENTLY needs a unique index on each view
+VIEW_KEYS = {
+    'mv_module_completions': 'course_id',
+    'mv_daily_active': 'day',
+    'mv_xp_distribution': 'xp_from',
+}
+
+DDL_REFRESH_LOG = """
+CREATE TABLE IF NOT EXISTS analytics_refresh (
+    view_name TEXT PRIMARY KEY,
+    refreshed_at TIMESTAMPTZ NOT NULL,
+    duration_ms INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+SQL_LOG_REFRESH = """
+INSERT INTO analytics_refresh(view_name, refreshed_at, duration_ms) VALUES (%s, NOW(), %s)
+ON CONFLICT (view_name) DO UPDATE SET refreshed_at = EXCLUDED.refreshed_at, duration_ms = EXCLUDED.duration_ms
+"""
+
+
+def ensure_analytics_schema(cur):
+    """Create the views (populated once, here) and the refresh log."""
+    cur.execute("SELECT to_regclass('analytics_refresh') IS NOT NULL")
+    if cur.fetchone()[0]:
+        return
+    for name, query in VIEWS.items():
+        cur.execute(f'CREATE MATERIALIZED VIEW IF NOT EXISTS {name} AS {query}')
+        cur.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS {name}_key ON {name} ({VIEW_KEYS[name]})')
+    cur.execute(DDL_REFRESH_LOG)
+    for name in VIEWS:
+        cur.execute(SQL_LOG_REFRESH, (name, 0))
+    _prepared.schema_changed(cur)
+
+
+def refresh(connect, max_age: float = 0.0) -> dict:
+    """Refresh every view not refreshed within `max_age` seconds; returns {view: ms or 'skipped'}."""
+    conn = connect()
+    if not conn:
+        return {}
+    results = {}
+    try:
+        for name in VIEWS:
+            started = time.perf_counter()
+            with conn:
+                with conn.cursor() as cur:
+                    # One refresher per view across instances; the rest skip it
+                    cur.execute("SELECT pg_try_advisory_xact_lock(hashtext(%s))", (name,))
+                    if not cur.fetchone()[0]:
+                        results[name] = 'skipped'
+                        continue
+                    cur.execute(
+                        "SELECT refreshed_at > NOW() - make_interval(secs => %s) FROM analytics_refresh WHERE view_name = %s",
+                        (max_age, name),
+                    )
+                    row = cur.fetchone()
+                    if max_age > 0 and row and row[0]:
+                        results[name] = 'skipped'
+                        continue
+                    cur.execute(f'REFRESH MATERIALIZED VIEW CONCURRENTLY {name}')
+                    ms = int((time.perf_counter() - started) * 1000)
+                    cur.execute(SQL_LOG_REFRESH, (name, ms))
+            results[name] = ms
+        return results
+    finally:
+        conn.close()
+
+
+def start_refresher(connect, interval: float = ANALYTICS_REFRESH):
+    """Refresh stale views every `interval` seconds on a daemon thread; 0 disables."""
+    if interval <= 0:
+        return None
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                # Slightly under the interval so this instance's own last run counts as stale
+                refresh(connect, max_age=interval * 0.9)
+            except Exception as e:
+                log_event('db', 'Analytics refresh failed', error=str(e))
+
+    t = threading.Thread(target=run, name='analytics-refresh', daemon=True)
+    t.start()
+    return t
+
+
+# --- Reads ---
+
+STATS = {
+    'modules': ('mv_module_completions',
+                "SELECT course_id, learners, completions, xp_awarded, last_completed_at FROM mv_module_completions "
+                "ORDER BY completions DESC, course_id LIMIT %(limit)s"),
+    'active': ('mv_daily_active',
+               "SELECT day, learners, events FROM mv_daily_active WHERE day >= CURRENT_DATE - %(days)s ORDER BY day"),
+    'xp': ('mv_xp_distribution',
+           "SELECT xp_from, xp_from + " + str(XP_BUCKET) + " AS xp_to, learners FROM mv_xp_distribution ORDER BY xp_from"),
+}
+
+
+def stat_params(query: dict) -> dict:
+    """Clamp `limit` / `days` from a parsed query string; raises ValueError on junk."""
+    limit = int((query.get('limit') or ['100'])[0])
+    days = int((query.get('days') or ['30'])[0])
+    return {'limit': max(1, min(limit, MAX_ROWS)), 'days': max(1, min(days, MAX_DAYS))}
+
+
+def _plain(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def read_stat(conn, name: str, params: dict) -> dict:
+    """Rows of one stat plus when its view was refreshed; KeyError for unknown names."""
+    view, sql = STATS[name]
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            cols = [d[0] for d in cur.description]
+            rows = [dict(zip(cols, (_plain(v) for v in r))) for r in cur.fetchall()]
+            cur.execute(
+                "SELECT refreshed_at, EXTRACT(EPOCH FROM NOW() - refreshed_at) FROM analytics_refresh WHERE view_name = %s",
+                (view,),
+            )
+            fresh = cur.fetchone()
+    return {
+        'stat': name,
+        'rows': rows,
+        'refreshed_at': fresh[0].isoformat() if fresh else None,
+        'age_seconds': round(float(fresh[1]), 1) if fresh else None,
+    }
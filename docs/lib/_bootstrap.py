@@ -0,0 +1,93 @@
+"""GET /api/bootstrap: what a page needs at load, in one response.
+
+Sections:
+
+    profile        the signed-in user, as GET /api/users/me returns it
+    catalog        {version, modules}: the public module catalog
+    notifications  {unread}
+    rank           {level, position}: rank and leaderboard position
+
+The session lookup, the profile and the leaderboard position come from one
+statement (`_prepared.BOOTSTRAP`) on one connection; the catalog comes from
+whatever the caller already caches. Every section carries its own ETag. The
+client sends the ETags it holds in If-None-Match, and sections that match
+are listed under `unchanged` instead of being sent again.
+"""
+import hashlib
+import json
+from typing import Optional
+
+from . import _prepared
+
+
+SECTIONS = ('profile', 'catalog', 'notifications', 'rank')
+SIGNED_IN_SECTIONS = ('profile', 'notifications', 'rank')
+
+
+def user_from_row(row) -> dict:
+    """Profile dict from the first 11 columns of SESSION_USER / BOOTSTRAP."""
+    return {
+        'id': row[0], 'username': row[1], 'email': row[2], 'name': row[3],
+        'xp_total': row[4], 'level_idx': row[5], 'xp_in_level': row[6], 'wallet': row[7],
+        'email_verified': bool(row[8]), 'is_admin': bool(row[9]),
+        'unread_notifications': row[10],
+    }
+
+
+def fetch(cur, token: str):
+    """(user, leaderboard position) for a live session token, or (None, None)."""
+    _prepared.execute(cur, _prepared.BOOTSTRAP, (token,))
+    row = cur.fetchone()
+    if not row:
+        return None, None
+    return user_from_row(row), int(row[11])
+
+
+def requested(query: dict, signed_in: bool) -> tuple:
+    """Sections named in `?sections=a,b` (default: all), minus the signed-in ones for guests."""
+    names = [s.strip() for s in (query.get('sections') or [''])[0].split(',') if s.strip()]
+    names = [s for s in SECTIONS if not names or s in names]
+    return tuple(s for s in names if signed_in or s not in SIGNED_IN_SECTIONS)
+
+
+def known_etags(header: Optional[str]) -> set:
+    """Entity tags listed in an If-None-Match header (weak or strong)."""
+    tags = set()
+    for part in (header or '').split(','):
+        part = part.strip()
+        if part.startswith('W/'):
+            part = part[2:]
+        if part:
+            tags.add(part)
+    return tags
+
+
+def _etag(name: str, data) -> str:
+    raw = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8')
+    return f'"{name}-{hashlib.sha256(raw).hexdigest()[:16]}"'
+
+
+def build(names, known: set, user: Optional[dict] = None, position: Optional[int] = None, catalog=None) -> dict:
+    """The response body; `catalog` is a lib._grading.Catalog (only read when requested)."""
+    sections, unchanged = {}, []
+    for name in names:
+        if name == 'catalog':
+            # The version already is a content hash; no need to serialize the modules for it
+            tag = f'"catalog-{catalog.version}"'
+            if tag in known:
+                unchanged.append(name)
+                continue
+            sections[name] = {'etag': tag, 'data': {'version': catalog.version, 'modules': catalog.public}}
+            continue
+        if name == 'profile':
+            data = user
+        elif name == 'notifications':
+            data = {'unread': user.get('unread_notifications') or 0}
+        else:
+            data = {'level': (user.get('level_idx') or 0) + 1, 'position': position}
+        tag = _etag(name, data)
+        if tag in known:
+            unchanged.append(name)
+        else:
+            sections[name] = {'etag': tag, 'data': data}
+    return {'sections': sections, 'unchanged': unchanged}
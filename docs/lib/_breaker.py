@@ -0,0 +1,98 @@
+"""Connect timeouts and a circuit breaker for the database.
+
+Without a connect timeout a Neon outage (or a compute waking from suspend)
+parks every request thread in TCP/TLS until the OS gives up, and threads
+pile up behind it. Connects now give up after DB_CONNECT_TIMEOUT seconds,
+and every session gets a DB_STATEMENT_TIMEOUT.
+
+The breaker counts consecutive connect failures. After
+DB_BREAKER_THRESHOLD of them it opens, and connects fail at once (callers
+answer 503 or fall back to cached data) instead of waiting out the timeout.
+After DB_BREAKER_RESET seconds it goes half-open: one caller is let through
+as a probe, and its result closes the breaker again or reopens it.
+"""
+import math
+import os
+import threading
+import time
+
+from . import _deadline
+from . import _metrics
+from ._accesslog import log_event
+
+
+DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT') or '5')
+# Milliseconds; 0 keeps the server's default
+DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT') or '15000')
+DB_BREAKER_THRESHOLD = int(os.environ.get('DB_BREAKER_THRESHOLD') or '5')
+DB_BREAKER_RESET = float(os.environ.get('DB_BREAKER_RESET') or '10')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+def connect_options() -> dict:
+    """Extra keyword arguments for psycopg2.connect(): DB_CONNECT_TIMEOUT, capped by the request deadline."""
+    timeout = _deadline.timeout(DB_CONNECT_TIMEOUT if DB_CONNECT_TIMEOUT > 0 else None)
+    if timeout is None:
+        return {}
+    # libpq takes whole seconds and treats anything below 2 as 2
+    return {'connect_timeout': max(2, math.ceil(timeout))}
+
+
+def apply_statement_timeout(conn):
+    """Set DB_STATEMENT_TIMEOUT as the session default on a new connection."""
+    if DB_STATEMENT_TIMEOUT <= 0:
+        return
+    with conn.cursor() as cur:
+        cur.execute('SET statement_timeout = %s', (DB_STATEMENT_TIMEOUT,))
+    conn.commit()
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, threshold: int = DB_BREAKER_THRESHOLD, reset_after: float = DB_BREAKER_RESET):
+        self.name = name
+        self.threshold = max(1, threshold)
+        self.reset_after = reset_after
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def degraded(self) -> bool:
+        return self.state != CLOSED
+
+    def allow(self) -> bool:
+        """Whether a connect may be attempted now; in half-open state only one probe at a time."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.reset_after:
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+        _metrics.REGISTRY.inc('topcit_db_breaker_rejections_total', (('breaker', self.name),))
+        return False
+
+    def record(self, ok: bool):
+        with self._lock:
+            self._probing = False
+            if ok:
+                self.failures = 0
+                if self.state != CLOSED:
+                    self._transition(CLOSED)
+                return
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.threshold):
+                self._opened_at = time.monotonic()
+                self._transition(OPEN)
+
+    def _transition(self, state: str):
+        self.state = state
+        _metrics.REGISTRY.inc('topcit_db_breaker_transitions_total', (('breaker', self.name), ('state', state)))
+        log_event('db', f'Circuit breaker {state}', breaker=self.name, failures=self.failures,
+                  retry_in=self.reset_after if state == OPEN else None)
@@ -0,0 +1,145 @@
+"""Per-user course state (enrolled / completed) with delta sync.
+
+Each user has a change counter, `users.sync_version`. A sync that changes
+anything bumps it once, and every `user_courses` row it writes carries the
+new value in `version`. The client keeps the last counter it saw as its sync
+token. POST /api/users/sync sends the entries changed locally since then and
+gets back, in the same round trip, only the rows other devices changed after
+that token, plus the new token.
+
+Statuses only move forward (ongoing -> completed), so merging is order-free:
+an incoming entry is kept only if it advances the stored status, and two
+devices can never undo each other's progress. The UPDATE that bumps the
+counter also locks the user's row, so concurrent syncs for one user are
+serialized and versions never go backwards.
+"""
+from typing import Optional
+
+from . import _pubsub
+
+
+ONGOING = 'ongoing'
+COMPLETED = 'completed'
+STATUS_RANK = {ONGOING: 1, COMPLETED: 2}
+# Largest change list one sync accepts (the first sync uploads a whole device)
+SYNC_MAX_CHANGES = 500
+
+DDL_USER_COURSES = """
+CREATE TABLE IF NOT EXISTS user_courses (
+    user_id TEXT NOT NULL,
+    course_id TEXT NOT NULL,
+    status TEXT NOT NULL CHECK (status IN ('ongoing', 'completed')),
+    version BIGINT NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, course_id)
+)
+"""
+
+DDL_COURSES_EXTRAS = (
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS sync_version BIGINT NOT NULL DEFAULT 0",
+    # Delta reads: the rows of one user above a version
+    "CREATE INDEX IF NOT EXISTS user_courses_user_version ON user_courses (user_id, version)",
+)
+
+
+def ensure_courses_schema(cur):
+    cur.execute("SELECT to_regclass('user_courses') IS NOT NULL")
+    if cur.fetchone()[0]:
+        return
+    cur.execute(DDL_USER_COURSES)
+    for ddl in DDL_COURSES_EXTRAS:
+        cur.execute(ddl)
+
+
+def parse_changes(payload: dict) -> tuple:
+    """(since, [(course_id, status), ...]) from a sync request body; raises ValueError."""
+    since = int(payload.get('token') or 0)
+    if since < 0:
+        raise ValueError('token must not be negative')
+    raw = payload.get('changes') or []
+    if not isinstance(raw, list):
+        raise ValueError('changes must be a list')
+    if len(raw) > SYNC_MAX_CHANGES:
+        raise ValueError(f'at most {SYNC_MAX_CHANGES} changes per sync')
+    merged = {}
+    for entry in raw:
+        if not isinstance(entry, dict):
+            raise ValueError('each change needs course_id and status')
+        course_id = str(entry.get('course_id') or '').strip().lower()
+        status = str(entry.get('status') or '').strip().lower()
+        if not course_id or len(course_id) > 200 or status not in STATUS_RANK:
+            raise ValueError(f'invalid change: {entry!r}')
+        # Duplicates within one request collapse to the furthest status
+        if STATUS_RANK[status] > STATUS_RANK.get(merged.get(course_id), 0):
+            merged[course_id] = status
+    return since, sorted(merged.items())
+
+
+def result(version: int, since: int, rows, sent: list) -> dict:
+    """The sync response: rows above `since` that the client did not just send itself."""
+    full = since > version
+    sent = set(sent)
+    changes = [{'course_id': c, 'status': s, 'version': int(v)} for c, s, v in rows
+               if full or (c, s) not in sent]
+    return {'token': int(version), 'changes': changes, 'full': full}
+
+
+SQL_BUMP = "UPDATE users SET sync_version = sync_version + 1 WHERE id = %s RETURNING sync_version"
+
+SQL_MERGE = """
+INSERT INTO user_courses AS uc (user_id, course_id, status, version, updated_at)
+SELECT %s, c.course_id, c.status, %s, NOW()
+FROM unnest(%s::text[], %s::text[]) AS c(course_id, status)
+ON CONFLICT (user_id, course_id) DO UPDATE
+SET status = EXCLUDED.status, version = EXCLUDED.version, updated_at = NOW()
+WHERE uc.status = 'ongoing' AND EXCLUDED.status = 'completed'
+"""
+
+# With nothing to write: the counter and the delta in one statement
+SQL_READ = """
+SELECT u.sync_version, c.course_id, c.status, c.version
+FROM users u
+LEFT JOIN user_courses c ON c.user_id = u.id AND c.version > %s
+WHERE u.id = %s
+ORDER BY c.version, c.course_id
+"""
+
+SQL_DELTA = """
+SELECT course_id, status, version FROM user_courses
+WHERE user_id = %s AND version > %s
+ORDER BY version, course_id
+"""
+
+
+def sync(cur, user_id: str, since: int, changes: list) -> Optional[dict]:
+    """Merge `changes` and return the delta since `since`; None for an unknown user.
+
+    Runs inside the caller's transaction. A token ahead of the server (a
+    restored database, another account's token) is answered with every row
+    and `full: true`, and the client replaces its state.
+    """
+    if not changes:
+        cur.execute(SQL_READ, (since, user_id))
+        rows = cur.fetchall()
+        if not rows:
+            return None
+        version = rows[0][0]
+        if since > version:
+            cur.execute(SQL_DELTA, (user_id, 0))
+            return result(version, since, cur.fetchall(), [])
+        return result(version, since, [r[1:] for r in rows if r[1] is not None], [])
+    cur.execute(SQL_BUMP, (user_id,))
+    row = cur.fetchone()
+    if not row:
+        return None
+    version = row[0]
+    cur.execute(SQL_MERGE, (user_id, version, [c for c, _ in changes], [s for _, s in changes]))
+    if cur.rowcount == 0:
+        # Nothing advanced; give the version back so idle devices don't see a phantom change
+        cur.execute("UPDATE users SET sync_version = sync_version - 1 WHERE id = %s RETURNING sync_version", (user_id,))
+        version = cur.fetchone()[0]
+    else:
+        # Other open tabs and devices pull the change
+        _pubsub.publish(_pubsub.user_topic(user_id), 'courses', {'token': version}, cur)
+    cur.execute(SQL_DELTA, (user_id, 0 if since > version else since))
+    return result(version, since, cur.fetchall(), changes)
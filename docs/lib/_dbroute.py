@@ -0,0 +1,89 @@
+"""Read/write splitting between DATABASE_URL and an optional DATABASE_READ_URL.
+
+Writes, and any read inside a write transaction, stay on the primary.
+Read-only hot paths call `connect_read(key)`, where `key` names the data
+being read: a user id, or MODULES for the published catalog. For
+READ_YOUR_WRITES seconds after a write to that key the read also goes to the
+primary, so a writer never sees the replica's lag. Writes are learned from
+the invalidation bus (lib/_invalidation.py), so the window holds across
+every instance that listens, not only the one that wrote.
+
+A replica that refuses a connection is skipped for REPLICA_RETRY seconds;
+reads fall back to the primary meanwhile.
+"""
+import os
+import threading
+import time
+
+from . import _invalidation
+from . import _metrics
+from ._accesslog import log_event
+
+
+READ_YOUR_WRITES = float(os.environ.get('READ_YOUR_WRITES') or '5')
+REPLICA_RETRY = float(os.environ.get('REPLICA_RETRY') or '30')
+
+MODULES = 'modules'
+_MAX_KEYS = 50000
+
+
+class Router:
+    def __init__(self, primary, replica=None):
+        """`primary` / `replica` are zero-argument connect functions returning a connection or None."""
+        self.primary = primary
+        self.replica = replica
+        self._lock = threading.Lock()
+        self._writes = {}
+        self._all_until = 0.0
+        self._replica_down_until = 0.0
+
+    def note_write(self, key: str):
+        until = time.monotonic() + READ_YOUR_WRITES
+        with self._lock:
+            if key == _invalidation.ALL:
+                self._all_until = until
+                return
+            if len(self._writes) >= _MAX_KEYS:
+                now = time.monotonic()
+                self._writes = {k: t for k, t in self._writes.items() if t > now}
+            self._writes[key] = until
+
+    def recently_written(self, key) -> bool:
+        now = time.monotonic()
+        if self._all_until > now:
+            return True
+        return key is not None and self._writes.get(key, 0.0) > now
+
+    def replica_usable(self) -> bool:
+        return self.replica is not None and time.monotonic() >= self._replica_down_until
+
+    def connect_replica(self):
+        """A replica connection, or None when there is no usable replica."""
+        if not self.replica_usable():
+            return None
+        conn = self.replica()
+        if conn is None:
+            self._replica_down_until = time.monotonic() + REPLICA_RETRY
+            log_event('db', 'Read replica unavailable; using primary', retry_in=REPLICA_RETRY)
+            return None
+        return conn
+
+    def connect_read(self, key=None):
+        """Connection for a read of `key`: the replica unless it lags the caller's write or is down."""
+        if self.replica is None:
+            return self.primary()
+        if self.recently_written(key):
+            _metrics.REGISTRY.inc('topcit_db_reads_total', (('target', 'primary'), ('reason', 'recent_write')))
+            return self.primary()
+        conn = self.connect_replica()
+        if conn is not None:
+            _metrics.REGISTRY.inc('topcit_db_reads_total', (('target', 'replica'), ('reason', 'read')))
+            return conn
+        _metrics.REGISTRY.inc('topcit_db_reads_total', (('target', 'primary'), ('reason', 'replica_down')))
+        return self.primary()
+
+    def track_writes(self):
+        """Open read-your-writes windows from the invalidation bus; returns self."""
+        _invalidation.on(_invalidation.USER_CHANGED, self.note_write)
+        _invalidation.on(_invalidation.MODULES_CHANGED, lambda _arg: self.note_write(MODULES))
+        return self
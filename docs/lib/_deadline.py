@@ -0,0 +1,134 @@
+"""Per-request time budgets.
+
+Every request gets a deadline from its route label when parsing finishes
+(lib/_metrics.MetricsMixin). Blocking calls inside the request bound their
+own waits by what is left of it:
+
+  - each statement carries `SET LOCAL statement_timeout` equal to the time
+    left, sent in the same round trip as the statement (lib/_metrics cursor);
+    a statement started with nothing left raises DeadlineExceeded instead
+  - pool checkouts and connect_timeout wait at most the time left
+  - SMTP sockets time out when the budget runs out
+
+A request that runs out of budget ends with 504 instead of the usual
+500/503 (MetricsMixin answers 504 for a timeout no handler caught), and topcit_deadline_overruns_total{route} counts every request that
+took longer than its budget, whatever it answered.
+
+Budgets are seconds, keyed by route label; override them with
+DEADLINE_ROUTES="/api/users/me=0.2,/api/users/login=2" (0 turns the
+deadline off for that route) and DEADLINE_DEFAULT for everything else.
+"""
+import os
+import threading
+import time
+from typing import Optional
+
+
+DEFAULT_BUDGETS = {
+    '/api/users/me': 0.5,
+    '/api/bootstrap': 1.0,
+    '/api/modules': 1.0,
+    '/api/notifications': 1.0,
+    '/api/notifications/unread': 0.5,
+    '/api/users/activity': 1.0,
+    '/api/users/progress': 1.0,
+    '/api/users/sync': 1.0,
+    '/api/users/batch': 2.0,
+    '/api/users/login': 2.0,
+    '/api/users/register': 3.0,
+    '/api/users/reset/complete': 3.0,
+    '/api/rewards/redeem': 2.0,
+    # Includes the verification / reset email
+    '/api/users/verify/start': 8.0,
+    '/api/users/reset/start': 8.0,
+    # REFRESH MATERIALIZED VIEW over the whole activity log
+    '/api/admin/stats/refresh': 120.0,
+}
+DEADLINE_DEFAULT = float(os.environ.get('DEADLINE_DEFAULT') or '10')
+# Long-lived by design: streams, exports, profiles, uploads, scrapes and static files
+EXEMPT = ('/api/stream', '/api/admin/export/', '/api/admin/profile', '/upload', '/metrics', 'static')
+
+
+# SQLSTATE query_canceled, raised when `SET LOCAL statement_timeout` fires
+QUERY_CANCELED = '57014'
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def is_timeout(exc) -> bool:
+    """True if `exc`, or an exception it was raised from, is a deadline overrun or a cancelled statement."""
+    while exc is not None:
+        if isinstance(exc, DeadlineExceeded) or getattr(exc, 'pgcode', None) == QUERY_CANCELED:
+            return True
+        exc = exc.__cause__
+    return False
+
+
+def _load_budgets() -> dict:
+    budgets = dict(DEFAULT_BUDGETS)
+    for item in (os.environ.get('DEADLINE_ROUTES') or '').split(','):
+        route, _, seconds = item.strip().partition('=')
+        try:
+            budgets[route.strip()] = float(seconds)
+        except ValueError:
+            continue
+    return budgets
+
+
+BUDGETS = _load_budgets()
+_local = threading.local()
+
+
+def budget_for(route: str) -> Optional[float]:
+    if route.startswith(EXEMPT):
+        return None
+    budget = BUDGETS.get(route, DEADLINE_DEFAULT)
+    return budget if budget > 0 else None
+
+
+def start(route: str) -> Optional[float]:
+    """Set this thread's deadline for a request on `route`; returns the budget (None: no deadline)."""
+    budget = budget_for(route)
+    _local.until = time.monotonic() + budget if budget is not None else None
+    return budget
+
+
+def clear():
+    _local.until = None
+
+
+def remaining() -> Optional[float]:
+    """Seconds left for the current request, or None when it has no deadline."""
+    until = getattr(_local, 'until', None)
+    return None if until is None else until - time.monotonic()
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def check():
+    if expired():
+        raise DeadlineExceeded('Request deadline exceeded')
+
+
+def timeout(default: Optional[float], floor: float = 0.05) -> Optional[float]:
+    """`default` capped by the time left (never below `floor`, so the call fails fast instead of blocking)."""
+    left = remaining()
+    if left is None:
+        return default
+    left = max(floor, left)
+    return left if default is None else min(default, left)
+
+
+def statement_prefix() -> str:
+    """`SET LOCAL statement_timeout` for the time left, to send ahead of a statement; '' without a deadline."""
+    left = remaining()
+    if left is None:
+        return ''
+    if left <= 0:
+        raise DeadlineExceeded('Request deadline exceeded')
+    return f'SET LOCAL statement_timeout = {max(1, int(left * 1000))}; '
@@ -0,0 +1,248 @@
+"""Server-side grading for published modules.
+
+The answer index is built once from the module_store catalog: quiz answers are
+kept as indexes, code-fill answers are pre-normalized, and CTF flags are kept
+only as SHA-256 digests. The public catalog is the same data with every answer
+field removed, so clients never download answers.
+
+Completions are the only way XP enters a user's total. The built-in courses
+of docs/script.js (COURSE_META) are in the index too and grade the same way;
+their answers live only here, and the server pays their fixed reward once
+per user.
+"""
+import copy
+import hashlib
+import hmac
+import json
+import uuid
+from typing import Optional
+
+from . import _invalidation, _notify, _pubsub, _ranks, _wallet
+
+
+def normalize_code(s) -> str:
+    # Same normalization the course page used client-side
+    return ''.join(str(s or '').split()).lower()
+
+
+def flag_digest(s) -> str:
+    return hashlib.sha256(str(s or '').strip().encode('utf-8')).hexdigest()
+
+
+def catalog_version(mods) -> str:
+    raw = json.dumps(mods, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+
+def _int_or_none(v) -> Optional[int]:
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return None
+
+
+# Mirrors COURSE_REWARDS in docs/script.js: id -> (title, xp, coins)
+BUILTIN_COURSES = {
+    'requirements': ('Requirements Engineering', 80, 120),
+    'design': ('Software Design & Architecture', 90, 140),
+    'programming': ('Programming Fundamentals', 60, 100),
+    'databases': ('Database Modeling', 70, 110),
+    'networks': ('Networking Fundamentals', 60, 100),
+    'os': ('Operating Systems', 80, 120),
+    'algorithms': ('Algorithms & Data Structures', 100, 160),
+    'security': ('Cybersecurity Essentials', 90, 140),
+    'cloud': ('Cloud Computing Basics', 70, 110),
+    # COURSE_META demos without an entry in COURSE_REWARDS pay nothing
+    'ctf': ('Web Security CTF', 0, 0),
+    'codefill': ('Code Completion Challenge', 0, 0),
+}
+
+# Answers to the COURSE_META tasks, in index form: quiz correctIndex,
+# normalize_code() of the code-fill answer, flag_digest() of the flag
+BUILTIN_ANSWERS = {
+    'requirements': {'quiz': 1},
+    'design': {'quiz': 1},
+    'programming': {'quiz': 1},
+    'databases': {'quiz': 1},
+    'networks': {'quiz': 1},
+    'os': {'quiz': 1},
+    'algorithms': {'quiz': 1},
+    'security': {'quiz': 1},
+    'cloud': {'quiz': 0},
+    'ctf': {'flag': '175797e760424201f8f6058942fc5562981b621be5d8e8868ff7144ca2a75865'},
+    'codefill': {'code': 'arr.reduce((a,b)=>a+b,0)'},
+}
+
+
+def build_answer_index(mods) -> dict:
+    """Grading entries by lowercase id; a published module replaces a built-in course of the same id."""
+    index = {
+        cid: dict({'title': title, 'xp': xp, 'coins': coins, 'quiz': None, 'code': None, 'flag': None, 'phased': None},
+                  **BUILTIN_ANSWERS.get(cid, {}))
+        for cid, (title, xp, coins) in BUILTIN_COURSES.items()
+    }
+    for m in mods if isinstance(mods, list) else []:
+        if not isinstance(m, dict) or not m.get('id'):
+            continue
+        c = m.get('content') or {}
+        entry = {
+            'title': m.get('title') or m['id'],
+            'xp': max(0, _int_or_none(m.get('xp')) or 0),
+            'coins': max(0, _int_or_none(m.get('coins')) or 0),
+            'quiz': None, 'code': None, 'flag': None, 'phased': None,
+        }
+        quiz = c.get('quiz')
+        if isinstance(quiz, dict) and isinstance(quiz.get('options'), list):
+            entry['quiz'] = _int_or_none(quiz.get('correctIndex'))
+        code = c.get('codeFill')
+        if isinstance(code, dict) and code.get('answer'):
+            entry['code'] = normalize_code(code.get('answer'))
+        ctf = c.get('ctf')
+        if isinstance(ctf, dict) and ctf.get('flag'):
+            entry['flag'] = flag_digest(ctf.get('flag'))
+        phased = c.get('phased')
+        if isinstance(phased, dict) and isinstance((phased.get('quiz') or {}).get('questions'), list):
+            entry['phased'] = [
+                {'correctIndex': _int_or_none(q.get('correctIndex')) or 0, 'explanation': q.get('explanation') or ''}
+                for q in phased['quiz']['questions'] if isinstance(q, dict)
+            ]
+        index[str(m['id']).lower()] = entry
+    return index
+
+
+def strip_answers(mods) -> list:
+    """Copy of the catalog without correct indexes, code answers, flags or explanations."""
+    public = copy.deepcopy(mods) if isinstance(mods, list) else []
+    for m in public:
+        c = m.get('content') if isinstance(m, dict) else None
+        if not isinstance(c, dict):
+            continue
+        if isinstance(c.get('quiz'), dict):
+            c['quiz'].pop('correctIndex', None)
+        if isinstance(c.get('codeFill'), dict):
+            c['codeFill'].pop('answer', None)
+        if isinstance(c.get('ctf'), dict):
+            c['ctf'].pop('flag', None)
+        phased = c.get('phased')
+        if isinstance(phased, dict) and isinstance(phased.get('quiz'), dict):
+            for q in phased['quiz'].get('questions') or []:
+                if isinstance(q, dict):
+                    q.pop('correctIndex', None)
+                    q.pop('explanation', None)
+    return public
+
+
+def grade(entry: dict, answers: dict) -> dict:
+    """Grade whichever answers were submitted.
+
+    `complete` is True only when every gradable task of the module was
+    submitted and passed; only complete submissions earn the award. Phased
+    quizzes may be answered wrongly and still complete, as on the client.
+    """
+    results = {}
+    complete = True
+    if entry['quiz'] is not None:
+        if 'quiz' in answers:
+            results['quiz'] = _int_or_none(answers.get('quiz')) == entry['quiz']
+        complete = complete and results.get('quiz', False)
+    if entry['code'] is not None:
+        if 'code' in answers:
+            results['code'] = hmac.compare_digest(normalize_code(answers.get('code')), entry['code'])
+        complete = complete and results.get('code', False)
+    if entry['flag'] is not None:
+        if 'flag' in answers:
+            results['flag'] = hmac.compare_digest(flag_digest(answers.get('flag')), entry['flag'])
+        complete = complete and results.get('flag', False)
+    if entry['phased'] is not None:
+        chosen = answers.get('phased')
+        if isinstance(chosen, list):
+            results['phased'] = [
+                {
+                    'correct': i < len(chosen) and _int_or_none(chosen[i]) == q['correctIndex'],
+                    'correctIndex': q['correctIndex'],
+                    'explanation': q['explanation'],
+                }
+                for i, q in enumerate(entry['phased'])
+            ]
+        complete = complete and 'phased' in results
+    return {'results': results, 'complete': complete}
+
+
+DDL_GRADED_ONCE = """
+CREATE UNIQUE INDEX IF NOT EXISTS activity_logs_graded_once
+ON activity_logs (user_id, course_id)
+WHERE event_type = 'course_completed' AND (metadata->>'graded') = 'true'
+"""
+
+# Log the completion, credit the user and append the wallet ledger entry in
+# one statement. The partial unique index makes a second award for the same
+# user/module a no-op, even when two submissions race.
+SQL_AWARD = """
+WITH ins AS (
+    INSERT INTO activity_logs(id, user_id, course_id, event_type, xp_awarded, coins_awarded, metadata)
+    VALUES (%(log_id)s, %(user_id)s, %(course_id)s, 'course_completed', %(xp)s, %(coins)s, %(metadata)s::jsonb)
+    ON CONFLICT (user_id, course_id) WHERE event_type = 'course_completed' AND (metadata->>'graded') = 'true'
+    DO NOTHING
+    RETURNING xp_awarded, coins_awarded
+), upd AS (
+    UPDATE users u
+    SET xp_total = u.xp_total + ins.xp_awarded, wallet = u.wallet + ins.coins_awarded
+    FROM ins
+    WHERE u.id = %(user_id)s
+    RETURNING u.xp_total, u.wallet, ins.xp_awarded, ins.coins_awarded
+), led AS (
+    INSERT INTO wallet_ledger(user_id, delta, balance, kind, reason, idempotency_key)
+    SELECT %(user_id)s, upd.coins_awarded, upd.wallet, 'course', %(title)s, %(ledger_key)s
+    FROM upd WHERE upd.coins_awarded <> 0
+)
+SELECT xp_total, wallet, xp_awarded, coins_awarded FROM upd
+"""
+
+
+def award_completion(conn, user_id: str, module_id: str, entry: dict) -> Optional[dict]:
+    """Credit XP/coins once per user and module and move the rank; returns None if already awarded.
+
+    Every rank the award reaches pays its rank-up coins through the ledger,
+    keyed `rank:<n>` so a rank never pays twice.
+    """
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(SQL_AWARD, {
+                'log_id': str(uuid.uuid4()), 'user_id': user_id, 'course_id': module_id,
+                'xp': entry['xp'], 'coins': entry['coins'],
+                'metadata': json.dumps({'title': entry['title'], 'graded': True}),
+                'title': entry['title'], 'ledger_key': f'course:{module_id}',
+            })
+            row = cur.fetchone()
+            if row:
+                xp_total, wallet, xp, coins = row
+                old_level = _ranks.level_for(xp_total - xp)[0]
+                level_idx, xp_in_level = _ranks.level_for(xp_total)
+                cur.execute("UPDATE users SET level_idx = %s, xp_in_level = %s WHERE id = %s",
+                            (level_idx, xp_in_level, user_id))
+                for idx in range(old_level, level_idx):
+                    balance = _wallet.credit_once(cur, user_id, _ranks.rank_up_coins(idx), 'rank',
+                                                  f'Rank {idx + 2}', f'rank:{idx + 2}')
+                    if balance is not None:
+                        wallet = balance
+                _invalidation.user_changed(user_id, cur)
+                topic = _pubsub.user_topic(user_id)
+                _pubsub.publish(topic, 'progress', {
+                    'xp_total': xp_total, 'level_idx': level_idx, 'xp_in_level': xp_in_level, 'wallet': wallet,
+                }, cur)
+                _pubsub.publish(topic, 'wallet', {'wallet': wallet}, cur)
+                _notify.progress_events(cur, user_id, xp_total - xp, old_level, xp_total, level_idx)
+    if not row:
+        return None
+    return {'xp_total': xp_total, 'level_idx': level_idx, 'xp_in_level': xp_in_level, 'wallet': wallet,
+            'xp': xp, 'coins': coins}
+
+
+class Catalog:
+    """Cached module catalog plus its answer index and public (stripped) form."""
+
+    def __init__(self, mods=None):
+        self.modules = mods if isinstance(mods, list) else []
+        self.public = strip_answers(self.modules)
+        self.index = build_answer_index(self.modules)
+        self.version = catalog_version(self.modules)
@@ -0,0 +1,166 @@
+"""Cross-instance cache invalidation over Postgres LISTEN/NOTIFY.
+
+Events are short strings on INVALIDATE_CHANNEL:
+
+    modules_changed               the published module catalog was replaced
+    user_changed:<id>             a user's row changed (`*` means every user)
+    session_revoked:<token_hash>  a session token stopped being valid
+    schema_changed                a migration ran; prepared statements are stale
+
+Writers call the helpers below with their cursor, so the NOTIFY is delivered
+only when their transaction commits. The event is also dispatched locally
+straight away; the echo that comes back on commit (or, without a bridge, a
+second local dispatch after commit) drops anything a concurrent reader
+cached from the pre-commit row. Listening shares the
+pub/sub bridge's single connection, and after every reconnect all callbacks
+get a `*` event, since notifications sent while disconnected are lost.
+"""
+import hashlib
+import os
+import threading
+import time
+from typing import Optional
+
+from . import _pubsub
+from ._accesslog import log_event
+
+
+INVALIDATE_CHANNEL = os.environ.get('INVALIDATE_CHANNEL') or 'topcit_invalidate'
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL') or '30')
+USER_CACHE_MAX = int(os.environ.get('USER_CACHE_MAX') or '20000')
+# How long past its TTL a cached profile may still be served while the database is down
+USER_CACHE_STALE = float(os.environ.get('USER_CACHE_STALE') or '3600')
+
+MODULES_CHANGED = 'modules_changed'
+USER_CHANGED = 'user_changed'
+SESSION_REVOKED = 'session_revoked'
+SCHEMA_CHANGED = 'schema_changed'
+ALL = '*'
+
+_callbacks = {}
+_callbacks_lock = threading.Lock()
+
+
+def on(kind: str, callback):
+    """Register callback(arg: str) for an event kind; runs on the listener thread."""
+    with _callbacks_lock:
+        _callbacks.setdefault(kind, []).append(callback)
+
+
+def _dispatch(payload: str):
+    kind, _, arg = payload.partition(':')
+    with _callbacks_lock:
+        callbacks = list(_callbacks.get(kind, ()))
+    for cb in callbacks:
+        try:
+            cb(arg)
+        except Exception as e:
+            log_event('pubsub', 'Invalidation callback failed', event=kind, error=str(e))
+
+
+def _flush_all():
+    with _callbacks_lock:
+        kinds = list(_callbacks)
+    for kind in kinds:
+        _dispatch(f'{kind}:{ALL}')
+
+
+_pubsub.listen(INVALIDATE_CHANNEL, _dispatch, on_connect=_flush_all)
+
+
+def invalidate(kind: str, arg: str = '', cur=None):
+    """Drop local copies now and, with `cur`, on every instance once the transaction commits."""
+    payload = f'{kind}:{arg}' if arg else kind
+    _dispatch(payload)
+    if cur is not None:
+        cur.execute('SELECT pg_notify(%s, %s)', (INVALIDATE_CHANNEL, payload))
+        if not _pubsub.bridge_active():
+            _pubsub.after_commit(cur, lambda: _dispatch(payload))
+
+
+def modules_changed(cur=None):
+    invalidate(MODULES_CHANGED, '', cur)
+
+
+def user_changed(user_id: str, cur=None):
+    invalidate(USER_CHANGED, str(user_id), cur)
+
+
+def session_revoked(token: str, cur=None):
+    invalidate(SESSION_REVOKED, token_hash(token), cur)
+
+
+def token_hash(token: str) -> str:
+    # Raw tokens never go over NOTIFY (or into the cache's keys)
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+class ProfileCache:
+    """Session token -> user dict, dropped by user_changed / session_revoked events.
+
+    Readers take `generation()` before querying and pass it to `put()`; a put
+    is ignored when any invalidation happened in between, so a read that
+    raced a write cannot re-cache the old row.
+    """
+
+    def __init__(self, ttl: float = USER_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._by_token = {}
+        self._by_user = {}
+        self._gen = 0
+        on(USER_CHANGED, self.drop_user)
+        on(SESSION_REVOKED, self.drop_token)
+
+    def generation(self) -> int:
+        return self._gen
+
+    def get(self, token: str, stale: float = 0.0) -> Optional[dict]:
+        """The cached user; `stale` accepts entries up to that many seconds past their TTL."""
+        if self.ttl <= 0:
+            return None
+        key = token_hash(token)
+        with self._lock:
+            hit = self._by_token.get(key)
+        if hit is None or hit[1] + stale < time.monotonic():
+            return None
+        return dict(hit[0])
+
+    def put(self, token: str, user: dict, gen: int):
+        if self.ttl <= 0:
+            return
+        key = token_hash(token)
+        with self._lock:
+            if gen != self._gen:
+                return
+            if len(self._by_token) >= USER_CACHE_MAX:
+                # Expired entries are only replaced, never swept; start over when full
+                self._by_token.clear()
+                self._by_user.clear()
+            self._by_token[key] = (dict(user), time.monotonic() + self.ttl)
+            self._by_user.setdefault(user['id'], set()).add(key)
+
+    def drop_user(self, user_id: str):
+        with self._lock:
+            self._gen += 1
+            if user_id == ALL:
+                self._by_token.clear()
+                self._by_user.clear()
+                return
+            for key in self._by_user.pop(user_id, ()):
+                self._by_token.pop(key, None)
+
+    def drop_token(self, key: str):
+        with self._lock:
+            self._gen += 1
+            if key == ALL:
+                self._by_token.clear()
+                self._by_user.clear()
+                return
+            hit = self._by_token.pop(key, None)
+            if hit is not None:
+                keys = self._by_user.get(hit[0]['id'])
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._by_user[hit[0]['id']]
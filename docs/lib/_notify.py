@@ -0,0 +1,319 @@
+"""Per-user notification feed with a denormalized unread counter.
+
+Notifications are rows in `notifications`, read newest-first with keyset
+pagination on the id (`?cursor=<last id>`), so every page is an index range
+scan no matter how deep the reader scrolls. `users.unread_notifications` is
+kept in step by the same statements that insert or mark rows, which lets the
+badge read one column instead of counting.
+
+Broadcasts (a newly published module) are queued in `notify_fanout` in the
+same transaction as the publish and fanned out set-based: each batch selects
+a slice of user ids after the job's cursor, inserts their rows, bumps their
+counters and advances the cursor in one transaction. A job therefore resumes
+where it stopped, whether the worker thread in server.py restarts or a
+Vercel request runs out of time and leaves the rest to the next call.
+"""
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+from . import _invalidation, _prepared, _pubsub
+from ._accesslog import log_event
+
+
+NOTIFY_FANOUT_BATCH = int(os.environ.get('NOTIFY_FANOUT_BATCH') or '5000')
+NOTIFY_FANOUT_POLL = float(os.environ.get('NOTIFY_FANOUT_POLL') or '5')
+# Time a Vercel request spends on queued batches before leaving the rest
+NOTIFY_REQUEST_SECONDS = float(os.environ.get('NOTIFY_REQUEST_SECONDS') or '3')
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+DDL_NOTIFICATIONS = """
+CREATE TABLE IF NOT EXISTS notifications (
+    id BIGSERIAL PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    title TEXT NOT NULL,
+    message TEXT NOT NULL,
+    data JSONB,
+    read_at TIMESTAMPTZ,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+)
+"""
+
+DDL_NOTIFY_EXTRAS = (
+    "CREATE INDEX IF NOT EXISTS notifications_user_feed ON notifications (user_id, id DESC)",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS unread_notifications INTEGER NOT NULL DEFAULT 0",
+    # Leaderboard position is a range count over xp_total
+    "CREATE INDEX IF NOT EXISTS users_xp_total ON users (xp_total)",
+)
+
+
+DDL_FANOUT = """
+CREATE TABLE IF NOT EXISTS notify_fanout (
+    id BIGSERIAL PRIMARY KEY,
+    kind TEXT NOT NULL,
+    title TEXT NOT NULL,
+    message TEXT NOT NULL,
+    data JSONB,
+    after_id TEXT NOT NULL DEFAULT '',
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    done_at TIMESTAMPTZ
+)
+"""
+
+DDL_FANOUT_PENDING = "CREATE INDEX IF NOT EXISTS notify_fanout_pending ON notify_fanout (id) WHERE done_at IS NULL"
+
+
+def ensure_notify_schema(cur):
+    cur.execute("SELECT to_regclass('notifications') IS NOT NULL, to_regclass('notify_fanout') IS NOT NULL")
+    has_notifications, has_fanout = cur.fetchone()
+    if not has_notifications:
+        cur.execute(DDL_NOTIFICATIONS)
+        for ddl in DDL_NOTIFY_EXTRAS:
+            cur.execute(ddl)
+    if not has_fanout:
+        cur.execute(DDL_FANOUT)
+        cur.execute(DDL_FANOUT_PENDING)
+    if not (has_notifications and has_fanout):
+        _prepared.schema_changed(cur)
+
+
+SQL_NOTIFY_ONE = """
+WITH ins AS (
+    INSERT INTO notifications(user_id, kind, title, message, data)
+    VALUES (%(user_id)s, %(kind)s, %(title)s, %(message)s, %(data)s::jsonb)
+    RETURNING user_id
+)
+UPDATE users u SET unread_notifications = u.unread_notifications + 1
+FROM ins WHERE u.id = ins.user_id
+"""
+
+SQL_FANOUT_BATCH = """
+WITH batch AS (
+    SELECT id FROM users WHERE id > %(after)s ORDER BY id LIMIT %(limit)s
+), ins AS (
+    INSERT INTO notifications(user_id, kind, title, message, data)
+    SELECT batch.id, %(kind)s, %(title)s, %(message)s, %(data)s::jsonb FROM batch
+), upd AS (
+    UPDATE users u SET unread_notifications = u.unread_notifications + 1
+    FROM batch WHERE u.id = batch.id
+)
+SELECT MAX(id), COUNT(*) FROM batch
+"""
+
+SQL_MARK_READ = """
+WITH r AS (
+    UPDATE notifications SET read_at = NOW()
+    WHERE user_id = %(user_id)s AND read_at IS NULL AND (%(all)s OR id = ANY(%(ids)s))
+    RETURNING 1
+)
+UPDATE users SET unread_notifications = GREATEST(0, unread_notifications - (SELECT COUNT(*) FROM r))
+WHERE id = %(user_id)s
+RETURNING unread_notifications
+"""
+
+
+def notify_user(cur, user_id: str, kind: str, title: str, message: str, data: Optional[dict] = None):
+    """Insert one notification inside the caller's transaction."""
+    cur.execute(SQL_NOTIFY_ONE, {
+        'user_id': user_id, 'kind': kind, 'title': title, 'message': message,
+        'data': json.dumps(data) if data is not None else None,
+    })
+    _invalidation.user_changed(user_id, cur)
+    _pubsub.publish(_pubsub.user_topic(user_id), 'notification', {'kind': kind, 'title': title, 'message': message}, cur)
+
+
+# Oldest unfinished job; SKIP LOCKED lets a second worker move on to the next
+SQL_FANOUT_CLAIM = """
+SELECT id, kind, title, message, data, after_id FROM notify_fanout
+WHERE done_at IS NULL ORDER BY id LIMIT 1
+FOR UPDATE SKIP LOCKED
+"""
+
+
+def queue_fan_out(cur, kind: str, title: str, message: str, data: Optional[dict] = None):
+    """Queue a notification for every user inside the caller's transaction."""
+    cur.execute(
+        "INSERT INTO notify_fanout(kind, title, message, data) VALUES (%s, %s, %s, %s::jsonb)",
+        (kind, title, message, json.dumps(data) if data is not None else None),
+    )
+
+
+def fan_out_step(conn, batch_size: int = NOTIFY_FANOUT_BATCH) -> Optional[bool]:
+    """Run one batch of the oldest queued job; returns None when nothing is queued, else whether that job finished."""
+    limit = max(1, int(batch_size))
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(SQL_FANOUT_CLAIM)
+            job = cur.fetchone()
+            if not job:
+                return None
+            job_id, kind, title, message, data, after_id = job
+            cur.execute(SQL_FANOUT_BATCH, {
+                'kind': kind, 'title': title, 'message': message, 'limit': limit, 'after': after_id,
+                'data': json.dumps(data) if data is not None else None,
+            })
+            last_id, n = cur.fetchone()
+            done = not last_id or n < limit
+            cur.execute("UPDATE notify_fanout SET after_id = %s, done_at = CASE WHEN %s THEN NOW() END WHERE id = %s",
+                        (last_id or after_id, done, job_id))
+            if done:
+                # One broadcast after the last batch; clients re-read their counter
+                _invalidation.invalidate(_invalidation.USER_CHANGED, _invalidation.ALL, cur)
+                _pubsub.publish(_pubsub.GLOBAL_TOPIC, 'notification', {'kind': kind, 'title': title, 'message': message}, cur)
+    return done
+
+
+def fan_out_pending(connect, budget: Optional[float] = None, batch_size: int = NOTIFY_FANOUT_BATCH) -> bool:
+    """Work through queued jobs, starting no batch after `budget` seconds; returns True if work is left."""
+    conn = connect()
+    if not conn:
+        return True
+    stop = None if budget is None else time.monotonic() + budget
+    try:
+        while stop is None or time.monotonic() < stop:
+            if fan_out_step(conn, batch_size) is None:
+                return False
+        return True
+    except Exception as e:
+        # The failed batch rolled back with its cursor; the next run repeats it
+        log_event('notify', 'Fan-out batch failed', error=str(e))
+        return True
+    finally:
+        conn.close()
+
+
+_wake = threading.Event()
+
+
+def wake_fan_out():
+    """Start on a just-queued job now instead of at the next poll."""
+    _wake.set()
+
+
+def start_fan_out_worker(connect) -> threading.Thread:
+    """Drain notify_fanout forever on a daemon thread."""
+    def run():
+        while True:
+            _wake.clear()
+            # Without a budget this only returns once the queue is empty or a batch failed
+            fan_out_pending(connect)
+            _wake.wait(NOTIFY_FANOUT_POLL)
+
+    t = threading.Thread(target=run, name='notify-fanout', daemon=True)
+    t.start()
+    return t
+
+
+def feed(conn, user_id: str, cursor: Optional[int] = None, limit: int = PAGE_SIZE) -> dict:
+    """One page of the feed, newest first; pass `next_cursor` back to continue."""
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    with conn:
+        with conn.cursor() as cur:
+            if cursor:
+                cur.execute(
+                    """
+                    SELECT id, kind, title, message, data, read_at IS NOT NULL, created_at
+                    FROM notifications WHERE user_id = %s AND id < %s
+                    ORDER BY id DESC LIMIT %s
+                    """,
+                    (user_id, int(cursor), limit + 1),
+                )
+            else:
+                cur.execute(
+                    """
+                    SELECT id, kind, title, message, data, read_at IS NOT NULL, created_at
+                    FROM notifications WHERE user_id = %s
+                    ORDER BY id DESC LIMIT %s
+                    """,
+                    (user_id, limit + 1),
+                )
+            rows = cur.fetchall()
+            cur.execute("SELECT unread_notifications FROM users WHERE id = %s", (user_id,))
+            row = cur.fetchone()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        'items': [
+            {'id': r[0], 'kind': r[1], 'title': r[2], 'message': r[3], 'data': r[4], 'read': bool(r[5]),
+             'created_at': r[6].isoformat() if r[6] else None}
+            for r in rows
+        ],
+        'next_cursor': rows[-1][0] if more and rows else None,
+        'unread': row[0] if row else 0,
+    }
+
+
+def unread_count(conn, user_id: str) -> int:
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT unread_notifications FROM users WHERE id = %s", (user_id,))
+            row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def mark_read(conn, user_id: str, ids=None) -> int:
+    """Mark the given ids (or everything when ids is None) read; returns the new unread count."""
+    clean = []
+    for v in ids or []:
+        try:
+            clean.append(int(v))
+        except (TypeError, ValueError):
+            continue
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(SQL_MARK_READ, {'user_id': user_id, 'all': ids is None, 'ids': clean})
+            row = cur.fetchone()
+            _invalidation.user_changed(user_id, cur)
+    return row[0] if row else 0
+
+
+# --- Events raised from XP awards ---
+
+SQL_POSITIONS = """
+SELECT COUNT(*) FILTER (WHERE xp_total > %(old)s) + 1, COUNT(*) FILTER (WHERE xp_total > %(new)s) + 1
+FROM users WHERE xp_total > %(old)s AND id <> %(user_id)s
+"""
+
+
+def progress_events(cur, user_id: str, old_xp: int, old_level: int, xp_total: int, level_idx: int):
+    """Raise rank-up / leaderboard notifications for an XP award, inside the caller's transaction.
+
+    The award's UPDATE holds the user's row lock, so two concurrent awards
+    cannot both announce the same rank.
+    """
+    topic = _pubsub.user_topic(user_id)
+    if level_idx > (old_level or 0):
+        rank = level_idx + 1
+        notify_user(cur, user_id, 'rank_up', '🎉 Rank Up!', f"Congratulations! You've reached Rank {rank}!", {'rank': rank})
+        _pubsub.publish(topic, 'rank', {'rank': rank}, cur)
+    if xp_total > (old_xp or 0):
+        cur.execute(SQL_POSITIONS, {'old': old_xp or 0, 'new': xp_total, 'user_id': user_id})
+        old_pos, new_pos = cur.fetchone()
+        if new_pos < old_pos:
+            notify_user(cur, user_id, 'leaderboard', '📈 Leaderboard Update!',
+                        f'Great job! You moved up to position #{new_pos} (from #{old_pos})',
+                        {'position': new_pos, 'previous': old_pos})
+            _pubsub.publish(topic, 'rank', {'position': new_pos, 'previous': old_pos}, cur)
+
+
+def new_module_ids(old_mods, new_mods) -> list:
+    """Ids of modules in `new_mods` that were not published before."""
+    old_ids = {str(m.get('id')).lower() for m in old_mods or [] if isinstance(m, dict) and m.get('id')}
+    return [m for m in new_mods or [] if isinstance(m, dict) and m.get('id') and str(m['id']).lower() not in old_ids]
+
+
+def announce_modules(cur, mods: list):
+    """Queue one 'new quest' notification for a publish that added `mods`, in the publish's transaction."""
+    if not mods:
+        return
+    if len(mods) == 1:
+        title = str(mods[0].get('title') or mods[0]['id'])
+        message = f'"{title}" is now available!'
+    else:
+        message = f'{len(mods)} new quests are now available!'
+    queue_fan_out(cur, 'new_course', '🧭 New Quest Available!', message,
+                  {'modules': [str(m['id']) for m in mods]})
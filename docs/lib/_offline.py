@@ -0,0 +1,111 @@
+"""Server side of the offline service worker (docs/sw.js).
+
+The static shell in docs/ used to be fetched again on every navigation, and
+the app was unusable offline even though most of its state lives in
+localStorage. server.py now hashes the shell at startup into an asset
+manifest, GET /asset-manifest.json:
+
+    {"version": "<hash of all hashes>", "files": {"/learn.html": "<sha256>", ...},
+     "precache": ["/learn.html", "/script.js", ...]}
+
+The service worker installs the `precache` list (pages, scripts, styles and
+images up to ASSET_PRECACHE_MAX bytes), caches the other listed files on
+first use, and serves all of them cache-first. When the version changes it
+builds the next cache from the manifest diff: files whose hash did not
+change are copied over, only new and changed ones are downloaded.
+
+Activity and progress writes made while offline are queued by the service
+worker and sent on reconnect as one POST /api/users/batch, parsed here.
+"""
+import hashlib
+import os
+import uuid
+from typing import Optional
+from urllib.parse import quote
+
+
+# Larger files (the login background photo) are cached the first time a page uses them
+ASSET_PRECACHE_MAX = int(os.environ.get('ASSET_PRECACHE_MAX') or str(256 * 1024))
+ASSET_EXTENSIONS = ('.html', '.js', '.css', '.svg', '.png', '.jpg', '.jpeg', '.webp', '.gif', '.ico')
+# Not part of the shell: Python mirrors, uploads (immutable names, cached at runtime) and profiles
+ASSET_SKIP_DIRS = ('lib', 'uploads', 'profiles')
+# The worker itself is checked by the browser, never cached by itself
+ASSET_SKIP_FILES = ('sw.js',)
+
+# Largest batch the service worker sends in one request
+BATCH_MAX_OPS = 200
+
+# scripts/build_assets.py names these after their content; a changed file gets a new URL
+IMMUTABLE_PREFIX = '/assets/'
+
+
+def build_manifest(root: str) -> dict:
+    files = {}
+    precache = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        if dirpath == root:
+            dirnames[:] = [d for d in dirnames if d not in ASSET_SKIP_DIRS]
+        dirnames.sort()
+        for name in sorted(filenames):
+            if not name.lower().endswith(ASSET_EXTENSIONS) or (dirpath == root and name in ASSET_SKIP_FILES):
+                continue
+            path = os.path.join(dirpath, name)
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(65536), b''):
+                    digest.update(chunk)
+            url = '/' + quote(os.path.relpath(path, root).replace(os.sep, '/'))
+            files[url] = digest.hexdigest()
+            if name.lower().endswith(('.html', '.js', '.css')) or os.path.getsize(path) <= ASSET_PRECACHE_MAX:
+                precache.append(url)
+    version = hashlib.sha256(''.join(f'{u}={h}\n' for u, h in sorted(files.items())).encode('utf-8'))
+    return {'version': version.hexdigest()[:16], 'files': files, 'precache': precache}
+
+
+def cache_control(path: str) -> Optional[str]:
+    """Cache-Control for a static file served by server.py, or None for the default."""
+    path = path.split('?', 1)[0]
+    if path.startswith(IMMUTABLE_PREFIX):
+        return 'public, max-age=31536000, immutable'
+    if path == '/sw.js' or path.endswith(('.html', '/')):
+        # Browsers look for a new worker on navigation, and pages name the current
+        # fingerprinted assets; revalidate both every time
+        return 'no-cache'
+    return None
+
+
+def parse_batch(payload: dict) -> tuple:
+    """([(log_id, course_id, event_type, xp, coins, metadata), ...], progress or None); raises ValueError.
+
+    Activity ids come from the client so a batch that is retried after a lost
+    response is not logged twice. Only the last progress op counts: each one
+    carries the full XP state.
+    """
+    ops = payload.get('ops')
+    if not isinstance(ops, list):
+        raise ValueError('ops must be a list')
+    if len(ops) > BATCH_MAX_OPS:
+        raise ValueError(f'at most {BATCH_MAX_OPS} ops per batch')
+    activities, progress = [], None
+    for op in ops:
+        if not isinstance(op, dict) or not isinstance(op.get('body'), dict):
+            raise ValueError('each op needs a type and a body')
+        body = op['body']
+        if op.get('type') == 'progress':
+            progress = (int(body.get('xp_total') or 0), int(body.get('level_idx') or 0), int(body.get('xp_in_level') or 0))
+        elif op.get('type') == 'activity':
+            log_id = str(uuid.UUID(str(op.get('id') or '')))
+            activities.append(activity_fields(log_id, body))
+        else:
+            raise ValueError(f"unknown op type: {op.get('type')!r}")
+    return activities, progress
+
+
+def activity_fields(log_id: str, payload: dict) -> tuple:
+    """One activity_logs row from a POST /api/users/activity body."""
+    course_id = (payload.get('course_id') or '').strip()
+    event_type = (payload.get('event_type') or '').strip() or 'course_completed'
+    xp_awarded = int(payload.get('xp_awarded') or 0)
+    coins_awarded = int(payload.get('coins_awarded') or 0)
+    metadata = payload.get('metadata') if isinstance(payload.get('metadata'), (dict, list)) else None
+    return log_id, course_id, event_type, xp_awarded, coins_awarded, metadata
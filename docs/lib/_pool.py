@@ -0,0 +1,138 @@
+"""Bounded connection pool for server.py.
+
+`db_connect()` hands out leases, so the usual
+`conn = db_connect(); try: with conn: ... finally: conn.close()` pattern is
+unchanged, but close() puts the session back instead of ending it. A checkout
+waits up to DB_POOL_TIMEOUT seconds for a free slot and then fails like a
+refused connect (callers answer 503); a request with a deadline waits no
+longer than its remaining budget. Sessions are recycled after
+DB_POOL_MAX_AGE seconds and discarded when they come back broken.
+"""
+import os
+import threading
+import time
+
+from . import _deadline
+from . import _metrics
+from . import _prepared
+from ._accesslog import log_event
+
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or '20')
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT') or '5')
+DB_POOL_MAX_AGE = float(os.environ.get('DB_POOL_MAX_AGE') or '600')
+
+# psycopg2.extensions.TRANSACTION_STATUS_IDLE, without importing the driver
+_STATUS_IDLE = 0
+
+
+class Lease:
+    """A pooled connection; attribute access goes to the real connection."""
+
+    __slots__ = ('_pool', '_conn', '_born')
+
+    def __init__(self, pool, conn, born):
+        object.__setattr__(self, '_pool', pool)
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, '_born', born)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def __getattr__(self, name):
+        conn = self._conn
+        if conn is None:
+            raise AttributeError(f'{name} (connection already returned to the pool)')
+        return getattr(conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def cursor(self, *args, **kwargs):
+        return self._conn.cursor(*args, **kwargs)
+
+    def close(self):
+        conn = self._conn
+        if conn is not None:
+            object.__setattr__(self, '_conn', None)
+            self._pool.put(conn, self._born)
+
+
+class Pool:
+    def __init__(self, connect, size: int = DB_POOL_SIZE, timeout: float = DB_POOL_TIMEOUT, name: str = 'primary'):
+        self._connect = connect
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle = []
+        self.size = size
+        self.timeout = timeout
+        self.name = name
+
+    def get(self):
+        """A Lease, or None when the database is unreachable or every slot stayed busy."""
+        # Never wait past the request's deadline (lib/_deadline.py)
+        timeout = _deadline.timeout(self.timeout, floor=0)
+        if not self._slots.acquire(timeout=timeout):
+            _metrics.REGISTRY.inc('topcit_db_pool_timeouts_total', (('pool', self.name),))
+            log_event('db', 'Connection pool exhausted', pool=self.name, size=self.size, waited=round(timeout, 3))
+            return None
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    break
+                conn, born = item
+                if conn.closed or time.monotonic() - born > DB_POOL_MAX_AGE:
+                    self._discard(conn)
+                    continue
+                return Lease(self, conn, born)
+            conn = self._connect()
+            if conn is None:
+                self._slots.release()
+                return None
+            _prepared.track(conn)
+            return Lease(self, conn, time.monotonic())
+        except Exception:
+            self._slots.release()
+            raise
+
+    def put(self, conn, born):
+        try:
+            if conn.closed:
+                self._discard(conn)
+                return
+            try:
+                if conn.get_transaction_status() != _STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except Exception:
+                self._discard(conn)
+                return
+            with self._lock:
+                self._idle.append((conn, born))
+        finally:
+            self._slots.release()
+
+    def _discard(self, conn):
+        _prepared.forget(conn)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def idle_count(self) -> int:
+        with self._lock:
+            return len(self._idle)
+
+    def close_idle(self):
+        """Close every idle session, e.g. before fork() so no child inherits a parent's socket."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
@@ -0,0 +1,268 @@
+"""Pre-fork worker processes for `server.py --workers N`.
+
+One Python process serializes bcrypt, JSON encoding and multipart parsing on
+the GIL however many threads it runs, so the supervisor forks N workers, each
+with its own interpreter, and they all accept on the same port:
+
+  - With SO_REUSEPORT (Linux, BSD) every worker opens its own listening
+    socket and the kernel spreads new connections across them. The
+    supervisor only binds (without listening) to hold the port.
+  - Otherwise the supervisor listens once and the workers inherit the fd.
+
+The supervisor restarts workers that exit unexpectedly (with a backoff when
+they die right after starting), forwards SIGTERM/SIGINT to them and restarts
+them one at a time on SIGHUP. Metrics are shared through METRICS_DIR (see
+lib/_metrics.share()), so /metrics on any worker shows the whole server.
+"""
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+
+from . import _accesslog
+from . import _metrics
+from ._accesslog import log_event
+
+
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY') or '1')
+# Seconds a stopping worker waits for in-flight requests before exiting anyway
+WORKER_GRACE = float(os.environ.get('WORKER_GRACE') or '10')
+# A worker that dies sooner than this after starting is restarted with a growing delay
+WORKER_MIN_UPTIME = float(os.environ.get('WORKER_MIN_UPTIME') or '5')
+WORKER_MAX_BACKOFF = float(os.environ.get('WORKER_MAX_BACKOFF') or '30')
+
+
+def reuse_port_supported() -> bool:
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        return False
+    probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        probe.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+def _bind(address, reuse_port: bool) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(address)
+    return sock
+
+
+def _tracking(server_class):
+    """A subclass of `server_class` that counts requests in flight, for a graceful stop."""
+    class Tracked(server_class):
+        def process_request_thread(self, request, client_address):
+            with self._inflight_lock:
+                self.inflight += 1
+            try:
+                super().process_request_thread(request, client_address)
+            finally:
+                with self._inflight_lock:
+                    self.inflight -= 1
+
+    Tracked.__name__ = server_class.__name__
+    return Tracked
+
+
+def adopt(server_class, handler_class, sock: socket.socket):
+    """An instance of `server_class` serving on an already bound and listening socket."""
+    httpd = _tracking(server_class)(sock.getsockname()[:2], handler_class, bind_and_activate=False)
+    httpd.socket.close()
+    httpd.socket = sock
+    httpd.server_address = sock.getsockname()
+    httpd.server_name = socket.getfqdn(httpd.server_address[0])
+    httpd.server_port = httpd.server_address[1]
+    httpd.inflight = 0
+    httpd._inflight_lock = threading.Lock()
+    return httpd
+
+
+class Supervisor:
+    def __init__(self, server_class, handler_class, address, workers: int, on_worker_start=None):
+        self.server_class = server_class
+        self.handler_class = handler_class
+        self.workers = max(1, workers)
+        self.on_worker_start = on_worker_start
+        self.reuse_port = reuse_port_supported()
+        self.backlog = getattr(server_class, 'request_queue_size', 128)
+        self._sock = _bind(address, self.reuse_port)
+        if not self.reuse_port:
+            self._sock.listen(self.backlog)
+        # Port 0 picks a free port once; every worker then binds that one
+        self.address = self._sock.getsockname()[:2]
+        configured = (os.environ.get('METRICS_DIR') or '').strip()
+        self.metrics_dir = configured or tempfile.mkdtemp(prefix='topcit-metrics-')
+        self._own_metrics_dir = not configured
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        for entry in os.listdir(self.metrics_dir):
+            if entry.endswith('.metrics'):
+                os.remove(os.path.join(self.metrics_dir, entry))
+        self._pids = {}        # pid -> slot
+        self._started = {}     # slot -> monotonic start time
+        self._backoff = {}     # slot -> seconds to wait before the next restart
+        self._due = {}         # slot -> monotonic time to (re)start it
+        self._retiring = set() # pids stopped on purpose (SIGHUP)
+        self._reload = []      # slots still to restart for a SIGHUP
+        self._stopping = False
+        self._stop_deadline = None
+
+    # --- Supervisor side ---
+
+    def run(self) -> int:
+        _metrics.share(self.metrics_dir, 'supervisor', interval=0)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self._on_reload)
+        log_event('server', 'Supervisor starting workers', workers=self.workers,
+                  port=self.address[1], reuse_port=self.reuse_port)
+        for slot in range(self.workers):
+            self._spawn(slot)
+        try:
+            while self._pids or not self._stopping:
+                self._reap()
+                now = time.monotonic()
+                for slot, due in list(self._due.items()):
+                    if due <= now and not self._stopping:
+                        del self._due[slot]
+                        self._spawn(slot)
+                self._continue_reload()
+                if self._stopping and self._stop_deadline and now > self._stop_deadline:
+                    self._signal_all(signal.SIGKILL)
+                    self._stop_deadline = None
+                time.sleep(0.1)
+        finally:
+            self._sock.close()
+            if self._own_metrics_dir:
+                shutil.rmtree(self.metrics_dir, ignore_errors=True)
+        return 0
+
+    def _spawn(self, slot: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = self._worker(slot)
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+            finally:
+                os._exit(code)
+        self._pids[pid] = slot
+        self._started[slot] = time.monotonic()
+
+    def _reap(self):
+        while self._pids:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self._pids.clear()
+                return
+            if pid == 0:
+                return
+            slot = self._pids.pop(pid, None)
+            if slot is None:
+                continue
+            _metrics.retire(self.metrics_dir, f'worker-{pid}')
+            if self._stopping:
+                continue
+            if pid in self._retiring:
+                self._retiring.discard(pid)
+                self._spawn(slot)
+                continue
+            uptime = time.monotonic() - self._started.get(slot, 0)
+            delay = 0.0
+            if uptime < WORKER_MIN_UPTIME:
+                delay = min(WORKER_MAX_BACKOFF, max(0.5, self._backoff.get(slot, 0) * 2))
+            self._backoff[slot] = delay
+            self._due[slot] = time.monotonic() + delay
+            _metrics.REGISTRY.inc('topcit_worker_restarts_total', (('worker', str(slot)),))
+            _metrics.publish()
+            code = os.waitstatus_to_exitcode(status) if hasattr(os, 'waitstatus_to_exitcode') else status
+            log_event('server', 'Worker exited; restarting', worker=slot, pid=pid, exit=code,
+                      uptime=round(uptime, 1), delay=delay)
+
+    def _signal_all(self, signum):
+        for pid in list(self._pids):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _on_stop(self, signum, frame):
+        if not self._stopping:
+            self._stopping = True
+            self._stop_deadline = time.monotonic() + WORKER_GRACE + 5
+            self._due.clear()
+            self._signal_all(signal.SIGTERM)
+
+    def _on_reload(self, signum, frame):
+        if not self._stopping and not self._reload:
+            self._reload = list(range(self.workers))
+
+    def _continue_reload(self):
+        # One worker at a time, so the others keep serving
+        if not self._reload or self._retiring or self._stopping:
+            return
+        slot = self._reload.pop(0)
+        for pid, s in self._pids.items():
+            if s == slot:
+                self._retiring.add(pid)
+                os.kill(pid, signal.SIGTERM)
+                return
+
+    # --- Worker side ---
+
+    def _worker(self, slot: int) -> int:
+        parent = os.getppid()
+        for signum in (signal.SIGTERM, signal.SIGINT) + ((signal.SIGHUP,) if hasattr(signal, 'SIGHUP') else ()):
+            signal.signal(signum, signal.SIG_DFL)
+        # Threads do not survive fork(): restart the log writer, drop the parent's counters
+        _accesslog.ACCESS_LOG.after_fork()
+        _metrics.REGISTRY.reset()
+        if self.on_worker_start:
+            # Warm up before listening, so with SO_REUSEPORT no connection waits on a cold worker
+            self.on_worker_start(slot)
+        if self.reuse_port:
+            self._sock.close()
+            sock = _bind(self.address, True)
+            sock.listen(self.backlog)
+        else:
+            sock = self._sock
+        httpd = adopt(self.server_class, self.handler_class, sock)
+        stopping = threading.Event()
+
+        def stop(*_):
+            if not stopping.is_set():
+                stopping.set()
+                threading.Thread(target=httpd.shutdown, name='worker-stop', daemon=True).start()
+
+        def watch_parent():
+            while not stopping.wait(1.0):
+                if os.getppid() != parent:
+                    stop()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        threading.Thread(target=watch_parent, name='worker-parent-watch', daemon=True).start()
+        _metrics.share(self.metrics_dir, f'worker-{os.getpid()}')
+        try:
+            httpd.serve_forever()
+        finally:
+            # Stop accepting, then give requests in flight WORKER_GRACE seconds
+            httpd.socket.close()
+            deadline = time.monotonic() + WORKER_GRACE
+            while httpd.inflight and time.monotonic() < deadline:
+                time.sleep(0.05)
+            _metrics.publish()
+            _accesslog.ACCESS_LOG.flush()
+        return 0
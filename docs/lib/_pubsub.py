@@ -0,0 +1,226 @@
+"""In-process pub/sub hub, bridged across instances with Postgres LISTEN/NOTIFY.
+
+Subscribers register for topics (`user:<id>`, `global`) and receive events
+as pre-encoded SSE frames, so a broadcast is serialized once no matter how
+many connections are listening. `publish()` called with a cursor queues a
+`pg_notify` inside the writer's transaction: Postgres delivers it only on
+commit, to every instance's listener (this one included), which hands it to
+the local hub. Without a running bridge (a single process, Vercel) the event
+is held on the connection and handed to the hub after commit, or dropped
+on rollback, so subscribers never see a write that is not durable yet.
+"""
+import json
+import os
+import select
+import threading
+from typing import Optional
+
+from ._accesslog import log_event
+
+
+PUBSUB_CHANNEL = os.environ.get('PUBSUB_CHANNEL') or 'topcit_events'
+# pg_notify payloads are capped at 8000 bytes
+_MAX_PAYLOAD = 7900
+
+
+def encode_frame(event: str, data) -> bytes:
+    """One SSE frame; `data` is JSON-encoded on a single line."""
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'.encode('utf-8')
+
+
+class Hub:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._topics = {}
+
+    def subscribe(self, sub, topics):
+        """`sub` must have a non-blocking `push(frame: bytes)`."""
+        with self._lock:
+            for t in topics:
+                self._topics.setdefault(t, set()).add(sub)
+
+    def unsubscribe(self, sub, topics):
+        with self._lock:
+            for t in topics:
+                subs = self._topics.get(t)
+                if subs is not None:
+                    subs.discard(sub)
+                    if not subs:
+                        del self._topics[t]
+
+    def deliver(self, topic: str, event: str, data) -> int:
+        with self._lock:
+            subs = list(self._topics.get(topic, ()))
+        if not subs:
+            return 0
+        frame = encode_frame(event, data)
+        for sub in subs:
+            sub.push(frame)
+        return len(subs)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len({s for subs in self._topics.values() for s in subs})
+
+
+HUB = Hub()
+
+
+class PgListener:
+    """Dedicated autocommit connection LISTENing on channels, reconnecting on failure.
+
+    `handlers` maps channel -> callback(payload: str). Callbacks run on the
+    listener thread and must not block. `on_connect` runs after every
+    successful (re)connect: notifications sent while disconnected are lost,
+    so it is the place to drop anything they might have invalidated.
+    """
+
+    def __init__(self, connect, handlers: dict, name: str = 'pg-listener', on_connect=None):
+        self.connect = connect
+        self.handlers = dict(handlers)
+        self.name = name
+        self.on_connect = on_connect
+        self.connected = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        backoff = 0.5
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self.connect()
+                if conn is None:
+                    raise OSError('no database connection')
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    for channel in self.handlers:
+                        cur.execute(f'LISTEN "{channel}"')
+                self.connected.set()
+                log_event('pubsub', 'Listening', channels=list(self.handlers))
+                if self.on_connect is not None:
+                    try:
+                        self.on_connect()
+                    except Exception as e:
+                        log_event('pubsub', 'Connect hook failed', error=str(e))
+                backoff = 0.5
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 5.0) == ([], [], []):
+                        # Idle: a cheap round trip notices dead connections
+                        with conn.cursor() as cur:
+                            cur.execute('SELECT 1')
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        n = conn.notifies.pop(0)
+                        cb = self.handlers.get(n.channel)
+                        if cb is not None:
+                            try:
+                                cb(n.payload)
+                            except Exception as e:
+                                log_event('pubsub', 'Handler failed', channel=n.channel, error=str(e))
+            except Exception as e:
+                self.connected.clear()
+                log_event('pubsub', 'Listener disconnected; retrying', error=str(e), retry_in=backoff)
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+        self.connected.clear()
+
+
+_bridge: Optional[PgListener] = None
+
+
+def _on_notify(payload: str):
+    msg = json.loads(payload)
+    HUB.deliver(msg['t'], msg['e'], msg.get('d'))
+
+
+# Channels sharing the bridge's one LISTEN connection
+_channels = {PUBSUB_CHANNEL: _on_notify}
+_connect_hooks = []
+
+
+def listen(channel: str, callback, on_connect=None):
+    """Add a channel to the shared listener; must be called before start_bridge()."""
+    _channels[channel] = callback
+    if on_connect is not None:
+        _connect_hooks.append(on_connect)
+
+
+def _run_connect_hooks():
+    for hook in _connect_hooks:
+        hook()
+
+
+def start_bridge(connect) -> PgListener:
+    global _bridge
+    if _bridge is None:
+        _bridge = PgListener(connect, _channels, name='pubsub-bridge', on_connect=_run_connect_hooks).start()
+    return _bridge
+
+
+def bridge_active() -> bool:
+    return _bridge is not None and _bridge.connected.is_set()
+
+
+def after_commit(cur, fn) -> bool:
+    """Run fn() once the cursor's transaction commits, never if it rolls back.
+
+    Returns False when there is no transaction to wait for (autocommit) or the
+    connection cannot hold callbacks; the caller then acts right away.
+    """
+    conn = cur.connection
+    if getattr(conn, 'autocommit', False):
+        return False
+    try:
+        conn.__dict__.setdefault('_after_commit', []).append(fn)
+    except AttributeError:
+        return False
+    return True
+
+
+def transaction_ended(conn, committed: bool):
+    """Called by the connection class (lib/_metrics) after every commit or rollback."""
+    callbacks = conn.__dict__.pop('_after_commit', None)
+    if not committed or not callbacks:
+        return
+    for fn in callbacks:
+        try:
+            fn()
+        except Exception as e:
+            log_event('pubsub', 'After-commit callback failed', error=str(e))
+
+
+def publish(topic: str, event: str, data, cur=None):
+    """Publish an event; with `cur`, it is delivered only once the cursor's transaction commits."""
+    if cur is not None:
+        if bridge_active():
+            payload = json.dumps({'t': topic, 'e': event, 'd': data}, separators=(',', ':'))
+            if len(payload) <= _MAX_PAYLOAD:
+                cur.execute('SELECT pg_notify(%s, %s)', (PUBSUB_CHANNEL, payload))
+                return
+        if after_commit(cur, lambda: HUB.deliver(topic, event, data)):
+            return
+    HUB.deliver(topic, event, data)
+
+
+def user_topic(user_id: str) -> str:
+    return f'user:{user_id}'
+
+
+GLOBAL_TOPIC = 'global'
@@ -0,0 +1,218 @@
+"""Token-bucket rate limiting for the auth endpoints.
+
+Buckets live in a sharded in-memory table and refill lazily on each check, so
+a check is O(1) and never touches the database. Multi-instance deployments can
+set RATE_LIMIT_BACKEND=postgres to share buckets through a single upsert per
+check; the `rate_limits` table is created with the rest of the schema. If
+that store is unreachable we fall back to the local buckets and log it.
+"""
+import math
+import os
+import threading
+import time
+import zlib
+from typing import Callable, Optional, Tuple
+
+from ._accesslog import log_event
+
+
+RATE_LIMIT_ENABLED = str(os.environ.get('RATE_LIMIT_ENABLED') or 'true').lower() in ('1', 'true', 'yes')
+RATE_LIMIT_BACKEND = str(os.environ.get('RATE_LIMIT_BACKEND') or 'memory').lower()
+# Only honour X-Forwarded-For when running behind a proxy we control (Render, Vercel)
+RATE_LIMIT_TRUST_PROXY = str(os.environ.get('RATE_LIMIT_TRUST_PROXY') or 'false').lower() in ('1', 'true', 'yes')
+
+# policy name -> (burst capacity, window seconds); refill rate is capacity / window
+DEFAULT_POLICIES = {
+    'login:ip': (20, 60),
+    'login:identity': (5, 300),
+    'register:ip': (5, 600),
+    # Keyed by the new account's email and, separately, its username
+    'register:identity': (5, 600),
+    'verify_start:ip': (5, 600),
+    'verify_start:identity': (3, 900),
+    'reset_start:ip': (5, 600),
+    'reset_start:identity': (3, 900),
+}
+
+
+def _load_policies() -> dict:
+    # Override with e.g. RATE_LIMIT_LOGIN_IP=50/60 (capacity/window seconds)
+    policies = {}
+    for name, (capacity, window) in DEFAULT_POLICIES.items():
+        env_key = 'RATE_LIMIT_' + name.replace(':', '_').upper()
+        raw = os.environ.get(env_key)
+        if raw:
+            try:
+                cap_s, win_s = raw.split('/', 1)
+                capacity, window = int(cap_s), float(win_s)
+            except Exception:
+                pass
+        policies[name] = (max(1, int(capacity)), max(1.0, float(window)))
+    return policies
+
+
+POLICIES = _load_policies()
+
+
+class TokenBucketLimiter:
+    """In-memory token buckets split across independently locked shards."""
+
+    def __init__(self, shards: int = 16, max_keys_per_shard: int = 10000):
+        self._shards = [(threading.Lock(), {}) for _ in range(shards)]
+        self._max_keys = max_keys_per_shard
+
+    def _shard(self, key: str):
+        return self._shards[zlib.crc32(key.encode('utf-8')) % len(self._shards)]
+
+    def hit(self, key: str, capacity: int, rate: float, now: Optional[float] = None) -> Tuple[bool, float]:
+        """Take one token from `key`; returns (allowed, seconds until a token is available)."""
+        now = time.monotonic() if now is None else now
+        lock, buckets = self._shard(key)
+        with lock:
+            bucket = buckets.get(key)
+            if bucket is None:
+                if len(buckets) >= self._max_keys:
+                    self._evict_full(buckets, capacity, rate, now)
+                bucket = buckets[key] = [float(capacity), now]
+            tokens = min(float(capacity), bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens >= 1.0:
+                bucket[0] = tokens - 1.0
+                return True, 0.0
+            bucket[0] = tokens
+            return False, (1.0 - tokens) / rate
+
+    @staticmethod
+    def _evict_full(buckets: dict, capacity: int, rate: float, now: float):
+        # Buckets that have refilled completely carry no state worth keeping
+        stale = [k for k, (tokens, ts) in buckets.items() if tokens + (now - ts) * rate >= capacity]
+        for k in stale:
+            del buckets[k]
+        if len(buckets) > 0 and not stale:
+            # Everything is actively limited; drop the oldest entry to stay bounded
+            oldest = min(buckets, key=lambda k: buckets[k][1])
+            del buckets[oldest]
+
+    def reset(self):
+        for lock, buckets in self._shards:
+            with lock:
+                buckets.clear()
+
+
+DDL_RATE_LIMITS = """
+CREATE TABLE IF NOT EXISTS rate_limits (
+    key TEXT PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,
+    allowed BOOLEAN NOT NULL DEFAULT TRUE,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+)
+"""
+
+# Refill and take a token in one statement; `allowed` records whether this hit succeeded.
+SQL_TAKE_TOKEN = """
+INSERT INTO rate_limits AS b (key, tokens, allowed, updated_at)
+VALUES (%(key)s, %(capacity)s - 1, TRUE, NOW())
+ON CONFLICT (key) DO UPDATE SET
+    tokens = CASE
+        WHEN LEAST(%(capacity)s, b.tokens + EXTRACT(EPOCH FROM (NOW() - b.updated_at)) * %(rate)s) >= 1
+        THEN LEAST(%(capacity)s, b.tokens + EXTRACT(EPOCH FROM (NOW() - b.updated_at)) * %(rate)s) - 1
+        ELSE LEAST(%(capacity)s, b.tokens + EXTRACT(EPOCH FROM (NOW() - b.updated_at)) * %(rate)s)
+    END,
+    allowed = LEAST(%(capacity)s, b.tokens + EXTRACT(EPOCH FROM (NOW() - b.updated_at)) * %(rate)s) >= 1,
+    updated_at = NOW()
+RETURNING tokens, allowed
+"""
+
+
+class PostgresBucketStore:
+    """Shared buckets in a `rate_limits` table, for running several instances."""
+
+    def __init__(self, connect: Callable):
+        self._connect = connect
+        self._failing = False
+
+    def _failed(self, error: str):
+        # Logged once per outage, not once per request
+        if not self._failing:
+            self._failing = True
+            log_event('ratelimit', 'Shared buckets unavailable; using local buckets', error=error)
+
+    def hit(self, key: str, capacity: int, rate: float) -> Optional[Tuple[bool, float]]:
+        conn = self._connect()
+        if not conn:
+            self._failed('no database connection')
+            return None
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(SQL_TAKE_TOKEN, {'key': key, 'capacity': capacity, 'rate': rate})
+                    tokens, allowed = cur.fetchone()
+            if self._failing:
+                self._failing = False
+                log_event('ratelimit', 'Shared buckets available again')
+            if allowed:
+                return True, 0.0
+            return False, (1.0 - float(tokens)) / rate
+        except Exception as e:
+            self._failed(str(e))
+            return None
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+_memory = TokenBucketLimiter()
+_store: Optional[PostgresBucketStore] = None
+
+
+def configure(connect: Optional[Callable]):
+    """Attach the shared Postgres store when RATE_LIMIT_BACKEND=postgres."""
+    global _store
+    if connect and RATE_LIMIT_BACKEND == 'postgres':
+        _store = PostgresBucketStore(connect)
+    else:
+        _store = None
+
+
+def _hit(key: str, policy: str) -> Tuple[bool, float]:
+    capacity, window = POLICIES[policy]
+    rate = capacity / window
+    if _store is not None:
+        res = _store.hit(key, capacity, rate)
+        if res is not None:
+            return res
+    return _memory.hit(key, capacity, rate)
+
+
+def check(route: str, ip: str = '', identity: str = '') -> int:
+    """Return 0 when the request may proceed, otherwise the Retry-After in seconds.
+
+    Call this before any password hashing or database work for `route`.
+    """
+    if not RATE_LIMIT_ENABLED:
+        return 0
+    checks = []
+    if ip and f'{route}:ip' in POLICIES:
+        checks.append((f'{route}:ip:{ip}', f'{route}:ip'))
+    identity = (identity or '').strip().lower()
+    if identity and f'{route}:identity' in POLICIES:
+        checks.append((f'{route}:id:{identity}', f'{route}:identity'))
+    for key, policy in checks:
+        allowed, retry_after = _hit(key, policy)
+        if not allowed:
+            return max(1, int(math.ceil(retry_after)))
+    return 0
+
+
+def client_ip(handler) -> str:
+    if RATE_LIMIT_TRUST_PROXY:
+        fwd = handler.headers.get('X-Forwarded-For') or ''
+        first = fwd.split(',', 1)[0].strip()
+        if first:
+            return first
+    try:
+        return str(handler.client_address[0])
+    except Exception:
+        return ''
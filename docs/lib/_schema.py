@@ -1,6 +1,13 @@
 from typing import Optional
 
 from ._utils import db_connect
+from ._grading import DDL_GRADED_ONCE
+from ._wallet import ensure_wallet_schema
+from ._notify import ensure_notify_schema
+from ._outbox import ensure_outbox_schema
+from ._export import ensure_export_schema
+from ._courses import ensure_courses_schema
+from ._ratelimit import DDL_RATE_LIMITS
 
 
 DDL_USERS = """
@@ -33,6 +40,19 @@ CREATE TABLE IF NOT EXISTS sessions (
 )
 """
 
+DDL_ACTIVITY_LOGS = """
+CREATE TABLE IF NOT EXISTS activity_logs (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    course_id TEXT,
+    event_type TEXT NOT NULL,
+    xp_awarded INTEGER DEFAULT 0,
+    coins_awarded INTEGER DEFAULT 0,
+    metadata JSONB,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+)
+"""
+
 DDL_MODULE_STORE = """
 CREATE TABLE IF NOT EXISTS module_store (
     id TEXT PRIMARY KEY,
@@ -42,8 +62,15 @@ CREATE TABLE IF NOT EXISTS module_store (
 """
 
 
+# Set after the first successful run; a warm instance skips the DDL round trips
+_ensured = False
+
+
 def ensure_schema() -> bool:
-    """Ensure required tables exist; safe to call per-request."""
+    """Ensure required tables exist; safe to call per-request, cheap after the first success."""
+    global _ensured
+    if _ensured:
+        return True
     conn = db_connect()
     if not conn:
         return False
@@ -65,6 +92,15 @@ def ensure_schema() -> bool:
 
                 cur.execute(DDL_SESSIONS)
                 cur.execute(DDL_MODULE_STORE)
+                cur.execute(DDL_ACTIVITY_LOGS)
+                cur.execute(DDL_GRADED_ONCE)
+                ensure_wallet_schema(cur)
+                ensure_notify_schema(cur)
+                ensure_outbox_schema(cur)
+                ensure_export_schema(cur)
+                ensure_courses_schema(cur)
+                cur.execute(DDL_RATE_LIMITS)
+        _ensured = True
         return True
     except Exception:
         return False
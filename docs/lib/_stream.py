@@ -0,0 +1,190 @@
+"""Server-Sent Events connections served from one selector loop.
+
+The HTTP handler thread authenticates `GET /api/stream`, writes the response
+headers and then detaches the socket and hands it here, so the request thread
+exits immediately. One `sse-loop` thread owns every stream socket in
+non-blocking mode: frames published to the hub are appended to a per-client
+buffer and flushed when the socket is writable. Idle clients cost a buffer
+and a selector registration rather than an OS thread.
+
+A client is dropped when its buffer exceeds SSE_MAX_BUFFER (a stalled
+reader), when a send or receive fails, or when it sends anything at all,
+EOF included; EventSource reconnects on its own and gets a fresh snapshot.
+"""
+import os
+import selectors
+import socket
+import threading
+import time
+
+from ._pubsub import HUB
+
+
+SSE_MAX_CONNECTIONS = int(os.environ.get('SSE_MAX_CONNECTIONS') or '10000')
+SSE_HEARTBEAT = float(os.environ.get('SSE_HEARTBEAT') or '20')
+SSE_MAX_BUFFER = int(os.environ.get('SSE_MAX_BUFFER') or str(256 * 1024))
+# Tells EventSource how long to wait before reconnecting
+SSE_RETRY_MS = int(os.environ.get('SSE_RETRY_MS') or '5000')
+
+_HEARTBEAT_FRAME = b': ping\n\n'
+
+
+class _Client:
+    __slots__ = ('loop', 'sock', 'topics', 'buf', 'closed', 'writing')
+
+    def __init__(self, loop, sock, topics):
+        self.loop = loop
+        self.sock = sock
+        self.topics = topics
+        self.buf = bytearray()
+        self.closed = False
+        self.writing = False
+
+    def push(self, frame: bytes):
+        # Called from publisher threads; the loop thread does the I/O
+        with self.loop.lock:
+            if self.closed:
+                return
+            self.buf += frame
+            self.loop.dirty.add(self)
+        self.loop.wake()
+
+
+class StreamLoop:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.dirty = set()
+        self.clients = set()
+        self._sel = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._sel.register(self._wake_r, selectors.EVENT_READ, None)
+        self._pending = []
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='sse-loop', daemon=True)
+            self._thread.start()
+        return self
+
+    def wake(self):
+        try:
+            self._wake_w.send(b'\0')
+        except (BlockingIOError, OSError):
+            # Buffer full means a wakeup is already pending
+            pass
+
+    def count(self) -> int:
+        with self.lock:
+            return len(self.clients) + len(self._pending)
+
+    def adopt(self, sock: socket.socket, topics, first_frames: bytes = b'') -> bool:
+        """Take ownership of a stream socket whose headers were already sent."""
+        self.start()
+        with self.lock:
+            if len(self.clients) + len(self._pending) >= SSE_MAX_CONNECTIONS:
+                return False
+            client = _Client(self, sock, tuple(topics))
+            client.buf += f'retry: {SSE_RETRY_MS}\n\n'.encode('ascii') + first_frames
+            self._pending.append(client)
+        self.wake()
+        return True
+
+    def _register(self):
+        with self.lock:
+            pending, self._pending = self._pending, []
+        for c in pending:
+            c.sock.setblocking(False)
+            self._sel.register(c.sock, selectors.EVENT_READ, c)
+            with self.lock:
+                self.clients.add(c)
+                self.dirty.add(c)
+            HUB.subscribe(c, c.topics)
+
+    def _close(self, c: _Client):
+        with self.lock:
+            if c.closed:
+                return
+            c.closed = True
+            self.clients.discard(c)
+            self.dirty.discard(c)
+        HUB.unsubscribe(c, c.topics)
+        try:
+            self._sel.unregister(c.sock)
+        except (KeyError, ValueError):
+            pass
+        try:
+            c.sock.close()
+        except OSError:
+            pass
+
+    def _flush(self, c: _Client):
+        with self.lock:
+            if c.closed or not c.buf:
+                return
+            if len(c.buf) > SSE_MAX_BUFFER:
+                overflow = True
+            else:
+                overflow = False
+                data = bytes(c.buf)
+        if overflow:
+            self._close(c)
+            return
+        try:
+            sent = c.sock.send(data)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self._close(c)
+            return
+        with self.lock:
+            del c.buf[:sent]
+            remaining = bool(c.buf)
+        want = selectors.EVENT_READ | (selectors.EVENT_WRITE if remaining else 0)
+        if remaining != c.writing:
+            c.writing = remaining
+            self._sel.modify(c.sock, want, c)
+
+    def _run(self):
+        next_beat = time.monotonic() + SSE_HEARTBEAT
+        while True:
+            timeout = max(0.0, next_beat - time.monotonic())
+            for key, mask in self._sel.select(timeout):
+                c = key.data
+                if c is None:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+                    continue
+                if mask & selectors.EVENT_READ:
+                    # Clients never send after the request; data, EOF or a reset means gone
+                    try:
+                        c.sock.recv(1024)
+                        gone = True
+                    except BlockingIOError:
+                        gone = False
+                    except OSError:
+                        gone = True
+                    if gone:
+                        self._close(c)
+                        continue
+                if mask & selectors.EVENT_WRITE:
+                    self._flush(c)
+            self._register()
+            if time.monotonic() >= next_beat:
+                next_beat = time.monotonic() + SSE_HEARTBEAT
+                with self.lock:
+                    for c in self.clients:
+                        c.buf += _HEARTBEAT_FRAME
+                        self.dirty.add(c)
+            with self.lock:
+                dirty, self.dirty = self.dirty, set()
+            for c in dirty:
+                self._flush(c)
+
+
+STREAMS = StreamLoop()
@@ -0,0 +1,261 @@
+"""Coin wallet: append-only ledger, cached balance and reward redemptions.
+
+Every change to `users.wallet` is written in the same statement as a
+`wallet_ledger` row carrying the delta and the resulting balance, so the
+column is a cache of the ledger sum. Redemptions debit with a conditional
+`UPDATE ... WHERE wallet >= cost`, which the row lock serializes, so
+concurrent spends can never overdraw. An idempotency key per user makes a
+retried redemption return the original result instead of charging twice.
+Client keys are stored as `redeem:<key>`, apart from the server's own
+`course:<id>` and `rank:<n>` credits that share the same unique index.
+"""
+import os
+import re
+import threading
+import time
+from typing import Optional
+
+from . import _invalidation, _prepared, _pubsub
+
+
+REWARDS_TTL = float(os.environ.get('REWARDS_TTL') or '60')
+
+UNIQUE_VIOLATION = '23505'
+
+# Idempotency-Key values clients may send (UUIDs, timestamps, ...)
+_CLIENT_KEY = re.compile(r'[A-Za-z0-9._-]{1,128}')
+
+# Seed catalog; mirrors the data-redeem items in rewards.html / index.html
+DEFAULT_REWARDS = (
+    ('grammarly-premium', 'Grammarly Premium', 400),
+    ('canva-pro', 'Canva Pro', 500),
+    ('spotify-premium', 'Spotify Premium', 650),
+    ('youtube-premium', 'YouTube Premium', 750),
+    ('tryhackme-premium', 'TryHackMe Premium', 1500),
+    ('hackthebox-vip', 'Hack The Box VIP', 1500),
+    ('leetcode-premium', 'LeetCode Premium', 2000),
+    ('adobe-photoshop', 'Adobe Photoshop License', 3000),
+    ('adobe-premiere', 'Adobe Premiere License', 3000),
+    ('adobe-illustrator', 'Adobe Illustrator License', 3000),
+    ('adobe-after-effects', 'Adobe After Effects License', 3000),
+    ('adobe-creative-cloud', 'Adobe Creative Cloud', 6000),
+    ('jetbrains-all-products', 'JetBrains All Products Pack', 10000),
+)
+
+DDL_WALLET_LEDGER = """
+CREATE TABLE IF NOT EXISTS wallet_ledger (
+    id BIGSERIAL PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    delta INTEGER NOT NULL,
+    balance INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    reward_id TEXT,
+    reason TEXT,
+    idempotency_key TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+)
+"""
+
+DDL_LEDGER_INDEXES = (
+    "CREATE UNIQUE INDEX IF NOT EXISTS wallet_ledger_idempotency ON wallet_ledger (user_id, idempotency_key) WHERE idempotency_key IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS wallet_ledger_user ON wallet_ledger (user_id, id)",
+)
+
+DDL_REWARDS = """
+CREATE TABLE IF NOT EXISTS rewards (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    cost INTEGER NOT NULL CHECK (cost > 0),
+    active BOOLEAN NOT NULL DEFAULT TRUE,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+)
+"""
+
+# Balances that predate the ledger get one opening entry so sums reconcile
+SQL_OPENING_BALANCES = """
+INSERT INTO wallet_ledger(user_id, delta, balance, kind, reason)
+SELECT u.id, u.wallet, u.wallet, 'opening', 'Balance before ledger'
+FROM users u
+WHERE u.wallet <> 0 AND NOT EXISTS (SELECT 1 FROM wallet_ledger l WHERE l.user_id = u.id)
+"""
+
+
+def ensure_wallet_schema(cur):
+    """Create ledger/catalog tables; seeding and backfill run only on creation.
+
+    Cheap enough for the serverless per-request ensure_schema(): once both
+    tables exist this is a single catalog lookup.
+    """
+    cur.execute("SELECT to_regclass('wallet_ledger') IS NOT NULL, to_regclass('rewards') IS NOT NULL")
+    has_ledger, has_rewards = cur.fetchone()
+    if not has_ledger:
+        cur.execute(DDL_WALLET_LEDGER)
+        for ddl in DDL_LEDGER_INDEXES:
+            cur.execute(ddl)
+        cur.execute(SQL_OPENING_BALANCES)
+    if not has_rewards:
+        cur.execute(DDL_REWARDS)
+        cur.executemany(
+            "INSERT INTO rewards(id, name, cost) VALUES (%s, %s, %s) ON CONFLICT (id) DO NOTHING",
+            DEFAULT_REWARDS,
+        )
+    if not (has_ledger and has_rewards):
+        _prepared.schema_changed(cur)
+
+
+# --- Reward catalog (cached in memory) ---
+
+_rewards_lock = threading.Lock()
+_rewards = {'items': None, 'loaded_at': 0.0}
+
+
+def get_rewards(connect, force: bool = False) -> dict:
+    """Active rewards keyed by id, reloaded at most every REWARDS_TTL seconds."""
+    items = _rewards['items']
+    if items is not None and not force and time.monotonic() - _rewards['loaded_at'] < REWARDS_TTL:
+        return items
+    with _rewards_lock:
+        if _rewards['items'] is not None and not force and time.monotonic() - _rewards['loaded_at'] < REWARDS_TTL:
+            return _rewards['items']
+        conn = connect() if connect else None
+        if not conn:
+            # Serve the last good copy (or the seed list) while the DB is away
+            return _rewards['items'] or {rid: {'id': rid, 'name': name, 'cost': cost} for rid, name, cost in DEFAULT_REWARDS}
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT id, name, cost FROM rewards WHERE active ORDER BY cost, id")
+                    rows = cur.fetchall()
+        finally:
+            conn.close()
+        _rewards['items'] = {r[0]: {'id': r[0], 'name': r[1], 'cost': r[2]} for r in rows}
+        _rewards['loaded_at'] = time.monotonic()
+        return _rewards['items']
+
+
+# --- Ledger writes ---
+
+SQL_REDEEM = """
+WITH debit AS (
+    UPDATE users SET wallet = wallet - %(cost)s
+    WHERE id = %(user_id)s AND wallet >= %(cost)s
+    RETURNING wallet
+)
+INSERT INTO wallet_ledger(user_id, delta, balance, kind, reward_id, reason, idempotency_key)
+SELECT %(user_id)s, -%(cost)s, debit.wallet, 'redeem', %(reward_id)s, %(reason)s, %(key)s FROM debit
+RETURNING id, balance, created_at
+"""
+
+SQL_FIND_KEY = """
+SELECT id, reward_id, -delta, balance, created_at FROM wallet_ledger
+WHERE user_id = %s AND idempotency_key = %s
+"""
+
+
+def _redemption(row) -> dict:
+    return {'id': row[0], 'reward_id': row[1], 'cost': row[2], 'balance': row[3], 'created_at': row[4].isoformat() if row[4] else None}
+
+
+def _find(conn, user_id: str, key: str) -> Optional[dict]:
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(SQL_FIND_KEY, (user_id, key))
+            row = cur.fetchone()
+    return _redemption(row) if row else None
+
+
+class InsufficientFunds(Exception):
+    def __init__(self, balance: int):
+        super().__init__('Not enough coins')
+        self.balance = balance
+
+
+class KeyReused(Exception):
+    """The idempotency key was already used for a different reward."""
+
+
+def valid_client_key(key: str) -> bool:
+    """1-128 characters of letters, digits, '.', '_' and '-'."""
+    return bool(key) and _CLIENT_KEY.fullmatch(key) is not None
+
+
+def redeem(conn, user_id: str, reward: dict, key: str) -> tuple:
+    """Debit `reward['cost']` once per (user, key); `key` must pass valid_client_key().
+
+    Returns (redemption, replayed). Raises InsufficientFunds when the balance
+    is too low and KeyReused when the key belongs to another reward.
+    """
+    key = 'redeem:' + key
+    prior = _find(conn, user_id, key)
+    if prior is None:
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(SQL_REDEEM, {
+                        'user_id': user_id, 'cost': reward['cost'], 'reward_id': reward['id'],
+                        'reason': reward['name'], 'key': key,
+                    })
+                    row = cur.fetchone()
+                    if row:
+                        _invalidation.user_changed(user_id, cur)
+                        _pubsub.publish(_pubsub.user_topic(user_id), 'wallet', {'wallet': row[1]}, cur)
+                        return {'id': row[0], 'reward_id': reward['id'], 'cost': reward['cost'], 'balance': row[1],
+                                'created_at': row[2].isoformat() if row[2] else None}, False
+                    cur.execute("SELECT wallet FROM users WHERE id = %s", (user_id,))
+                    bal = cur.fetchone()
+            raise InsufficientFunds(bal[0] if bal else 0)
+        except Exception as e:
+            if getattr(e, 'pgcode', None) != UNIQUE_VIOLATION:
+                raise
+            # A concurrent request with the same key committed first; its debit
+            # stands and ours was rolled back with the transaction.
+            prior = _find(conn, user_id, key)
+            if prior is None:
+                raise
+    if prior['reward_id'] != reward['id']:
+        raise KeyReused(key)
+    return prior, True
+
+
+# Credit `delta` unless the key was used before; the caller holds the user's
+# row lock (it has just updated it), so the existence check cannot race
+SQL_CREDIT_ONCE = """
+WITH fresh AS (
+    SELECT 1 WHERE NOT EXISTS (
+        SELECT 1 FROM wallet_ledger WHERE user_id = %(user_id)s AND idempotency_key = %(key)s
+    )
+), upd AS (
+    UPDATE users SET wallet = wallet + %(delta)s
+    FROM fresh
+    WHERE id = %(user_id)s
+    RETURNING wallet
+)
+INSERT INTO wallet_ledger(user_id, delta, balance, kind, reason, idempotency_key)
+SELECT %(user_id)s, %(delta)s, upd.wallet, %(kind)s, %(reason)s, %(key)s FROM upd
+RETURNING balance
+"""
+
+
+def credit_once(cur, user_id: str, delta: int, kind: str, reason: str, key: str) -> Optional[int]:
+    """Credit coins once per (user, key) inside the caller's transaction; returns the new balance, or None if already credited."""
+    cur.execute(SQL_CREDIT_ONCE, {'user_id': user_id, 'delta': delta, 'kind': kind, 'reason': reason, 'key': key})
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def history(conn, user_id: str, limit: int = 50) -> list:
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT id, delta, balance, kind, reward_id, reason, created_at
+                FROM wallet_ledger WHERE user_id = %s ORDER BY id DESC LIMIT %s
+                """,
+                (user_id, max(1, min(int(limit), 200))),
+            )
+            rows = cur.fetchall()
+    return [
+        {'id': r[0], 'delta': r[1], 'balance': r[2], 'kind': r[3], 'reward_id': r[4], 'reason': r[5],
+         'created_at': r[6].isoformat() if r[6] else None}
+        for r in rows
+    ]
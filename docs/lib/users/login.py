@@ -1,12 +1,17 @@
 from http.server import BaseHTTPRequestHandler
 import json
+import secrets
 
-from .._utils import db_connect, json_response, verify_password, issue_session_token, cors_preflight
+from .._utils import db_connect, json_response, verify_password, cors_preflight, rate_limited
 from .._schema import ensure_schema
+from .._metrics import MetricsMixin
+from .. import _prepared
 
 
-class handler(BaseHTTPRequestHandler):
+class handler(MetricsMixin, BaseHTTPRequestHandler):
     def do_POST(self):
+        if rate_limited(self, 'login'):
+            return
         try:
             length = int(self.headers.get('Content-Length', '0'))
             raw = self.rfile.read(length)
@@ -18,6 +23,8 @@ class handler(BaseHTTPRequestHandler):
         password = str(payload.get('password') or '')
         if not identity or not password:
             return json_response(self, 400, { 'ok': False, 'error': 'Missing credentials' })
+        if rate_limited(self, 'login', identity):
+            return
 
         # Ensure DB schema exists (safe to call per-request)
         ensure_schema()
@@ -27,23 +34,28 @@ class handler(BaseHTTPRequestHandler):
             return json_response(self, 503, { 'ok': False, 'error': 'Database connection failed' })
 
         user = None
+        token = None
         try:
-            with conn:
-                with conn.cursor() as cur:
-                    is_email = '@' in identity
-                    if is_email:
-                        cur.execute("SELECT id, username, email, name, xp_total, level_idx, xp_in_level, wallet, email_verified, is_admin, password_hash FROM users WHERE email = %s", (identity,))
-                    else:
-                        cur.execute("SELECT id, username, email, name, xp_total, level_idx, xp_in_level, wallet, email_verified, is_admin, password_hash FROM users WHERE username = %s", (identity,))
-                    row = cur.fetchone()
-                    if row:
-                        stored = row[10] or ''
-                        if verify_password(password, stored):
-                            user = {
-                                'id': row[0], 'username': row[1], 'email': row[2], 'name': row[3],
-                                'xp_total': row[4], 'level_idx': row[5], 'xp_in_level': row[6], 'wallet': row[7],
-                                'email_verified': bool(row[8]), 'is_admin': bool(row[9])
-                            }
+            # Autocommit: the lookup and the session insert are one round trip
+            # each, on one connection, and no transaction is open during bcrypt
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                is_email = '@' in identity
+                _prepared.execute(cur, _prepared.LOGIN_BY_EMAIL if is_email else _prepared.LOGIN_BY_USERNAME, (identity,))
+                row = cur.fetchone()
+                if row:
+                    stored = row[10] or ''
+                    if verify_password(password, stored):
+                        user = {
+                            'id': row[0], 'username': row[1], 'email': row[2], 'name': row[3],
+                            'xp_total': row[4], 'level_idx': row[5], 'xp_in_level': row[6], 'wallet': row[7],
+                            'email_verified': bool(row[8]), 'is_admin': bool(row[9])
+                        }
+                if user and user['email_verified']:
+                    # Re-checks the verified hash, so a reset since the lookup gets no session
+                    _prepared.execute(cur, _prepared.SESSION_OPEN, (secrets.token_hex(32), user['id'], stored))
+                    session = cur.fetchone()
+                    token = session[0] if session else None
         finally:
             try:
                 conn.close()
@@ -56,7 +68,6 @@ class handler(BaseHTTPRequestHandler):
         if not user.get('email_verified'):
             return json_response(self, 403, { 'ok': False, 'error': 'Email not verified. Please check your inbox.', 'needs_verification': True })
 
-        token = issue_session_token(user['id'])
         if not token:
             return json_response(self, 503, { 'ok': False, 'error': 'Could not issue session' })
 
@@ -1,9 +1,10 @@
 from http.server import BaseHTTPRequestHandler
 
 from .._utils import json_response, get_bearer_token, get_user_by_token, cors_preflight
+from .._metrics import MetricsMixin
 
 
-class handler(BaseHTTPRequestHandler):
+class handler(MetricsMixin, BaseHTTPRequestHandler):
     def do_GET(self):
         token = get_bearer_token(self)
         if not token:
@@ -1,19 +1,16 @@
 from http.server import BaseHTTPRequestHandler
 import json
-import hashlib
 import uuid
 
-from .._utils import db_connect, json_response, cors_preflight
+from .._utils import db_connect, json_response, cors_preflight, rate_limited, hash_password
 from .._schema import ensure_schema
+from .._metrics import MetricsMixin
 
-try:
-    import bcrypt  # optional; fallback to sha256
-except Exception:
-    bcrypt = None
 
-
-class handler(BaseHTTPRequestHandler):
+class handler(MetricsMixin, BaseHTTPRequestHandler):
     def do_POST(self):
+        if rate_limited(self, 'register'):
+            return
         # Parse JSON body
         try:
             length = int(self.headers.get('Content-Length', '0'))
@@ -33,13 +30,11 @@ class handler(BaseHTTPRequestHandler):
             return json_response(self, 400, { 'ok': False, 'error': 'Enter a valid email address' })
         if len(password) < 6:
             return json_response(self, 400, { 'ok': False, 'error': 'Password must be at least 6 characters' })
+        if rate_limited(self, 'register', email) or rate_limited(self, 'register', username):
+            return
 
-        # Hash password (prefer bcrypt when available)
         try:
-            if bcrypt:
-                pwd_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-            else:
-                pwd_hash = hashlib.sha256(password.encode('utf-8')).hexdigest()
+            pwd_hash = hash_password(password)
         except Exception:
             return json_response(self, 500, { 'ok': False, 'error': 'Failed to hash password' })
 
@@ -53,18 +48,27 @@ class handler(BaseHTTPRequestHandler):
         user_id = str(uuid.uuid4())
         ok = False
         err_msg = None
+        user_payload = None
 
         try:
-            with conn:
-                with conn.cursor() as cur:
-                    cur.execute(
-                        """
-                        INSERT INTO users(id, username, email, name, password_hash)
-                        VALUES (%s, %s, %s, %s, %s)
-                        """,
-                        (user_id, username, email, name, pwd_hash)
-                    )
-                    ok = True
+            # One statement, one round trip: the insert returns the profile
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO users(id, username, email, name, password_hash)
+                    VALUES (%s, %s, %s, %s, %s)
+                    RETURNING id, username, email, name, xp_total, level_idx, xp_in_level, wallet, email_verified, is_admin
+                    """,
+                    (user_id, username, email, name, pwd_hash)
+                )
+                r = cur.fetchone()
+                user_payload = {
+                    'id': r[0], 'username': r[1], 'email': r[2], 'name': r[3],
+                    'xp_total': r[4], 'level_idx': r[5], 'xp_in_level': r[6], 'wallet': r[7],
+                    'email_verified': bool(r[8]), 'is_admin': bool(r[9])
+                }
+                ok = True
         except Exception as e:
             msg = str(e)
             if 'users_email_key' in msg or ('duplicate key value' in msg and '(email)=' in msg):
@@ -80,31 +84,6 @@ class handler(BaseHTTPRequestHandler):
             except Exception:
                 pass
 
-        user_payload = None
-        if ok:
-            # Load minimal profile for client
-            conn2 = db_connect()
-            if conn2:
-                try:
-                    with conn2:
-                        with conn2.cursor() as cur2:
-                            cur2.execute(
-                                "SELECT id, username, email, name, xp_total, level_idx, xp_in_level, wallet, email_verified, is_admin FROM users WHERE id = %s",
-                                (user_id,)
-                            )
-                            r = cur2.fetchone()
-                            if r:
-                                user_payload = {
-                                    'id': r[0], 'username': r[1], 'email': r[2], 'name': r[3],
-                                    'xp_total': r[4], 'level_idx': r[5], 'xp_in_level': r[6], 'wallet': r[7],
-                                    'email_verified': bool(r[8]), 'is_admin': bool(r[9])
-                                }
-                finally:
-                    try:
-                        conn2.close()
-                    except Exception:
-                        pass
-
         status = 200 if ok else 409
         return json_response(self, status, { 'ok': ok, 'error': err_msg, 'user': user_payload })
 
@@ -3,11 +3,14 @@ import json
 import secrets
 from urllib.parse import urlsplit
 
-from .._utils import db_connect, send_email, json_response, cors_preflight
+from ..._utils import db_connect, send_email, json_response, cors_preflight, rate_limited
+from ..._metrics import MetricsMixin
 
 
-class handler(BaseHTTPRequestHandler):
+class handler(MetricsMixin, BaseHTTPRequestHandler):
     def do_POST(self):
+        if rate_limited(self, 'verify_start'):
+            return
         try:
             length = int(self.headers.get('Content-Length', '0'))
             raw = self.rfile.read(length)
@@ -18,6 +21,8 @@ class handler(BaseHTTPRequestHandler):
         identity = str(payload.get('identity') or '').strip()
         if not identity or '@' not in identity:
             return json_response(self, 400, { 'ok': False, 'error': 'Provide an email' })
+        if rate_limited(self, 'verify_start', identity):
+            return
 
         token = secrets.token_urlsafe(32)
         conn = db_connect()
@@ -26,10 +31,11 @@ class handler(BaseHTTPRequestHandler):
 
         ok = False
         try:
-            with conn:
-                with conn.cursor() as cur:
-                    cur.execute("UPDATE users SET email_verification_token = %s WHERE email = %s", (token, identity))
-                    ok = cur.rowcount > 0
+            # Single-statement transaction: no BEGIN/COMMIT round trips
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute("UPDATE users SET email_verification_token = %s WHERE email = %s", (token, identity))
+                ok = cur.rowcount > 0
         finally:
             try:
                 conn.close()
@@ -27,12 +27,15 @@
   let xpTotal = getNum(XP_TOTAL_KEY, 0);
   let levelIdx = getNum(LEVEL_IDX_KEY, 0); // 0-based -> Rank = levelIdx + 1
   let xpInLevel = getNum(XP_IN_LEVEL_KEY, 0);
-  function saveProgress(){
+  function storeProgress(){
     try{
       localStorage.setItem(XP_TOTAL_KEY, String(xpTotal));
       localStorage.setItem(LEVEL_IDX_KEY, String(levelIdx));
       localStorage.setItem(XP_IN_LEVEL_KEY, String(xpInLevel));
     }catch(_){}
+  }
+  function saveProgress(){
+    storeProgress();
     scheduleProgressPush();
   }
   function requiredXpForRank(rank){
@@ -147,7 +150,51 @@
   const LAST_LEADERBOARD_POS_KEY = 'topcit_last_leaderboard_pos';
   const COURSE_COUNT_KEY = 'topcit_course_count';
 
+  // Signed-in users read the server feed (GET /api/notifications, keyset
+  // cursor) and its unread counter; localStorage is the signed-out fallback.
+  const notifState = { items: null, nextCursor: null, unread: 0 };
+  function useServerNotifications(){ return !!getAuthToken(); }
+  function notifEsc(s){ return String(s||'').replace(/[&<>"']/g, c => ({'&':'&amp;','<':'&lt;','>':'&gt;','"':'&quot;','\'':'&#39;'}[c]||c)); }
+
+  async function notificationsApi(path, body){
+    const token = getAuthToken();
+    if(!token) return null;
+    try{
+      const opts = { headers: { 'Authorization': `Bearer ${token}` } };
+      if(body !== undefined){
+        opts.method = 'POST';
+        opts.headers['Content-Type'] = 'application/json';
+        opts.body = JSON.stringify(body);
+      }
+      const res = await fetch(path, opts);
+      return res.ok ? await res.json() : null;
+    }catch(_){ return null; }
+  }
+
+  async function refreshUnreadCount(){
+    const d = await notificationsApi('/api/notifications/unread');
+    if(d && Number.isFinite(d.unread)){
+      notifState.unread = d.unread;
+      updateNotificationBadge();
+    }
+  }
+
+  async function loadNotificationFeed(more){
+    const q = more && notifState.nextCursor ? `?cursor=${encodeURIComponent(notifState.nextCursor)}` : '';
+    const d = await notificationsApi(`/api/notifications${q}`);
+    if(!d) return;
+    const items = (d.items || []).map(n => ({
+      id: n.id, type: n.kind, title: n.title, message: n.message,
+      timestamp: Date.parse(n.created_at) || Date.now(), read: !!n.read
+    }));
+    notifState.items = more ? (notifState.items || []).concat(items) : items;
+    notifState.nextCursor = d.next_cursor || null;
+    notifState.unread = d.unread || 0;
+    updateNotificationBadge();
+  }
+
   function getNotifications(){
+    if(useServerNotifications()) return notifState.items || [];
     try{
       const stored = localStorage.getItem(NOTIFICATIONS_KEY);
       return stored ? JSON.parse(stored) : [];
@@ -162,6 +209,13 @@
   }
 
   function addNotification(type, title, message, timestamp = Date.now()){
+    if(useServerNotifications()){
+      // The server records rank-ups when the progress push lands
+      showToast(title, 'info');
+      notifState.items = null;
+      setTimeout(refreshUnreadCount, 1500);
+      return;
+    }
     const notifications = getNotifications();
     const notification = {
       id: `${type}_${timestamp}_${Math.random().toString(36).substr(2, 9)}`,
@@ -181,6 +235,15 @@
   }
 
   function markNotificationRead(id){
+    if(useServerNotifications()){
+      const n = (notifState.items || []).find(x => String(x.id) === String(id));
+      if(n && !n.read){ n.read = true; notifState.unread = Math.max(0, notifState.unread - 1); }
+      updateNotificationBadge();
+      notificationsApi('/api/notifications/read', { ids: [Number(id)] }).then(d => {
+        if(d && Number.isFinite(d.unread)){ notifState.unread = d.unread; updateNotificationBadge(); }
+      });
+      return;
+    }
     const notifications = getNotifications();
     const notification = notifications.find(n => n.id === id);
     if(notification){
@@ -190,14 +253,22 @@
   }
 
   function markAllNotificationsRead(){
+    if(useServerNotifications()){
+      (notifState.items || []).forEach(n => n.read = true);
+      notifState.unread = 0;
+      updateNotificationBadge();
+      notificationsApi('/api/notifications/read', { all: true });
+      return;
+    }
     const notifications = getNotifications();
     notifications.forEach(n => n.read = true);
     saveNotifications(notifications);
   }
 
   function updateNotificationBadge(){
-    const notifications = getNotifications();
-    const unreadCount = notifications.filter(n => !n.read).length;
+    const unreadCount = useServerNotifications()
+      ? notifState.unread
+      : getNotifications().filter(n => !n.read).length;
     const badges = document.querySelectorAll('#notify-btn .dot-badge');
     badges.forEach(badge => {
       if(unreadCount > 0){
@@ -289,10 +360,14 @@
     return dropdown;
   }
 
-  function renderNotifications(){
+  async function renderNotifications(){
     const list = document.getElementById('notification-list');
     if(!list) return;
 
+    if(useServerNotifications() && notifState.items === null){
+      list.innerHTML = '<div class="no-notifications">Loading…</div>';
+      await loadNotificationFeed(false);
+    }
     const notifications = getNotifications();
     
     if(notifications.length === 0){
@@ -301,15 +376,26 @@
     }
 
     list.innerHTML = notifications.map(notification => `
-      <div class="notification-item ${notification.read ? 'read' : 'unread'}" data-id="${notification.id}">
+      <div class="notification-item ${notification.read ? 'read' : 'unread'}" data-id="${notifEsc(notification.id)}">
         <div class="notification-content">
-          <div class="notification-title">${notification.title}</div>
-          <div class="notification-message">${notification.message}</div>
+          <div class="notification-title">${notifEsc(notification.title)}</div>
+          <div class="notification-message">${notifEsc(notification.message)}</div>
           <div class="notification-time">${formatNotificationTime(notification.timestamp)}</div>
         </div>
         ${!notification.read ? '<div class="unread-indicator"></div>' : ''}
       </div>
-    `).join('');
+    `).join('') + (useServerNotifications() && notifState.nextCursor
+      ? '<button class="mark-all-read-btn notification-more" type="button">Load more</button>' : '');
+
+    const moreBtn = list.querySelector('.notification-more');
+    if(moreBtn){
+      moreBtn.addEventListener('click', async (e) => {
+        e.stopPropagation();
+        moreBtn.disabled = true;
+        await loadNotificationFeed(true);
+        renderNotifications();
+      });
+    }
 
     // Add click handlers to mark as read
     list.querySelectorAll('.notification-item.unread').forEach(item => {
@@ -374,6 +460,16 @@
       }
     }
 
+    if(useServerNotifications()){
+      // Rank, leaderboard and new-quest events are raised server-side;
+      // the badge only needs the O(1) unread counter, which the bootstrap carries
+      bootstrapFromServer().then(ok => { if(!ok) refreshUnreadCount(); });
+      if(!startLiveStream() && !liveStream){
+        setInterval(()=>{ if(!document.hidden) refreshUnreadCount(); }, 60 * 1000);
+      }
+      return;
+    }
+
     // Check for notifications on page load
     checkRankUpNotification();
     checkNewCoursesNotification();
@@ -517,8 +613,9 @@
     saveProgress();
     scheduleProgressPush();
     if(didLevel){
-      // Credit awarded coins to wallet and refresh store filters
-      if(coinsGained > 0){
+      // Guests keep coins locally; signed-in rank-ups are paid by the server
+      // with the award and arrive through applyServerProgress
+      if(coinsGained > 0 && !getAuthToken()){
         setWallet(getWallet() + coinsGained);
         filterAffordableStoreItems();
         limitDashboardStoreItems();
@@ -556,6 +653,7 @@
     if(!arr.includes(key)){
       arr.push(key);
       try{ localStorage.setItem(COMPLETED_KEY, JSON.stringify(arr)); }catch(_){}
+      queueCourseChange(key, 'completed');
     }
   }
   const ONGOING_KEY = 'topcit_ongoing_courses';
@@ -568,6 +666,7 @@
     if(!arr.includes(key)){
       arr.push(key);
       try{ localStorage.setItem(ONGOING_KEY, JSON.stringify(arr)); }catch(_){}
+      queueCourseChange(key, 'ongoing');
     }
   }
   function removeOngoingCourse(id){
@@ -613,11 +712,12 @@
     try{ localStorage.setItem(WALLET_KEY, String(domDefault)); }catch(_){}
     return domDefault;
   }
-  function setWallet(value){
+  function setWallet(value, push = true){
     const safe = Math.max(0, parseInt(value,10) || 0);
     if(walletAmountEl){ walletAmountEl.textContent = safe.toLocaleString(); }
     try{ localStorage.setItem(WALLET_KEY, String(safe)); }catch(_){}
-    scheduleProgressPush();
+    // Balances that came from the server don't need to be pushed back
+    if(push) scheduleProgressPush();
   }
   function loadWallet(){
     const domDefault = parseInt((walletAmountEl?.textContent || '0').replace(/,/g,''),10) || 0;
@@ -715,19 +815,47 @@
     });
   }
 
-  function handleRedeem(el){
+  // Page chunks: `python scripts/build_assets.py` leaves each #chunk region
+  // out of the bundles for pages that don't use it (see CHUNKS there)
+  // #chunk rewards
+  async function handleRedeem(el){
     const cost = parseInt(el.getAttribute('data-cost') || '0', 10);
     const have = getWallet();
     if(have < cost){
       showToast('Not enough coins to redeem.', 'error');
       return;
     }
-    setWallet(have - cost);
-    scheduleProgressPush();
-    try{
-      const name = el.querySelector('.name')?.textContent?.trim() || 'reward';
-      logActivity({ event_type: 'redeem', course_id: null, xp_awarded: 0, coins_awarded: -cost, metadata: { item: name, cost } });
-    }catch(_){ }
+    const token = getAuthToken();
+    const rewardId = el.getAttribute('data-reward-id');
+    if(token && rewardId){
+      // Server debits the wallet; the key makes a retried click safe to replay
+      if(!el.dataset.redeemKey){
+        el.dataset.redeemKey = (window.crypto && crypto.randomUUID) ? crypto.randomUUID() : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+      }
+      let res, body = {};
+      try{
+        res = await fetch('/api/rewards/redeem', {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json', 'Authorization': `Bearer ${token}`, 'Idempotency-Key': el.dataset.redeemKey },
+          body: JSON.stringify({ reward_id: rewardId })
+        });
+        body = await res.json().catch(()=>({}));
+      }catch(_){
+        showToast('Could not reach the store. Please try again.', 'error');
+        return;
+      }
+      if(Number.isFinite(body.wallet)) setWallet(body.wallet, false);
+      if(!res.ok){
+        delete el.dataset.redeemKey;
+        filterAffordableStoreItems();
+        limitDashboardStoreItems();
+        showToast(res.status === 409 ? 'Not enough coins to redeem.' : 'Redemption failed. Please try again.', 'error');
+        return;
+      }
+      delete el.dataset.redeemKey;
+    }else{
+      setWallet(have - cost);
+    }
     // Re-filter store items after wallet changes
     filterAffordableStoreItems();
     limitDashboardStoreItems();
@@ -736,6 +864,7 @@
     if(btn){ btn.disabled = true; btn.textContent = 'Redeemed'; }
     showToast('Item redeemed! Enjoy your reward.', 'success');
   }
+  // #endchunk
 
   // Bind events
   // User menu toggle
@@ -757,6 +886,7 @@
       }
     });
   }
+  // #chunk rewards
   redeemables.forEach(el => {
     el.addEventListener('click', (e)=>{
       // only act on button or container click
@@ -774,7 +904,9 @@
       }
     });
   });
+  // #endchunk
 
+  // #chunk learn
   // Learn page: navigate to dedicated course page with metadata
   function setupLearnCourses(){
     const onLearnPage = !!document.querySelector('main .card .learn-grid, [data-completed-grid]');
@@ -1035,6 +1167,7 @@
     window.addEventListener('scroll', reposition);
     window.addEventListener('resize', reposition);
   }
+  // #endchunk
 
   // Build the Completed Courses tab by cloning items from the All grid
   function populateCompletedGrid(){
@@ -1075,6 +1208,7 @@
     });
   }
 
+  // #chunk learn
   // Sub-tabs toggling between All and Completed
   function setupLearnTabs(){
     const tabsWrap = document.querySelector('[data-sub-tabs]');
@@ -1145,6 +1279,7 @@
       obsCounts.observe(completedGrid, {childList:true, subtree:true});
     }
   }
+  // #endchunk
 
   // Dashboard materials sync
   function setupDashboardMaterials(){
@@ -1283,6 +1418,7 @@
     const id = (params.get('course') || '').toLowerCase();
     const xp = parseInt(params.get('xp') || '0',10) || 0;
     const coins = parseInt(params.get('coins') || '0',10) || 0;
+    const xpParam = xp, coinsParam = coins;
   
     // Track ongoing status when visiting course page
     if(id && !isCourseCompleted(id)){
@@ -1291,47 +1427,47 @@
   
     const COURSE_META = {
       requirements: { title: 'Requirements Engineering',
-        quiz: { question: 'Which is a non-functional requirement?', options: ['Login feature', 'System performance', 'Checkout flow'], correctIndex: 1 },
+        quiz: { question: 'Which is a non-functional requirement?', options: ['Login feature', 'System performance', 'Checkout flow'] },
         bullets: ['Functional vs non-functional', 'User stories & acceptance criteria', 'Validation & traceability'],
         reflection: 'Describe one non-functional requirement (e.g., performance or security).'
       },
       design: { title: 'Software Design & Architecture',
-        quiz: { question: 'Which principle reduces coupling?', options: ['Global variables', 'SOLID', 'Hard-coded dependencies'], correctIndex: 1 },
+        quiz: { question: 'Which principle reduces coupling?', options: ['Global variables', 'SOLID', 'Hard-coded dependencies'] },
         bullets: ['SOLID principles', 'Layered vs microservices', 'Trade-offs & patterns'],
         reflection: 'Name a design pattern and a case where you’d use it.'
       },
       programming: { title: 'Programming Fundamentals',
-        quiz: { question: 'Which structure is LIFO?', options: ['Queue', 'Stack', 'Array'], correctIndex: 1 },
+        quiz: { question: 'Which structure is LIFO?', options: ['Queue', 'Stack', 'Array'] },
         bullets: ['Data types & control flow', 'Functions & collections', 'Debugging basics'],
         reflection: 'Write a short plan to solve a simple problem.'
       },
       databases: { title: 'Database Modeling',
-        quiz: { question: 'Which creates a relationship?', options: ['Index', 'Foreign key', 'View'], correctIndex: 1 },
+        quiz: { question: 'Which creates a relationship?', options: ['Index', 'Foreign key', 'View'] },
         bullets: ['ER modeling', 'Normalization basics', 'SQL joins'],
         reflection: 'Sketch a simple ER: Users—Orders (1..*) description.'
       },
       networks: { title: 'Networking Fundamentals',
-        quiz: { question: 'DNS is used for?', options: ['Encrypt traffic', 'Name resolution', 'Routing'], correctIndex: 1 },
+        quiz: { question: 'DNS is used for?', options: ['Encrypt traffic', 'Name resolution', 'Routing'] },
         bullets: ['OSI vs TCP/IP', 'HTTP/TLS/DNS', 'Routing basics'],
         reflection: 'Explain how a browser finds a host from a URL.'
       },
       os: { title: 'Operating Systems',
-        quiz: { question: 'Which schedules CPU time?', options: ['Filesystem', 'Scheduler', 'Pager'], correctIndex: 1 },
+        quiz: { question: 'Which schedules CPU time?', options: ['Filesystem', 'Scheduler', 'Pager'] },
         bullets: ['Processes vs threads', 'Memory & paging', 'Filesystem'],
         reflection: 'Describe a race condition and how to avoid it.'
       },
       algorithms: { title: 'Algorithms & Data Structures',
-        quiz: { question: 'Average complexity of binary search?', options: ['O(n)', 'O(log n)', 'O(1)'], correctIndex: 1 },
+        quiz: { question: 'Average complexity of binary search?', options: ['O(n)', 'O(log n)', 'O(1)'] },
         bullets: ['Complexity overview', 'Sorting/searching', 'Traversal strategies'],
         reflection: 'Pick a structure (tree/graph) and a use case.'
       },
       security: { title: 'Cybersecurity Essentials',
-        quiz: { question: 'Password hashing is for:', options: ['Encrypt at rest', 'Store safely', 'Compress data'], correctIndex: 1 },
+        quiz: { question: 'Password hashing is for:', options: ['Encrypt at rest', 'Store safely', 'Compress data'] },
         bullets: ['OWASP Top 10', 'AuthN/AuthZ', 'Encryption & hashing'],
         reflection: 'List two secure coding practices.'
       },
       cloud: { title: 'Cloud Computing Basics',
-        quiz: { question: 'SaaS means:', options: ['Hosted software', 'Virtual machines', 'Object storage'], correctIndex: 0 },
+        quiz: { question: 'SaaS means:', options: ['Hosted software', 'Virtual machines', 'Object storage'] },
         bullets: ['IaaS/PaaS/SaaS', 'Provisioning & scaling', 'Shared responsibility'],
         reflection: 'Explain the shared responsibility model briefly.'
       },
@@ -1339,13 +1475,13 @@
         quiz: null,
         bullets: null,
         reflection: null,
-        ctf: { prompt: 'Recover the flag (format TOPCIT{...}).', flag: 'TOPCIT{layered_security}' }
+        ctf: { prompt: 'Recover the flag (format TOPCIT{...}).' }
       },
       codefill: { title: 'Code Completion Challenge',
         quiz: null,
         bullets: null,
         reflection: null,
-        codeFill: { snippet: 'function sum(arr) {\n  // TODO\n}\n// Expect: sum([1,2,3]) === 6', answer: 'arr.reduce((a,b)=>a+b,0)' }
+        codeFill: { snippet: 'function sum(arr) {\n  // TODO\n}\n// Expect: sum([1,2,3]) === 6' }
       }
     };
     // Prefer admin-published custom module content if available
@@ -1371,6 +1507,16 @@
       }
     }catch(_){ customMeta = null; }
     let meta = customMeta || (COURSE_META[id] || { title: 'Course', quiz: { question: 'Quick check:', options: ['A','B','C'], correctIndex: 0 }, bullets: ['Read the material'], reflection: 'Write a brief reflection.' });
+    // Built-in courses and published modules arrive without answers; those are
+    // graded by POST /api/modules/<id>/submit
+    const serverGraded = (
+      (meta.quiz && !Number.isFinite(meta.quiz.correctIndex)) ||
+      (meta.codeFill && meta.codeFill.answer == null) ||
+      (meta.ctf && meta.ctf.flag == null) ||
+      (meta.phased && meta.phased.quiz && Array.isArray(meta.phased.quiz.questions) && meta.phased.quiz.questions.some(q => !Number.isFinite(q.correctIndex)))
+    );
+    if(serverGraded && !getAuthToken()){ showToast('Sign in to check your answers and claim rewards.', 'error'); }
+    const submitted = {};
   
     // Fill header
     const titleEl = container.querySelector('[data-course-title]');
@@ -1455,7 +1601,19 @@
     if(names.length){ showToast(`Please complete: ${names.join(', ')}.`, 'error'); }
   }
   if(readBtn && needRead){ readBtn.addEventListener('click', ()=>{ readDone = true; container.querySelector('[data-read-status]').textContent = 'Marked as read ✓'; readBtn.disabled = true; updateFinish(); }); }
-  if(quizOptsEl && needQuiz){ quizOptsEl.addEventListener('change', ()=>{ const sel = container.querySelector('input[name="quiz"]:checked'); quizDone = !!sel && parseInt(sel.value,10) === meta.quiz.correctIndex; updateFinish(); }); }
+  if(quizOptsEl && needQuiz){ quizOptsEl.addEventListener('change', async ()=>{
+    const sel = container.querySelector('input[name="quiz"]:checked');
+    if(!sel){ quizDone = false; updateFinish(); return; }
+    const choice = parseInt(sel.value,10);
+    if(serverGraded){
+      submitted.quiz = choice;
+      const res = await submitModuleAnswers(id, { quiz: choice });
+      quizDone = !!(res && res.results && res.results.quiz);
+    }else{
+      quizDone = choice === meta.quiz.correctIndex;
+    }
+    updateFinish();
+  }); }
   if(reflectInput && needRefl){ reflectInput.addEventListener('input', ()=>{ reflectDone = (reflectInput.value.trim().length >= 20); updateFinish(); }); }
   
   // Phased flow: Review -> Quiz -> Answers
@@ -1510,15 +1668,27 @@
     const reviewEl = flow.querySelector('[data-review-answers]');
     const nextBtns = Array.from(flow.querySelectorAll('[data-next]'));
     nextBtns.forEach(btn=>{
-      btn.addEventListener('click', ()=>{
+      btn.addEventListener('click', async ()=>{
         if(phase === 1){ phase1.style.display = 'none'; phase2.style.display = ''; phase = 2; flow.scrollIntoView({behavior:'smooth', block:'start'}); }
         else if(phase === 2){
-          // Compute results
+          // Compute results (correct answers come from the server for published modules)
+          const chosen = questions.map((q,qi)=>{
+            const sel = flow.querySelector(`input[name=\"pq-${qi}\"]:checked`);
+            return sel ? parseInt(sel.value,10) : null;
+          });
+          let graded = null;
+          if(serverGraded){
+            submitted.phased = chosen;
+            const res = await submitModuleAnswers(id, { phased: chosen });
+            graded = (res && res.results && Array.isArray(res.results.phased)) ? res.results.phased : null;
+            if(!graded){ showToast('Could not check answers. Please try again.', 'error'); return; }
+          }
           const blocks = [];
           questions.forEach((q,qi)=>{
             const opts = Array.isArray(q.options)?q.options:[];
-            const sel = flow.querySelector(`input[name=\"pq-${qi}\"]:checked`);
-            const chosenIdx = sel ? parseInt(sel.value,10) : null;
+            const chosenIdx = chosen[qi];
+            const g = graded ? graded[qi] : null;
+            if(g){ q = Object.assign({}, q, { correctIndex: g.correctIndex, explanation: g.explanation }); }
             const correctIdx = Number.isFinite(q.correctIndex) ? q.correctIndex : 0;
             const correctLabel = opts[correctIdx] || '';
             const chosenLabel = (chosenIdx!=null && opts[chosenIdx]!=null) ? opts[chosenIdx] : '(no answer)';
@@ -1547,9 +1717,15 @@
     const chk = ctfBlock.querySelector('[data-ctf-check]');
     const status = ctfBlock.querySelector('[data-ctf-status]');
     if(pEl) pEl.textContent = meta.ctf.prompt;
-    chk?.addEventListener('click', ()=>{
+    chk?.addEventListener('click', async ()=>{
       const val = (inp?.value || '').trim();
-      if(val === meta.ctf.flag){
+      let ok = val === meta.ctf.flag;
+      if(serverGraded){
+        submitted.flag = val;
+        const res = await submitModuleAnswers(id, { flag: val });
+        ok = !!(res && res.results && res.results.flag);
+      }
+      if(ok){
         ctfDone = true; updateFinish();
         if(status) status.textContent = 'Flag accepted ✓';
         if(inp) inp.disabled = true; if(chk) chk.disabled = true;
@@ -1570,8 +1746,13 @@
     const status = codeBlock.querySelector('[data-codefill-status]');
     if(sn) sn.textContent = meta.codeFill.snippet;
     function norm(s){ return String(s||'').replace(/\s+/g,'').toLowerCase(); }
-    chk?.addEventListener('click', ()=>{
-      const ok = norm(inp?.value || '') === norm(meta.codeFill.answer);
+    chk?.addEventListener('click', async ()=>{
+      let ok = norm(inp?.value || '') === norm(meta.codeFill.answer);
+      if(serverGraded){
+        submitted.code = inp?.value || '';
+        const res = await submitModuleAnswers(id, { code: submitted.code });
+        ok = !!(res && res.results && res.results.code);
+      }
       if(ok){
         codeDone = true; updateFinish();
         if(status) status.textContent = 'Correct ✓';
@@ -1587,16 +1768,32 @@
   updateFinish();
   
   if(finishBtn){
-    finishBtn.addEventListener('click', ()=>{
+    finishBtn.addEventListener('click', async ()=>{
       if(!(readDone && quizDone && reflectDone && ctfDone && codeDone)){
         indicateMissing();
         return;
       }
-      addXp(xp);
-      setWallet(getWallet() + coins);
-      scheduleProgressPush();
-      // Log course completion to server for analytics
-      logActivity({ course_id: id, event_type: 'course_completed', xp_awarded: xp, coins_awarded: coins, metadata: { title: meta.title || id } });
+      let xp = xpParam, coins = coinsParam;
+      if(serverGraded || getAuthToken()){
+        // The server grades published modules, and awards XP/coins once per
+        // course for those and the built-in courses alike
+        const res = await submitModuleAnswers(id, Object.assign({ finish: true }, submitted));
+        if(!res || !res.complete){
+          showToast(res ? 'Some answers were not accepted. Please check them and try again.' : 'Could not reach the server to claim rewards. Please try again.', 'error');
+          return;
+        }
+        xp = res.awarded ? res.awarded.xp : 0;
+        coins = res.awarded ? res.awarded.coins : 0;
+        if(xp) addXp(xp);
+        if(res.user) applyServerProgress(res.user);
+        if(res.already_completed) showToast('Already completed — rewards were claimed earlier.', 'success');
+      }else{
+        addXp(xp);
+        setWallet(getWallet() + coins);
+        scheduleProgressPush();
+        // Log course completion to server for analytics
+        logActivity({ course_id: id, event_type: 'course_completed', xp_awarded: xp, coins_awarded: coins, metadata: { title: meta.title || id } });
+      }
       // Record course completion for Learn page
       addCompletedCourse(id);
       removeOngoingCourse(id);
@@ -1860,6 +2057,19 @@ function getAuthUser(){
 }
 function getAuthUserId(){ try{ return (getAuthUser()||{}).id || ''; }catch(_){ return ''; } }
 function getAuthToken(){ try{ return (getAuthUser()||{}).token || ''; }catch(_){ return ''; } }
+async function submitModuleAnswers(moduleId, answers){
+  const token = getAuthToken();
+  if(!token) return null;
+  try{
+    const res = await fetch(`/api/modules/${encodeURIComponent(moduleId)}/submit`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json', 'Authorization': `Bearer ${token}` },
+      body: JSON.stringify(answers || {})
+    });
+    if(!res.ok) return null;
+    return await res.json();
+  }catch(_){ return null; }
+}
 async function logActivity(activity){
   const token = getAuthToken();
   if(!token) return;
@@ -1879,15 +2089,114 @@ function scheduleProgressPush(){
   if(__progressTimer) clearTimeout(__progressTimer);
   __progressTimer = setTimeout(()=>{
     try{
-      const wallet = getWallet();
+      // XP and wallet are server-owned (course awards, the ledger); the
+      // response carries the authoritative values
       fetch('/api/users/progress', {
         method: 'PUT', headers: { 'Content-Type': 'application/json', 'Authorization': `Bearer ${token}` },
-        body: JSON.stringify({ xp_total: xpTotal, level_idx: levelIdx, xp_in_level: xpInLevel, wallet })
+        body: JSON.stringify({ xp_total: xpTotal, level_idx: levelIdx, xp_in_level: xpInLevel })
+      }).then(r => r.ok ? r.json() : null).then(d => {
+        if(d && d.ok) applyServerProgress(d);
       }).catch(()=>{});
     }catch(_){ }
   }, 400);
 }
 
+// Course state sync: local adds are queued and go up with the next
+// POST /api/users/sync, whose response brings back what other devices changed
+// since our token. Statuses only advance, so merging never loses progress.
+const COURSE_SYNC_KEY = 'topcit_course_sync';
+let __courseSyncTimer = null;
+let __courseSyncBusy = false;
+let __courseSyncAgain = false;
+function readCourseSync(){
+  try{ const s = JSON.parse(localStorage.getItem(COURSE_SYNC_KEY) || 'null'); return s && typeof s === 'object' ? s : null; }catch(_){ return null; }
+}
+function writeCourseSync(s){
+  try{ localStorage.setItem(COURSE_SYNC_KEY, JSON.stringify(s)); }catch(_){}
+}
+function queueCourseChange(id, status){
+  const s = readCourseSync();
+  // Before the first sync there is nothing to queue: it uploads every local entry
+  if(s && s.user === getAuthUserId()){
+    s.pending = s.pending || {};
+    if(s.pending[id] !== 'completed') s.pending[id] = status;
+    writeCourseSync(s);
+  }
+  scheduleCourseSync();
+}
+function scheduleCourseSync(){
+  if(!getAuthToken()) return;
+  if(__courseSyncTimer) clearTimeout(__courseSyncTimer);
+  __courseSyncTimer = setTimeout(()=>{ syncCourses(); }, 400);
+}
+function localCourseEntries(){
+  const out = {};
+  getOngoingCourses().forEach(id => { out[id] = 'ongoing'; });
+  getCompletedCourses().forEach(id => { out[id] = 'completed'; });
+  return out;
+}
+function applyCourseChanges(changes){
+  const completed = getCompletedCourses();
+  let ongoing = getOngoingCourses();
+  let changed = false;
+  changes.forEach(c => {
+    const id = String(c.course_id || '').toLowerCase();
+    if(!id) return;
+    if(c.status === 'completed'){
+      if(!completed.includes(id)){ completed.push(id); changed = true; }
+      if(ongoing.includes(id)){ ongoing = ongoing.filter(x => x !== id); changed = true; }
+    }else if(c.status === 'ongoing' && !completed.includes(id) && !ongoing.includes(id)){
+      ongoing.push(id);
+      changed = true;
+    }
+  });
+  if(!changed) return;
+  // Written directly so the server's own entries are not queued back to it
+  try{
+    localStorage.setItem(COMPLETED_KEY, JSON.stringify(completed));
+    localStorage.setItem(ONGOING_KEY, JSON.stringify(ongoing));
+  }catch(_){}
+  setupDashboardMaterials();
+  setupTopicsSection();
+  populateCompletedGrid();
+}
+async function syncCourses(){
+  const token = getAuthToken();
+  if(!token) return;
+  if(__courseSyncBusy){ __courseSyncAgain = true; return; }
+  __courseSyncBusy = true;
+  try{
+    let s = readCourseSync();
+    const user = getAuthUserId();
+    // First sync on this device (or for this account): upload everything
+    if(!s || s.user !== user) s = { user, token: 0, pending: localCourseEntries() };
+    const sent = Object.assign({}, s.pending || {});
+    const resp = await fetch('/api/users/sync', {
+      method: 'POST', headers: { 'Content-Type': 'application/json', 'Authorization': `Bearer ${token}` },
+      body: JSON.stringify({ token: s.token || 0, changes: Object.keys(sent).map(id => ({ course_id: id, status: sent[id] })) })
+    });
+    if(!resp.ok) return;
+    const d = await resp.json();
+    // Entries queued while the request was in flight stay pending
+    const latest = readCourseSync();
+    const pending = latest && latest.user === user ? (latest.pending || {}) : {};
+    Object.keys(sent).forEach(id => { if(pending[id] === sent[id]) delete pending[id]; });
+    if(d.full){
+      // The server did not know our token (e.g. a restored database): re-send what it lacks
+      const known = new Set((d.changes || []).map(c => c.course_id));
+      const local = localCourseEntries();
+      Object.keys(local).forEach(id => { if(!known.has(id)) pending[id] = local[id]; });
+      if(Object.keys(pending).length) __courseSyncAgain = true;
+    }
+    writeCourseSync({ user, token: parseInt(d.token || 0, 10) || 0, pending });
+    applyCourseChanges(Array.isArray(d.changes) ? d.changes : []);
+  }catch(_){ /* offline; pending entries go with the next sync */ }
+  finally{
+    __courseSyncBusy = false;
+    if(__courseSyncAgain){ __courseSyncAgain = false; scheduleCourseSync(); }
+  }
+}
+
 async function syncUserProgressFromServer(){
   const token = getAuthToken();
   if(!token) return;
@@ -1903,9 +2212,58 @@ async function syncUserProgressFromServer(){
     setLevel(levelIdx);
     if(xpTotalEl){ xpTotalEl.textContent = xpTotal.toLocaleString(); }
     const w = parseInt(u.wallet||0,10) || 0;
-    setWallet(w);
+    setWallet(w, false);
   }catch(_){ }
 }
+// One request at page load (GET /api/bootstrap) for the profile, catalog,
+// unread count and leaderboard position. Each section has its own ETag: the
+// ones held locally go back in If-None-Match and unchanged sections are left
+// out of the response. Callers share the promise; it resolves false when the
+// endpoint is unavailable so they can fall back to the per-resource calls.
+const BOOTSTRAP_ETAGS_KEY = 'topcit_bootstrap_etags';
+let bootstrapRequest = null;
+function bootstrapFromServer(){
+  if(!bootstrapRequest) bootstrapRequest = loadBootstrap();
+  return bootstrapRequest;
+}
+async function loadBootstrap(){
+  const token = getAuthToken();
+  // Admins load the full catalog (with answers) for the editor separately
+  const admin = !!(getAuthUser() || {}).is_admin && !!token;
+  const sections = (token ? ['profile', 'notifications', 'rank'] : []).concat(admin ? [] : ['catalog']);
+  let etags = {};
+  try{ etags = JSON.parse(localStorage.getItem(BOOTSTRAP_ETAGS_KEY) || '{}') || {}; }catch(_){ etags = {}; }
+  // Only claim the catalog if the cached copy is still there
+  if(!localStorage.getItem('topcit_custom_modules')) delete etags.catalog;
+  const held = sections.map(name => etags[name]).filter(Boolean);
+  const headers = { 'Accept': 'application/json' };
+  if(token) headers['Authorization'] = `Bearer ${token}`;
+  if(held.length) headers['If-None-Match'] = held.join(', ');
+  try{
+    const res = await fetch(`/api/bootstrap?sections=${sections.join(',')}`, { headers });
+    if(!res.ok) return false;
+    const d = await res.json();
+    const got = d.sections || {};
+    if(got.profile) applyServerProgress(got.profile.data);
+    if(got.notifications){
+      notifState.unread = got.notifications.data.unread || 0;
+      updateNotificationBadge();
+    }
+    if(got.rank && Number.isFinite(got.rank.data.position)){
+      try{ localStorage.setItem(LAST_LEADERBOARD_POS_KEY, String(got.rank.data.position)); }catch(_){}
+    }
+    if(got.catalog){
+      const mods = got.catalog.data.modules;
+      if(Array.isArray(mods) && mods.length > 0){
+        try{ localStorage.setItem('topcit_custom_modules', JSON.stringify(mods)); }catch(_){}
+      }
+      try{ localStorage.setItem(CATALOG_VERSION_KEY, got.catalog.data.version); }catch(_){}
+    }
+    Object.keys(got).forEach(name => { etags[name] = got[name].etag; });
+    try{ localStorage.setItem(BOOTSTRAP_ETAGS_KEY, JSON.stringify(etags)); }catch(_){}
+    return true;
+  }catch(_){ return false; }
+}
 function isAuthPage(){
   const name = location.pathname.split('/').pop().toLowerCase();
   return name === 'login.html' || name === 'register.html' || name === 'admin.html';
@@ -1978,7 +2336,77 @@ function enforceAuthLanding(){
 // Run early to avoid flash of protected pages
 window.addEventListener('DOMContentLoaded', enforceAuthLanding);
 // Load server-side progress for logged-in users
-window.addEventListener('load', syncUserProgressFromServer);
+window.addEventListener('load', ()=>{ bootstrapFromServer().then(ok => { if(!ok) syncUserProgressFromServer(); }); });
+window.addEventListener('load', ()=>{ syncCourses(); });
+// Offline shell and write queue (docs/sw.js); needs the manifest server.py generates
+if('serviceWorker' in navigator && location.protocol.startsWith('http')){
+  window.addEventListener('load', ()=>{ navigator.serviceWorker.register('/sw.js').catch(()=>{}); });
+  window.addEventListener('online', ()=>{
+    const sw = navigator.serviceWorker.controller;
+    if(sw) sw.postMessage({ type: 'flush' });
+    syncCourses();
+  });
+}
+
+// Live updates over Server-Sent Events (server.py only; one connection per tab).
+// EventSource reconnects on its own and every (re)connect starts with a
+// `hello` snapshot, so missed events never leave the page stale.
+const CATALOG_VERSION_KEY = 'topcit_catalog_version';
+let liveStream = null;
+function applyServerProgress(d){
+  if(Number.isFinite(d.xp_total)){
+    xpTotal = d.xp_total;
+    if(xpTotalEl){ xpTotalEl.textContent = xpTotal.toLocaleString(); }
+  }
+  if(Number.isFinite(d.level_idx)) levelIdx = d.level_idx;
+  if(Number.isFinite(d.xp_in_level)) xpInLevel = d.xp_in_level;
+  // Server values; pushing them back would only echo
+  storeProgress();
+  setLevel(levelIdx);
+  if(Number.isFinite(d.wallet)) applyServerWallet(d.wallet);
+}
+function applyServerWallet(w){
+  setWallet(w, false);
+  try{ filterAffordableStoreItems(); limitDashboardStoreItems(); }catch(_){}
+}
+function applyCatalogVersion(version){
+  let known = null;
+  try{ known = localStorage.getItem(CATALOG_VERSION_KEY); }catch(_){}
+  if(!version || version === known) return;
+  try{ localStorage.setItem(CATALOG_VERSION_KEY, version); }catch(_){}
+  if(known !== null){
+    syncModulesFromServer().then(()=>{ try{ renderCustomModulesIntoAllGrid(); }catch(_){} });
+  }
+}
+function startLiveStream(){
+  const token = getAuthToken();
+  if(!token || liveStream || isAuthPage() || typeof EventSource === 'undefined') return false;
+  liveStream = new EventSource(`/api/stream?token=${encodeURIComponent(token)}`);
+  const on = (name, fn) => liveStream.addEventListener(name, (e)=>{
+    let d = {};
+    try{ d = JSON.parse(e.data || '{}'); }catch(_){ return; }
+    fn(d);
+  });
+  on('hello', d => {
+    applyServerProgress(d);
+    notifState.unread = d.unread || 0;
+    updateNotificationBadge();
+    applyCatalogVersion(d.catalog);
+  });
+  on('progress', applyServerProgress);
+  on('wallet', d => { if(Number.isFinite(d.wallet)) applyServerWallet(d.wallet); });
+  on('notification', () => { notifState.items = null; refreshUnreadCount(); });
+  on('catalog', d => applyCatalogVersion(d.version));
+  on('courses', d => { if((d.token || 0) > ((readCourseSync() || {}).token || 0)) syncCourses(); });
+  liveStream.onerror = () => {
+    // 401/503 close the stream for good; fall back to polling the counter
+    if(liveStream && liveStream.readyState === EventSource.CLOSED){
+      liveStream = null;
+      setInterval(()=>{ if(!document.hidden) refreshUnreadCount(); }, 60 * 1000);
+    }
+  };
+  return true;
+}
 
 // ---- Theme Preference & Settings Modal ----
 const THEME_KEY = 'topcit_theme';
@@ -2179,16 +2607,24 @@ window.addEventListener('load', seedDefaultModules);
 // Attempt to sync published modules from server (Neon) into localStorage
 async function syncModulesFromServer(){
   try{
-    const res = await fetch('/api/modules', { headers: { 'Accept': 'application/json' } });
+    // Learners get the catalog without answers; admins fetch the full copy for the editor
+    const admin = !!(getAuthUser() || {}).is_admin && !!getAuthToken();
+    const headers = { 'Accept': 'application/json' };
+    if(admin) headers['Authorization'] = `Bearer ${getAuthToken()}`;
+    const res = await fetch(admin ? '/api/modules?full=1' : '/api/modules', { headers });
     if(!res.ok) return; // keep localStorage fallback
     const data = await res.json();
     if(Array.isArray(data) && data.length > 0){
       try{ localStorage.setItem('topcit_custom_modules', JSON.stringify(data)); }catch(_){}
-      try{ localStorage.setItem('topcit_admin_modules', JSON.stringify(data)); }catch(_){}
+      if(admin){ try{ localStorage.setItem('topcit_admin_modules', JSON.stringify(data)); }catch(_){} }
     }
   }catch(_){ /* ignore; offline or API not available */ }
 }
-window.addEventListener('load', ()=>{ syncModulesFromServer().then(()=>{
+window.addEventListener('load', ()=>{ bootstrapFromServer().then(ok => {
+  // The bootstrap carries the learner catalog; admins still need the full copy
+  const admin = !!(getAuthUser() || {}).is_admin && !!getAuthToken();
+  return ok && !admin ? null : syncModulesFromServer();
+}).then(()=>{
   // After potential sync, re-render All grid if present
   try{ renderCustomModulesIntoAllGrid(); }catch(_){}
 }); });
@@ -2233,9 +2669,11 @@ function renderCustomModulesIntoAllGrid(){
   grid.innerHTML = mods.map(toCard).join('');
 }
 window.addEventListener('load', renderCustomModulesIntoAllGrid);
+// #chunk learn
 window.addEventListener('load', setupLearnCourses);
 window.addEventListener('load', setupLearnTabs);
 window.addEventListener('load', setupLearnPreviews);
+// #endchunk
 window.addEventListener('load', setupDashboardMaterials);
 window.addEventListener('load', setupTopicsSection);
 window.addEventListener('load', initNotificationSystem);
@@ -2329,6 +2767,7 @@ function getLeaderboardNames(){
   try{ localStorage.setItem(LB_NAMES_KEY, JSON.stringify(defaults)); }catch(_){}
   return defaults;
 }
+// #chunk leaderboards
 function renderLeaderboardNames(){
   const names = getLeaderboardNames();
   const top1User = document.querySelector('.leaderboard-top1 .user');
@@ -2338,6 +2777,7 @@ function renderLeaderboardNames(){
   const restUsers = Array.from(document.querySelectorAll('.leaderboard-rest .player-row .user'));
   for(let i=0;i<restUsers.length;i++){ if(names[i+5]) restUsers[i].textContent = names[i+5]; }
 }
+// #endchunk
 function renderDashboardLeaderboardNames(){
   const names = getLeaderboardNames();
   const boardUsers = Array.from(document.querySelectorAll('.leaderboard-card .board .user'));
@@ -2347,7 +2787,9 @@ function renderDashboardLeaderboardNames(){
     }
   }
 }
+// #chunk leaderboards
 window.addEventListener('load', renderLeaderboardNames);
+// #endchunk
 window.addEventListener('load', renderDashboardLeaderboardNames);
 
 // ---- Page Transitions - DISABLED ----
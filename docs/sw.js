@@ -0,0 +1,198 @@
+// TOPCIT Quest - Service worker: offline shell and write queue
+// The shell (pages, scripts, styles, images) is listed with content hashes in
+// /asset-manifest.json, generated by server.py. It is served cache-first from
+// one cache per manifest version; a new version is built from the diff, so
+// only changed files are downloaded. Activity and progress writes that fail
+// offline are queued and sent as one POST /api/users/batch on reconnect.
+const SHELL_PREFIX = 'topcit-shell-';
+const META_CACHE = 'topcit-meta';
+const UPLOADS_CACHE = 'topcit-uploads';
+const MANIFEST_URL = '/asset-manifest.json';
+const OUTBOX_KEY = '/__outbox__';
+const OUTBOX_MAX = 500;
+const BATCH_MAX = 200; // BATCH_MAX_OPS in lib/_offline.py
+const QUEUED_WRITES = { '/api/users/activity': 'activity', '/api/users/progress': 'progress' };
+// At most one manifest check per interval, on navigation
+const CHECK_INTERVAL = 60 * 1000;
+
+let manifest = null;
+let lastCheck = 0;
+
+async function readJSON(key){
+  const hit = await (await caches.open(META_CACHE)).match(key);
+  return hit ? hit.json() : null;
+}
+async function writeJSON(key, value){
+  await (await caches.open(META_CACHE)).put(key, new Response(JSON.stringify(value), { headers: { 'Content-Type': 'application/json' } }));
+}
+async function currentManifest(){
+  if(!manifest) manifest = await readJSON(MANIFEST_URL);
+  return manifest;
+}
+
+async function fetchAsset(url){
+  const resp = await fetch(url, { cache: 'no-cache' });
+  if(!resp.ok) throw new Error(`${url}: ${resp.status}`);
+  // Redirected responses can't answer navigations; store a plain copy
+  return resp.redirected ? new Response(await resp.blob(), { status: resp.status, headers: resp.headers }) : resp;
+}
+
+// Build the cache for the server's manifest from the current one; true if the version changed
+async function update(){
+  const resp = await fetch(MANIFEST_URL, { cache: 'no-store' });
+  if(!resp.ok) throw new Error(`manifest: ${resp.status}`);
+  const next = await resp.json();
+  const prev = await currentManifest();
+  if(prev && prev.version === next.version) return false;
+  const target = await caches.open(SHELL_PREFIX + next.version);
+  const source = prev ? await caches.open(SHELL_PREFIX + prev.version) : null;
+  const prevFiles = (prev && prev.files) || {};
+  const precache = new Set(next.precache || []);
+  await Promise.all(Object.keys(next.files).map(async url => {
+    if(await target.match(url)) return;
+    // Unchanged files move over, including ones cached on first use
+    if(source && prevFiles[url] === next.files[url]){
+      const hit = await source.match(url);
+      if(hit){ await target.put(url, hit); return; }
+    }
+    if(precache.has(url)) await target.put(url, await fetchAsset(url));
+  }));
+  await writeJSON(MANIFEST_URL, next);
+  manifest = next;
+  const keys = await caches.keys();
+  await Promise.all(keys.filter(k => k.startsWith(SHELL_PREFIX) && k !== SHELL_PREFIX + next.version).map(k => caches.delete(k)));
+  return true;
+}
+
+function maybeUpdate(){
+  if(Date.now() - lastCheck < CHECK_INTERVAL) return Promise.resolve(false);
+  lastCheck = Date.now();
+  return update().catch(() => false);
+}
+
+// Manifest URL for a request path: "/" is index.html, "/learn" is learn.html
+function shellPath(m, path){
+  if(!m || !m.files) return null;
+  if(path.endsWith('/')) path += 'index.html';
+  if(m.files[path]) return path;
+  if(m.files[path + '.html']) return path + '.html';
+  return null;
+}
+
+async function fromShell(request, path){
+  const m = await currentManifest();
+  const key = shellPath(m, path);
+  if(!key) return fetch(request);
+  const cache = await caches.open(SHELL_PREFIX + m.version);
+  const hit = await cache.match(key);
+  if(hit) return hit;
+  const resp = await fetchAsset(key);
+  cache.put(key, resp.clone()).catch(() => {});
+  return resp;
+}
+
+async function fromUploads(request){
+  // Upload names carry a timestamp and never change
+  const cache = await caches.open(UPLOADS_CACHE);
+  const hit = await cache.match(request);
+  if(hit) return hit;
+  const resp = await fetch(request);
+  if(resp.ok) cache.put(request, resp.clone()).catch(() => {});
+  return resp;
+}
+
+// --- Offline write queue ---
+// One at a time: every change reads and rewrites the whole queue
+let outboxChain = Promise.resolve();
+function withOutbox(fn){
+  const run = outboxChain.then(async () => {
+    const items = (await readJSON(OUTBOX_KEY)) || [];
+    const next = await fn(items);
+    if(next !== items) await writeJSON(OUTBOX_KEY, next);
+  });
+  outboxChain = run.catch(() => {});
+  return run;
+}
+
+async function sendOrQueue(event, type){
+  const copy = event.request.clone();
+  const token = (copy.headers.get('Authorization') || '').replace(/^Bearer\s+/i, '');
+  try{
+    const resp = await fetch(event.request);
+    // Back online: anything queued goes now, except progress this write just replaced
+    event.waitUntil(withOutbox(items => type === 'progress' && items.some(i => i.type === 'progress' && i.token === token)
+      ? items.filter(i => !(i.type === 'progress' && i.token === token)) : items).then(flush));
+    return resp;
+  }catch(err){
+    let body = null;
+    try{ body = JSON.parse(await copy.text()); }catch(_){ }
+    if(!token || !body || typeof body !== 'object') throw err;
+    await withOutbox(items => {
+      // Progress carries the whole XP state; only the newest one matters
+      if(type === 'progress') items = items.filter(i => !(i.type === 'progress' && i.token === token));
+      items.push({ type, token, body, id: type === 'activity' ? self.crypto.randomUUID() : undefined });
+      return items.slice(-OUTBOX_MAX);
+    });
+    if(self.registration.sync) self.registration.sync.register('topcit-outbox').catch(() => {});
+    return new Response(JSON.stringify({ ok: true, queued: true }), { status: 202, headers: { 'Content-Type': 'application/json' } });
+  }
+}
+
+function flush(){
+  return withOutbox(async items => {
+    if(!items.length) return items;
+    const keep = [];
+    const tokens = [...new Set(items.map(i => i.token))];
+    for(const token of tokens){
+      const ops = items.filter(i => i.token === token);
+      for(let i = 0; i < ops.length; i += BATCH_MAX){
+        const chunk = ops.slice(i, i + BATCH_MAX);
+        try{
+          const resp = await fetch('/api/users/batch', {
+            method: 'POST', headers: { 'Content-Type': 'application/json', 'Authorization': `Bearer ${token}` },
+            body: JSON.stringify({ ops: chunk.map(({ type, id, body }) => ({ type, id, body })) })
+          });
+          // 400 and 401 (signed out) will never succeed; anything else is retried
+          if(!resp.ok && resp.status !== 400 && resp.status !== 401) keep.push(...chunk);
+        }catch(_){ keep.push(...chunk); }
+      }
+    }
+    return keep;
+  });
+}
+
+self.addEventListener('install', event => {
+  event.waitUntil(update().then(() => self.skipWaiting()));
+});
+
+self.addEventListener('activate', event => {
+  event.waitUntil(self.clients.claim());
+});
+
+self.addEventListener('fetch', event => {
+  const request = event.request;
+  const url = new URL(request.url);
+  if(url.origin !== self.location.origin) return;
+  if(request.method !== 'GET'){
+    const type = QUEUED_WRITES[url.pathname];
+    if(type && request.method === (type === 'progress' ? 'PUT' : 'POST')){
+      event.respondWith(sendOrQueue(event, type));
+    }
+    return;
+  }
+  if(url.pathname.startsWith('/api/') || url.pathname === MANIFEST_URL) return;
+  if(url.pathname.startsWith('/uploads/')){
+    event.respondWith(fromUploads(request));
+    return;
+  }
+  if(request.mode === 'navigate') event.waitUntil(maybeUpdate().then(() => flush()));
+  event.respondWith(fromShell(request, url.pathname));
+});
+
+self.addEventListener('sync', event => {
+  if(event.tag === 'topcit-outbox') event.waitUntil(flush());
+});
+
+self.addEventListener('message', event => {
+  if(event.data && event.data.type === 'flush') event.waitUntil(flush());
+});
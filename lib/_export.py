@@ -0,0 +1,117 @@
+"""Streaming exports of learner data (users, activity_logs).
+
+Rows are read through a server-side (named) cursor, EXPORT_BATCH at a time,
+in (created_at, id) order, and encoded batch by batch as NDJSON or CSV, so
+memory stays flat however large the table is. That order is also the
+watermark: given the (created_at, id) of the last row already exported, an
+export continues strictly after it, which makes exports both incremental
+and resumable. Rows younger than EXPORT_LAG seconds are held back so a
+transaction that commits late with an older created_at is not skipped.
+
+scripts/export_data.py writes the batches to gzip files;
+GET /api/admin/export/<dataset> streams them over HTTP.
+"""
+import csv
+import io
+import json
+import os
+import zlib
+
+from lib import _prepared
+
+
+EXPORT_BATCH = int(os.environ.get('EXPORT_BATCH') or '5000')
+EXPORT_LAG = float(os.environ.get('EXPORT_LAG') or '60')
+FORMATS = ('ndjson', 'csv')
+
+# Secrets (password hashes, tokens) are never exported
+DATASETS = {
+    'users': ('users', ('id', 'username', 'email', 'name', 'xp_total', 'level_idx', 'xp_in_level',
+                        'wallet', 'email_verified', 'is_admin', 'created_at')),
+    'activity': ('activity_logs', ('id', 'user_id', 'course_id', 'event_type', 'xp_awarded',
+                                   'coins_awarded', 'metadata', 'created_at')),
+}
+
+DDL_EXPORT_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS users_created_id ON users (created_at, id)",
+    "CREATE INDEX IF NOT EXISTS activity_logs_created_id ON activity_logs (created_at, id)",
+)
+
+
+def ensure_export_schema(cur):
+    cur.execute("SELECT to_regclass('activity_logs_created_id') IS NOT NULL")
+    if cur.fetchone()[0]:
+        return
+    for ddl in DDL_EXPORT_INDEXES:
+        cur.execute(ddl)
+    _prepared.schema_changed(cur)
+
+
+def parse_watermark(value):
+    """'<created_at>[,<id>]' -> (created_at, id) or None; a bare timestamp means 'since'."""
+    value = (value or '').strip()
+    if not value:
+        return None
+    created_at, _, row_id = value.partition(',')
+    return (created_at.strip(), row_id.strip())
+
+
+def format_watermark(mark) -> str:
+    return f'{mark[0]},{mark[1]}' if mark else ''
+
+
+def _plain(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def _encode(rows, columns, fmt: str, header: bool) -> bytes:
+    if fmt == 'ndjson':
+        return ''.join(
+            json.dumps(dict(zip(columns, map(_plain, row))), ensure_ascii=False, separators=(',', ':')) + '\n'
+            for row in rows
+        ).encode('utf-8')
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator='\n')
+    if header:
+        writer.writerow(columns)
+    for row in rows:
+        writer.writerow([json.dumps(v) if isinstance(v, (dict, list)) else _plain(v) for v in row])
+    return buf.getvalue().encode('utf-8')
+
+
+def batches(conn, dataset: str, fmt: str = 'ndjson', after=None, header: bool = True,
+            batch_size: int = EXPORT_BATCH, lag: float = EXPORT_LAG):
+    """Yield (encoded bytes, watermark of the batch's last row, row count) per batch.
+
+    The CSV header rides on the first batch when `header` is set. Closing the
+    generator early rolls the read transaction back.
+    """
+    table, columns = DATASETS[dataset]
+    sql = f"SELECT {', '.join(columns)} FROM {table} WHERE created_at < NOW() - make_interval(secs => %(lag)s)"
+    params = {'lag': lag}
+    if after:
+        sql += ' AND (created_at, id) > (%(after_ts)s::timestamptz, %(after_id)s)'
+        params.update(after_ts=after[0], after_id=after[1])
+    sql += ' ORDER BY created_at, id'
+    ts_idx, id_idx = columns.index('created_at'), columns.index('id')
+    with conn:
+        # Named cursors live inside a transaction; rows arrive batch_size at a time
+        with conn.cursor(name=f'export_{dataset}') as cur:
+            cur.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                last = rows[-1]
+                yield (_encode(rows, columns, fmt, header), (_plain(last[ts_idx]), last[id_idx]), len(rows))
+                header = False
+
+
+def gzip_stream(chunks):
+    """Gzip an iterable of byte chunks, flushing after each so readers see progress."""
+    z = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        out = z.compress(chunk) + z.flush(zlib.Z_SYNC_FLUSH)
+        if out:
+            yield out
+    yield z.flush()
@@ -0,0 +1,577 @@
+"""Request counters, latency histograms and per-phase timers.
+
+Series are striped across shards picked by thread id, so request threads
+rarely contend on the same lock; scrapes merge the shards. Latencies go into
+log-linear (HDR-style) buckets with ~12% precision from 1µs to over an hour.
+
+server.py exposes the merged view at /metrics in Prometheus text format. The
+serverless handlers use the same mixin and write one JSON line per request
+(plus a periodic aggregate) to stdout, which ends up in the platform logs.
+
+With `server.py --workers N` every process publishes its registry to a
+shared directory (see share()), and /metrics merges all of them.
+"""
+import json
+import marshal
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from lib import _deadline
+from lib import _pubsub
+
+
+PHASES = ('connect', 'query', 'hash', 'email', 'serialize')
+
+METRICS_LOG = str(os.environ.get('METRICS_LOG') or ('true' if os.environ.get('VERCEL') else 'false')).lower() in ('1', 'true', 'yes')
+METRICS_LOG_INTERVAL = float(os.environ.get('METRICS_LOG_INTERVAL') or '60')
+# Seconds between snapshots each pre-fork worker writes for the others to merge
+METRICS_SHARE_INTERVAL = float(os.environ.get('METRICS_SHARE_INTERVAL') or '2')
+
+_SUB_BITS = 3
+_SUB_COUNT = 1 << _SUB_BITS
+_MAX_INDEX = 36 * _SUB_COUNT
+# Exported `le` boundaries: powers of two from 128µs to ~33s
+_EXPORT_EXPONENTS = range(7, 26)
+_QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _bucket_index(us: int) -> int:
+    if us < _SUB_COUNT:
+        return max(0, us)
+    shift = us.bit_length() - _SUB_BITS - 1
+    idx = (shift + 1) * _SUB_COUNT + ((us >> shift) - _SUB_COUNT)
+    return min(idx, _MAX_INDEX - 1)
+
+
+def _bucket_upper(idx: int) -> int:
+    if idx < _SUB_COUNT:
+        return idx + 1
+    shift = idx // _SUB_COUNT - 1
+    return (_SUB_COUNT + idx % _SUB_COUNT + 1) << shift
+
+
+class Histogram:
+    """Log-linear latency histogram over integer microseconds."""
+
+    __slots__ = ('counts', 'count', 'total_us')
+
+    def __init__(self):
+        self.counts = [0] * _MAX_INDEX
+        self.count = 0
+        self.total_us = 0
+
+    def record(self, seconds: float):
+        us = int(seconds * 1e6)
+        self.counts[_bucket_index(us)] += 1
+        self.count += 1
+        self.total_us += us
+
+    def merge(self, other: 'Histogram'):
+        counts = self.counts
+        for i, c in enumerate(other.counts):
+            if c:
+                counts[i] += c
+        self.count += other.count
+        self.total_us += other.total_us
+
+    def quantile(self, q: float) -> float:
+        """Upper bound (seconds) of the bucket holding the q-th quantile."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if c and seen >= rank:
+                return _bucket_upper(i) / 1e6
+        return _bucket_upper(_MAX_INDEX - 1) / 1e6
+
+    def cumulative(self):
+        """Yield (le_seconds, cumulative_count) at the exported power-of-two bounds."""
+        seen = 0
+        idx = 0
+        for exp in _EXPORT_EXPONENTS:
+            bound = 1 << exp
+            while idx < _MAX_INDEX and _bucket_upper(idx) <= bound:
+                seen += self.counts[idx]
+                idx += 1
+            yield bound / 1e6, seen
+
+
+class _Shard:
+    __slots__ = ('lock', 'counters', 'histograms')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+
+class Registry:
+    def __init__(self, shards: int = 16):
+        self._shards = [_Shard() for _ in range(shards)]
+
+    def _shard(self) -> _Shard:
+        ident = threading.get_ident()
+        return self._shards[((ident >> 4) ^ (ident >> 12)) % len(self._shards)]
+
+    def inc(self, name: str, labels: tuple, n: int = 1):
+        shard = self._shard()
+        key = (name, labels)
+        with shard.lock:
+            shard.counters[key] = shard.counters.get(key, 0) + n
+
+    def observe(self, name: str, labels: tuple, seconds: float):
+        shard = self._shard()
+        key = (name, labels)
+        with shard.lock:
+            h = shard.histograms.get(key)
+            if h is None:
+                h = shard.histograms[key] = Histogram()
+            h.record(seconds)
+
+    def collect(self):
+        """Merge all shards into (counters, histograms) dicts."""
+        counters, histograms = {}, {}
+        for shard in self._shards:
+            with shard.lock:
+                for key, v in shard.counters.items():
+                    counters[key] = counters.get(key, 0) + v
+                for key, h in shard.histograms.items():
+                    merged = histograms.get(key)
+                    if merged is None:
+                        merged = histograms[key] = Histogram()
+                    merged.merge(h)
+        return counters, histograms
+
+    def reset(self):
+        for shard in self._shards:
+            with shard.lock:
+                shard.counters.clear()
+                shard.histograms.clear()
+
+
+REGISTRY = Registry()
+_local = threading.local()
+
+# Every API path server.py and the Vercel functions (api/*.py) answer; anything
+# else is 'other', so scanners can't add label series to the registry
+API_ROUTES = frozenset((
+    '/api/admin', '/api/admin/profile', '/api/admin/stats/refresh', '/api/bootstrap', '/api/modules',
+    '/api/notifications', '/api/notifications/fanout', '/api/notifications/read', '/api/notifications/unread',
+    '/api/rewards', '/api/rewards/history', '/api/rewards/redeem', '/api/stream', '/api/users', '/api/users/activity',
+    '/api/users/batch', '/api/users/login', '/api/users/me', '/api/users/progress', '/api/users/register',
+    '/api/users/reset/complete', '/api/users/reset/start', '/api/users/sync', '/api/users/verify',
+    '/api/users/verify/start',
+))
+# Routes with an id or name segment, labelled by their template
+API_TEMPLATES = (
+    (re.compile(r'^/api/modules/[^/]+/submit$'), '/api/modules/:id/submit'),
+    (re.compile(r'^/api/admin/stats/[^/]+$'), '/api/admin/stats/:name'),
+    (re.compile(r'^/api/admin/export/[^/]+$'), '/api/admin/export/:dataset'),
+)
+
+
+def route_label(path: str) -> str:
+    """Collapse a request path into a low-cardinality route label."""
+    path = (path or '').split('?', 1)[0]
+    if path in ('/metrics', '/healthz', '/readyz'):
+        return path
+    if path.startswith('/api/'):
+        if path in API_ROUTES:
+            return path
+        for pattern, template in API_TEMPLATES:
+            if pattern.match(path):
+                return template
+        return 'other'
+    if path == '/upload':
+        return path
+    return 'static'
+
+
+def begin_request(route: str, method: str, path: str = ''):
+    _local.ctx = {
+        'route': route, 'method': method, 'path': (path or '').split('?', 1)[0],
+        'start': time.perf_counter(), 'phases': {}, 'status': None,
+        'budget': _deadline.start(route),
+    }
+
+
+def current() -> Optional[dict]:
+    return getattr(_local, 'ctx', None)
+
+
+def set_status(code: int):
+    ctx = current()
+    if ctx is not None and ctx['status'] is None:
+        ctx['status'] = int(code)
+
+
+def end_request() -> Optional[dict]:
+    ctx = current()
+    if ctx is None:
+        return None
+    _local.ctx = None
+    ctx['duration'] = time.perf_counter() - ctx['start']
+    status = str(ctx['status'] or 0)
+    REGISTRY.inc('topcit_http_requests_total', (('route', ctx['route']), ('method', ctx['method']), ('status', status)))
+    REGISTRY.observe('topcit_http_request_duration_seconds', (('route', ctx['route']), ('method', ctx['method'])), ctx['duration'])
+    _deadline.clear()
+    if ctx['budget'] is not None and ctx['duration'] > ctx['budget']:
+        REGISTRY.inc('topcit_deadline_overruns_total', (('route', ctx['route']), ('status', status)))
+    return ctx
+
+
+@contextmanager
+def phase(name: str):
+    """Time a block as one of PHASES, attributed to the current request's route."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        ctx = current()
+        route = ctx['route'] if ctx is not None else '-'
+        if ctx is not None:
+            ctx['phases'][name] = ctx['phases'].get(name, 0.0) + elapsed
+        REGISTRY.observe('topcit_phase_duration_seconds', (('route', route), ('phase', name)), elapsed)
+
+
+def round_trip(kind: str, n: int = 1):
+    """Count `n` database round trips of `kind` (connect, begin, statement, commit, rollback) for the current route."""
+    ctx = current()
+    if ctx is not None:
+        ctx['round_trips'] = ctx.get('round_trips', 0) + n
+    REGISTRY.inc('topcit_db_round_trips_total', (('route', ctx['route'] if ctx is not None else '-'), ('kind', kind)), n)
+
+
+# psycopg2.extensions.TRANSACTION_STATUS_IDLE; a statement sent in this state is preceded by BEGIN
+_STATUS_IDLE = 0
+
+
+def _opens_transaction(conn) -> bool:
+    return not conn.autocommit and conn.get_transaction_status() == _STATUS_IDLE
+
+
+def timed_cursor_class(base):
+    """Build a psycopg2 cursor subclass whose executes count as the `query` phase and as round trips."""
+    class TimedCursor(base):
+        def execute(self, query, vars=None):
+            if self.name is None and isinstance(query, str):
+                # The request's remaining budget rides along in the same round trip
+                query = _deadline.statement_prefix() + query
+            if _opens_transaction(self.connection):
+                round_trip('begin')
+            round_trip('statement')
+            with phase('query'):
+                return super().execute(query, vars)
+
+        def executemany(self, query, vars_list):
+            vars_list = list(vars_list)
+            if _opens_transaction(self.connection):
+                round_trip('begin')
+            round_trip('statement', len(vars_list))
+            with phase('query'):
+                return super().executemany(query, vars_list)
+
+        def copy_expert(self, sql, file, size=8192):
+            if _opens_transaction(self.connection):
+                round_trip('begin')
+            round_trip('statement')
+            with phase('query'):
+                return super().copy_expert(sql, file, size)
+
+    return TimedCursor
+
+
+def counted_connection_class(base):
+    """Build a psycopg2 connection subclass that counts connects, commits and rollbacks as round trips.
+
+    It also runs the transaction's after-commit callbacks (lib/_pubsub) once
+    the commit succeeded, and drops them on rollback or a failed commit.
+    """
+    class CountedConnection(base):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            round_trip('connect')
+
+        def commit(self):
+            # Nothing goes over the wire when no transaction is open
+            if not self.autocommit and self.get_transaction_status() != _STATUS_IDLE:
+                round_trip('commit')
+            try:
+                result = super().commit()
+            except Exception:
+                _pubsub.transaction_ended(self, False)
+                raise
+            _pubsub.transaction_ended(self, True)
+            return result
+
+        def rollback(self):
+            if not self.autocommit and self.get_transaction_status() != _STATUS_IDLE:
+                round_trip('rollback')
+            _pubsub.transaction_ended(self, False)
+            return super().rollback()
+
+        def close(self):
+            _pubsub.transaction_ended(self, False)
+            return super().close()
+
+    return CountedConnection
+
+
+def _fmt_labels(labels: tuple, extra: tuple = ()) -> str:
+    items = tuple(labels) + tuple(extra)
+    if not items:
+        return ''
+    parts = []
+    for k, v in items:
+        v = str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{k}="{v}"')
+    return '{' + ','.join(parts) + '}'
+
+
+_HELP = {
+    'topcit_http_requests_total': ('counter', 'HTTP requests by route, method and status.'),
+    'topcit_http_request_duration_seconds': ('histogram', 'End-to-end request latency.'),
+    'topcit_phase_duration_seconds': ('histogram', 'Time spent per request phase (connect, query, hash, email, serialize).'),
+    'topcit_db_reads_total': ('counter', 'Read-only connections by target (replica, primary) and reason.'),
+    'topcit_db_pool_timeouts_total': ('counter', 'Checkouts that gave up waiting for a pooled connection.'),
+    'topcit_db_round_trips_total': ('counter', 'Database round trips by route and kind (connect, begin, statement, commit, rollback).'),
+    'topcit_db_breaker_transitions_total': ('counter', 'Database circuit breaker state changes (open, half_open, closed).'),
+    'topcit_db_breaker_rejections_total': ('counter', 'Connects refused without trying because the circuit breaker was open.'),
+    'topcit_deadline_overruns_total': ('counter', 'Requests that took longer than their route deadline, by route and status.'),
+    'topcit_startup_phase_duration_seconds': ('histogram', 'Time spent in each startup warmup phase.'),
+    'topcit_worker_restarts_total': ('counter', 'Pre-fork workers restarted after exiting unexpectedly, by worker slot.'),
+    'topcit_sqlite_commits_total': ('counter', 'Group commits run by the SQLite writer thread.'),
+    'topcit_sqlite_writes_total': ('counter', 'Write jobs committed by the SQLite writer thread (writes / commits = batch size).'),
+}
+
+
+def render_prometheus(registry: Registry = REGISTRY) -> str:
+    counters, histograms = registry.collect()
+    out = []
+    seen_names = set()
+
+    def header(name, default_type):
+        if name in seen_names:
+            return
+        seen_names.add(name)
+        mtype, help_text = _HELP.get(name, (default_type, name))
+        out.append(f'# HELP {name} {help_text}')
+        out.append(f'# TYPE {name} {mtype}')
+
+    for (name, labels), value in sorted(counters.items()):
+        header(name, 'counter')
+        out.append(f'{name}{_fmt_labels(labels)} {value}')
+    for (name, labels), h in sorted(histograms.items(), key=lambda kv: kv[0]):
+        header(name, 'histogram')
+        for le, cum in h.cumulative():
+            out.append(f'{name}_bucket{_fmt_labels(labels, (("le", f"{le:g}"),))} {cum}')
+        out.append(f'{name}_bucket{_fmt_labels(labels, (("le", "+Inf"),))} {h.count}')
+        out.append(f'{name}_sum{_fmt_labels(labels)} {h.total_us / 1e6:.6f}')
+        out.append(f'{name}_count{_fmt_labels(labels)} {h.count}')
+    quantile_lines = []
+    for (name, labels), h in sorted(histograms.items(), key=lambda kv: kv[0]):
+        for q in _QUANTILES:
+            quantile_lines.append(f'{name}_quantile{_fmt_labels(labels, (("quantile", q),))} {h.quantile(q):.6f}')
+    if quantile_lines:
+        out.append('# HELP topcit_latency_quantile_seconds Quantiles estimated from the HDR buckets.')
+        out.append('# TYPE topcit_latency_quantile_seconds gauge')
+        out.extend(quantile_lines)
+    return '\n'.join(out) + '\n'
+
+
+def snapshot(registry: Registry = REGISTRY) -> dict:
+    """Compact aggregate view used for log flushing."""
+    counters, histograms = registry.collect()
+    routes = {}
+    for (name, labels), value in counters.items():
+        if name == 'topcit_http_requests_total':
+            d = dict(labels)
+            routes.setdefault(d['route'], {'requests': 0})['requests'] += value
+        elif name == 'topcit_db_round_trips_total':
+            d = dict(labels)
+            entry = routes.setdefault(d['route'], {'requests': 0})
+            entry['round_trips'] = entry.get('round_trips', 0) + value
+    for entry in routes.values():
+        if entry.get('round_trips') and entry['requests']:
+            entry['round_trips_per_request'] = round(entry['round_trips'] / entry['requests'], 2)
+    for (name, labels), h in histograms.items():
+        d = dict(labels)
+        entry = routes.setdefault(d.get('route', '-'), {'requests': 0})
+        key = 'latency' if name == 'topcit_http_request_duration_seconds' else f"phase_{d.get('phase')}"
+        entry[key] = {
+            'count': h.count,
+            'p50_ms': round(h.quantile(0.5) * 1000, 3),
+            'p99_ms': round(h.quantile(0.99) * 1000, 3),
+        }
+    return routes
+
+
+# --- Pre-fork mode: one snapshot file per process, merged on scrape ---
+
+_share = {'dir': None, 'name': None}
+
+
+def _dump(registry: Registry) -> bytes:
+    counters, histograms = registry.collect()
+    return marshal.dumps((
+        list(counters.items()),
+        [(key, h.count, h.total_us, [(i, c) for i, c in enumerate(h.counts) if c])
+         for key, h in histograms.items()],
+    ))
+
+
+def _load_into(registry: Registry, data: bytes):
+    counters, histograms = marshal.loads(data)
+    shard = registry._shards[0]
+    with shard.lock:
+        for key, value in counters:
+            shard.counters[key] = shard.counters.get(key, 0) + value
+        for key, count, total_us, buckets in histograms:
+            h = shard.histograms.get(key)
+            if h is None:
+                h = shard.histograms[key] = Histogram()
+            for i, c in buckets:
+                h.counts[i] += c
+            h.count += count
+            h.total_us += total_us
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as fh:
+        fh.write(data)
+    os.replace(tmp, path)
+
+
+def share(directory: str, name: str, interval: float = METRICS_SHARE_INTERVAL):
+    """Publish this process's REGISTRY as <directory>/<name>.metrics (every `interval` seconds if > 0)."""
+    _share.update(dir=directory, name=name)
+    publish()
+    if interval > 0:
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    publish()
+                except OSError:
+                    pass
+        threading.Thread(target=loop, name='metrics-share', daemon=True).start()
+
+
+def publish():
+    if _share['dir']:
+        _write_atomic(os.path.join(_share['dir'], f"{_share['name']}.metrics"), _dump(REGISTRY))
+
+
+def aggregate() -> Registry:
+    """REGISTRY, or in pre-fork mode the sum over every process's latest snapshot."""
+    if not _share['dir']:
+        return REGISTRY
+    publish()
+    merged = Registry(shards=1)
+    for entry in sorted(os.listdir(_share['dir'])):
+        if not entry.endswith('.metrics'):
+            continue
+        try:
+            with open(os.path.join(_share['dir'], entry), 'rb') as fh:
+                _load_into(merged, fh.read())
+        except (OSError, EOFError, ValueError, TypeError):
+            continue
+    return merged
+
+
+def retire(directory: str, name: str):
+    """Fold an exited worker's last snapshot into retired.metrics so merged counters never go backwards."""
+    path = os.path.join(directory, f'{name}.metrics')
+    retired = os.path.join(directory, 'retired.metrics')
+    merged = Registry(shards=1)
+    for src in (retired, path):
+        try:
+            with open(src, 'rb') as fh:
+                _load_into(merged, fh.read())
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+    _write_atomic(retired, _dump(merged))
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+_last_flush = [time.monotonic()]
+
+
+def log_request(ctx: dict):
+    """Emit one request's timings as a JSON log line (serverless mode)."""
+    line = {
+        'metric': 'request', 'route': ctx['route'], 'method': ctx['method'], 'status': ctx['status'],
+        'duration_ms': round(ctx['duration'] * 1000, 3),
+        'phases_ms': {k: round(v * 1000, 3) for k, v in ctx['phases'].items()},
+        'round_trips': ctx.get('round_trips', 0),
+    }
+    print(json.dumps(line), file=sys.stdout, flush=True)
+    now = time.monotonic()
+    if now - _last_flush[0] >= METRICS_LOG_INTERVAL:
+        _last_flush[0] = now
+        flush_to_log()
+
+
+def flush_to_log():
+    print(json.dumps({'metric': 'aggregate', 'routes': snapshot()}), file=sys.stdout, flush=True)
+
+
+class MetricsMixin:
+    """Mix into a BaseHTTPRequestHandler to time every request it serves."""
+
+    def parse_request(self):
+        ok = super().parse_request()
+        if ok:
+            begin_request(route_label(self.path), self.command, self.path)
+        return ok
+
+    def send_response(self, code, message=None):
+        set_status(code)
+        return super().send_response(code, message)
+
+    def handle_one_request(self):
+        try:
+            super().handle_one_request()
+        except Exception as e:
+            # A statement cancelled by the deadline, or DeadlineExceeded, that
+            # no handler caught: answer 504 instead of dropping the socket
+            if not _deadline.is_timeout(e) or not self._send_timeout():
+                raise
+        finally:
+            ctx = end_request()
+            if ctx is not None:
+                if METRICS_LOG:
+                    log_request(ctx)
+                self.request_finished(ctx)
+
+    def _send_timeout(self) -> bool:
+        ctx = current()
+        if ctx is None or ctx['status'] is not None:
+            # Part of a response is already out; all we can do is close
+            return False
+        data = json.dumps({'ok': False, 'error': 'Request timed out'}).encode('utf-8')
+        self.send_response(504)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(data)
+        self.wfile.flush()
+        self.close_connection = True
+        return True
+
+    def request_finished(self, ctx: dict):
+        """Hook for subclasses; called once per request with the timing context."""
+        pass
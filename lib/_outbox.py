@@ -0,0 +1,106 @@
+"""Transactional email outbox.
+
+Mail that does not have to go out inside the request (bulk imports today) is
+written to `email_outbox` in the same transaction as the rows it belongs to,
+then sent by a background thread in server.py. Senders claim batches with
+FOR UPDATE SKIP LOCKED and a short lease, so several instances can drain the
+table without sending a message twice; a failed send is retried up to
+OUTBOX_MAX_ATTEMPTS times.
+"""
+import os
+import threading
+import time
+
+from lib._accesslog import log_event
+
+
+OUTBOX_BATCH = int(os.environ.get('OUTBOX_BATCH') or '50')
+OUTBOX_POLL = float(os.environ.get('OUTBOX_POLL') or '5')
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS') or '5')
+
+DDL_OUTBOX = """
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    kind TEXT NOT NULL,
+    to_email TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    text_body TEXT NOT NULL,
+    html_body TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    locked_until TIMESTAMPTZ,
+    last_error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    sent_at TIMESTAMPTZ
+)
+"""
+
+DDL_OUTBOX_PENDING = "CREATE INDEX IF NOT EXISTS email_outbox_pending ON email_outbox (id) WHERE sent_at IS NULL"
+
+
+def ensure_outbox_schema(cur):
+    cur.execute("SELECT to_regclass('email_outbox') IS NOT NULL")
+    if cur.fetchone()[0]:
+        return
+    cur.execute(DDL_OUTBOX)
+    cur.execute(DDL_OUTBOX_PENDING)
+
+
+SQL_CLAIM = """
+UPDATE email_outbox SET attempts = attempts + 1, locked_until = NOW() + INTERVAL '5 minutes'
+WHERE id IN (
+    SELECT id FROM email_outbox
+    WHERE sent_at IS NULL AND attempts < %(max_attempts)s AND (locked_until IS NULL OR locked_until < NOW())
+    ORDER BY id LIMIT %(limit)s
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING id, to_email, subject, text_body, html_body
+"""
+
+
+def drain_once(connect, send, limit: int = OUTBOX_BATCH) -> int:
+    """Claim and send one batch; returns how many were claimed."""
+    conn = connect()
+    if not conn:
+        return 0
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(SQL_CLAIM, {'limit': limit, 'max_attempts': OUTBOX_MAX_ATTEMPTS})
+                batch = cur.fetchall()
+        sent, failed = [], []
+        for msg_id, to_email, subject, text_body, html_body in batch:
+            try:
+                if send(to_email, subject, text_body, html_body):
+                    sent.append(msg_id)
+                else:
+                    failed.append((msg_id, 'SMTP not configured'))
+            except Exception as e:
+                failed.append((msg_id, str(e)[:500]))
+        with conn:
+            with conn.cursor() as cur:
+                if sent:
+                    cur.execute("UPDATE email_outbox SET sent_at = NOW(), locked_until = NULL WHERE id = ANY(%s)", (sent,))
+                for msg_id, error in failed:
+                    cur.execute("UPDATE email_outbox SET last_error = %s, locked_until = NULL WHERE id = %s", (error, msg_id))
+        if failed:
+            log_event('email', 'Outbox sends failed', failed=len(failed), sent=len(sent))
+        return len(batch)
+    finally:
+        conn.close()
+
+
+def start_sender(connect, send) -> threading.Thread:
+    """Drain the outbox forever on a daemon thread."""
+    def run():
+        while True:
+            try:
+                n = drain_once(connect, send)
+            except Exception as e:
+                log_event('email', 'Outbox drain failed', error=str(e))
+                n = 0
+            if n < OUTBOX_BATCH:
+                time.sleep(OUTBOX_POLL)
+
+    t = threading.Thread(target=run, name='email-outbox', daemon=True)
+    t.start()
+    return t
@@ -0,0 +1,150 @@
+"""Named prepared statements for the hot queries, kept per pooled connection.
+
+Statements are registered once, at import, with ordinary `%s` placeholders.
+On a connection from lib/_pool.py the first `execute()` of a statement runs
+`PREPARE name AS ...` and every later one `EXECUTE name (...)`, so the
+server parses and plans it once per session instead of once per request.
+Unpooled connections (the Vercel functions, DB_POOL_SIZE=0) and
+PREPARED_STATEMENTS=0 run the plain SQL.
+
+A migration bumps the schema epoch (`schema_changed`, broadcast to every
+instance over the invalidation bus); each connection runs DEALLOCATE ALL
+before its next prepared execute and re-prepares from scratch.
+"""
+import os
+import threading
+import weakref
+
+from lib import _invalidation
+
+
+PREPARED_STATEMENTS = (os.environ.get('PREPARED_STATEMENTS') or 'true').lower() in ('1', 'true', 'yes')
+
+# 26000 invalid_sql_statement_name, 0A000 "cached plan must not change result type"
+_STALE_CODES = ('26000', '0A000')
+
+_statements = {}
+# Keyed by the connection itself: an id() can be reused by a new connection after GC
+_conns = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+_epoch = 0
+
+
+def register(name: str, sql: str) -> str:
+    """Register `sql` (positional %s placeholders) under `name`; returns the name."""
+    parts = sql.split('%s')
+    prepare_sql = parts[0] + ''.join(f'${i}{part}' for i, part in enumerate(parts[1:], start=1))
+    _statements[name] = (sql, prepare_sql, len(parts) - 1)
+    return name
+
+
+def track(conn):
+    """Start keeping prepared state for a pooled connection."""
+    with _lock:
+        _conns[conn] = [_epoch, set()]
+
+
+def forget(conn):
+    with _lock:
+        _conns.pop(conn, None)
+
+
+def _bump(_arg):
+    global _epoch
+    with _lock:
+        _epoch += 1
+
+
+_invalidation.on(_invalidation.SCHEMA_CHANGED, _bump)
+
+
+def schema_changed(cur=None):
+    """Call after DDL; with `cur`, other instances hear about it on commit."""
+    _invalidation.invalidate(_invalidation.SCHEMA_CHANGED, '', cur)
+
+
+def execute(cur, name: str, params=()):
+    sql, prepare_sql, nparams = _statements[name]
+    state = _conns.get(cur.connection) if PREPARED_STATEMENTS else None
+    if state is None:
+        cur.execute(sql, params)
+        return
+    if state[0] != _epoch:
+        cur.execute('DEALLOCATE ALL')
+        state[0] = _epoch
+        state[1].clear()
+    if name not in state[1]:
+        cur.execute(f'PREPARE {name} AS {prepare_sql}')
+        state[1].add(name)
+    try:
+        if nparams:
+            cur.execute(f'EXECUTE {name} ({", ".join(["%s"] * nparams)})', params)
+        else:
+            cur.execute(f'EXECUTE {name}')
+    except Exception as e:
+        if getattr(e, 'pgcode', None) in _STALE_CODES:
+            # Start over on this connection; the caller's transaction is lost either way
+            state[0] = -1
+        raise
+
+
+def prepare_all(cur):
+    """PREPARE every registered statement on a pooled connection ahead of use (warmup)."""
+    state = _conns.get(cur.connection) if PREPARED_STATEMENTS else None
+    if state is None:
+        return
+    if state[0] != _epoch:
+        cur.execute('DEALLOCATE ALL')
+        state[0] = _epoch
+        state[1].clear()
+    for name, (_sql, prepare_sql, _n) in _statements.items():
+        if name not in state[1]:
+            cur.execute(f'PREPARE {name} AS {prepare_sql}')
+            state[1].add(name)
+
+
+# --- The hot statements ---
+
+SESSION_USER = register('session_user', """
+SELECT u.id, u.username, u.email, u.name, u.xp_total, u.level_idx, u.xp_in_level, u.wallet, u.email_verified, u.is_admin, u.unread_notifications
+FROM sessions s
+JOIN users u ON s.user_id = u.id
+WHERE s.token = %s AND s.revoked = FALSE AND s.expires_at > NOW()
+""")
+
+LOGIN_BY_EMAIL = register('login_by_email', """
+SELECT id, username, email, name, xp_total, level_idx, xp_in_level, wallet, email_verified, is_admin, password_hash
+FROM users WHERE email = %s
+""")
+
+LOGIN_BY_USERNAME = register('login_by_username', """
+SELECT id, username, email, name, xp_total, level_idx, xp_in_level, wallet, email_verified, is_admin, password_hash
+FROM users WHERE username = %s
+""")
+
+# XP is credited by awards only (lib/_grading.py); progress pushes read it back
+PROGRESS_READ = register('progress_read', """
+SELECT xp_total, level_idx, xp_in_level, wallet FROM users WHERE id = %s
+""")
+
+ACTIVITY_INSERT = register('activity_insert', """
+INSERT INTO activity_logs(id, user_id, course_id, event_type, xp_awarded, coins_awarded, metadata)
+VALUES (%s, %s, %s, %s, %s, %s, %s::jsonb)
+""")
+
+# GET /api/bootstrap: the session user plus their leaderboard position in one round trip
+BOOTSTRAP = register('bootstrap', """
+SELECT u.id, u.username, u.email, u.name, u.xp_total, u.level_idx, u.xp_in_level, u.wallet, u.email_verified, u.is_admin, u.unread_notifications,
+       (SELECT COUNT(*) + 1 FROM users r WHERE r.xp_total > u.xp_total)
+FROM sessions s
+JOIN users u ON s.user_id = u.id
+WHERE s.token = %s AND s.revoked = FALSE AND s.expires_at > NOW()
+""")
+
+# Login: issue the session only if the hash just verified is still current (no reset in between)
+SESSION_OPEN = register('session_open', """
+INSERT INTO sessions(token, user_id, expires_at)
+SELECT %s, id, NOW() + INTERVAL '7 days' FROM users
+WHERE id = %s AND password_hash = %s AND email_verified
+RETURNING token
+""")
@@ -0,0 +1,132 @@
+"""Low-overhead statistical profiler for a running server.
+
+A background thread wakes `hz` times per second, grabs every thread's current
+frame via sys._current_frames() and counts the resulting stacks. Nothing is
+installed in the profiled threads, so overhead is one stack walk per thread per
+tick. Results export either as collapsed stacks (flamegraph.pl / speedscope
+input) or as a marshal'd pstats table that `python -m pstats` can open.
+"""
+import marshal
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+
+MAX_SECONDS = 60.0
+MAX_HZ = 1000
+
+# Only one capture may run at a time per process
+_capture_lock = threading.Lock()
+
+
+def _frame_key(frame) -> tuple:
+    code = frame.f_code
+    return (code.co_filename, code.co_firstlineno, code.co_name)
+
+
+def _is_request_stack(stack: tuple) -> bool:
+    # socketserver.ThreadingMixIn runs each request in process_request_thread
+    return any(name == 'process_request_thread' for _, _, name in stack)
+
+
+class SamplingProfiler:
+    def __init__(self, hz: int = 200, request_threads_only: bool = True, exclude: Optional[set] = None):
+        self.interval = 1.0 / max(1, min(int(hz), MAX_HZ))
+        self.request_threads_only = request_threads_only
+        self.exclude = set(exclude or ())
+        self.stacks = Counter()
+        self.samples = 0
+        self.elapsed = 0.0
+
+    def _sample_once(self, own_ident: int):
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident or ident in self.exclude:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_key(frame))
+                frame = frame.f_back
+            stack.reverse()
+            stack = tuple(stack)
+            if self.request_threads_only and not _is_request_stack(stack):
+                continue
+            self.stacks[stack] += 1
+        self.samples += 1
+
+    def run(self, seconds: float):
+        """Sample on a helper thread for `seconds` and block until done."""
+        seconds = max(0.1, min(float(seconds), MAX_SECONDS))
+
+        def loop():
+            own = threading.get_ident()
+            started = time.perf_counter()
+            deadline = started + seconds
+            next_tick = started
+            while True:
+                now = time.perf_counter()
+                if now >= deadline:
+                    break
+                if now < next_tick:
+                    time.sleep(next_tick - now)
+                self._sample_once(own)
+                next_tick += self.interval
+            self.elapsed = time.perf_counter() - started
+
+        t = threading.Thread(target=loop, name='sampling-profiler', daemon=True)
+        t.start()
+        t.join()
+        return self
+
+    def collapsed(self) -> str:
+        lines = []
+        for stack, n in self.stacks.most_common():
+            frames = ';'.join(f'{name} ({filename.rsplit("/", 1)[-1]}:{line})' for filename, line, name in stack)
+            lines.append(f'{frames} {n}')
+        return '\n'.join(lines) + '\n'
+
+    def pstats_bytes(self) -> bytes:
+        """Convert samples into the dict layout pstats.Stats loads from disk.
+
+        Each sample stands for `interval` seconds: the leaf frame accrues it as
+        own time, every distinct frame on the stack as cumulative time, and the
+        sample count doubles as the call count.
+        """
+        w = self.interval
+        stats = {}
+        for stack, n in self.stacks.items():
+            if not stack:
+                continue
+            seen = set()
+            for i, key in enumerate(stack):
+                cc, nc, tt, ct, callers = stats.get(key, (0, 0, 0.0, 0.0, {}))
+                is_leaf = i == len(stack) - 1
+                if is_leaf:
+                    tt += n * w
+                if key not in seen:
+                    seen.add(key)
+                    cc += n
+                    nc += n
+                    ct += n * w
+                    if i > 0:
+                        caller = stack[i - 1]
+                        pcc, pnc, ptt, pct = callers.get(caller, (0, 0, 0.0, 0.0))
+                        callers[caller] = (pcc + n, pnc + n, ptt + (n * w if is_leaf else 0.0), pct + n * w)
+                stats[key] = (cc, nc, tt, ct, callers)
+        return marshal.dumps(stats)
+
+
+def capture(seconds: float, hz: int = 200, fmt: str = 'collapsed', request_threads_only: bool = True,
+            exclude: Optional[set] = None) -> Optional[tuple]:
+    """Run one capture; returns (body bytes, filename) or None if one is already running."""
+    if not _capture_lock.acquire(blocking=False):
+        return None
+    try:
+        prof = SamplingProfiler(hz=hz, request_threads_only=request_threads_only, exclude=exclude).run(seconds)
+    finally:
+        _capture_lock.release()
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    if fmt == 'pstats':
+        return prof.pstats_bytes(), f'topcit-profile-{stamp}.pstats'
+    return prof.collapsed().encode('utf-8'), f'topcit-profile-{stamp}.collapsed.txt'
@@ -0,0 +1,41 @@
+"""Rank thresholds and rank-up coins, the same ones the page uses (docs/script.js).
+
+XP is credited only by the server (lib/_grading.award_completion), and the
+rank and the XP into it follow from the total. Progress pushes from clients
+are checked against the same rules but no longer write XP. Each rank reached
+pays rank_up_coins() once, through the wallet ledger.
+"""
+from typing import Tuple
+
+
+MAX_RANK = 50
+
+
+def required_xp(rank: int) -> int:
+    """XP needed to leave `rank` (1-based)."""
+    rank = max(1, min(MAX_RANK, int(rank)))
+    return 20 + (rank - 1) * 200
+
+
+def rank_up_coins(level_idx: int) -> int:
+    """Coins for leaving rank level_idx + 1: 200 plus 10 per earlier rank, as addXp pays them."""
+    return 200 + int(level_idx) * 10
+
+
+def level_for(xp_total: int) -> Tuple[int, int]:
+    """(level_idx, xp_in_level) for a total, as reconcileProgressFromTotal computes it."""
+    remaining = max(0, int(xp_total))
+    idx = 0
+    while idx < MAX_RANK - 1:
+        need = required_xp(idx + 1)
+        if remaining < need:
+            break
+        remaining -= need
+        idx += 1
+    return idx, remaining
+
+
+def check(xp_total: int, level_idx: int, xp_in_level: int):
+    """Raise ValueError unless the rank and in-rank XP match the total."""
+    if xp_total < 0 or (level_idx, xp_in_level) != level_for(xp_total):
+        raise ValueError('level_idx and xp_in_level do not match xp_total')
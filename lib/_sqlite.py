@@ -0,0 +1,547 @@
+"""Embedded SQLite storage (lib/_storage.Store) for small single-VM deployments.
+
+Set SQLITE_PATH (and leave DATABASE_URL unset) and server.py keeps users,
+sessions, course state, the module store and activity logs in one local file:
+
+  - WAL journal with synchronous=NORMAL: readers never block the writer and
+    a commit is one append to the log, fsynced at checkpoints
+  - one writer thread owns the only read-write connection. Request threads
+    hand it jobs and wait; it runs every job queued at that moment inside a
+    single BEGIN IMMEDIATE ... COMMIT (one SAVEPOINT per job, so a failing
+    job rolls back alone), which turns a burst of small writes into one commit
+  - up to SQLITE_READERS read-only connections, opened on first use and
+    pooled, serve the reads in parallel with the writer
+
+Timestamps are epoch seconds (REAL). Notifications do not exist here, so
+the unread counter is always 0, and there is no wallet ledger: course
+awards add to users.wallet directly. The file belongs to one process: server.py
+refuses --workers with SQLite.
+"""
+import json
+import os
+import pathlib
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+from lib import _courses
+from lib import _deadline
+from lib import _grading
+from lib import _invalidation
+from lib import _metrics
+from lib import _pubsub
+from lib import _ranks
+from lib._accesslog import log_event
+from lib._storage import Conflict, PROFILE_COLUMNS, Store, Unavailable, activity_entry, profile, progress_from_row
+
+
+SQLITE_PATH = os.environ.get('SQLITE_PATH', '').strip()
+SQLITE_READERS = int(os.environ.get('SQLITE_READERS') or '4')
+# Most jobs one group commit takes off the queue
+SQLITE_BATCH = int(os.environ.get('SQLITE_BATCH') or '64')
+SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT') or '5000')
+
+SESSION_DAYS = 7
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS module_store (
+        id TEXT PRIMARY KEY,
+        data TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id TEXT PRIMARY KEY,
+        username TEXT UNIQUE,
+        email TEXT UNIQUE,
+        name TEXT,
+        password_hash TEXT NOT NULL,
+        xp_total INTEGER NOT NULL DEFAULT 0,
+        level_idx INTEGER NOT NULL DEFAULT 0,
+        xp_in_level INTEGER NOT NULL DEFAULT 0,
+        wallet INTEGER NOT NULL DEFAULT 0,
+        is_admin INTEGER NOT NULL DEFAULT 0,
+        email_verified INTEGER NOT NULL DEFAULT 0,
+        email_verification_token TEXT,
+        reset_token TEXT,
+        reset_token_expires REAL,
+        sync_version INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL DEFAULT ((julianday('now') - 2440587.5) * 86400.0)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS users_xp_total_idx ON users(xp_total)",
+    """
+    CREATE TABLE IF NOT EXISTS user_courses (
+        user_id TEXT NOT NULL,
+        course_id TEXT NOT NULL,
+        status TEXT NOT NULL CHECK (status IN ('ongoing', 'completed')),
+        version INTEGER NOT NULL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (user_id, course_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS user_courses_user_version ON user_courses(user_id, version)",
+    """
+    CREATE TABLE IF NOT EXISTS sessions (
+        token TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        created_at REAL NOT NULL DEFAULT ((julianday('now') - 2440587.5) * 86400.0),
+        expires_at REAL NOT NULL,
+        revoked INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS sessions_user_idx ON sessions(user_id)",
+    """
+    CREATE TABLE IF NOT EXISTS activity_logs (
+        id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        course_id TEXT,
+        event_type TEXT NOT NULL,
+        xp_awarded INTEGER DEFAULT 0,
+        coins_awarded INTEGER DEFAULT 0,
+        metadata TEXT,
+        created_at REAL NOT NULL DEFAULT ((julianday('now') - 2440587.5) * 86400.0)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS activity_logs_user_idx ON activity_logs(user_id, created_at)",
+    # One award per user and course, as _grading.DDL_GRADED_ONCE on Postgres
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS activity_logs_graded_once ON activity_logs(user_id, course_id)
+    WHERE event_type = 'course_completed' AND json_extract(metadata, '$.graded') = 1
+    """,
+)
+
+_PROFILE = ', '.join(f'u.{c}' for c in PROFILE_COLUMNS)
+
+# Same columns as _prepared.SESSION_USER / BOOTSTRAP (unread_notifications is always 0)
+SESSION_USER = f"""
+SELECT {_PROFILE}, 0
+FROM sessions s
+JOIN users u ON s.user_id = u.id
+WHERE s.token = ? AND s.revoked = 0 AND s.expires_at > ?
+"""
+
+BOOTSTRAP = f"""
+SELECT {_PROFILE}, 0,
+       (SELECT COUNT(*) + 1 FROM users r WHERE r.xp_total > u.xp_total)
+FROM sessions s
+JOIN users u ON s.user_id = u.id
+WHERE s.token = ? AND s.revoked = 0 AND s.expires_at > ?
+"""
+
+COURSES_MERGE = """
+INSERT INTO user_courses(user_id, course_id, status, version, updated_at) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (user_id, course_id) DO UPDATE
+SET status = excluded.status, version = excluded.version, updated_at = excluded.updated_at
+WHERE user_courses.status = 'ongoing' AND excluded.status = 'completed'
+"""
+
+COURSES_DELTA = """
+SELECT course_id, status, version FROM user_courses
+WHERE user_id = ? AND version > ?
+ORDER BY version, course_id
+"""
+
+
+def _epoch(value) -> float:
+    """Epoch seconds for a datetime (naive ones are UTC, as server.py builds them) or a number."""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    return float(value)
+
+
+class _Job:
+    __slots__ = ('fn', 'done', 'lock', 'started', 'cancelled', 'result', 'error')
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+        self.started = False
+        self.cancelled = False
+        self.result = None
+        self.error = None
+
+
+class SqliteStore(Store):
+    kind = 'sqlite'
+
+    def __init__(self, path: str = SQLITE_PATH, readers: int = SQLITE_READERS):
+        self.path = os.path.abspath(path)
+        self.readers = max(1, readers)
+        self._jobs = queue.Queue()
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._writer = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+        self._writer.start()
+
+    # --- Connections ---
+
+    def _connect_writer(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        conn.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT}')
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        return conn
+
+    def _connect_reader(self) -> sqlite3.Connection:
+        uri = pathlib.Path(self.path).as_uri() + '?mode=ro'
+        conn = sqlite3.connect(uri, uri=True, isolation_level=None, check_same_thread=False)
+        conn.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT}')
+        return conn
+
+    def _read(self, fn):
+        """Run `fn(conn)` on a pooled read-only connection."""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if self._opened < self.readers:
+                    self._opened += 1
+                    try:
+                        conn = self._connect_reader()
+                    except sqlite3.Error as e:
+                        self._opened -= 1
+                        raise Unavailable(f'SQLite open failed: {e}') from e
+            if conn is None:
+                try:
+                    conn = self._idle.get(timeout=_deadline.timeout(5.0))
+                except queue.Empty:
+                    raise Unavailable('No SQLite reader available') from None
+        try:
+            with _metrics.phase('query'):
+                return fn(conn)
+        finally:
+            self._idle.put(conn)
+
+    # --- The writer thread ---
+
+    def _write(self, fn):
+        """Run `fn(conn)` on the writer thread, inside its next group commit; returns its result."""
+        job = _Job(fn)
+        self._jobs.put(job)
+        with _metrics.phase('query'):
+            if not job.done.wait(_deadline.timeout(None)):
+                with job.lock:
+                    if not job.started:
+                        # Out of budget before the writer got to it: it never runs
+                        job.cancelled = True
+                        raise Unavailable('SQLite writer busy')
+                job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _run(self):
+        conn = self._connect_writer()
+        while True:
+            batch = [self._jobs.get()]
+            while len(batch) < SQLITE_BATCH:
+                try:
+                    batch.append(self._jobs.get_nowait())
+                except queue.Empty:
+                    break
+            if any(job is None for job in batch):
+                batch = [job for job in batch if job is not None]
+                self._commit(conn, batch)
+                conn.close()
+                return
+            self._commit(conn, batch)
+
+    def _commit(self, conn, batch):
+        ran = []
+        for job in batch:
+            with job.lock:
+                if job.cancelled:
+                    job.done.set()
+                    continue
+                job.started = True
+            ran.append(job)
+        if not ran:
+            return
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for job in ran:
+                conn.execute('SAVEPOINT job')
+                try:
+                    job.result = job.fn(conn)
+                except Exception as e:
+                    job.error = e
+                    conn.execute('ROLLBACK TO job')
+                conn.execute('RELEASE job')
+            conn.execute('COMMIT')
+        except sqlite3.Error as e:
+            log_event('db', 'SQLite commit failed', error=str(e), jobs=len(ran))
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            for job in ran:
+                if job.error is None:
+                    job.error = Unavailable(f'SQLite commit failed: {e}')
+        _metrics.REGISTRY.inc('topcit_sqlite_commits_total', ())
+        _metrics.REGISTRY.inc('topcit_sqlite_writes_total', (), len(ran))
+        for job in ran:
+            job.done.set()
+
+    def close(self):
+        self._jobs.put(None)
+        self._writer.join(timeout=10)
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def init_schema(self):
+        def create(conn):
+            for ddl in SCHEMA:
+                conn.execute(ddl)
+            # Files created before course sync existed
+            if 'sync_version' not in {row[1] for row in conn.execute('PRAGMA table_info(users)')}:
+                conn.execute('ALTER TABLE users ADD COLUMN sync_version INTEGER NOT NULL DEFAULT 0')
+        self._write(create)
+        log_event('db', 'Initialized SQLite module_store, users, sessions, user_courses and activity_logs tables.', path=self.path)
+
+    # --- Module store ---
+
+    def load_modules(self) -> Optional[list]:
+        try:
+            row = self._read(lambda conn: conn.execute(
+                "SELECT data FROM module_store WHERE id = ?", ('custom_modules',)).fetchone())
+        except Exception as e:
+            log_event('db', 'Fetch failed', error=str(e))
+            return None
+        return json.loads(row[0]) if row and row[0] is not None else None
+
+    def save_modules(self, mods: list, added: list = ()) -> bool:
+        # No notifications on SQLite, so `added` is not announced
+        data = json.dumps(mods)
+        try:
+            self._write(lambda conn: conn.execute(
+                """
+                INSERT INTO module_store(id, data, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+                """,
+                ('custom_modules', data, time.time())
+            ))
+        except Exception as e:
+            log_event('db', 'Upsert failed', error=str(e))
+            return False
+        _invalidation.modules_changed()
+        _pubsub.publish(_pubsub.GLOBAL_TOPIC, 'catalog', {'version': _grading.catalog_version(mods)})
+        return True
+
+    # --- Users ---
+
+    def create_user(self, user_id, username, email, name, password_hash) -> dict:
+        def insert(conn):
+            return conn.execute(
+                f"""
+                INSERT INTO users(id, username, email, name, password_hash)
+                VALUES (?, ?, ?, ?, ?)
+                RETURNING {', '.join(PROFILE_COLUMNS)}
+                """,
+                (user_id, username, email, name, password_hash)
+            ).fetchone()
+        try:
+            return profile(self._write(insert))
+        except sqlite3.IntegrityError as e:
+            # "UNIQUE constraint failed: users.email"
+            message = str(e)
+            raise Conflict('email' if 'users.email' in message else 'username' if 'users.username' in message else None) from e
+
+    def set_verification_token(self, email, token) -> bool:
+        return self._write(lambda conn: conn.execute(
+            "UPDATE users SET email_verification_token = ? WHERE email = ?", (token, email)).rowcount > 0)
+
+    def verify_email(self, token) -> Optional[str]:
+        row = self._write(lambda conn: conn.execute(
+            "UPDATE users SET email_verified = 1, email_verification_token = NULL WHERE email_verification_token = ? RETURNING id",
+            (token,)).fetchone())
+        if not row:
+            return None
+        _invalidation.user_changed(row[0])
+        return row[0]
+
+    def set_reset_token(self, email, token, expires) -> bool:
+        return self._write(lambda conn: conn.execute(
+            "UPDATE users SET reset_token = ?, reset_token_expires = ? WHERE email = ?",
+            (token, _epoch(expires), email)).rowcount > 0)
+
+    def reset_password(self, token, password_hash) -> Optional[str]:
+        def reset(conn):
+            row = conn.execute(
+                """
+                UPDATE users
+                SET password_hash = ?, reset_token = NULL, reset_token_expires = NULL
+                WHERE reset_token = ? AND reset_token_expires > ?
+                RETURNING id
+                """,
+                (password_hash, token, time.time())
+            ).fetchone()
+            if not row:
+                return None, []
+            # A new password signs out every existing session
+            revoked = conn.execute(
+                "UPDATE sessions SET revoked = 1 WHERE user_id = ? AND revoked = 0 RETURNING token", (row[0],)
+            ).fetchall()
+            return row[0], [t for (t,) in revoked]
+        user_id, tokens = self._write(reset)
+        for session_token in tokens:
+            _invalidation.session_revoked(session_token)
+        if user_id:
+            _invalidation.user_changed(user_id)
+        return user_id
+
+    def progress(self, user_id) -> Optional[dict]:
+        return progress_from_row(self._read(lambda conn: conn.execute(
+            "SELECT xp_total, level_idx, xp_in_level, wallet FROM users WHERE id = ?", (user_id,)).fetchone()))
+
+    def award_completion(self, user_id, course_id, entry) -> Optional[dict]:
+        def award(conn):
+            if not conn.execute("SELECT 1 FROM users WHERE id = ?", (user_id,)).fetchone():
+                return None
+            inserted = conn.execute(
+                """
+                INSERT OR IGNORE INTO activity_logs(id, user_id, course_id, event_type, xp_awarded, coins_awarded, metadata)
+                VALUES (?, ?, ?, 'course_completed', ?, ?, ?)
+                """,
+                (str(uuid.uuid4()), user_id, course_id, entry['xp'], entry['coins'],
+                 json.dumps({'title': entry['title'], 'graded': True}))
+            ).rowcount
+            if not inserted:
+                return None
+            xp_total = conn.execute(
+                "UPDATE users SET xp_total = xp_total + ? WHERE id = ? RETURNING xp_total",
+                (entry['xp'], user_id)).fetchone()[0]
+            old_level = _ranks.level_for(xp_total - entry['xp'])[0]
+            level_idx, xp_in_level = _ranks.level_for(xp_total)
+            # XP only rises and this job runs alone, so each rank is crossed (and paid) once
+            coins = entry['coins'] + sum(_ranks.rank_up_coins(idx) for idx in range(old_level, level_idx))
+            wallet = conn.execute(
+                "UPDATE users SET level_idx = ?, xp_in_level = ?, wallet = wallet + ? WHERE id = ? RETURNING wallet",
+                (level_idx, xp_in_level, coins, user_id)).fetchone()[0]
+            return {'xp_total': xp_total, 'level_idx': level_idx, 'xp_in_level': xp_in_level, 'wallet': wallet,
+                    'xp': entry['xp'], 'coins': entry['coins']}
+        result = self._write(award)
+        if result:
+            _invalidation.user_changed(user_id)
+            _pubsub.publish(_pubsub.user_topic(user_id), 'progress', {
+                k: result[k] for k in ('xp_total', 'level_idx', 'xp_in_level', 'wallet')
+            })
+        return result
+
+    def sync_courses(self, user_id, since, changes) -> Optional[dict]:
+        if not changes:
+            def read(conn):
+                # One snapshot for the counter and the rows
+                conn.execute('BEGIN')
+                try:
+                    row = conn.execute("SELECT sync_version FROM users WHERE id = ?", (user_id,)).fetchone()
+                    if not row:
+                        return None
+                    return row[0], conn.execute(COURSES_DELTA, (user_id, 0 if since > row[0] else since)).fetchall()
+                finally:
+                    conn.execute('COMMIT')
+            found = self._read(read)
+            return _courses.result(found[0], since, found[1], []) if found else None
+
+        def merge(conn):
+            row = conn.execute(
+                "UPDATE users SET sync_version = sync_version + 1 WHERE id = ? RETURNING sync_version", (user_id,)
+            ).fetchone()
+            if not row:
+                return None
+            version, changed, now = row[0], 0, time.time()
+            for course_id, status in changes:
+                changed += conn.execute(COURSES_MERGE, (user_id, course_id, status, version, now)).rowcount
+            if not changed:
+                # Nothing advanced; give the version back
+                version -= 1
+                conn.execute("UPDATE users SET sync_version = ? WHERE id = ?", (version, user_id))
+            return version, changed, conn.execute(COURSES_DELTA, (user_id, 0 if since > version else since)).fetchall()
+        found = self._write(merge)
+        if not found:
+            return None
+        version, changed, rows = found
+        if changed:
+            _pubsub.publish(_pubsub.user_topic(user_id), 'courses', {'token': version})
+        return _courses.result(version, since, rows, changes)
+
+    # --- Sessions ---
+
+    def login(self, identity, check, new_token):
+        column = 'email' if '@' in identity else 'username'
+        row = self._read(lambda conn: conn.execute(
+            f"SELECT {', '.join(PROFILE_COLUMNS)}, password_hash FROM users WHERE {column} = ?", (identity,)).fetchone())
+        stored = (row[10] or '') if row else ''
+        # bcrypt runs here, outside the writer
+        if not row or not check(stored):
+            return None, None
+        user = profile(row)
+        if not user['email_verified']:
+            return user, None
+        # Re-checks the verified hash, so a reset since the lookup gets no session
+        session = self._write(lambda conn: conn.execute(
+            """
+            INSERT INTO sessions(token, user_id, expires_at)
+            SELECT ?, id, ? FROM users
+            WHERE id = ? AND password_hash = ? AND email_verified
+            RETURNING token
+            """,
+            (new_token, time.time() + SESSION_DAYS * 86400, user['id'], stored)
+        ).fetchone())
+        return user, (session[0] if session else None)
+
+    def session_row(self, token, bootstrap=False):
+        statement = BOOTSTRAP if bootstrap else SESSION_USER
+        try:
+            return self._read(lambda conn: conn.execute(statement, (token, time.time())).fetchone())
+        except Exception:
+            return None
+
+    # --- Activity ---
+
+    def log_activity(self, log_id, user_id, course_id, event_type, xp_awarded, coins_awarded, metadata=None):
+        self._write(lambda conn: conn.execute(
+            """
+            INSERT INTO activity_logs(id, user_id, course_id, event_type, xp_awarded, coins_awarded, metadata)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (log_id, user_id, course_id or None, event_type, xp_awarded, coins_awarded,
+             json.dumps(metadata) if metadata is not None else None)
+        ))
+
+    def log_activities(self, user_id, entries) -> int:
+        def insert(conn):
+            inserted = 0
+            for log_id, course_id, event_type, xp_awarded, coins_awarded, metadata in entries:
+                inserted += conn.execute(
+                    """
+                    INSERT OR IGNORE INTO activity_logs(id, user_id, course_id, event_type, xp_awarded, coins_awarded, metadata)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (log_id, user_id, course_id or None, event_type, xp_awarded, coins_awarded,
+                     json.dumps(metadata) if metadata is not None else None)
+                ).rowcount
+            return inserted
+        return self._write(insert)
+
+    def recent_activity(self, user_id, limit=50) -> list:
+        rows = self._read(lambda conn: conn.execute(
+            """
+            SELECT id, course_id, event_type, xp_awarded, coins_awarded, metadata
+            FROM activity_logs WHERE user_id = ?
+            ORDER BY created_at DESC, id DESC LIMIT ?
+            """,
+            (user_id, limit)).fetchall())
+        return [activity_entry(row) for row in rows]
@@ -0,0 +1,468 @@
+"""Storage for users, sessions, course state and awards, the module store and activity logs.
+
+server.py talks to these through a Store, so the same routes run on
+either backend:
+
+  PostgresStore  DATABASE_URL; the pooled, prepared, replica-aware paths
+                 server.py already had, moved here unchanged
+  SqliteStore    SQLITE_PATH; an embedded database for small single-VM
+                 deployments (lib/_sqlite.py)
+
+Everything else (wallet, rewards, notifications, live updates, analytics,
+exports) stays Postgres-only and answers 503 in SQLite mode, as it does
+without a database. scripts/storage_check.py runs one conformance suite
+against both backends.
+
+Methods raise Unavailable when the database cannot be reached, Timeout (a
+kind of Unavailable) when the request's deadline cancelled a statement, and
+Conflict (with the clashing field) when a new user's email or username is
+taken.
+"""
+import functools
+import json
+from typing import Callable, Optional, Tuple
+
+from lib import _courses
+from lib import _dbroute
+from lib import _deadline
+from lib import _grading
+from lib import _invalidation
+from lib import _notify
+from lib import _prepared
+from lib import _pubsub
+from lib import _ranks
+from lib._accesslog import log_event
+
+
+class Unavailable(Exception):
+    pass
+
+
+class Timeout(Unavailable):
+    """The request ran out of budget (lib/_deadline.py); handlers answer 504."""
+
+
+class Conflict(Exception):
+    def __init__(self, field: Optional[str]):
+        super().__init__(f'{field or "value"} already exists')
+        self.field = field
+
+
+# Column order shared by SESSION_USER / BOOTSTRAP rows and lib/_bootstrap.user_from_row
+PROFILE_COLUMNS = ('id', 'username', 'email', 'name', 'xp_total', 'level_idx', 'xp_in_level', 'wallet',
+                   'email_verified', 'is_admin')
+
+
+def profile(row) -> dict:
+    """Public profile from the first ten PROFILE_COLUMNS of a row."""
+    user = dict(zip(PROFILE_COLUMNS, row[:10]))
+    user['email_verified'] = bool(user['email_verified'])
+    user['is_admin'] = bool(user['is_admin'])
+    return user
+
+
+def progress_from_row(row) -> Optional[dict]:
+    """Progress from an (xp_total, level_idx, xp_in_level, wallet) row.
+
+    The rank is derived from the total: rows written before awards owned XP
+    may carry a rank the client pushed.
+    """
+    if not row:
+        return None
+    level_idx, xp_in_level = _ranks.level_for(row[0])
+    return {'xp_total': row[0], 'level_idx': level_idx, 'xp_in_level': xp_in_level, 'wallet': row[3]}
+
+
+class Store:
+    """The interface both backends implement; see scripts/storage_check.py for the contract."""
+
+    kind = ''
+
+    def init_schema(self):
+        pass
+
+    def close(self):
+        pass
+
+    # --- Module store ---
+
+    def load_modules(self) -> Optional[list]:
+        raise NotImplementedError
+
+    def save_modules(self, mods: list, added: list = ()) -> bool:
+        """Publish `mods`; `added` (the new ones) are announced to every user where notifications exist."""
+        raise NotImplementedError
+
+    # --- Users ---
+
+    def create_user(self, user_id: str, username: str, email: str, name: str, password_hash: str) -> dict:
+        raise NotImplementedError
+
+    def set_verification_token(self, email: str, token: str) -> bool:
+        raise NotImplementedError
+
+    def verify_email(self, token: str) -> Optional[str]:
+        """Mark the token's user verified; returns their id."""
+        raise NotImplementedError
+
+    def set_reset_token(self, email: str, token: str, expires) -> bool:
+        raise NotImplementedError
+
+    def reset_password(self, token: str, password_hash: str) -> Optional[str]:
+        """Set a new password for an unexpired reset token and revoke every session; returns the user id."""
+        raise NotImplementedError
+
+    def progress(self, user_id: str) -> Optional[dict]:
+        """{xp_total, level_idx, xp_in_level, wallet} as the server holds them, or None for an unknown user."""
+        raise NotImplementedError
+
+    def award_completion(self, user_id: str, course_id: str, entry: dict) -> Optional[dict]:
+        """Credit a completed course's XP/coins once (lib/_grading.py); None if it was already awarded."""
+        raise NotImplementedError
+
+    def sync_courses(self, user_id: str, since: int, changes: list) -> Optional[dict]:
+        """Merge course changes and return the delta since a sync token (lib/_courses.py); None for an unknown user."""
+        raise NotImplementedError
+
+    # --- Sessions ---
+
+    def login(self, identity: str, check: Callable[[str], bool], new_token: str) -> Tuple[Optional[dict], Optional[str]]:
+        """(profile, session token) for an email or username whose stored hash passes `check`.
+
+        (None, None) for bad credentials; (profile, None) when the email is
+        not verified or the password changed between the lookup and the insert.
+        """
+        raise NotImplementedError
+
+    def session_row(self, token: str, bootstrap: bool = False):
+        """SESSION_USER row for a live session (plus the leaderboard position with `bootstrap`), or None."""
+        raise NotImplementedError
+
+    # --- Activity ---
+
+    def log_activity(self, log_id: str, user_id: str, course_id: Optional[str], event_type: str,
+                     xp_awarded: int, coins_awarded: int, metadata=None):
+        raise NotImplementedError
+
+    def log_activities(self, user_id: str, entries: list) -> int:
+        """Log (log_id, course_id, event_type, xp, coins, metadata) rows in one transaction; ids already stored are skipped."""
+        raise NotImplementedError
+
+    def recent_activity(self, user_id: str, limit: int = 50) -> list:
+        raise NotImplementedError
+
+
+def _conflict_field(message: str) -> Optional[str]:
+    if 'users_email_key' in message or ('duplicate key value' in message and '(email)=' in message):
+        return 'email'
+    if 'users_username_key' in message or ('duplicate key value' in message and '(username)=' in message):
+        return 'username'
+    return None
+
+
+class PostgresStore(Store):
+    kind = 'postgres'
+
+    def __init__(self, connect, router=None):
+        """`connect` returns a (pooled) primary connection or None; `router` is a lib/_dbroute.Router."""
+        self.connect = connect
+        self.router = router
+
+    def _conn(self):
+        conn = self.connect()
+        if not conn:
+            raise Unavailable('Database connection failed')
+        return conn
+
+    def load_modules(self) -> Optional[list]:
+        conn = self.router.connect_read(_dbroute.MODULES) if self.router else self.connect()
+        if not conn:
+            return None
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT data FROM module_store WHERE id = %s", ('custom_modules',))
+                    row = cur.fetchone()
+                    if row and row[0] is not None:
+                        # row[0] may be a dict already depending on driver setup
+                        return row[0] if isinstance(row[0], (list, dict)) else json.loads(row[0])
+            return None
+        except Exception as e:
+            log_event('db', 'Fetch failed', error=str(e))
+            return None
+        finally:
+            conn.close()
+
+    def save_modules(self, mods: list, added: list = ()) -> bool:
+        """Store the entire modules array under a single key for simplicity."""
+        conn = self.connect()
+        if not conn:
+            return False
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        INSERT INTO module_store(id, data, updated_at)
+                        VALUES (%s, %s::jsonb, NOW())
+                        ON CONFLICT (id)
+                        DO UPDATE SET data = EXCLUDED.data, updated_at = NOW()
+                        """,
+                        ('custom_modules', json.dumps(mods))
+                    )
+                    # Every instance drops its cached catalog on commit
+                    _invalidation.modules_changed(cur)
+                    # Open streams learn the new catalog version on commit
+                    _pubsub.publish(_pubsub.GLOBAL_TOPIC, 'catalog', {'version': _grading.catalog_version(mods)}, cur)
+                    # Fanned out by the notify-fanout worker once this commits
+                    _notify.announce_modules(cur, list(added))
+            return True
+        except Exception as e:
+            log_event('db', 'Upsert failed', error=str(e))
+            return False
+        finally:
+            conn.close()
+
+    def create_user(self, user_id, username, email, name, password_hash) -> dict:
+        conn = self._conn()
+        try:
+            # One statement, one round trip: the insert returns the profile
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"""
+                    INSERT INTO users(id, username, email, name, password_hash)
+                    VALUES (%s, %s, %s, %s, %s)
+                    RETURNING {', '.join(PROFILE_COLUMNS)}
+                    """,
+                    (user_id, username, email, name, password_hash)
+                )
+                return profile(cur.fetchone())
+        except Exception as e:
+            field = _conflict_field(str(e))
+            if field:
+                raise Conflict(field) from e
+            raise
+        finally:
+            conn.close()
+
+    def set_verification_token(self, email, token) -> bool:
+        conn = self._conn()
+        try:
+            # Single-statement transaction: no BEGIN/COMMIT round trips
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute("UPDATE users SET email_verification_token = %s WHERE email = %s", (token, email))
+                return cur.rowcount > 0
+        finally:
+            conn.close()
+
+    def verify_email(self, token) -> Optional[str]:
+        conn = self._conn()
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute("UPDATE users SET email_verified = TRUE, email_verification_token = NULL WHERE email_verification_token = %s RETURNING id", (token,))
+                    row = cur.fetchone()
+                    if row:
+                        _invalidation.user_changed(row[0], cur)
+                    return row[0] if row else None
+        finally:
+            conn.close()
+
+    def set_reset_token(self, email, token, expires) -> bool:
+        conn = self._conn()
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute("UPDATE users SET reset_token = %s, reset_token_expires = %s WHERE email = %s", (token, expires, email))
+                    return cur.rowcount > 0
+        finally:
+            conn.close()
+
+    def reset_password(self, token, password_hash) -> Optional[str]:
+        conn = self._conn()
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        UPDATE users
+                        SET password_hash = %s, reset_token = NULL, reset_token_expires = NULL
+                        WHERE reset_token = %s AND reset_token_expires > NOW()
+                        RETURNING id
+                        """,
+                        (password_hash, token)
+                    )
+                    row = cur.fetchone()
+                    if not row:
+                        return None
+                    # A new password signs out every existing session
+                    cur.execute(
+                        "UPDATE sessions SET revoked = TRUE WHERE user_id = %s AND revoked = FALSE RETURNING token",
+                        (row[0],)
+                    )
+                    for (session_token,) in cur.fetchall():
+                        _invalidation.session_revoked(session_token, cur)
+                    _invalidation.user_changed(row[0], cur)
+                    return row[0]
+        finally:
+            conn.close()
+
+    def progress(self, user_id) -> Optional[dict]:
+        conn = self._conn()
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    _prepared.execute(cur, _prepared.PROGRESS_READ, (user_id,))
+                    return progress_from_row(cur.fetchone())
+        finally:
+            conn.close()
+
+    def award_completion(self, user_id, course_id, entry) -> Optional[dict]:
+        conn = self._conn()
+        try:
+            # Rank-ups and leaderboard moves are notified in the same transaction
+            return _grading.award_completion(conn, user_id, course_id, entry)
+        finally:
+            conn.close()
+
+    def sync_courses(self, user_id, since, changes) -> Optional[dict]:
+        conn = self._conn()
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    return _courses.sync(cur, user_id, since, changes)
+        finally:
+            conn.close()
+
+    def login(self, identity, check, new_token):
+        conn = self._conn()
+        try:
+            # Autocommit: the lookup and the session insert are one round trip
+            # each, on one connection, and no transaction is open during bcrypt
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                _prepared.execute(cur, _prepared.LOGIN_BY_EMAIL if '@' in identity else _prepared.LOGIN_BY_USERNAME, (identity,))
+                row = cur.fetchone()
+                stored = (row[10] or '') if row else ''
+                if not row or not check(stored):
+                    return None, None
+                user = profile(row)
+                if not user['email_verified']:
+                    return user, None
+                # Re-checks the verified hash, so a reset since the lookup gets no session
+                _prepared.execute(cur, _prepared.SESSION_OPEN, (new_token, user['id'], stored))
+                session = cur.fetchone()
+                return user, (session[0] if session else None)
+        finally:
+            conn.close()
+
+    def _fetch_session_row(self, conn, token, statement):
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    _prepared.execute(cur, statement, (token,))
+                    return cur.fetchone()
+        except Exception as e:
+            # A timeout is not a missing session; answering None would sign the user out
+            if _deadline.is_timeout(e):
+                raise
+            return None
+        finally:
+            conn.close()
+
+    def session_row(self, token, bootstrap=False):
+        statement = _prepared.BOOTSTRAP if bootstrap else _prepared.SESSION_USER
+        # Replica first; a miss (a session created moments ago) or a user
+        # inside their read-your-writes window is re-read on the primary
+        row = None
+        conn = self.router.connect_replica() if self.router else None
+        if conn:
+            row = self._fetch_session_row(conn, token, statement)
+        if row is None or (self.router and self.router.recently_written(row[0])):
+            conn = self.connect()
+            if not conn:
+                return None
+            row = self._fetch_session_row(conn, token, statement)
+        return row
+
+    def log_activity(self, log_id, user_id, course_id, event_type, xp_awarded, coins_awarded, metadata=None):
+        conn = self._conn()
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    _prepared.execute(
+                        cur, _prepared.ACTIVITY_INSERT,
+                        (log_id, user_id, course_id or None, event_type, xp_awarded, coins_awarded,
+                         json.dumps(metadata) if metadata is not None else None)
+                    )
+        finally:
+            conn.close()
+
+    def log_activities(self, user_id, entries) -> int:
+        conn = self._conn()
+        inserted = 0
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    for log_id, course_id, event_type, xp_awarded, coins_awarded, metadata in entries:
+                        cur.execute(
+                            """
+                            INSERT INTO activity_logs(id, user_id, course_id, event_type, xp_awarded, coins_awarded, metadata)
+                            VALUES (%s, %s, %s, %s, %s, %s, %s::jsonb)
+                            ON CONFLICT (id) DO NOTHING
+                            """,
+                            (log_id, user_id, course_id or None, event_type, xp_awarded, coins_awarded,
+                             json.dumps(metadata) if metadata is not None else None)
+                        )
+                        inserted += cur.rowcount
+        finally:
+            conn.close()
+        return inserted
+
+    def recent_activity(self, user_id, limit=50) -> list:
+        conn = self._conn()
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        SELECT id, course_id, event_type, xp_awarded, coins_awarded, metadata
+                        FROM activity_logs WHERE user_id = %s
+                        ORDER BY created_at DESC, id DESC LIMIT %s
+                        """,
+                        (user_id, limit)
+                    )
+                    return [activity_entry(row) for row in cur.fetchall()]
+        finally:
+            conn.close()
+
+
+def _timeouts_as_unavailable(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        except Timeout:
+            raise
+        except Exception as e:
+            if _deadline.is_timeout(e):
+                raise Timeout('Request deadline exceeded') from e
+            raise
+    return wrapper
+
+
+# Every route already answers Unavailable (503, or 504 once the deadline has
+# passed), so statement timeouts and DeadlineExceeded surface as Timeout
+for _name, _fn in list(vars(PostgresStore).items()):
+    if callable(_fn) and not _name.startswith('_'):
+        setattr(PostgresStore, _name, _timeouts_as_unavailable(_fn))
+
+
+def activity_entry(row) -> dict:
+    metadata = row[5]
+    if isinstance(metadata, str):
+        metadata = json.loads(metadata)
+    return {'id': row[0], 'course_id': row[1], 'event_type': row[2], 'xp_awarded': row[3],
+            'coins_awarded': row[4], 'metadata': metadata}
@@ -3,8 +3,8 @@ import json
 import ssl
 import smtplib
 import psycopg2
+import psycopg2.extensions
 import hashlib
-import datetime
 try:
     import bcrypt  # optional; fallback to sha256
 except Exception:
@@ -21,6 +21,15 @@ try:
 except Exception:
     pass
 
+from lib import _ratelimit
+from lib import _metrics
+from lib import _dbroute
+from lib import _breaker
+from lib import _deadline
+
+_TimedCursor = _metrics.timed_cursor_class(psycopg2.extensions.cursor)
+_CountedConnection = _metrics.counted_connection_class(psycopg2.extensions.connection)
+
 
 def _with_sslmode(url: str) -> str:
     if not url:
@@ -33,16 +42,50 @@ def _with_sslmode(url: str) -> str:
     return url + '?sslmode=require'
 
 
+# Lives as long as the warm function instance; see lib/_breaker.py
+_breaker_primary = _breaker.CircuitBreaker('primary')
+
+
 def db_connect():
     url = _with_sslmode(os.environ.get('DATABASE_URL'))
-    if not url:
+    if not url or not _breaker_primary.allow():
+        return None
+    # No per-session statement_timeout here: a SET would cost two more round trips on
+    # every request, and the function's maxDuration already bounds a runaway query
+    try:
+        with _metrics.phase('connect'):
+            conn = psycopg2.connect(url, connection_factory=_CountedConnection, cursor_factory=_TimedCursor,
+                                    **_breaker.connect_options())
+    except Exception:
+        _breaker_primary.record(False)
         return None
+    _breaker_primary.record(True)
+    return conn
+
+
+def _connect_replica():
+    url = _with_sslmode(os.environ.get('DATABASE_READ_URL'))
     try:
-        return psycopg2.connect(url)
+        with _metrics.phase('connect'):
+            conn = psycopg2.connect(url, connection_factory=_CountedConnection, cursor_factory=_TimedCursor,
+                                    **_breaker.connect_options())
+        conn.set_session(readonly=True)
+        return conn
     except Exception:
         return None
 
 
+_router = _dbroute.Router(db_connect, _connect_replica if os.environ.get('DATABASE_READ_URL') else None).track_writes()
+
+
+def db_connect_read(key=None):
+    """Connection for a read-only query; see lib/_dbroute.py."""
+    return _router.connect_read(key)
+
+
+_ratelimit.configure(db_connect)
+
+
 def send_email(to_addr: str, subject: str, text: str, html: Optional[str] = None) -> bool:
     host = os.environ.get('SMTP_HOST')
     port = int(os.environ.get('SMTP_PORT') or '587')
@@ -54,11 +97,18 @@ def send_email(to_addr: str, subject: str, text: str, html: Optional[str] = None
     if not host or not port or not user or not password or not from_addr:
         return False
 
+    with _metrics.phase('email'):
+        return _smtp_send(host, port, user, password, from_addr, use_ssl, to_addr, subject, text, html)
+
+
+def _smtp_send(host, port, user, password, from_addr, use_ssl, to_addr, subject, text, html) -> bool:
+    # Per-socket-operation timeout, capped by the request deadline
+    timeout = _deadline.timeout(float(os.environ.get('SMTP_TIMEOUT') or '10'))
     try:
         if use_ssl:
-            server = smtplib.SMTP_SSL(host, port, context=ssl.create_default_context())
+            server = smtplib.SMTP_SSL(host, port, context=ssl.create_default_context(), timeout=timeout)
         else:
-            server = smtplib.SMTP(host, port)
+            server = smtplib.SMTP(host, port, timeout=timeout)
             server.ehlo()
             try:
                 server.starttls(context=ssl.create_default_context())
@@ -105,7 +155,7 @@ def _set_cors(handler):
         ao = origin or '*'
     handler.send_header('Access-Control-Allow-Origin', ao)
     handler.send_header('Vary', 'Origin')
-    handler.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+    handler.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization, Idempotency-Key, If-None-Match')
     handler.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, OPTIONS')
     handler.send_header('Access-Control-Max-Age', '86400')
 
@@ -116,16 +166,37 @@ def cors_preflight(handler):
     handler.end_headers()
 
 
-def json_response(handler, status_code: int, payload: dict):
-    data = json.dumps(payload).encode('utf-8')
+def json_response(handler, status_code: int, payload: dict, headers: Optional[dict] = None):
+    if status_code >= 500 and _deadline.expired():
+        # The failure came from running out of the route's budget (lib/_deadline.py)
+        status_code = 504
+        payload = { 'ok': False, 'error': 'Request timed out' }
+    with _metrics.phase('serialize'):
+        data = json.dumps(payload).encode('utf-8')
     handler.send_response(status_code)
     handler.send_header('Content-Type', 'application/json')
     handler.send_header('Content-Length', str(len(data)))
+    for k, v in (headers or {}).items():
+        handler.send_header(k, str(v))
     _set_cors(handler)
     handler.end_headers()
     handler.wfile.write(data)
 
 
+def rate_limited(handler, route: str, identity: str = '') -> bool:
+    """Send 429 and return True when `route` is over its limit for this client.
+
+    Called once without `identity` (charges the IP bucket) and once with it
+    after the body is parsed (charges only the identity bucket).
+    """
+    ip = '' if identity else _ratelimit.client_ip(handler)
+    retry_after = _ratelimit.check(route, ip=ip, identity=identity)
+    if not retry_after:
+        return False
+    json_response(handler, 429, { 'ok': False, 'error': 'Too many requests. Please try again later.' }, { 'Retry-After': retry_after })
+    return True
+
+
 def get_bearer_token(handler) -> Optional[str]:
     auth = handler.headers.get('Authorization') or ''
     if auth.lower().startswith('bearer '):
@@ -159,7 +230,10 @@ def get_user_by_token(token: str) -> Optional[dict]:
                         'email_verified': bool(row[8]), 'is_admin': bool(row[9])
                     }
                 return None
-    except Exception:
+    except Exception as e:
+        # A timeout is not a missing session: MetricsMixin answers 504 instead of a 401
+        if _deadline.is_timeout(e):
+            raise
         return None
     finally:
         try:
@@ -169,33 +243,21 @@ def get_user_by_token(token: str) -> Optional[dict]:
 
 
 def verify_password(plain: str, stored_hash: str) -> bool:
-    try:
-        if bcrypt and stored_hash:
-            return bcrypt.checkpw(plain.encode('utf-8'), stored_hash.encode('utf-8'))
-    except Exception:
-        pass
-    try:
-        return stored_hash == hashlib.sha256(plain.encode('utf-8')).hexdigest()
-    except Exception:
-        return False
-
-
-def issue_session_token(user_id: str) -> Optional[str]:
-    import secrets
-    token = secrets.token_hex(32)
-    expires = datetime.datetime.utcnow() + datetime.timedelta(days=7)
-    conn = db_connect()
-    if not conn:
-        return None
-    try:
-        with conn:
-            with conn.cursor() as cur:
-                cur.execute("INSERT INTO sessions(token, user_id, expires_at) VALUES (%s, %s, %s)", (token, user_id, expires))
-                return token
-    except Exception:
-        return None
-    finally:
+    with _metrics.phase('hash'):
         try:
-            conn.close()
+            if bcrypt and stored_hash:
+                return bcrypt.checkpw(plain.encode('utf-8'), stored_hash.encode('utf-8'))
         except Exception:
-            pass
\ No newline at end of file
+            pass
+        try:
+            return stored_hash == hashlib.sha256(plain.encode('utf-8')).hexdigest()
+        except Exception:
+            return False
+
+
+def hash_password(plain: str) -> str:
+    # Prefer bcrypt when available
+    with _metrics.phase('hash'):
+        if bcrypt:
+            return bcrypt.hashpw(plain.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        return hashlib.sha256(plain.encode('utf-8')).hexdigest()
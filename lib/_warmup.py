@@ -0,0 +1,86 @@
+"""Startup warmup and readiness for server.py.
+
+Right after a deploy the first requests used to pay for the first database
+connects, the first catalog fetch, the first PREPARE of every hot statement
+and the first bcrypt hash. server.py now does that work before it reports
+ready: each step runs as a timed phase of STARTUP, and /healthz and /readyz
+answer 503 until the last one has finished. A phase that fails (say the
+database is down) is logged and reported, but does not keep the instance
+out of rotation; the API degrades the same way it does without warmup.
+
+Per-phase durations go to the log (`server` event "Ready"), to /readyz and
+to the topcit_startup_phase_duration_seconds histogram.
+"""
+import os
+import threading
+import time
+
+from lib import _metrics
+from lib._accesslog import log_event
+
+
+# Pooled sessions to open (and prepare) per database before reporting ready
+WARMUP_CONNECTIONS = int(os.environ.get('WARMUP_CONNECTIONS') or '4')
+
+
+class Startup:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.phases = {}
+        self.errors = {}
+        self._ready = threading.Event()
+
+    def phase(self, name: str, fn, *args):
+        """Run one warmup step, timing it; errors are recorded instead of raised."""
+        t0 = time.perf_counter()
+        try:
+            return fn(*args)
+        except Exception as e:
+            self.errors[name] = str(e)
+            log_event('server', 'Warmup phase failed', phase=name, error=str(e))
+            return None
+        finally:
+            elapsed = time.perf_counter() - t0
+            self.phases[name] = elapsed
+            _metrics.REGISTRY.observe('topcit_startup_phase_duration_seconds', (('phase', name),), elapsed)
+
+    def finish(self):
+        self._ready.set()
+        log_event('server', 'Ready', total_ms=round((time.monotonic() - self.started) * 1000, 1),
+                  phases_ms=self.phases_ms(), errors=self.errors or None)
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def phases_ms(self) -> dict:
+        return {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()}
+
+    def status(self) -> dict:
+        return {
+            'ready': self.ready,
+            'uptime_seconds': round(time.monotonic() - self.started, 1),
+            'phases_ms': self.phases_ms(),
+            'errors': self.errors,
+        }
+
+
+STARTUP = Startup()
+
+
+def warm_pool(pool, prepare, n: int = WARMUP_CONNECTIONS) -> int:
+    """Open up to `n` sessions in `pool` and run `prepare(cur)` on each; returns how many opened."""
+    leases = []
+    try:
+        for _ in range(min(n, pool.size)):
+            lease = pool.get()
+            if lease is None:
+                break
+            leases.append(lease)
+            with lease:
+                with lease.cursor() as cur:
+                    prepare(cur)
+    finally:
+        for lease in leases:
+            lease.close()
+    return len(leases)
@@ -2,9 +2,13 @@ from http.server import BaseHTTPRequestHandler
 import json
 
 from lib._utils import json_response, get_bearer_token, get_user_by_token, db_connect, cors_preflight
+from lib._metrics import MetricsMixin
+from lib._storage import progress_from_row
+from lib import _prepared
+from lib import _ranks
 
 
-class handler(BaseHTTPRequestHandler):
+class handler(MetricsMixin, BaseHTTPRequestHandler):
     def do_PUT(self):
         token = get_bearer_token(self)
         if not token:
@@ -20,34 +24,30 @@ class handler(BaseHTTPRequestHandler):
             xp_total = int(payload.get('xp_total') or 0)
             level_idx = int(payload.get('level_idx') or 0)
             xp_in_level = int(payload.get('xp_in_level') or 0)
-            wallet = int(payload.get('wallet') or 0)
+            _ranks.check(xp_total, level_idx, xp_in_level)
         except Exception as e:
-            return json_response(self, 400, { 'ok': False, 'error': f'Invalid JSON: {e}' })
+            return json_response(self, 400, { 'ok': False, 'error': f'Invalid progress: {e}' })
 
         conn = db_connect()
         if not conn:
             return json_response(self, 503, { 'ok': False, 'error': 'Database connection failed' })
 
-        ok = False
+        progress = None
         try:
             with conn:
                 with conn.cursor() as cur:
-                    cur.execute(
-                        """
-                        UPDATE users
-                        SET xp_total = %s, level_idx = %s, xp_in_level = %s, wallet = %s
-                        WHERE id = %s
-                        """,
-                        (xp_total, level_idx, xp_in_level, wallet, user['id'])
-                    )
-                    ok = cur.rowcount > 0
+                    # XP is credited by course awards (lib/_grading.py) and the
+                    # wallet by the ledger; the client gets the server's values back
+                    _prepared.execute(cur, _prepared.PROGRESS_READ, (user['id'],))
+                    progress = progress_from_row(cur.fetchone())
         finally:
             try:
                 conn.close()
             except Exception:
                 pass
 
-        return json_response(self, 200 if ok else 404, { 'ok': ok })
+        ok = progress is not None
+        return json_response(self, 200 if ok else 404, dict(progress or {}, ok=ok))
 
     def do_GET(self):
         return json_response(self, 405, { 'ok': False, 'error': 'Use PUT' })
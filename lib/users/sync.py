@@ -0,0 +1,51 @@
+from http.server import BaseHTTPRequestHandler
+import json
+
+from lib._utils import json_response, get_bearer_token, get_user_by_token, db_connect, cors_preflight
+from lib._metrics import MetricsMixin
+from lib._courses import parse_changes, sync
+from lib._schema import ensure_schema
+
+
+class handler(MetricsMixin, BaseHTTPRequestHandler):
+    def do_POST(self):
+        ensure_schema()
+        token = get_bearer_token(self)
+        if not token:
+            return json_response(self, 401, { 'ok': False, 'error': 'Unauthorized' })
+        user = get_user_by_token(token)
+        if not user:
+            return json_response(self, 401, { 'ok': False, 'error': 'Unauthorized' })
+
+        try:
+            length = int(self.headers.get('Content-Length', '0'))
+            raw = self.rfile.read(length)
+            since, changes = parse_changes(json.loads(raw.decode('utf-8') or '{}'))
+        except Exception as e:
+            return json_response(self, 400, { 'ok': False, 'error': f'Invalid JSON: {e}' })
+
+        conn = db_connect()
+        if not conn:
+            return json_response(self, 503, { 'ok': False, 'error': 'Database connection failed' })
+
+        body = None
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    # Merge the client's changes and read back everything past its token
+                    body = sync(cur, user['id'], since, changes)
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+        if body is None:
+            return json_response(self, 404, { 'ok': False, 'error': 'User not found' })
+        return json_response(self, 200, body)
+
+    def do_GET(self):
+        return json_response(self, 405, { 'ok': False, 'error': 'Use POST' })
+
+    def do_OPTIONS(self):
+        return cors_preflight(self)
@@ -2,9 +2,11 @@ from http.server import BaseHTTPRequestHandler
 from urllib.parse import parse_qs, urlsplit
 
 from lib._utils import db_connect, json_response, cors_preflight
+from lib._metrics import MetricsMixin
+from lib import _invalidation
 
 
-class handler(BaseHTTPRequestHandler):
+class handler(MetricsMixin, BaseHTTPRequestHandler):
     def do_POST(self):
         # Token is expected in query string: /api/users/verify?token=...
         try:
@@ -25,10 +27,13 @@ class handler(BaseHTTPRequestHandler):
             with conn:
                 with conn.cursor() as cur:
                     cur.execute(
-                        "UPDATE users SET email_verified = TRUE, email_verification_token = NULL WHERE email_verification_token = %s",
+                        "UPDATE users SET email_verified = TRUE, email_verification_token = NULL WHERE email_verification_token = %s RETURNING id",
                         (token,)
                     )
-                    ok = cur.rowcount > 0
+                    row = cur.fetchone()
+                    ok = row is not None
+                    if ok:
+                        _invalidation.user_changed(row[0], cur)
         finally:
             try:
                 conn.close()
@@ -0,0 +1,599 @@
+"""Load-test server.py against a local Postgres and report per-route latency.
+
+By default this creates a throwaway cluster with `initdb` / `pg_ctl` (no Docker
+needed), starts server.py against it, seeds users, sessions and modules, then
+drives a weighted mix of scenarios from a pool of client threads:
+
+  page_load  static page + script + GET /api/users/me + GET /api/modules
+  quest      PUT /api/users/activity + PUT /api/users/progress
+  login      POST /api/users/login (bcrypt-bound)
+  redeem     POST /api/rewards/redeem, sometimes retried with the same key
+
+After the run every seeded wallet is checked against its ledger (balance never
+negative, users.wallet equal to the sum of wallet_ledger deltas).
+
+The report's `planning` section runs each hot statement from lib/_prepared.py
+under EXPLAIN ANALYZE, once as plain SQL and once through its prepared name,
+and gives the planning time saved per call and per second of the measured
+load for each route. Compare whole runs with
+`--server-env PREPARED_STATEMENTS=0` against the default.
+
+The `round_trips` section is scraped from the server's /metrics after the run:
+database round trips (connects, BEGIN, statements, COMMIT) per request, by
+route. --compare prints how it moved against the baseline.
+
+server.py's stderr is written to topcit-bench-server-<port>.log in the
+temp directory.
+
+Results (throughput and p50/p95/p99 per route) are printed as JSON and can be
+saved with --out and compared against an earlier run with --compare.
+
+--storage picks the backend server.py runs on (lib/_storage.py): postgres
+(default), sqlite (an embedded file, SQLITE_PATH) or both, which runs the same
+load against each in turn, reports them under `backends` and prints the
+SQLite p95/throughput against Postgres per route. The redeem scenario, the
+wallet check and the planning report need Postgres and are skipped on SQLite.
+
+Examples:
+  python scripts/bench.py --users 500 --concurrency 16 --duration 30 --out bench.json
+  python scripts/bench.py --dsn postgresql://localhost/topcit?sslmode=disable --mix page_load=1
+  python scripts/bench.py --compare bench.json --fail-threshold 0.2
+  python scripts/bench.py --users 10 --concurrency 32 --mix redeem=1
+  python scripts/bench.py --server-env PREPARED_STATEMENTS=0 --out plain.json
+  python scripts/bench.py --mix login=1 --concurrency 32 --server-arg=--workers=4
+  python scripts/bench.py --storage both --mix page_load=5,quest=5 --out storage.json
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lib import _ranks  # noqa: E402
+
+BENCH_PASSWORD = 'bench-password'
+BENCH_WALLET = 5000
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class LocalPostgres:
+    """A temporary Postgres cluster created with initdb and torn down afterwards."""
+
+    def __init__(self):
+        self.dir = tempfile.mkdtemp(prefix='topcit-bench-pg-')
+        self.port = _free_port()
+
+    def start(self) -> str:
+        initdb = shutil.which('initdb')
+        pg_ctl = shutil.which('pg_ctl')
+        if not initdb or not pg_ctl:
+            raise SystemExit('initdb/pg_ctl not found on PATH; install Postgres or pass --dsn')
+        data = os.path.join(self.dir, 'data')
+        subprocess.run([initdb, '-D', data, '-A', 'trust', '-U', 'postgres', '--no-sync'],
+                       check=True, stdout=subprocess.DEVNULL)
+        opts = f"-p {self.port} -k {self.dir} -c listen_addresses=127.0.0.1 -c fsync=off -c max_connections=300"
+        subprocess.run([pg_ctl, '-D', data, '-o', opts, '-l', os.path.join(self.dir, 'pg.log'), '-w', 'start'],
+                       check=True, stdout=subprocess.DEVNULL)
+        return f'postgresql://postgres@127.0.0.1:{self.port}/postgres?sslmode=disable'
+
+    def stop(self):
+        pg_ctl = shutil.which('pg_ctl')
+        if pg_ctl:
+            subprocess.run([pg_ctl, '-D', os.path.join(self.dir, 'data'), '-m', 'fast', 'stop'],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+class ServerProcess:
+    def __init__(self, db_env: dict, port: int, extra_env: dict, extra_args: list):
+        """`db_env` is {'DATABASE_URL': dsn} or {'SQLITE_PATH': path}."""
+        self.port = port
+        env = dict(os.environ)
+        env.update({
+            'DATABASE_URL': '',
+            'PORT': str(port),
+            'RATE_LIMIT_ENABLED': 'false',
+            'ACCESS_LOG_STATIC_SAMPLE': '0',
+            'ACCESS_LOG_PATH': os.path.join(tempfile.gettempdir(), f'topcit-bench-access-{port}.log'),
+            # Keep the project .env from pointing the run at a remote database
+            'DOTENV_PATH': os.devnull,
+        })
+        env.update(db_env)
+        env.update(extra_env)
+        # A file, not a pipe: nothing reads stderr during the run, and a full
+        # pipe would block the server's logging and skew the results
+        self.log_path = os.path.join(tempfile.gettempdir(), f'topcit-bench-server-{port}.log')
+        self.log = open(self.log_path, 'wb')
+        self.proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server.py')] + extra_args,
+                                     cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=self.log)
+
+    def wait_ready(self, timeout: float = 30.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                with open(self.log_path, 'rb') as f:
+                    err = f.read().decode('utf-8', 'replace')
+                raise SystemExit(f'server.py exited early:\n{err}')
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=2)
+                conn.request('GET', '/metrics')
+                conn.getresponse().read()
+                conn.close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise SystemExit('server.py did not become ready in time')
+
+    def stop(self):
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+        self.log.close()
+
+
+def _seed_data(users: int, modules: int) -> tuple:
+    """(user rows, (token, user id) sessions, account dicts, module catalog) for verified users."""
+    try:
+        import bcrypt
+        pwd_hash = bcrypt.hashpw(BENCH_PASSWORD.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    except Exception:
+        import hashlib
+        pwd_hash = hashlib.sha256(BENCH_PASSWORD.encode('utf-8')).hexdigest()
+
+    run = uuid.uuid4().hex[:8]
+    rows, sessions, accounts = [], [], []
+    for i in range(users):
+        uid = str(uuid.uuid4())
+        username = f'bench_{run}_{i}'
+        token = uuid.uuid4().hex + uuid.uuid4().hex
+        rows.append((uid, username, f'{username}@bench.local', f'Bench User {i}', pwd_hash, True, BENCH_WALLET))
+        sessions.append((token, uid))
+        accounts.append({'id': uid, 'username': username, 'token': token})
+
+    mods = []
+    for i in range(modules):
+        mods.append({
+            'id': f'bench-{i}', 'title': f'Bench Module {i}', 'description': 'Seeded by scripts/bench.py',
+            'xp': 60, 'coins': 100, 'difficulty': 'Beginner',
+            'content': {
+                'bullets': ['Read the material', 'Take the quiz'],
+                'quiz': {'question': 'Pick B', 'options': ['A', 'B', 'C'], 'correctIndex': 1},
+                'codeFill': {'snippet': 'function f(){}', 'answer': 'return 1'},
+            },
+        })
+    return rows, sessions, accounts, mods
+
+
+def seed(dsn: str, users: int, modules: int) -> list:
+    """Insert verified users with sessions, wallets and a module catalog; returns account dicts."""
+    import psycopg2
+    from psycopg2.extras import execute_values
+    rows, sessions, accounts, mods = _seed_data(users, modules)
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                execute_values(cur, """
+                    INSERT INTO users(id, username, email, name, password_hash, email_verified, wallet) VALUES %s
+                """, rows, page_size=1000)
+                execute_values(cur, """
+                    INSERT INTO wallet_ledger(user_id, delta, balance, kind, reason) VALUES %s
+                """, [(a['id'], BENCH_WALLET, BENCH_WALLET, 'opening', 'bench seed') for a in accounts], page_size=1000)
+                execute_values(cur, """
+                    INSERT INTO sessions(token, user_id, expires_at) VALUES %s
+                """, sessions, template="(%s, %s, NOW() + INTERVAL '1 day')", page_size=1000)
+                cur.execute("""
+                    INSERT INTO module_store(id, data, updated_at) VALUES ('custom_modules', %s::jsonb, NOW())
+                    ON CONFLICT (id) DO UPDATE SET data = EXCLUDED.data, updated_at = NOW()
+                """, (json.dumps(mods),))
+    finally:
+        conn.close()
+    return accounts
+
+
+def seed_sqlite(path: str, users: int, modules: int) -> list:
+    """seed() for the SQLite file server.py is running on (it has created the tables)."""
+    import sqlite3
+    rows, sessions, accounts, mods = _seed_data(users, modules)
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        with conn:
+            conn.executemany("""
+                INSERT INTO users(id, username, email, name, password_hash, email_verified, wallet)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            conn.executemany("INSERT INTO sessions(token, user_id, expires_at) VALUES (?, ?, ?)",
+                             [(token, uid, time.time() + 86400) for token, uid in sessions])
+            conn.execute("""
+                INSERT INTO module_store(id, data, updated_at) VALUES ('custom_modules', ?, ?)
+                ON CONFLICT (id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+            """, (json.dumps(mods), time.time()))
+    finally:
+        conn.close()
+    return accounts
+
+
+class Client:
+    """One benchmark thread's view of the server; records (route, seconds, ok)."""
+
+    def __init__(self, port: int, account: dict, samples: list):
+        self.port = port
+        self.account = account
+        self.samples = samples
+        self.conn = None
+
+    def _request(self, route: str, method: str, path: str, body=None, auth=True, expected=(), headers=None):
+        headers = dict(headers or {})
+        if auth:
+            headers['Authorization'] = f"Bearer {self.account['token']}"
+        data = None
+        if body is not None:
+            data = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        started = time.perf_counter()
+        ok = False
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+            self.conn.request(method, path, body=data, headers=headers)
+            resp = self.conn.getresponse()
+            resp.read()
+            ok = resp.status < 400 or resp.status in expected
+            if resp.getheader('Connection', '').lower() == 'close' or resp.version == 10:
+                self.conn.close()
+                self.conn = None
+        except Exception:
+            if self.conn is not None:
+                self.conn.close()
+            self.conn = None
+        self.samples.append((route, time.perf_counter() - started, ok))
+
+    def page_load(self):
+        self._request('static', 'GET', '/index.html', auth=False)
+        self._request('static', 'GET', '/script.js', auth=False)
+        self._request('/api/users/me', 'GET', '/api/users/me')
+        self._request('/api/modules', 'GET', '/api/modules', auth=False)
+
+    def quest(self):
+        course = f'bench-{random.randint(0, 9)}'
+        self._request('/api/users/activity', 'PUT', '/api/users/activity',
+                      {'course_id': course, 'event_type': 'course_completed', 'xp_awarded': 60, 'coins_awarded': 100})
+        xp_total = random.randint(0, 5000)
+        level_idx, xp_in_level = _ranks.level_for(xp_total)
+        self._request('/api/users/progress', 'PUT', '/api/users/progress',
+                      {'xp_total': xp_total, 'level_idx': level_idx, 'xp_in_level': xp_in_level})
+
+    def login(self):
+        self._request('/api/users/login', 'POST', '/api/users/login',
+                      {'identity': self.account['username'], 'password': BENCH_PASSWORD}, auth=False)
+
+
+    def redeem(self):
+        reward = random.choice(REDEEM_REWARDS)
+        key = uuid.uuid4().hex
+        # 409 (not enough coins) is the expected outcome once a wallet runs dry
+        for _ in range(2 if random.random() < 0.2 else 1):
+            self._request('/api/rewards/redeem', 'POST', '/api/rewards/redeem', {'reward_id': reward},
+                          expected=(409,), headers={'Idempotency-Key': key})
+
+
+REDEEM_REWARDS = ('grammarly-premium', 'canva-pro', 'spotify-premium', 'youtube-premium')
+SCENARIOS = ('page_load', 'quest', 'login', 'redeem')
+
+
+def check_wallets(dsn: str, accounts: list) -> dict:
+    """Every seeded wallet must be non-negative and equal to its ledger sum."""
+    import psycopg2
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT u.id, u.wallet, COALESCE(SUM(l.delta), 0), MIN(l.balance), COUNT(l.id) FILTER (WHERE l.kind = 'redeem')
+                    FROM users u LEFT JOIN wallet_ledger l ON l.user_id = u.id
+                    WHERE u.id = ANY(%s)
+                    GROUP BY u.id, u.wallet
+                """, ([a['id'] for a in accounts],))
+                rows = cur.fetchall()
+    finally:
+        conn.close()
+    mismatched = [r[0] for r in rows if r[1] != r[2]]
+    negative = [r[0] for r in rows if r[1] < 0 or (r[3] is not None and r[3] < 0)]
+    return {
+        'users': len(rows), 'redemptions': sum(r[4] for r in rows),
+        'mismatched': len(mismatched), 'negative': len(negative),
+        'ok': not mismatched and not negative,
+    }
+
+
+# Route -> hot statement it runs on every request (lib/_prepared.py)
+HOT_STATEMENTS = (
+    ('/api/users/me', 'session_user'),
+    ('/api/users/login', 'login_by_username'),
+    ('/api/users/progress', 'progress_read'),
+    ('/api/users/activity', 'activity_insert'),
+)
+
+
+def _statement_params(name: str, account: dict) -> tuple:
+    if name == 'session_user':
+        return (account['token'],)
+    if name == 'login_by_username':
+        return (account['username'],)
+    if name == 'progress_read':
+        return (account['id'],)
+    return (str(uuid.uuid4()), account['id'], 'bench-1', 'course_completed', 60, 100, None)
+
+
+def planning_report(dsn: str, accounts: list, iterations: int, routes: dict) -> dict:
+    """Mean planning time per hot statement, plain vs prepared; writes are rolled back."""
+    import psycopg2
+    from lib import _prepared
+
+    conn = psycopg2.connect(dsn)
+    report = {}
+    try:
+        with conn.cursor() as cur:
+            for route, name in HOT_STATEMENTS:
+                sql, prepare_sql, nparams = _prepared._statements[name]
+                cur.execute(f'PREPARE {name} AS {prepare_sql}')
+                execute_sql = f'EXECUTE {name} ({", ".join(["%s"] * nparams)})'
+                plain, prepared = [], []
+                for i in range(iterations):
+                    params = _statement_params(name, accounts[i % len(accounts)])
+                    cur.execute('EXPLAIN (ANALYZE, TIMING OFF, FORMAT JSON) ' + sql, params)
+                    plain.append(cur.fetchone()[0][0]['Planning Time'])
+                    cur.execute('EXPLAIN (ANALYZE, TIMING OFF, FORMAT JSON) ' + execute_sql, params)
+                    prepared.append(cur.fetchone()[0][0]['Planning Time'])
+                cur.execute(f'DEALLOCATE {name}')
+                plain_ms = sum(plain) / len(plain)
+                prepared_ms = sum(prepared) / len(prepared)
+                rps = routes.get(route, {}).get('rps', 0.0)
+                report[route] = {
+                    'statement': name,
+                    'plan_ms_plain': round(plain_ms, 4),
+                    'plan_ms_prepared': round(prepared_ms, 4),
+                    'saved_ms_per_call': round(plain_ms - prepared_ms, 4),
+                    'saved_ms_per_second': round((plain_ms - prepared_ms) * rps, 3),
+                }
+    finally:
+        conn.rollback()
+        conn.close()
+    return report
+
+
+def parse_mix(text: str) -> list:
+    weights = []
+    for part in (text or '').split(','):
+        if not part.strip():
+            continue
+        name, _, w = part.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f'unknown scenario {name!r}; choose from {", ".join(SCENARIOS)}')
+        weights.append((name, float(w or 1)))
+    return weights
+
+
+def run_load(port: int, accounts: list, mix: list, concurrency: int, duration: float, warmup: float) -> tuple:
+    names = [n for n, _ in mix]
+    weights = [w for _, w in mix]
+    results = []
+    lock = threading.Lock()
+    stop_at = time.monotonic() + warmup + duration
+    measure_from = time.monotonic() + warmup
+
+    def worker(idx: int):
+        rnd = random.Random(idx)
+        local = []
+        client = Client(port, accounts[idx % len(accounts)], local)
+        while time.monotonic() < stop_at:
+            mark = len(local)
+            getattr(client, rnd.choices(names, weights)[0])()
+            if time.monotonic() < measure_from:
+                del local[mark:]
+        with lock:
+            results.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, duration
+
+
+def _pct(sorted_vals: list, q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    # Nearest-rank percentile
+    k = max(0, min(len(sorted_vals) - 1, math.ceil(q * len(sorted_vals)) - 1))
+    return sorted_vals[k]
+
+
+def summarize(samples: list, elapsed: float) -> dict:
+    by_route = {}
+    for route, secs, ok in samples:
+        by_route.setdefault(route, []).append((secs, ok))
+    routes = {}
+    for route, vals in sorted(by_route.items()):
+        lat = sorted(v for v, _ in vals)
+        routes[route] = {
+            'count': len(vals),
+            'errors': sum(1 for _, ok in vals if not ok),
+            'rps': round(len(vals) / elapsed, 2),
+            'p50_ms': round(_pct(lat, 0.50) * 1000, 3),
+            'p95_ms': round(_pct(lat, 0.95) * 1000, 3),
+            'p99_ms': round(_pct(lat, 0.99) * 1000, 3),
+            'max_ms': round(lat[-1] * 1000, 3),
+        }
+    total = len(samples)
+    return {
+        'total': {
+            'requests': total,
+            'errors': sum(1 for _, _, ok in samples if not ok),
+            'rps': round(total / elapsed, 2) if elapsed else 0.0,
+        },
+        'routes': routes,
+    }
+
+
+_SAMPLE = re.compile(r'^(topcit_db_round_trips_total|topcit_http_requests_total)\{route="([^"]*)"[^}]*\} (\d+)$')
+
+
+def round_trip_report(port: int) -> dict:
+    """Database round trips per request by route, from the server's /metrics counters."""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    conn.request('GET', '/metrics')
+    text = conn.getresponse().read().decode('utf-8', 'replace')
+    conn.close()
+    trips, requests = {}, {}
+    for line in text.splitlines():
+        m = _SAMPLE.match(line)
+        if m:
+            target = trips if m.group(1) == 'topcit_db_round_trips_total' else requests
+            target[m.group(2)] = target.get(m.group(2), 0) + int(m.group(3))
+    return {route: round(n / requests[route], 2) for route, n in sorted(trips.items()) if requests.get(route)}
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> bool:
+    """Print p95/throughput deltas per route; returns True if any route regressed."""
+    regressed = False
+    for route, cur in current['routes'].items():
+        base = baseline.get('routes', {}).get(route)
+        if not base or not base.get('p95_ms'):
+            continue
+        delta = (cur['p95_ms'] - base['p95_ms']) / base['p95_ms']
+        rps_delta = (cur['rps'] - base['rps']) / base['rps'] if base.get('rps') else 0.0
+        flag = ''
+        if delta > threshold:
+            regressed = True
+            flag = '  REGRESSION'
+        print(f"{route:28s} p95 {base['p95_ms']:9.2f} -> {cur['p95_ms']:9.2f} ms ({delta:+.1%})"
+              f"  rps {rps_delta:+.1%}{flag}", file=sys.stderr)
+    for route, trips in current.get('round_trips', {}).items():
+        base = baseline.get('round_trips', {}).get(route)
+        if base is not None and base != trips:
+            print(f"{route:28s} round trips/request {base:6.2f} -> {trips:6.2f}", file=sys.stderr)
+    return regressed
+
+
+def run_backend(storage: str, args, mix: list, extra_env: dict) -> dict:
+    """Start server.py on `storage` (postgres or sqlite), seed it, drive the load and build the report."""
+    pg = None
+    server = None
+    tmp = None
+    try:
+        dsn = None
+        if storage == 'sqlite':
+            tmp = tempfile.mkdtemp(prefix='topcit-bench-sqlite-')
+            db_env = {'SQLITE_PATH': os.path.join(tmp, 'topcit.db')}
+        else:
+            dsn = args.dsn
+            if not dsn:
+                pg = LocalPostgres()
+                dsn = pg.start()
+            db_env = {'DATABASE_URL': dsn}
+        port = _free_port()
+        server = ServerProcess(db_env, port, extra_env, args.server_arg)
+        server.wait_ready()
+        if dsn:
+            accounts = seed(dsn, args.users, args.modules)
+        else:
+            accounts = seed_sqlite(db_env['SQLITE_PATH'], args.users, args.modules)
+        samples, elapsed = run_load(port, accounts, mix, args.concurrency, args.duration, args.warmup)
+        report = summarize(samples, elapsed)
+        report['round_trips'] = round_trip_report(port)
+        if dsn:
+            report['wallet_check'] = check_wallets(dsn, accounts)
+            if args.plan_iterations > 0:
+                report['planning'] = planning_report(dsn, accounts, args.plan_iterations, report['routes'])
+        report['config'] = {
+            'users': args.users, 'modules': args.modules, 'concurrency': args.concurrency,
+            'duration': args.duration, 'mix': dict(mix), 'server_env': extra_env,
+            'server_args': args.server_arg, 'storage': storage,
+            'database': 'sqlite' if not dsn else 'dsn' if args.dsn else 'initdb',
+        }
+        return report
+    finally:
+        if server:
+            server.stop()
+        if pg:
+            pg.stop()
+        if tmp:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--dsn', help='Use this database instead of a temporary initdb cluster')
+    ap.add_argument('--storage', choices=('postgres', 'sqlite', 'both'), default='postgres',
+                    help='Backend server.py runs on; both runs each and compares them')
+    ap.add_argument('--users', type=int, default=200)
+    ap.add_argument('--modules', type=int, default=20)
+    ap.add_argument('--concurrency', type=int, default=8)
+    ap.add_argument('--duration', type=float, default=20.0, help='Measured seconds')
+    ap.add_argument('--warmup', type=float, default=3.0, help='Unmeasured seconds before measuring')
+    ap.add_argument('--mix', default='page_load=7,quest=2,login=1', help='Weighted scenarios, e.g. page_load=7,quest=3')
+    ap.add_argument('--server-env', action='append', default=[], metavar='KEY=VALUE', help='Extra env for server.py')
+    ap.add_argument('--server-arg', action='append', default=[], help='Extra argument for server.py')
+    ap.add_argument('--out', help='Write the JSON report here')
+    ap.add_argument('--compare', help='Baseline JSON report to compare against')
+    ap.add_argument('--fail-threshold', type=float, default=0.25, help='p95 increase that counts as a regression')
+    ap.add_argument('--plan-iterations', type=int, default=200, help='EXPLAIN runs per hot statement (0 skips the planning report)')
+    args = ap.parse_args(argv)
+
+    mix = parse_mix(args.mix)
+    if args.storage != 'postgres' and any(name == 'redeem' for name, _ in mix):
+        raise SystemExit('the redeem scenario needs Postgres (the wallet is not part of the SQLite store)')
+    extra_env = dict(kv.split('=', 1) for kv in args.server_env)
+    storages = ('postgres', 'sqlite') if args.storage == 'both' else (args.storage,)
+    reports = {storage: run_backend(storage, args, mix, extra_env) for storage in storages}
+    report = reports[storages[0]] if len(storages) == 1 else {'backends': reports}
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as fh:
+            fh.write(text + '\n')
+    if len(storages) > 1:
+        print('sqlite vs postgres:', file=sys.stderr)
+        compare(reports['sqlite'], reports['postgres'], args.fail_threshold)
+    if not all(r.get('wallet_check', {'ok': True})['ok'] for r in reports.values()):
+        print('wallet ledger check failed', file=sys.stderr)
+        return 1
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as fh:
+            baseline = json.load(fh)
+        regressed = False
+        for storage, current in reports.items():
+            # A --storage both baseline is compared backend by backend
+            base = baseline.get('backends', {}).get(storage, baseline)
+            regressed = compare(current, base, args.fail_threshold) or regressed
+        if regressed:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
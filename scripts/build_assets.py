@@ -0,0 +1,379 @@
+"""Build docs/ for long-term caching: minify, fingerprint and rewrite references.
+
+docs/ stays the source tree. This writes a deployable copy (default dist/):
+
+  - script.js is cut into page bundles. Regions between `// #chunk <name>`
+    and `// #endchunk` lines only go into the bundles of the pages listed
+    for that chunk in CHUNKS (learn, rewards, leaderboards); every page
+    gets everything outside them. The admin page's code is its own file,
+    admin.js. A function defined in a chunk and used outside it fails the
+    build.
+  - The top-level .js and .css files are minified: comments and
+    indentation go, line breaks stay (so automatic semicolon insertion
+    behaves as in the source).
+  - Built files are named after their content, assets/<name>.<hash>.<ext>.
+    The <script src> and <link href> references in the pages and the url()
+    references in the stylesheets are rewritten to the new names.
+  - Everything else (pages, images, sw.js) is copied as is. Uploads are not
+    copied; server.py keeps serving them from docs/uploads.
+
+Serve the result with `STATIC_DIR=dist python server.py`. Files under
+/assets/ then go out with `Cache-Control: public, max-age=31536000,
+immutable`, and pages with `no-cache`. The service worker's manifest
+(lib/_offline.py) is built from the same directory.
+
+Examples:
+  python scripts/build_assets.py
+  python scripts/build_assets.py --out /srv/topcit/static
+  python scripts/build_assets.py --no-minify
+"""
+import argparse
+import hashlib
+import os
+import re
+import shutil
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lib import _offline  # noqa: E402
+
+# Chunk name -> pages whose bundle includes it
+CHUNKS = {
+    'learn': ('learn.html',),
+    # The dashboard has a store too
+    'rewards': ('index.html', 'rewards.html'),
+    'leaderboards': ('leaderboards.html',),
+}
+BUNDLED = 'script.js'
+# Keeps its name and scope; browsers look it up at /sw.js
+UNBUILT = ('sw.js',)
+ASSETS_DIR = 'assets'
+HASH_LENGTH = 10
+# Written into the output directory; it is only ever deleted when this is there
+MARKER = '.topcit-build'
+
+CHUNK_START = re.compile(r'^\s*// #chunk ([a-z][a-z0-9-]*)\s*$')
+CHUNK_END = re.compile(r'^\s*// #endchunk\s*$')
+FUNCTION_NAME = re.compile(r'\bfunction\s+([A-Za-z_$][\w$]*)')
+HTML_REF = re.compile(r'''(<(?:script|link)\b[^>]*?\b(?:src|href)=)(["'])([^"']+)\2''', re.I)
+CSS_URL = re.compile(r'''url\(\s*(["']?)([^"')]+)\1\s*\)''')
+
+
+# --- Chunks ---
+
+def split_chunks(source: str) -> list:
+    """[(chunk name or None, text), ...]; marker lines are dropped."""
+    segments, current, name = [], [], None
+    for number, line in enumerate(source.splitlines(keepends=True), 1):
+        start, end = CHUNK_START.match(line), CHUNK_END.match(line)
+        if start or end:
+            if start and name is not None:
+                raise SystemExit(f'{BUNDLED}:{number}: #chunk {start.group(1)} inside #chunk {name}')
+            if end and name is None:
+                raise SystemExit(f'{BUNDLED}:{number}: #endchunk without #chunk')
+            segments.append((name, ''.join(current)))
+            current, name = [], start.group(1) if start else None
+            continue
+        current.append(line)
+    if name is not None:
+        raise SystemExit(f'{BUNDLED}: #chunk {name} is never closed')
+    segments.append((None, ''.join(current)))
+    unknown = {n for n, _ in segments if n is not None} - set(CHUNKS)
+    if unknown:
+        raise SystemExit(f'{BUNDLED}: chunks not listed in CHUNKS: {", ".join(sorted(unknown))}')
+    return segments
+
+
+def bundle(segments: list, chunks: tuple) -> str:
+    text = ''.join(t for n, t in segments if n is None or n in chunks)
+    # Whatever a left-out chunk defines must not be needed by the rest
+    for name in set(CHUNKS) - set(chunks):
+        for fn in FUNCTION_NAME.findall(''.join(t for n, t in segments if n == name)):
+            if re.search(r'(?<![\w$])' + re.escape(fn) + r'(?![\w$])', text):
+                raise SystemExit(f'{BUNDLED}: {fn}() is defined in chunk {name!r} but used outside it')
+    return text
+
+
+def page_chunks(page: str) -> tuple:
+    return tuple(sorted(name for name, pages in CHUNKS.items() if page in pages))
+
+
+# --- Minifiers ---
+
+_WORD = re.compile(r'[\w$]')
+_IDENT = re.compile(r'[\w$]+')
+# After these (or at the start) a slash opens a regular expression, not a division
+_REGEX_AFTER = set('(,=:[!&|?{};+-*%<>~^')
+_REGEX_KEYWORDS = ('return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete', 'void', 'throw',
+                   'instanceof', 'yield', 'await')
+# A line break after these (or before a closing brace) never ends a statement
+_JOIN_AFTER = set('{(,;[')
+
+
+def minify_js(src: str) -> str:
+    """Drop comments and indentation; strings, templates and regex literals are copied verbatim."""
+    out = []
+    n = len(src)
+    i = 0
+    pending = ''            # '' / ' ' / '\n': whitespace or comments seen since the last token
+    last = ''               # last character written
+    word = ''               # identifier or keyword being written, for the regex rule
+    templates = []          # open ${ } depth for each template literal we are inside
+
+    def emit(text):
+        nonlocal pending, last, word
+        if pending and out:
+            first = text[0]
+            if pending == '\n' and last not in _JOIN_AFTER and first != '}':
+                out.append('\n')
+            elif _WORD.match(last) and (_WORD.match(first) or first == '.'):
+                # `return .5` must not become `return.5`
+                out.append(' ')
+            elif last in '+-' and first in '+-':
+                out.append(' ')
+        pending = ''
+        out.append(text)
+        last = text[-1]
+        word = text if _IDENT.fullmatch(text) else ''
+
+    def copy_quoted(start, quote):
+        j = start + 1
+        while j < n and src[j] != quote:
+            j += 2 if src[j] == '\\' else 1
+        return j + 1
+
+    def copy_template(start):
+        # From just after ` or } to the closing ` (returns j, True) or to ${ (returns j, False)
+        j = start
+        while j < n:
+            c = src[j]
+            if c == '\\':
+                j += 2
+            elif c == '`':
+                return j + 1, True
+            elif c == '$' and src.startswith('${', j):
+                return j + 2, False
+            else:
+                j += 1
+        return n, True
+
+    while i < n:
+        c = src[i]
+        if c in ' \t\r\n\f\v':
+            if c == '\n':
+                pending = '\n'
+            elif not pending:
+                pending = ' '
+            i += 1
+        elif src.startswith('//', i):
+            j = src.find('\n', i)
+            i = n if j < 0 else j
+            pending = pending or ' '
+        elif src.startswith('/*', i):
+            j = src.find('*/', i + 2)
+            j = n if j < 0 else j + 2
+            if '\n' in src[i:j]:
+                pending = '\n'
+            else:
+                pending = pending or ' '
+            i = j
+        elif c in '"\'':
+            j = copy_quoted(i, c)
+            emit(src[i:j])
+            i = j
+        elif c == '`':
+            j, closed = copy_template(i + 1)
+            emit(src[i:j])
+            if not closed:
+                templates.append(0)
+            i = j
+        elif c == '}' and templates and templates[-1] == 0:
+            templates.pop()
+            j, closed = copy_template(i + 1)
+            emit(src[i:j])
+            if not closed:
+                templates.append(0)
+            i = j
+        elif c == '/' and (not out or last in _REGEX_AFTER or word in _REGEX_KEYWORDS):
+            j, in_class = i + 1, False
+            while j < n and src[j] != '\n':
+                if src[j] == '\\':
+                    j += 2
+                    continue
+                if src[j] == '[':
+                    in_class = True
+                elif src[j] == ']':
+                    in_class = False
+                elif src[j] == '/' and not in_class:
+                    break
+                j += 1
+            emit(src[i:j + 1])
+            i = j + 1
+        else:
+            if templates:
+                if c == '{':
+                    templates[-1] += 1
+                elif c == '}':
+                    templates[-1] -= 1
+            m = _WORD.match(c)
+            if m:
+                j = i
+                while j < n and _WORD.match(src[j]):
+                    j += 1
+                emit(src[i:j])
+                i = j
+            else:
+                emit(c)
+                i += 1
+    return ''.join(out).strip() + '\n'
+
+
+_CSS_STRING = r'"(?:\\.|[^"\\])*"' + r"|'(?:\\.|[^'\\])*'"
+_CSS_COMMENT_OR_STRING = re.compile(r'/\*.*?\*/|' + _CSS_STRING, re.S)
+
+
+def minify_css(src: str) -> str:
+    """Drop comments and collapse whitespace around braces, semicolons, colons and commas."""
+    # One left-to-right pass, so quotes inside comments and comment marks inside strings are left alone
+    src = _CSS_COMMENT_OR_STRING.sub(lambda m: m.group(0) if m.group(0)[0] in '"\'' else ' ', src)
+    parts = re.split('(' + _CSS_STRING + ')', src)
+    for k in range(0, len(parts), 2):
+        code = re.sub(r'\s+', ' ', parts[k])
+        code = re.sub(r'\s*([{};,>])\s*', r'\1', code)
+        parts[k] = re.sub(r':\s+', ':', code)
+    text = re.sub(r';+}', '}', ''.join(parts))
+    return text.strip() + '\n'
+
+
+# --- Build ---
+
+def _hashed(name: str, data: bytes) -> str:
+    stem, ext = os.path.splitext(name)
+    return f'{ASSETS_DIR}/{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}'
+
+
+def _local(ref: str):
+    """A reference to a top-level file of the site, or None for anything else."""
+    if '://' in ref or ref.startswith(('//', 'data:', '#')):
+        return None
+    ref = ref.split('?', 1)[0].split('#', 1)[0]
+    return ref[2:] if ref.startswith('./') else ref.lstrip('/')
+
+
+def _prepare(out: str):
+    if os.path.exists(out):
+        if os.listdir(out) and not os.path.exists(os.path.join(out, MARKER)):
+            raise SystemExit(f'{out} exists and was not written by this script; refusing to replace it')
+        shutil.rmtree(out)
+    os.makedirs(os.path.join(out, ASSETS_DIR))
+    with open(os.path.join(out, MARKER), 'w') as f:
+        f.write('Generated by scripts/build_assets.py; replaced on every build.\n')
+
+
+def build(src: str, out: str, minify: bool = True) -> dict:
+    """Write the site to `out`; returns {source name: [built names]}."""
+    src, out = os.path.abspath(src), os.path.abspath(out)
+    if out == src or out.startswith(src + os.sep):
+        raise SystemExit('--out must be outside the source directory')
+    _prepare(out)
+    sources = sorted(f for f in os.listdir(src) if f.endswith(('.js', '.css')) and f not in UNBUILT
+                     and os.path.isfile(os.path.join(src, f)))
+    pages = sorted(f for f in os.listdir(src) if f.endswith('.html'))
+    built = {}      # source name (or script.js bundle key) -> built name
+    report = {}
+
+    def write(name: str, text: str) -> str:
+        data = text.encode('utf-8')
+        target = _hashed(name, data)
+        with open(os.path.join(out, target), 'wb') as f:
+            f.write(data)
+        return target
+
+    def read(name: str) -> str:
+        with open(os.path.join(src, name), encoding='utf-8') as f:
+            return f.read()
+
+    # Stylesheets: the ones others @import are written first
+    styles = [s for s in sources if s.endswith('.css')]
+    texts = {s: read(s) for s in styles}
+    while styles:
+        ready = [s for s in styles if not any(_local(u) in styles and _local(u) != s
+                                              for _, u in CSS_URL.findall(texts[s]))]
+        if not ready:
+            raise SystemExit(f'circular @import between {", ".join(styles)}')
+        for name in ready:
+            def rewrite_url(m, name=name):
+                ref = _local(m.group(2))
+                if ref is None:
+                    return m.group(0)
+                if ref in built:
+                    return f'url({m.group(1)}{os.path.basename(built[ref])}{m.group(1)})'
+                # Built files live one level down, in assets/
+                return f'url({m.group(1)}../{ref}{m.group(1)})'
+            text = CSS_URL.sub(rewrite_url, texts[name])
+            built[name] = write(name, minify_css(text) if minify else text)
+            report[name] = [built[name]]
+            styles.remove(name)
+
+    # Scripts: one bundle per chunk set for script.js, one file for the others
+    bundles = {}
+    for name in (s for s in sources if s.endswith('.js')):
+        if name != BUNDLED:
+            text = read(name)
+            built[name] = write(name, minify_js(text) if minify else text)
+            report[name] = [built[name]]
+            continue
+        segments = split_chunks(read(name))
+        for chunks in sorted({page_chunks(p) for p in pages}):
+            text = bundle(segments, chunks)
+            stem = '.'.join(('script',) + chunks)
+            bundles[chunks] = write(stem + '.js', minify_js(text) if minify else text)
+        report[name] = sorted(bundles.values())
+
+    # Pages: point at the built files
+    for page in pages:
+        def rewrite_ref(m, page=page):
+            ref = _local(m.group(3))
+            if ref == BUNDLED and bundles:
+                return f'{m.group(1)}{m.group(2)}{bundles[page_chunks(page)]}{m.group(2)}'
+            if ref in built:
+                return f'{m.group(1)}{m.group(2)}{built[ref]}{m.group(2)}'
+            return m.group(0)
+        with open(os.path.join(out, page), 'w', encoding='utf-8') as f:
+            f.write(HTML_REF.sub(rewrite_ref, read(page)))
+
+    # The rest of the shell, unchanged
+    for dirpath, dirnames, filenames in os.walk(src):
+        if dirpath == src:
+            dirnames[:] = [d for d in dirnames if d not in _offline.ASSET_SKIP_DIRS]
+        for name in filenames:
+            rel = os.path.relpath(os.path.join(dirpath, name), src)
+            if dirpath == src and (name in sources or name in pages):
+                continue
+            if not name.lower().endswith(_offline.ASSET_EXTENSIONS):
+                continue
+            os.makedirs(os.path.join(out, os.path.dirname(rel)), exist_ok=True)
+            shutil.copy2(os.path.join(src, rel), os.path.join(out, rel))
+    return report
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--src', default=os.path.join(ROOT, 'docs'), help='Source directory (default: docs/)')
+    ap.add_argument('--out', default=os.path.join(ROOT, 'dist'), help='Output directory (default: dist/)')
+    ap.add_argument('--no-minify', action='store_true', help='Fingerprint and split only')
+    args = ap.parse_args(argv)
+
+    report = build(args.src, args.out, minify=not args.no_minify)
+    for source, targets in report.items():
+        before = os.path.getsize(os.path.join(args.src, source))
+        for target in targets:
+            after = os.path.getsize(os.path.join(args.out, target))
+            print(f'{source:18s} {before:8d} -> {after:8d}  {target}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
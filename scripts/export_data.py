@@ -0,0 +1,158 @@
+"""Export users and activity to gzip'd NDJSON or CSV files, incrementally.
+
+Each dataset is read in (created_at, id) order through a server-side cursor
+(lib/_export.py), so memory use does not grow with the table. Every batch is
+appended to the output file as its own gzip member (concatenated members are
+one valid .gz file) and then checkpointed in the state file: the byte offset
+reached and the (created_at, id) of the last row written.
+
+  - Incremental: the next run exports only rows after the dataset's
+    watermark from the previous completed run, into a new file.
+  - Resumable: if a run is interrupted, the next run truncates the
+    unfinished file back to its last checkpoint and carries on from there.
+
+Point --dsn at the read replica (DATABASE_READ_URL) to keep the export off
+the primary. A JSON summary per dataset is printed.
+
+Examples:
+  python scripts/export_data.py --out exports
+  python scripts/export_data.py activity --format csv --out exports
+  python scripts/export_data.py users --full --out exports/snapshot
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lib import _export
+
+
+def _with_sslmode(url: str) -> str:
+    # Same default as server.py: Neon requires SSL
+    if not url or 'sslmode=' in url:
+        return url
+    return url + ('&' if '?' in url else '?') + 'sslmode=require'
+
+
+def load_state(path: str) -> dict:
+    try:
+        with open(path, encoding='utf-8') as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(path: str, state: dict):
+    # Write-then-rename so a crash never leaves a half-written state file
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as fh:
+        json.dump(state, fh, indent=2)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+
+
+def export_dataset(conn, dataset: str, args, state: dict) -> dict:
+    """Run or resume one dataset's export; updates and saves `state` after every batch."""
+    entry = state.setdefault(dataset, {})
+    current = entry.get('current')
+    if current and current['format'] != args.format:
+        raise SystemExit(f'{dataset}: an unfinished {current["format"]} export exists; rerun with --format {current["format"]}')
+    resumed = bool(current)
+    if current and not os.path.exists(current['file']):
+        # The partial file is gone; redo this run from where it started
+        current.update(after=current['start'], offset=0, rows=0)
+    if not current:
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        path = os.path.join(args.out, f'{dataset}-{stamp}.{args.format}.gz')
+        n = 1
+        while os.path.exists(path):
+            n += 1
+            path = os.path.join(args.out, f'{dataset}-{stamp}-{n}.{args.format}.gz')
+        start = None if args.full else entry.get('watermark')
+        current = {
+            'file': path,
+            'format': args.format,
+            'start': start,
+            'after': start,
+            'offset': 0,
+            'rows': 0,
+        }
+        entry['current'] = current
+        save_state(args.state, state)
+
+    started = time.perf_counter()
+    rows_before = current['rows']
+    with open(current['file'], 'r+b' if current['offset'] else 'wb') as fh:
+        # Anything past the last checkpoint is a partial member from the interrupted run
+        fh.truncate(current['offset'])
+        fh.seek(current['offset'])
+        after = tuple(current['after']) if current['after'] else None
+        for data, mark, n in _export.batches(conn, dataset, args.format, after,
+                                             header=current['offset'] == 0, batch_size=args.batch_size):
+            fh.write(gzip.compress(data, compresslevel=6))
+            fh.flush()
+            os.fsync(fh.fileno())
+            current.update(offset=fh.tell(), after=list(mark), rows=current['rows'] + n)
+            save_state(args.state, state)
+            print(f'{dataset}: {current["rows"]} rows', file=sys.stderr)
+
+    entry.pop('current')
+    if current['rows']:
+        entry['watermark'] = current['after']
+        entry['last_file'] = current['file']
+    else:
+        os.remove(current['file'])
+    save_state(args.state, state)
+    elapsed = time.perf_counter() - started
+    exported = current['rows'] - rows_before
+    return {
+        'dataset': dataset,
+        'file': current['file'] if current['rows'] else None,
+        'rows': current['rows'],
+        'resumed': resumed,
+        'watermark': _export.format_watermark(entry.get('watermark')),
+        'seconds': round(elapsed, 2),
+        'rows_per_second': round(exported / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('datasets', nargs='*', help=f"Any of {', '.join(_export.DATASETS)} (default: all)")
+    ap.add_argument('--dsn', default=os.environ.get('DATABASE_READ_URL') or os.environ.get('DATABASE_URL', ''),
+                    help='Defaults to DATABASE_READ_URL, then DATABASE_URL')
+    ap.add_argument('--out', default='exports', help='Output directory')
+    ap.add_argument('--format', choices=_export.FORMATS, default='ndjson')
+    ap.add_argument('--state', help='Watermark/checkpoint file (default: <out>/export-state.json)')
+    ap.add_argument('--full', action='store_true', help='Ignore the watermark and export everything')
+    ap.add_argument('--batch-size', type=int, default=_export.EXPORT_BATCH, help='Rows per cursor fetch and gzip member')
+    args = ap.parse_args(argv)
+
+    unknown = [d for d in args.datasets if d not in _export.DATASETS]
+    if unknown:
+        raise SystemExit(f"Unknown dataset(s): {', '.join(unknown)}")
+    if not args.dsn:
+        raise SystemExit('Set DATABASE_URL or pass --dsn')
+    os.makedirs(args.out, exist_ok=True)
+    args.state = args.state or os.path.join(args.out, 'export-state.json')
+    state = load_state(args.state)
+
+    import psycopg2
+    conn = psycopg2.connect(_with_sslmode(args.dsn))
+    try:
+        report = [export_dataset(conn, dataset, args, state) for dataset in (args.datasets or list(_export.DATASETS))]
+    finally:
+        conn.close()
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
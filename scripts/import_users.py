@@ -0,0 +1,271 @@
+"""Bulk-create user accounts from a CSV file.
+
+The CSV needs a header row with `username` and `email`, plus `name` (optional)
+and either `password` or `password_hash` (an existing bcrypt hash, kept as is).
+Rows are validated first. Passwords are then hashed in a process pool, and
+each batch is loaded with COPY into a temporary staging table and merged into
+`users` with a single INSERT ... ON CONFLICT DO NOTHING. Rows that collide
+with existing accounts are reported, not updated. In the same transaction a
+verification email per new account is queued in `email_outbox`; server.py's
+outbox thread sends them. Pass --verified to mark the accounts verified
+instead.
+
+Hashing dominates: bcrypt at the default cost 12 takes roughly a quarter of a
+second per row per core, so throughput is about --workers / 0.25 rows per
+second. Use a lower --rounds for very large cohorts; logins verify any cost.
+
+A JSON summary (counts and rows/s) is printed; per-row errors go to --errors.
+
+Examples:
+  python scripts/import_users.py cohort.csv --base-url https://topcit.example.com
+  python scripts/import_users.py cohort.csv --verified --workers 16 --errors rejected.csv
+  python scripts/import_users.py cohort.csv --rounds 10 --dsn postgresql://localhost/topcit?sslmode=disable
+"""
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import secrets
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import bcrypt
+except Exception:
+    bcrypt = None
+
+
+SUBJECT = 'Your Topcit Quest account is ready'
+TEXT_BODY = (
+    'An account has been created for you on Topcit Quest (username: {username}).\n\n'
+    'Verify your email to sign in: {link}\n'
+)
+HTML_BODY = (
+    '<p>An account has been created for you on Topcit Quest (username: <b>{username}</b>).</p>'
+    "<p><a href='{link}'>Verify your email to sign in</a></p>"
+)
+
+DDL_STAGING = """
+CREATE TEMP TABLE IF NOT EXISTS import_staging (
+    line_no INTEGER NOT NULL,
+    id TEXT NOT NULL,
+    username TEXT NOT NULL,
+    email TEXT NOT NULL,
+    name TEXT NOT NULL,
+    password_hash TEXT NOT NULL,
+    verification_token TEXT NOT NULL
+) ON COMMIT DELETE ROWS
+"""
+
+# One statement per batch: insert what does not collide, queue mail for what
+# was inserted, and explain the collisions (EXISTS sees users as of before the insert)
+SQL_MERGE = """
+WITH ins AS (
+    INSERT INTO users(id, username, email, name, password_hash, email_verified, email_verification_token)
+    SELECT id, username, email, name, password_hash, %(verified)s,
+           CASE WHEN %(verified)s THEN NULL ELSE verification_token END
+    FROM import_staging ORDER BY line_no
+    ON CONFLICT DO NOTHING
+    RETURNING id, username, email, email_verification_token
+), mail AS (
+    INSERT INTO email_outbox(kind, to_email, subject, text_body, html_body)
+    SELECT 'verify_email', ins.email, %(subject)s,
+           replace(replace(%(text)s, '{username}', ins.username), '{link}', %(verify_url)s || ins.email_verification_token),
+           replace(replace(%(html)s, '{username}',
+                   replace(replace(replace(ins.username, '&', '&amp;'), '<', '&lt;'), '>', '&gt;')),
+                   '{link}', %(verify_url)s || ins.email_verification_token)
+    FROM ins WHERE %(send)s AND ins.email_verification_token IS NOT NULL
+    RETURNING 1
+)
+SELECT
+    (SELECT COUNT(*) FROM ins),
+    (SELECT COUNT(*) FROM mail),
+    COALESCE((
+        SELECT json_agg(json_build_array(
+            s.line_no,
+            EXISTS (SELECT 1 FROM users u WHERE u.email = s.email),
+            EXISTS (SELECT 1 FROM users u WHERE u.username = s.username)
+        ) ORDER BY s.line_no)
+        FROM import_staging s WHERE NOT EXISTS (SELECT 1 FROM ins WHERE ins.id = s.id)
+    ), '[]'::json)
+"""
+
+
+def _with_sslmode(url: str) -> str:
+    # Same default as server.py: Neon requires SSL
+    if not url or 'sslmode=' in url:
+        return url
+    return url + ('&' if '?' in url else '?') + 'sslmode=require'
+
+
+def hash_one(job: tuple) -> str:
+    """(password, rounds) -> stored hash, matching server.py's hash_password()."""
+    password, rounds = job
+    if bcrypt:
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+    return hashlib.sha256(password.encode('utf-8')).hexdigest()
+
+
+def read_rows(path: str):
+    """Yield (line_no, row dict) with lower-cased, trimmed header names."""
+    with open(path, newline='', encoding='utf-8-sig') as fh:
+        reader = csv.reader(fh)
+        header = [h.strip().lower() for h in next(reader, [])]
+        for row in reader:
+            if not any(cell.strip() for cell in row):
+                continue
+            yield reader.line_num, dict(zip(header, (cell.strip() for cell in row)))
+
+
+def validate(rows) -> tuple:
+    """Split rows into (accepted, errors); duplicates within the file are errors."""
+    accepted, errors = [], []
+    seen_email, seen_username = {}, {}
+    for line_no, row in rows:
+        username = row.get('username', '')
+        email = row.get('email', '')
+        password = row.get('password', '')
+        password_hash = row.get('password_hash', '')
+        error = None
+        if not username or not email:
+            error = 'username and email are required'
+        elif '@' not in email:
+            error = 'invalid email'
+        elif not password and not password_hash:
+            error = 'password or password_hash is required'
+        elif password_hash and not password_hash.startswith('$2'):
+            error = 'password_hash must be a bcrypt hash'
+        elif email.lower() in seen_email:
+            error = f'duplicate email (line {seen_email[email.lower()]})'
+        elif username.lower() in seen_username:
+            error = f'duplicate username (line {seen_username[username.lower()]})'
+        if error:
+            errors.append((line_no, username, email, error))
+            continue
+        seen_email[email.lower()] = line_no
+        seen_username[username.lower()] = line_no
+        accepted.append({
+            'line_no': line_no, 'username': username, 'email': email,
+            'name': row.get('name', ''), 'password': password, 'password_hash': password_hash,
+        })
+    return accepted, errors
+
+
+def _hashes(pool, accepted: list, rounds: int):
+    """Yield one stored hash per accepted row, in order; hashing runs ahead in the pool."""
+    jobs = [(r['password'], rounds) for r in accepted if not r['password_hash']]
+    computed = pool.map(hash_one, jobs, chunksize=32) if jobs else iter(())
+    for r in accepted:
+        yield r['password_hash'] or next(computed)
+
+
+def load_batch(cur, batch: list, opts: dict) -> tuple:
+    """COPY one batch into staging and merge it; returns (inserted, queued, conflicts)."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for r in batch:
+        writer.writerow((r['line_no'], str(uuid.uuid4()), r['username'], r['email'], r['name'],
+                         r['hash'], secrets.token_urlsafe(32)))
+    buf.seek(0)
+    cur.copy_expert('COPY import_staging FROM STDIN WITH (FORMAT csv)', buf)
+    cur.execute(SQL_MERGE, opts)
+    return cur.fetchone()
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('csv', help='CSV file with username, email, name, password or password_hash')
+    ap.add_argument('--dsn', default=os.environ.get('DATABASE_URL', ''), help='Defaults to DATABASE_URL')
+    ap.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='Hashing processes')
+    ap.add_argument('--rounds', type=int, default=12, help='bcrypt cost (server default 12)')
+    ap.add_argument('--batch-size', type=int, default=5000, help='Rows per COPY + merge transaction')
+    ap.add_argument('--verified', action='store_true', help='Mark accounts verified; no emails are queued')
+    ap.add_argument('--no-email', action='store_true', help='Do not queue verification emails')
+    ap.add_argument('--base-url', default=os.environ.get('PUBLIC_BASE_URL', ''),
+                    help='Site URL used in verification links (defaults to PUBLIC_BASE_URL)')
+    ap.add_argument('--errors', help='Write rejected rows here as CSV (line, username, email, error)')
+    args = ap.parse_args(argv)
+
+    if not args.dsn:
+        raise SystemExit('Set DATABASE_URL or pass --dsn')
+    send = not args.verified and not args.no_email
+    if send and not args.base_url:
+        raise SystemExit('Pass --base-url (or set PUBLIC_BASE_URL) for verification links, or use --no-email')
+
+    import psycopg2
+    sys.path.insert(0, ROOT)
+    from lib._outbox import ensure_outbox_schema
+
+    started = time.perf_counter()
+    accepted, errors = validate(read_rows(args.csv))
+    rows_read = len(accepted) + len(errors)
+    opts = {
+        'verified': args.verified, 'send': send, 'subject': SUBJECT, 'text': TEXT_BODY, 'html': HTML_BODY,
+        'verify_url': args.base_url.rstrip('/') + '/verify.html?token=',
+    }
+    by_line = {r['line_no']: r for r in accepted}
+    inserted = queued = 0
+    load_seconds = 0.0
+
+    conn = psycopg2.connect(_with_sslmode(args.dsn))
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                ensure_outbox_schema(cur)
+                cur.execute(DDL_STAGING)
+        with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+            hashes = _hashes(pool, accepted, args.rounds)
+            for start in range(0, len(accepted), args.batch_size):
+                batch = accepted[start:start + args.batch_size]
+                for r in batch:
+                    r['hash'] = next(hashes)
+                t0 = time.perf_counter()
+                with conn:
+                    with conn.cursor() as cur:
+                        n_ins, n_mail, conflicts = load_batch(cur, batch, opts)
+                load_seconds += time.perf_counter() - t0
+                inserted += n_ins
+                queued += n_mail
+                for line_no, email_taken, username_taken in conflicts:
+                    r = by_line[line_no]
+                    reason = 'email already exists' if email_taken else (
+                        'username already exists' if username_taken else 'conflicts with a concurrent insert')
+                    errors.append((line_no, r['username'], r['email'], reason))
+                done = start + len(batch)
+                rate = done / (time.perf_counter() - started)
+                print(f'{done}/{len(accepted)} rows, {inserted} created, {rate:.0f} rows/s', file=sys.stderr)
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - started
+    errors.sort()
+    if args.errors:
+        with open(args.errors, 'w', newline='', encoding='utf-8') as fh:
+            writer = csv.writer(fh)
+            writer.writerow(('line', 'username', 'email', 'error'))
+            writer.writerows(errors)
+    report = {
+        'rows_read': rows_read,
+        'created': inserted,
+        'rejected': len(errors),
+        'emails_queued': queued,
+        'seconds': round(elapsed, 2),
+        'load_seconds': round(load_seconds, 2),
+        'rows_per_second': round(rows_read / elapsed, 1) if elapsed else 0.0,
+        'config': {'workers': args.workers, 'rounds': args.rounds, 'batch_size': args.batch_size,
+                   'verified': args.verified, 'emails': send},
+    }
+    if errors and not args.errors:
+        report['errors_sample'] = [dict(zip(('line', 'username', 'email', 'error'), e)) for e in errors[:20]]
+    print(json.dumps(report, indent=2))
+    return 0 if not errors else 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,140 @@
+"""Check that every rate-limited route admits exactly its configured budget.
+
+Starts server.py on a temporary SQLite file and, for each policy in
+lib/_ratelimit.py, sends as many requests as the policy allows followed by
+one more: the first ones must get through, the last one must get 429 with a
+Retry-After. IP policies use a new identity per request and identity
+policies a new client address per request (X-Forwarded-For, with
+RATE_LIMIT_TRUST_PROXY on), so each budget is measured on its own. Each
+check prints ok/FAIL; the exit status is 1 if any failed.
+
+Examples:
+  python scripts/ratelimit_check.py
+  python scripts/ratelimit_check.py --only login:ip
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lib import _ratelimit  # noqa: E402
+
+# route -> (method, path) as server.py dispatches it
+ROUTES = {
+    'login': ('POST', '/api/users/login'),
+    'register': ('POST', '/api/users/register'),
+    'verify_start': ('POST', '/api/users/verify/start'),
+    'reset_start': ('PUT', '/api/users/reset/start'),
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _body(route: str, identity: str) -> dict:
+    if route == 'login':
+        return {'identity': identity, 'password': 'wrong-password'}
+    if route == 'register':
+        name = identity.split('@', 1)[0]
+        return {'username': name, 'email': identity, 'name': 'Check', 'password': 'check-password'}
+    return {'identity': identity}
+
+
+def _send(port: int, method: str, path: str, body: dict, ip: str) -> tuple:
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        conn.request(method, path, json.dumps(body), {'Content-Type': 'application/json', 'X-Forwarded-For': ip})
+        resp = conn.getresponse()
+        resp.read()
+        return resp.status, resp.getheader('Retry-After')
+    finally:
+        conn.close()
+
+
+def check_policy(port: int, policy: str):
+    route, kind = policy.split(':', 1)
+    capacity, _window = _ratelimit.POLICIES[policy]
+    run = uuid.uuid4().hex[:8]
+    fixed_ip = f'10.{int(run[:2], 16)}.{int(run[2:4], 16)}.{int(run[4:6], 16)}'
+    fixed_identity = f'rl_{run}@example.test'
+    for n in range(capacity + 1):
+        if kind == 'ip':
+            ip, identity = fixed_ip, f'rl_{run}_{n}@example.test'
+        else:
+            ip, identity = f'10.255.{n // 250}.{n % 250 + 1}', fixed_identity
+        status, retry_after = _send(port, *ROUTES[route], _body(route, identity), ip)
+        if n < capacity:
+            assert status != 429, f'attempt {n + 1} of {capacity} was limited'
+        else:
+            assert status == 429, f'attempt {capacity + 1} got {status}, expected 429'
+            assert retry_after and int(retry_after) >= 1, f'bad Retry-After: {retry_after!r}'
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--only', choices=sorted(_ratelimit.POLICIES), help='Check one policy')
+    args = ap.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix='topcit-ratelimit-check-')
+    port = _free_port()
+    env = dict(os.environ)
+    env.update({
+        'DATABASE_URL': '',
+        'SQLITE_PATH': os.path.join(tmp, 'topcit.db'),
+        'PORT': str(port),
+        'RATE_LIMIT_ENABLED': 'true',
+        'RATE_LIMIT_BACKEND': 'memory',
+        'RATE_LIMIT_TRUST_PROXY': 'true',
+        'ACCESS_LOG_PATH': os.path.join(tmp, 'access.log'),
+        'DOTENV_PATH': os.devnull,
+    })
+    log = open(os.path.join(tmp, 'server.log'), 'wb')
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server.py')],
+                            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=log)
+    failed = 0
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            if proc.poll() is not None or time.monotonic() > deadline:
+                with open(log.name, 'rb') as f:
+                    raise SystemExit('server.py did not start:\n' + f.read().decode('utf-8', 'replace'))
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.2)
+        for policy in sorted(_ratelimit.POLICIES):
+            if args.only and policy != args.only:
+                continue
+            try:
+                check_policy(port, policy)
+                print(f'{policy:24s} ok')
+            except AssertionError as e:
+                failed += 1
+                print(f'{policy:24s} FAIL  {e}')
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        log.close()
+        shutil.rmtree(tmp, ignore_errors=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
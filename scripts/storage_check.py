@@ -0,0 +1,314 @@
+"""Run one conformance suite against every storage backend (lib/_storage.py).
+
+SQLite always runs, on a temporary file. Postgres runs when a DSN is given
+(--dsn or DATABASE_URL): tables are created with lib/_schema.py, and every
+check works on freshly generated users (and puts the published modules
+back), so pointing it at a shared database only adds rows. Each check prints ok/FAIL; the exit status is 1 if any failed.
+
+Examples:
+  python scripts/storage_check.py
+  python scripts/storage_check.py --dsn postgresql://localhost/topcit?sslmode=disable
+  python scripts/storage_check.py --only sqlite
+"""
+import argparse
+import hashlib
+import os
+import secrets
+import shutil
+import sys
+import tempfile
+import threading
+import traceback
+import uuid
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _hash(password: str) -> str:
+    return hashlib.sha256(password.encode('utf-8')).hexdigest()
+
+
+def _checker(password: str):
+    return lambda stored: stored == _hash(password)
+
+
+def _new_user(store, verified: bool = True, password: str = 'pw') -> dict:
+    tag = uuid.uuid4().hex[:12]
+    user = store.create_user(str(uuid.uuid4()), f'check_{tag}', f'check_{tag}@example.test', 'Check', _hash(password))
+    if verified:
+        token = secrets.token_urlsafe(16)
+        assert store.set_verification_token(user['email'], token)
+        assert store.verify_email(token) == user['id']
+        user['email_verified'] = True
+    return user
+
+
+def _login(store, user: dict, password: str = 'pw'):
+    return store.login(user['username'], _checker(password), secrets.token_hex(32))
+
+
+def check_modules(store):
+    previous = store.load_modules()
+    mods = [{'id': f'check-{uuid.uuid4().hex[:8]}', 'title': 'Check', 'content': {'quiz': {'correctIndex': 1}}}]
+    try:
+        assert store.save_modules(mods)
+        assert store.load_modules() == mods
+        assert store.save_modules(mods + [{'id': 'second'}])
+        assert store.load_modules() == mods + [{'id': 'second'}]
+    finally:
+        if previous is not None:
+            store.save_modules(previous)
+
+
+def check_register(store):
+    user = _new_user(store, verified=False)
+    assert user['xp_total'] == 0 and user['wallet'] == 0
+    assert user['email_verified'] is False and user['is_admin'] is False
+    for username, email, field in ((user['username'], 'other@example.test', 'username'),
+                                   ('other_' + uuid.uuid4().hex[:8], user['email'], 'email')):
+        try:
+            store.create_user(str(uuid.uuid4()), username, email, 'Dup', _hash('pw'))
+        except Exception as e:
+            assert getattr(e, 'field', None) == field, f'expected a Conflict on {field}, got {e!r}'
+        else:
+            raise AssertionError(f'duplicate {field} was accepted')
+
+
+def check_verification(store):
+    user = _new_user(store, verified=False)
+    assert not store.set_verification_token('nobody-' + uuid.uuid4().hex + '@example.test', 'x')
+    assert store.verify_email('no-such-token') is None
+    profile, token = _login(store, user)
+    assert profile and profile['id'] == user['id'] and token is None, 'unverified users get no session'
+    token = secrets.token_urlsafe(16)
+    assert store.set_verification_token(user['email'], token)
+    assert store.verify_email(token) == user['id']
+    assert store.verify_email(token) is None, 'verification tokens are single use'
+
+
+def check_login(store):
+    user = _new_user(store)
+    assert _login(store, user, 'wrong') == (None, None)
+    assert store.login('nobody_' + uuid.uuid4().hex[:8], _checker('pw'), 'x') == (None, None)
+    profile, token = _login(store, user)
+    assert profile['id'] == user['id'] and token
+    profile, token = store.login(user['email'], _checker('pw'), secrets.token_hex(32))
+    assert token, 'login by email'
+
+
+def check_sessions(store):
+    user = _new_user(store)
+    _, token = _login(store, user)
+    row = store.session_row(token)
+    assert row is not None and len(row) == 11 and row[0] == user['id']
+    assert bool(row[8]) and not bool(row[9]) and row[10] == 0
+    row = store.session_row(token, bootstrap=True)
+    assert row is not None and len(row) == 12 and int(row[11]) >= 1
+    assert store.session_row('no-such-session') is None
+
+
+def _entry(xp: int, coins: int = 0) -> dict:
+    return {'title': 'Check', 'xp': xp, 'coins': coins}
+
+
+def check_progress(store):
+    user = _new_user(store)
+    _, token = _login(store, user)
+    assert store.progress(user['id']) == {'xp_total': 0, 'level_idx': 0, 'xp_in_level': 0, 'wallet': 0}
+    award = store.award_completion(user['id'], f'check-{uuid.uuid4().hex[:8]}', _entry(250, 30))
+    assert (award['xp'], award['coins']) == (250, 30)
+    # Rank 1 needs 20 XP and rank 2 another 220
+    assert (award['xp_total'], award['level_idx'], award['xp_in_level']) == (250, 2, 10)
+    row = store.session_row(token)
+    assert (row[4], row[5], row[6]) == (250, 2, 10)
+    progress = store.progress(user['id'])
+    assert (progress['xp_total'], progress['level_idx'], progress['xp_in_level']) == (250, 2, 10)
+    assert store.progress(str(uuid.uuid4())) is None
+
+
+def check_awards(store):
+    user = _new_user(store)
+    course = f'check-{uuid.uuid4().hex[:8]}'
+    first = store.award_completion(user['id'], course, _entry(60, 100))
+    assert first['xp_total'] == 60
+    # A second completion of the same course pays nothing
+    assert store.award_completion(user['id'], course, _entry(60, 100)) is None
+    second = store.award_completion(user['id'], course + '-2', _entry(40, 0))
+    assert second['xp_total'] == 100 and second['wallet'] == first['wallet']
+    assert store.progress(user['id'])['xp_total'] == 100
+    logged = [a for a in store.recent_activity(user['id']) if a['event_type'] == 'course_completed']
+    assert len(logged) == 2
+    assert store.award_completion(str(uuid.uuid4()), course, _entry(60, 100)) is None
+
+
+def check_rank_coins(store):
+    from lib import _ranks
+    user = _new_user(store)
+    # 250 XP leaves ranks 1 and 2; each rank-up pays once on top of the course coins
+    award = store.award_completion(user['id'], f'check-{uuid.uuid4().hex[:8]}', _entry(250, 30))
+    assert award['wallet'] == 30 + _ranks.rank_up_coins(0) + _ranks.rank_up_coins(1)
+    # What a progress push answers with, and what the page then stores
+    assert store.progress(user['id'])['wallet'] == award['wallet']
+    again = store.award_completion(user['id'], f'check-{uuid.uuid4().hex[:8]}', _entry(10, 0))
+    assert again['level_idx'] == 2 and again['wallet'] == award['wallet']
+
+
+def check_reset(store):
+    user = _new_user(store)
+    _, token = _login(store, user)
+    expired = secrets.token_urlsafe(16)
+    assert store.set_reset_token(user['email'], expired, datetime.utcnow() - timedelta(minutes=1))
+    assert store.reset_password(expired, _hash('new')) is None, 'expired reset tokens are refused'
+    reset = secrets.token_urlsafe(16)
+    assert store.set_reset_token(user['email'], reset, datetime.utcnow() + timedelta(hours=1))
+    assert store.reset_password(reset, _hash('new')) == user['id']
+    assert store.reset_password(reset, _hash('again')) is None, 'reset tokens are single use'
+    assert store.session_row(token) is None, 'a reset revokes existing sessions'
+    assert _login(store, user, 'pw') == (None, None)
+    assert _login(store, user, 'new')[1]
+
+
+def check_login_race(store):
+    # A reset landing between the password check and the session insert issues no session
+    user = _new_user(store)
+    reset = secrets.token_urlsafe(16)
+    assert store.set_reset_token(user['email'], reset, datetime.utcnow() + timedelta(hours=1))
+
+    def check_then_reset(stored):
+        ok = stored == _hash('pw')
+        assert store.reset_password(reset, _hash('new')) == user['id']
+        return ok
+
+    profile, token = store.login(user['username'], check_then_reset, secrets.token_hex(32))
+    assert profile is not None and token is None
+
+
+def check_activity(store):
+    user = _new_user(store)
+    ids = [str(uuid.uuid4()) for _ in range(3)]
+    store.log_activity(ids[0], user['id'], 'course-1', 'course_completed', 60, 100, {'score': 3})
+    store.log_activity(ids[1], user['id'], None, 'quiz_attempt', 0, 0)
+    store.log_activity(ids[2], user['id'], '', 'course_completed', 10, 0, [1, 2])
+    entries = {e['id']: e for e in store.recent_activity(user['id'])}
+    assert set(entries) == set(ids)
+    assert entries[ids[0]]['metadata'] == {'score': 3} and entries[ids[0]]['coins_awarded'] == 100
+    assert entries[ids[1]]['metadata'] is None and entries[ids[1]]['course_id'] is None
+    assert entries[ids[2]]['course_id'] is None and entries[ids[2]]['metadata'] == [1, 2]
+    assert len(store.recent_activity(user['id'], limit=2)) == 2
+    assert store.recent_activity(str(uuid.uuid4())) == []
+    # Offline batches: retried ids are skipped
+    batch = [(str(uuid.uuid4()), 'course-2', 'quiz_attempt', 5, 0, None), (ids[0], 'course-1', 'course_completed', 60, 100, None)]
+    assert store.log_activities(user['id'], batch) == 1
+    assert store.log_activities(user['id'], batch) == 0
+    assert len(store.recent_activity(user['id'])) == 4
+
+
+def check_course_sync(store):
+    user = _new_user(store)
+    first = store.sync_courses(user['id'], 0, [('c-1', 'ongoing'), ('c-2', 'completed')])
+    assert first['token'] == 1 and first['changes'] == [] and not first['full'], 'own changes are not echoed'
+    # Another device: starts from zero, sends an older status for c-2
+    other = store.sync_courses(user['id'], 0, [('c-2', 'ongoing'), ('c-3', 'ongoing')])
+    assert other['token'] == 2
+    assert {(c['course_id'], c['status']) for c in other['changes']} == {('c-1', 'ongoing'), ('c-2', 'completed')}
+    # The first device only gets what happened after its token
+    delta = store.sync_courses(user['id'], 1, [])
+    assert [(c['course_id'], c['status'], c['version']) for c in delta['changes']] == [('c-3', 'ongoing', 2)]
+    assert store.sync_courses(user['id'], 2, []) == {'token': 2, 'changes': [], 'full': False}
+    # Statuses never go backwards, and a no-op sync does not move the counter
+    assert store.sync_courses(user['id'], 2, [('c-1', 'ongoing')])['token'] == 2
+    assert store.sync_courses(user['id'], 2, [('c-1', 'completed')]) == {'token': 3, 'changes': [], 'full': False}
+    ahead = store.sync_courses(user['id'], 99, [])
+    assert ahead['full'] and ahead['token'] == 3 and len(ahead['changes']) == 3
+    assert store.sync_courses(str(uuid.uuid4()), 0, []) is None
+    assert store.sync_courses(str(uuid.uuid4()), 0, [('c-1', 'ongoing')]) is None
+
+
+def check_concurrent_writes(store):
+    users = [_new_user(store, verified=False) for _ in range(8)]
+    errors = []
+
+    def push(i):
+        try:
+            user = users[i % len(users)]
+            for n in range(10):
+                assert store.award_completion(user['id'], f'concurrent-{i}-{n}', _entry(1))['xp'] == 1
+                store.log_activity(str(uuid.uuid4()), user['id'], None, 'concurrent', 1, 0)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=push, args=(i,)) for i in range(32)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors, errors[0]
+    assert sum(len(store.recent_activity(u['id'], limit=1000)) for u in users) == 32 * 10 * 2
+    assert sum(store.progress(u['id'])['xp_total'] for u in users) == 32 * 10
+
+
+CHECKS = (check_modules, check_register, check_verification, check_login, check_sessions, check_progress,
+          check_awards, check_rank_coins, check_reset, check_login_race, check_activity, check_course_sync, check_concurrent_writes)
+
+
+def run(name: str, store) -> int:
+    failed = 0
+    for check in CHECKS:
+        try:
+            check(store)
+            print(f'{name:9s} {check.__name__[6:]:20s} ok')
+        except Exception:
+            failed += 1
+            print(f'{name:9s} {check.__name__[6:]:20s} FAIL')
+            traceback.print_exc()
+    return failed
+
+
+def sqlite_store():
+    from lib import _sqlite
+    tmp = tempfile.mkdtemp(prefix='topcit-storage-check-')
+    store = _sqlite.SqliteStore(os.path.join(tmp, 'topcit.db'))
+    store.init_schema()
+    return store, lambda: (store.close(), shutil.rmtree(tmp, ignore_errors=True))
+
+
+def postgres_store(dsn: str):
+    os.environ['DATABASE_URL'] = dsn
+    from lib import _schema
+    from lib import _storage
+    from lib import _utils
+    if not _schema.ensure_schema():
+        raise SystemExit('could not create the Postgres schema; check the DSN')
+    return _storage.PostgresStore(_utils.db_connect), lambda: None
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--dsn', default=os.environ.get('DATABASE_URL'), help='Postgres to check (default: DATABASE_URL)')
+    ap.add_argument('--only', choices=('sqlite', 'postgres'), help='Check one backend')
+    args = ap.parse_args(argv)
+
+    backends = []
+    if args.only != 'postgres':
+        backends.append(('sqlite', sqlite_store))
+    if args.only != 'sqlite':
+        if args.dsn:
+            backends.append(('postgres', lambda: postgres_store(args.dsn)))
+        elif args.only == 'postgres':
+            raise SystemExit('--only postgres needs --dsn or DATABASE_URL')
+        else:
+            print('postgres  skipped (no --dsn or DATABASE_URL)')
+    failed = 0
+    for name, make in backends:
+        store, cleanup = make()
+        try:
+            failed += run(name, store)
+        finally:
+            cleanup()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
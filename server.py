@@ -20,6 +20,11 @@ from email.mime.multipart import MIMEMultipart
 import time
 from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
 import re
+import socket
+import sys
+import threading
+import itertools
+from urllib.parse import urlsplit, parse_qs, unquote
 from datetime import datetime, timedelta
 import uuid
 import hashlib
@@ -29,6 +34,35 @@ try:
 except Exception:
     bcrypt = None
 
+from lib import _ratelimit
+from lib import _metrics
+from lib._metrics import MetricsMixin
+from lib import _accesslog
+from lib._accesslog import log_event
+from lib import _profiler
+from lib import _grading
+from lib import _wallet
+from lib import _notify
+from lib import _outbox
+from lib import _analytics
+from lib import _bootstrap
+from lib import _export
+from lib import _pubsub
+from lib import _invalidation
+from lib import _dbroute
+from lib import _pool
+from lib import _prepared
+from lib import _stream
+from lib import _prefork
+from lib import _warmup
+from lib import _breaker
+from lib import _deadline
+from lib import _storage
+from lib import _sqlite
+from lib import _courses
+from lib import _offline
+from lib import _ranks
+
 # Optional Postgres driver (Neon)
 DB_ENABLED = False
 
@@ -39,22 +73,52 @@ SMTP_USER = os.environ.get('SMTP_USER')
 SMTP_PASS = os.environ.get('SMTP_PASS')
 SMTP_FROM = os.environ.get('SMTP_FROM') or SMTP_USER
 SMTP_USE_SSL = os.environ.get('SMTP_USE_SSL', 'false').lower() in ('1', 'true', 'yes')
+# Socket timeout for SMTP; inside a request it is also capped by the request deadline
+SMTP_TIMEOUT = float(os.environ.get('SMTP_TIMEOUT', '10'))
+
+# Optional bearer token required to scrape /metrics
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '').strip()
+
+def encode_json(payload) -> bytes:
+    with _metrics.phase('serialize'):
+        return json.dumps(payload).encode('utf-8')
+
+def hash_password(password: str) -> str:
+    # Prefer bcrypt when available
+    with _metrics.phase('hash'):
+        if bcrypt:
+            return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        return hashlib.sha256(password.encode('utf-8')).hexdigest()
+
+def check_password(password: str, stored: str) -> bool:
+    try:
+        with _metrics.phase('hash'):
+            if bcrypt and stored:
+                return bcrypt.checkpw(password.encode('utf-8'), stored.encode('utf-8'))
+            return stored == hashlib.sha256(password.encode('utf-8')).hexdigest()
+    except Exception:
+        return False
 
 def send_email(to_email: str, subject: str, text_body: str, html_body: str) -> bool:
     if not (SMTP_HOST and SMTP_USER and SMTP_PASS and SMTP_FROM):
         return False
+    with _metrics.phase('email'):
+        return _smtp_send(to_email, subject, text_body, html_body)
+
+def _smtp_send(to_email: str, subject: str, text_body: str, html_body: str) -> bool:
     msg = MIMEMultipart('alternative')
     msg['Subject'] = subject
     msg['From'] = SMTP_FROM
     msg['To'] = to_email
     msg.attach(MIMEText(text_body, 'plain'))
     msg.attach(MIMEText(html_body, 'html'))
+    timeout = _deadline.timeout(SMTP_TIMEOUT)
     if SMTP_USE_SSL:
-        with smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT) as s:
+        with smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=timeout) as s:
             s.login(SMTP_USER, SMTP_PASS)
             s.sendmail(SMTP_FROM, [to_email], msg.as_string())
     else:
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as s:
+        with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=timeout) as s:
             s.ehlo()
             try:
                 s.starttls()
@@ -65,42 +129,117 @@ def send_email(to_email: str, subject: str, text_body: str, html_body: str) -> b
             s.sendmail(SMTP_FROM, [to_email], msg.as_string())
     return True
 DB_URL = os.environ.get('DATABASE_URL', '').strip()
+# Optional read replica for read-only hot paths (see lib/_dbroute.py)
+DB_READ_URL = os.environ.get('DATABASE_READ_URL', '').strip()
 conn_params = None
+read_conn_params = None
+TimedCursor = None
+
+def _require_ssl(url: str) -> str:
+    # Neon requires SSL; append sslmode=require if not present
+    if 'sslmode=' in url:
+        return url
+    return url + ('&' if '?' in url else '?') + 'sslmode=require'
+
 try:
     import psycopg2  # psycopg2-binary
+    import psycopg2.extensions
+    TimedCursor = _metrics.timed_cursor_class(psycopg2.extensions.cursor)
+    CountedConnection = _metrics.counted_connection_class(psycopg2.extensions.connection)
     if DB_URL:
-        # Neon requires SSL; append sslmode=require if not present
-        if 'sslmode=' not in DB_URL:
-            if '?' in DB_URL:
-                DB_URL = DB_URL + '&sslmode=require'
-            else:
-                DB_URL = DB_URL + '?sslmode=require'
+        DB_URL = _require_ssl(DB_URL)
         conn_params = DB_URL
         DB_ENABLED = True
+        if DB_READ_URL:
+            read_conn_params = _require_ssl(DB_READ_URL)
 except Exception as _:
     DB_ENABLED = False
 
 DOCS_DIR = os.path.join(os.getcwd(), 'docs')
+# A build of docs/ from scripts/build_assets.py (fingerprinted, minified); uploads stay in docs/
+STATIC_DIR = os.path.abspath(os.environ.get('STATIC_DIR') or DOCS_DIR)
 UPLOAD_DIR = os.path.join(DOCS_DIR, 'uploads')
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-def db_connect():
-    if not DB_ENABLED:
+# Fails connects fast while the primary is unreachable (lib/_breaker.py)
+DB_BREAKER = _breaker.CircuitBreaker('primary')
+
+def _close_quietly(conn):
+    # A session that connected but failed its setup (statement_timeout, read-only)
+    if conn is not None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+def db_connect_direct():
+    """A new, unpooled session (the LISTEN bridge keeps one for its lifetime)."""
+    if not DB_ENABLED or not DB_BREAKER.allow():
         return None
+    conn = None
+    try:
+        conn = psycopg2.connect(conn_params, connection_factory=CountedConnection, cursor_factory=TimedCursor,
+                                **_breaker.connect_options())
+        _breaker.apply_statement_timeout(conn)
+    except Exception as e:
+        _close_quietly(conn)
+        DB_BREAKER.record(False)
+        log_event('db', 'Connection failed', error=str(e))
+        return None
+    DB_BREAKER.record(True)
+    return conn
+
+def _connect_replica_direct():
+    # No breaker here: the router already skips a failing replica for REPLICA_RETRY seconds
+    conn = None
     try:
-        return psycopg2.connect(conn_params)
+        conn = psycopg2.connect(read_conn_params, connection_factory=CountedConnection, cursor_factory=TimedCursor,
+                                **_breaker.connect_options())
+        _breaker.apply_statement_timeout(conn)
+        conn.set_session(readonly=True)
+        return conn
     except Exception as e:
-        print(f"[DB] Connection failed: {e}")
+        _close_quietly(conn)
+        log_event('db', 'Replica connection failed', error=str(e))
         return None
 
+# DB_POOL_SIZE=0 goes back to one connection per call
+_primary_pool = _pool.Pool(db_connect_direct, name='primary') if _pool.DB_POOL_SIZE > 0 else None
+_replica_pool = _pool.Pool(_connect_replica_direct, name='replica') if _pool.DB_POOL_SIZE > 0 and read_conn_params else None
+
+def db_connect():
+    if not DB_ENABLED:
+        return None
+    with _metrics.phase('connect'):
+        return _primary_pool.get() if _primary_pool else db_connect_direct()
+
+def db_connect_replica():
+    with _metrics.phase('connect'):
+        return _replica_pool.get() if _replica_pool else _connect_replica_direct()
+
+# Read-only hot paths go through DB_ROUTER.connect_read(key)
+DB_ROUTER = _dbroute.Router(db_connect, db_connect_replica if read_conn_params else None).track_writes()
+
+# Users, sessions, the module store and activity logs (lib/_storage.py):
+# Postgres with DATABASE_URL, otherwise an embedded SQLite file with SQLITE_PATH
+if DB_ENABLED:
+    STORE = _storage.PostgresStore(db_connect, DB_ROUTER)
+elif _sqlite.SQLITE_PATH:
+    STORE = _sqlite.SqliteStore(_sqlite.SQLITE_PATH)
+else:
+    STORE = None
+
 def db_init():
+    if STORE and STORE.kind == 'sqlite':
+        STORE.init_schema()
+        return True
     if not DB_ENABLED:
-        print("[DB] DATABASE_URL not set; API will use localStorage fallback.")
+        log_event('db', 'DATABASE_URL not set; API will use localStorage fallback.')
         return False
     conn = db_connect()
     if not conn:
-        print("[DB] Could not connect; API will use localStorage fallback.")
+        log_event('db', 'Could not connect; API will use localStorage fallback.')
         return False
     try:
         with conn:
@@ -176,63 +315,147 @@ def db_init():
                     )
                     """
                 )
-        print("[DB] Initialized module_store table.")
-        print("[DB] Initialized users, sessions, and activity_logs tables.")
+                # Server-graded completions are awarded at most once per user/module
+                cur.execute(_grading.DDL_GRADED_ONCE)
+                # Wallet ledger and reward catalog
+                _wallet.ensure_wallet_schema(cur)
+                # Notification feed and unread counters
+                _notify.ensure_notify_schema(cur)
+                # Queued mail (bulk imports)
+                _outbox.ensure_outbox_schema(cur)
+                # Keyset order for streaming exports
+                _export.ensure_export_schema(cur)
+                # Admin analytics views
+                _analytics.ensure_analytics_schema(cur)
+                # Per-user course state and sync counters
+                _courses.ensure_courses_schema(cur)
+                # Shared rate-limit buckets (RATE_LIMIT_BACKEND=postgres)
+                cur.execute(_ratelimit.DDL_RATE_LIMITS)
+                # Pooled sessions here and on other instances re-prepare their statements
+                _prepared.schema_changed(cur)
+        log_event('db', 'Initialized module_store, users, sessions, activity_logs, wallet_ledger, rewards, notifications, email_outbox, user_courses and rate_limits tables.')
         return True
     finally:
         conn.close()
 
-def db_upsert_modules(mods):
+def db_upsert_modules(mods, added=()):
     """Store entire modules array under a single key for simplicity."""
-    if not DB_ENABLED:
-        return False
-    conn = db_connect()
-    if not conn:
-        return False
-    try:
-        with conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    INSERT INTO module_store(id, data, updated_at)
-                    VALUES (%s, %s::jsonb, NOW())
-                    ON CONFLICT (id)
-                    DO UPDATE SET data = EXCLUDED.data, updated_at = NOW()
-                    """,
-                    ('custom_modules', json.dumps(mods))
-                )
-        return True
-    except Exception as e:
-        print(f"[DB] Upsert failed: {e}")
-        return False
-    finally:
-        conn.close()
+    return STORE.save_modules(mods, added) if STORE else False
 
 def db_fetch_modules():
-    if not DB_ENABLED:
-        return None
-    conn = db_connect()
-    if not conn:
-        return None
-    try:
-        with conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT data FROM module_store WHERE id = %s", ('custom_modules',))
-                row = cur.fetchone()
-                if row and row[0] is not None:
-                    # row[0] may be a dict already depending on driver setup
-                    return row[0] if isinstance(row[0], (list, dict)) else json.loads(row[0])
-        return None
-    except Exception as e:
-        print(f"[DB] Fetch failed: {e}")
-        return None
-    finally:
-        conn.close()
+    return STORE.load_modules() if STORE else None
+
+# ---- Module catalog cache (answers indexed server-side, stripped from GET) ----
+CATALOG_TTL = float(os.environ.get('CATALOG_TTL', '30'))
+_catalog = None
+_catalog_loaded_at = 0.0
+_catalog_lock = threading.Lock()
+
+def get_catalog(force=False):
+    """Return the cached Catalog, reloading from module_store once it is older than CATALOG_TTL."""
+    global _catalog, _catalog_loaded_at
+    cat = _catalog
+    if cat is not None and not force and time.monotonic() - _catalog_loaded_at < CATALOG_TTL:
+        return cat
+    with _catalog_lock:
+        if _catalog is not None and not force and time.monotonic() - _catalog_loaded_at < CATALOG_TTL:
+            return _catalog
+        mods = db_fetch_modules()
+        if mods is None and _catalog is not None:
+            # Keep serving the last good catalog if the DB hiccups
+            _catalog_loaded_at = time.monotonic()
+            return _catalog
+        _catalog = _grading.Catalog(mods)
+        _catalog_loaded_at = time.monotonic()
+        return _catalog
+
+def set_catalog(mods):
+    """Rebuild the catalog and answer index after an admin publish."""
+    global _catalog, _catalog_loaded_at
+    with _catalog_lock:
+        _catalog = _grading.Catalog(mods)
+        _catalog_loaded_at = time.monotonic()
+    return _catalog
+
+def _expire_catalog(_arg):
+    # Another instance published; keep serving the old catalog until the next get reloads it
+    global _catalog_loaded_at
+    _catalog_loaded_at = 0.0
+
+_invalidation.on(_invalidation.MODULES_CHANGED, _expire_catalog)
+
+# Session token -> user row, dropped on user_changed / session_revoked
+_profiles = _invalidation.ProfileCache()
+
+# Content hashes of the static shell for the service worker (lib/_offline.py)
+_asset_manifest = None
+
+def get_asset_manifest():
+    """Encoded /asset-manifest.json; built once per process, the files don't change while it runs."""
+    global _asset_manifest
+    if _asset_manifest is None:
+        _asset_manifest = encode_json(_offline.build_manifest(STATIC_DIR))
+    return _asset_manifest
+
+class UploadHandler(MetricsMixin, SimpleHTTPRequestHandler):
+    _request_id = None
+    _log_user_id = None
+    _resp_bytes = None
+    _static_cache = None
 
-class UploadHandler(SimpleHTTPRequestHandler):
     def __init__(self, *args, **kwargs):
-        # Serve files out of the docs directory
-        super().__init__(*args, directory=DOCS_DIR, **kwargs)
+        # Serve files out of the docs directory (or its build)
+        super().__init__(*args, directory=STATIC_DIR, **kwargs)
+
+    def translate_path(self, path):
+        if STATIC_DIR != os.path.abspath(DOCS_DIR) and path.startswith('/uploads/'):
+            # Builds don't carry uploads; they are written to docs/uploads
+            name = os.path.basename(unquote(path.split('?', 1)[0].split('#', 1)[0]))
+            if name not in ('', '.', '..'):
+                return os.path.join(UPLOAD_DIR, name)
+        return super().translate_path(path)
+
+    # ---- Access logging ----
+    def parse_request(self):
+        self._request_id = None
+        self._log_user_id = None
+        self._resp_bytes = None
+        self._static_cache = None
+        ok = super().parse_request()
+        if ok:
+            self._request_id = _accesslog.new_request_id(self.headers.get('X-Request-ID'))
+        return ok
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'content-length':
+            try:
+                self._resp_bytes = int(value)
+            except (TypeError, ValueError):
+                pass
+        super().send_header(keyword, value)
+
+    def send_error(self, code, message=None, explain=None):
+        if code >= 500 and _deadline.expired():
+            # The failure came from running out of the route's budget (lib/_deadline.py)
+            code, message = 504, 'Request timed out'
+        super().send_error(code, message, explain)
+
+    def end_headers(self):
+        if self._request_id:
+            super().send_header('X-Request-ID', self._request_id)
+        if DB_ENABLED and DB_BREAKER.degraded:
+            # Answers are coming from caches; writes are being refused
+            super().send_header('X-Degraded', 'database')
+        if self._static_cache:
+            super().send_header('Cache-Control', self._static_cache)
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        # Replaced by the structured access log written in request_finished()
+        pass
+
+    def request_finished(self, ctx):
+        _accesslog.log_access(ctx, self._request_id, self._log_user_id, self._resp_bytes, self.client_address[0])
 
     # ---- Auth helpers ----
     def _get_bearer_token(self):
@@ -245,46 +468,97 @@ class UploadHandler(SimpleHTTPRequestHandler):
             pass
         return ''
 
-    def _get_user_by_token(self):
-        if not DB_ENABLED:
+    def _get_user_by_token(self, token=None):
+        if not STORE:
             return None
-        token = self._get_bearer_token()
+        token = token or self._get_bearer_token()
         if not token:
             return None
-        conn = db_connect()
-        if not conn:
-            return None
-        try:
-            with conn:
-                with conn.cursor() as cur:
-                    cur.execute(
-                        """
-                        SELECT u.id, u.username, u.email, u.name, u.xp_total, u.level_idx, u.xp_in_level, u.wallet, u.email_verified, u.is_admin
-                        FROM sessions s
-                        JOIN users u ON s.user_id = u.id
-                        WHERE s.token = %s AND s.revoked = FALSE AND s.expires_at > NOW()
-                        """,
-                        (token,)
-                    )
-                    row = cur.fetchone()
-                    if row:
-                        return {
-                            'id': row[0], 'username': row[1], 'email': row[2], 'name': row[3],
-                            'xp_total': row[4], 'level_idx': row[5], 'xp_in_level': row[6], 'wallet': row[7],
-                            'email_verified': bool(row[8]), 'is_admin': bool(row[9])
-                        }
-        except Exception:
+        cached = _profiles.get(token)
+        if cached is not None:
+            self._log_user_id = cached['id']
+            return cached
+        gen = _profiles.generation()
+        row = STORE.session_row(token)
+        if not row:
+            return self._degraded_user(token)
+        self._log_user_id = row[0]
+        user = _bootstrap.user_from_row(row)
+        _profiles.put(token, user, gen)
+        return user
+
+    def _degraded_user(self, token):
+        # While the primary is down, a session seen recently keeps reading its cached profile
+        if not DB_BREAKER.degraded:
             return None
-        finally:
-            conn.close()
-        return None
+        user = _profiles.get(token, stale=_invalidation.USER_CACHE_STALE)
+        if user is not None:
+            self._log_user_id = user['id']
+        return user
+
+    def _rate_limited(self, route, identity=''):
+        # Checked before any hashing or DB work so bursts stay cheap to reject.
+        # Routes check the IP first and the identity once the body is parsed;
+        # the second call must not take another IP token.
+        ip = '' if identity else _ratelimit.client_ip(self)
+        retry_after = _ratelimit.check(route, ip=ip, identity=identity)
+        if not retry_after:
+            return False
+        data = encode_json({ 'ok': False, 'error': 'Too many requests. Please try again later.' })
+        self.send_response(429)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Retry-After', str(retry_after))
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        return True
+
+    def _send_stream(self, chunks, headers):
+        """Send a 200 whose body is produced by `chunks`: chunked for HTTP/1.1 clients, read-to-close otherwise."""
+        chunked = self.request_version == 'HTTP/1.1'
+        if chunked:
+            # Transfer-Encoding needs a 1.1 status line; this handler instance only
+            self.protocol_version = 'HTTP/1.1'
+        self.send_response(200)
+        for name, value in headers:
+            self.send_header(name, value)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        for chunk in chunks:
+            if not chunk:
+                continue
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk) if chunked else chunk)
+        if chunked:
+            self.wfile.write(b'0\r\n\r\n')
 
     def do_POST(self):
+        # --- Admin analytics: refresh the views now ---
+        if self.path == '/api/admin/stats/refresh':
+            if not DB_ENABLED:
+                self.send_error(503, 'Database not available')
+                return
+            user = self._get_user_by_token()
+            if not user or not user.get('is_admin'):
+                self.send_error(403, 'Admin authorization required')
+                return
+            data = encode_json({ 'ok': True, 'refreshed': _analytics.refresh(db_connect) })
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
         # --- Users: Register ---
         if self.path == '/api/users/register':
-            if not DB_ENABLED:
+            if not STORE:
                 self.send_error(503, 'Database not available')
                 return
+            if self._rate_limited('register'):
+                return
             try:
                 length = int(self.headers.get('Content-Length', '0'))
                 raw = self.rfile.read(length)
@@ -298,64 +572,32 @@ class UploadHandler(SimpleHTTPRequestHandler):
             except Exception as e:
                 self.send_error(400, f'Invalid JSON: {e}')
                 return
+            if self._rate_limited('register', email) or self._rate_limited('register', username):
+                return
 
-            # Hash password (prefer bcrypt when available)
-            if bcrypt:
-                pwd_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-            else:
-                pwd_hash = hashlib.sha256(password.encode('utf-8')).hexdigest()
+            pwd_hash = hash_password(password)
             user_id = str(uuid.uuid4())
             ok = False
             err_msg = None
-            conn = db_connect()
-            if not conn:
+            user_payload = None
+            try:
+                user_payload = STORE.create_user(user_id, username, email, name, pwd_hash)
+                ok = True
+            except _storage.Unavailable:
                 self.send_error(503, 'Database connection failed')
                 return
-            try:
-                with conn:
-                    with conn.cursor() as cur:
-                        cur.execute(
-                            """
-                            INSERT INTO users(id, username, email, name, password_hash)
-                            VALUES (%s, %s, %s, %s, %s)
-                            """,
-                            (user_id, username, email, name, pwd_hash)
-                        )
-                        ok = True
-            except Exception as e:
-                # Simplify error messaging for duplicate keys
-                msg = str(e)
+            except _storage.Conflict as e:
                 # Prefer concise, user-friendly messages
-                if 'users_email_key' in msg or ('duplicate key value' in msg and '(email)=' in msg):
+                if e.field == 'email':
                     err_msg = 'Email Already Exists'
-                elif 'users_username_key' in msg or ('duplicate key value' in msg and '(username)=' in msg):
+                elif e.field == 'username':
                     err_msg = 'Username Already Exists'
                 else:
                     err_msg = 'Registration failed'
-                ok = False
-            finally:
-                conn.close()
-
-            user_payload = None
-            if ok:
-                # Load minimal profile for client
-                conn3 = db_connect()
-                if conn3:
-                    try:
-                        with conn3:
-                            with conn3.cursor() as cur3:
-                                cur3.execute("SELECT id, username, email, name, xp_total, level_idx, xp_in_level, wallet, email_verified, is_admin FROM users WHERE id = %s", (user_id,))
-                                r = cur3.fetchone()
-                                if r:
-                                    user_payload = {
-                                        'id': r[0], 'username': r[1], 'email': r[2], 'name': r[3],
-                                        'xp_total': r[4], 'level_idx': r[5], 'xp_in_level': r[6], 'wallet': r[7],
-                                        'email_verified': bool(r[8]), 'is_admin': bool(r[9])
-                                    }
-                    finally:
-                        conn3.close()
+            except Exception:
+                err_msg = 'Registration failed'
             resp = { 'ok': ok, 'error': err_msg, 'user': user_payload }
-            data = json.dumps(resp).encode('utf-8')
+            data = encode_json(resp)
             self.send_response(200 if ok else 409)
             self.send_header('Content-Type', 'application/json')
             self.send_header('Content-Length', str(len(data)))
@@ -365,9 +607,11 @@ class UploadHandler(SimpleHTTPRequestHandler):
 
         # --- Users: Email verification start (POST) ---
         if self.path == '/api/users/verify/start':
-            if not DB_ENABLED:
+            if not STORE:
                 self.send_error(503, 'Database not available')
                 return
+            if self._rate_limited('verify_start'):
+                return
             try:
                 length = int(self.headers.get('Content-Length', '0'))
                 raw = self.rfile.read(length)
@@ -378,19 +622,14 @@ class UploadHandler(SimpleHTTPRequestHandler):
             except Exception as e:
                 self.send_error(400, f'Invalid JSON: {e}')
                 return
+            if self._rate_limited('verify_start', identity):
+                return
             token = secrets.token_urlsafe(32)
-            conn = db_connect()
-            if not conn:
+            try:
+                ok = STORE.set_verification_token(identity, token)
+            except _storage.Unavailable:
                 self.send_error(503, 'Database connection failed')
                 return
-            ok = False
-            try:
-                with conn:
-                    with conn.cursor() as cur:
-                        cur.execute("UPDATE users SET email_verification_token = %s WHERE email = %s", (token, identity))
-                        ok = cur.rowcount > 0
-            finally:
-                conn.close()
 
             email_sent = False
             send_error = None
@@ -418,7 +657,7 @@ class UploadHandler(SimpleHTTPRequestHandler):
             body = { 'ok': ok, 'token': token if ok else None, 'email_sent': email_sent }
             if send_error:
                 body['email_error'] = send_error
-            data = json.dumps(body).encode('utf-8')
+            data = encode_json(body)
             self.send_response(200 if ok else 404)
             self.send_header('Content-Type', 'application/json')
             self.send_header('Content-Length', str(len(data)))
@@ -426,11 +665,85 @@ class UploadHandler(SimpleHTTPRequestHandler):
             self.wfile.write(data)
             return
 
+        # --- Users: Activity log create; the page POSTs, the handler lives with the PUT routes ---
+        if self.path == '/api/users/activity':
+            return self.do_PUT()
+
+        # --- Users: Writes queued offline by the service worker (Authorization required) ---
+        if self.path == '/api/users/batch':
+            if not STORE:
+                self.send_error(503, 'Database not available')
+                return
+            try:
+                length = int(self.headers.get('Content-Length', '0'))
+                raw = self.rfile.read(length)
+                activities, progress = _offline.parse_batch(json.loads(raw.decode('utf-8') or '{}'))
+            except Exception as e:
+                self.send_error(400, f'Invalid JSON: {e}')
+                return
+            user = self._get_user_by_token()
+            if not user:
+                self.send_error(401, 'Unauthorized')
+                return
+            try:
+                # All queued activity in one transaction; retried ids are skipped.
+                # Queued progress is answered with the server's, as PUT /api/users/progress is
+                logged = STORE.log_activities(user['id'], activities) if activities else 0
+                current = STORE.progress(user['id']) if progress else None
+            except _storage.Unavailable:
+                self.send_error(503, 'Database connection failed')
+                return
+            data = encode_json({ 'ok': True, 'activity': logged, 'wallet': current['wallet'] if current else None,
+                                 'progress': current })
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        # --- Users: Course sync (Authorization required) ---
+        if self.path == '/api/users/sync':
+            if not STORE:
+                self.send_error(503, 'Database not available')
+                return
+            try:
+                length = int(self.headers.get('Content-Length', '0'))
+                raw = self.rfile.read(length)
+                since, changes = _courses.parse_changes(json.loads(raw.decode('utf-8') or '{}'))
+            except Exception as e:
+                self.send_error(400, f'Invalid JSON: {e}')
+                return
+            user = self._get_user_by_token()
+            if not user:
+                self.send_error(401, 'Unauthorized')
+                return
+            try:
+                # Upload and download in one round trip: the client's changes
+                # go in, everything newer than its token comes back
+                body = STORE.sync_courses(user['id'], since, changes)
+            except _storage.Unavailable:
+                self.send_error(503, 'Database connection failed')
+                return
+            if body is None:
+                self.send_error(404, 'User not found')
+                return
+            data = encode_json(body)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Cache-Control', 'no-store')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
         # --- Users: Login ---
         if self.path == '/api/users/login':
-            if not DB_ENABLED:
+            if not STORE:
                 self.send_error(503, 'Database not available')
                 return
+            if self._rate_limited('login'):
+                return
             try:
                 length = int(self.headers.get('Content-Length', '0'))
                 raw = self.rfile.read(length)
@@ -442,46 +755,18 @@ class UploadHandler(SimpleHTTPRequestHandler):
             except Exception as e:
                 self.send_error(400, f'Invalid JSON: {e}')
                 return
+            if self._rate_limited('login', identity):
+                return
 
-            pwd_hash = hashlib.sha256(password.encode('utf-8')).hexdigest()
-            conn = db_connect()
-            if not conn:
+            try:
+                user, token = STORE.login(identity, lambda stored: check_password(password, stored), secrets.token_hex(32))
+            except _storage.Unavailable:
                 self.send_error(503, 'Database connection failed')
                 return
-            user = None
-            try:
-                with conn:
-                    with conn.cursor() as cur:
-                        # Decide whether identity is email or username
-                        is_email = '@' in identity
-                        if is_email:
-                            cur.execute("SELECT id, username, email, name, xp_total, level_idx, xp_in_level, wallet, email_verified, is_admin, password_hash FROM users WHERE email = %s", (identity,))
-                        else:
-                            cur.execute("SELECT id, username, email, name, xp_total, level_idx, xp_in_level, wallet, email_verified, is_admin, password_hash FROM users WHERE username = %s", (identity,))
-                        row = cur.fetchone()
-                        if row:
-                            # Verify password
-                            stored = row[10] or ''
-                            ok = False
-                            try:
-                                if bcrypt and stored:
-                                    ok = bcrypt.checkpw(password.encode('utf-8'), stored.encode('utf-8'))
-                                else:
-                                    ok = (stored == hashlib.sha256(password.encode('utf-8')).hexdigest())
-                            except Exception:
-                                ok = False
-                            if ok:
-                                user = {
-                                    'id': row[0], 'username': row[1], 'email': row[2], 'name': row[3],
-                                    'xp_total': row[4], 'level_idx': row[5], 'xp_in_level': row[6], 'wallet': row[7],
-                                    'email_verified': bool(row[8]), 'is_admin': bool(row[9])
-                                }
-            finally:
-                conn.close()
 
             if not user:
                 payload = { 'ok': False, 'error': 'Invalid credentials' }
-                data = json.dumps(payload).encode('utf-8')
+                data = encode_json(payload)
                 self.send_response(401)
                 self.send_header('Content-Type', 'application/json')
                 self.send_header('Content-Length', str(len(data)))
@@ -492,7 +777,7 @@ class UploadHandler(SimpleHTTPRequestHandler):
             # Enforce verified email before issuing session
             if not user.get('email_verified'):
                 payload = { 'ok': False, 'error': 'Email not verified. Please check your inbox.', 'needs_verification': True }
-                data = json.dumps(payload).encode('utf-8')
+                data = encode_json(payload)
                 self.send_response(403)
                 self.send_header('Content-Type', 'application/json')
                 self.send_header('Content-Length', str(len(data)))
@@ -500,19 +785,12 @@ class UploadHandler(SimpleHTTPRequestHandler):
                 self.wfile.write(data)
                 return
 
-            # Issue session token
-            token = secrets.token_hex(32)
-            expires = datetime.utcnow() + timedelta(days=7)
-            conn2 = db_connect()
-            if conn2:
-                try:
-                    with conn2:
-                        with conn2.cursor() as cur2:
-                            cur2.execute("INSERT INTO sessions(token, user_id, expires_at) VALUES (%s, %s, %s)", (token, user['id'], expires))
-                finally:
-                    conn2.close()
+            self._log_user_id = user['id']
+            if not token:
+                self.send_error(503, 'Could not issue session')
+                return
             payload = { 'ok': True, 'user': user, 'token': token }
-            data = json.dumps(payload).encode('utf-8')
+            data = encode_json(payload)
             self.send_response(200)
             self.send_header('Content-Type', 'application/json')
             self.send_header('Content-Length', str(len(data)))
@@ -522,7 +800,7 @@ class UploadHandler(SimpleHTTPRequestHandler):
 
         # --- Users: Email verification complete (by token, POST) ---
         if self.path.startswith('/api/users/verify'):
-            if not DB_ENABLED:
+            if not STORE:
                 self.send_error(503, 'Database not available')
                 return
             try:
@@ -534,20 +812,143 @@ class UploadHandler(SimpleHTTPRequestHandler):
             except Exception as e:
                 self.send_error(400, f'Invalid request: {e}')
                 return
+            try:
+                ok = STORE.verify_email(token) is not None
+            except _storage.Unavailable:
+                self.send_error(503, 'Database connection failed')
+                return
+            data = encode_json({ 'ok': ok })
+            self.send_response(200 if ok else 404)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        # --- Notifications: mark read ({"ids": [...]} or {"all": true}) ---
+        if self.path == '/api/notifications/read':
+            if not DB_ENABLED:
+                self.send_error(503, 'Database not available')
+                return
+            user = self._get_user_by_token()
+            if not user:
+                self.send_error(401, 'Unauthorized')
+                return
+            try:
+                length = int(self.headers.get('Content-Length', '0'))
+                raw = self.rfile.read(length)
+                payload = json.loads(raw.decode('utf-8') or '{}')
+                ids = None if payload.get('all') is True else payload.get('ids', [])
+                if ids is not None and not isinstance(ids, list):
+                    raise ValueError('ids must be a list')
+            except Exception as e:
+                self.send_error(400, f'Invalid JSON: {e}')
+                return
             conn = db_connect()
             if not conn:
                 self.send_error(503, 'Database connection failed')
                 return
-            ok = False
             try:
-                with conn:
-                    with conn.cursor() as cur:
-                        cur.execute("UPDATE users SET email_verified = TRUE, email_verification_token = NULL WHERE email_verification_token = %s", (token,))
-                        ok = cur.rowcount > 0
+                unread = _notify.mark_read(conn, user['id'], ids)
             finally:
                 conn.close()
-            data = json.dumps({ 'ok': ok }).encode('utf-8')
-            self.send_response(200 if ok else 404)
+            data = encode_json({ 'ok': True, 'unread': unread })
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        # --- Rewards: redeem an item from the store ---
+        if self.path == '/api/rewards/redeem':
+            if not DB_ENABLED:
+                self.send_error(503, 'Database not available')
+                return
+            user = self._get_user_by_token()
+            if not user:
+                self.send_error(401, 'Unauthorized')
+                return
+            try:
+                length = int(self.headers.get('Content-Length', '0'))
+                raw = self.rfile.read(length)
+                payload = json.loads(raw.decode('utf-8') or '{}')
+                reward_id = (payload.get('reward_id') or '').strip()
+                key = (self.headers.get('Idempotency-Key') or payload.get('idempotency_key') or '').strip()
+                if not reward_id:
+                    raise ValueError('Provide reward_id')
+                if not _wallet.valid_client_key(key):
+                    raise ValueError('Provide an Idempotency-Key of 1-128 letters, digits, ".", "_" or "-"')
+            except Exception as e:
+                self.send_error(400, f'Invalid JSON: {e}')
+                return
+            reward = _wallet.get_rewards(DB_ROUTER.connect_read).get(reward_id)
+            if not reward:
+                self.send_error(404, 'Unknown reward')
+                return
+            conn = db_connect()
+            if not conn:
+                self.send_error(503, 'Database connection failed')
+                return
+            status = 200
+            try:
+                redemption, replayed = _wallet.redeem(conn, user['id'], reward, key)
+                body = { 'ok': True, 'replayed': replayed, 'redemption': redemption, 'wallet': redemption['balance'] }
+            except _wallet.InsufficientFunds as e:
+                status = 409
+                body = { 'ok': False, 'error': 'Not enough coins', 'wallet': e.balance }
+            except _wallet.KeyReused:
+                status = 422
+                body = { 'ok': False, 'error': 'Idempotency-Key already used for another reward' }
+            finally:
+                conn.close()
+            data = encode_json(body)
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        # --- Modules: grade a submission and award XP/coins once ---
+        m = re.match(r'^/api/modules/([^/?]+)/submit$', self.path)
+        if m:
+            if not STORE:
+                self.send_error(503, 'Database not available')
+                return
+            user = self._get_user_by_token()
+            if not user:
+                self.send_error(401, 'Unauthorized')
+                return
+            try:
+                length = int(self.headers.get('Content-Length', '0'))
+                raw = self.rfile.read(length)
+                answers = json.loads(raw.decode('utf-8') or '{}')
+                if not isinstance(answers, dict):
+                    raise ValueError('Expected an object of answers')
+            except Exception as e:
+                self.send_error(400, f'Invalid JSON: {e}')
+                return
+            module_id = m.group(1).lower()
+            entry = get_catalog().index.get(module_id)
+            if not entry:
+                self.send_error(404, 'Unknown module')
+                return
+            graded = _grading.grade(entry, answers)
+            body = { 'ok': True, 'complete': graded['complete'], 'results': graded['results'], 'awarded': None }
+            if graded['complete'] and answers.get('finish'):
+                try:
+                    award = STORE.award_completion(user['id'], module_id, entry)
+                except _storage.Unavailable:
+                    self.send_error(503, 'Database connection failed')
+                    return
+                if award:
+                    body['awarded'] = { 'xp': award['xp'], 'coins': award['coins'] }
+                    body['user'] = { k: award[k] for k in ('xp_total', 'level_idx', 'xp_in_level', 'wallet') }
+                else:
+                    body['already_completed'] = True
+            data = encode_json(body)
+            self.send_response(200)
             self.send_header('Content-Type', 'application/json')
             self.send_header('Content-Length', str(len(data)))
             self.end_headers()
@@ -570,9 +971,15 @@ class UploadHandler(SimpleHTTPRequestHandler):
             if not user or not user.get('is_admin'):
                 self.send_error(403, 'Admin authorization required')
                 return
-            ok = db_upsert_modules(mods)
+            added = _notify.new_module_ids(get_catalog().modules, mods) if DB_ENABLED else []
+            ok = db_upsert_modules(mods, added)
+            if ok:
+                set_catalog(mods)
+                if added:
+                    # Queued with the publish; the fan-out worker notifies every user in batches
+                    _notify.wake_fan_out()
             payload = { 'ok': bool(ok), 'source': 'neon' if ok else 'fallback' }
-            data = json.dumps(payload).encode('utf-8')
+            data = encode_json(payload)
             self.send_response(200)
             self.send_header('Content-Type', 'application/json')
             self.send_header('Content-Length', str(len(data)))
@@ -637,7 +1044,7 @@ class UploadHandler(SimpleHTTPRequestHandler):
         rel_path = f"uploads/{fname}"
 
         payload = { 'url': rel_url, 'path': rel_path, 'filename': fname }
-        data = json.dumps(payload).encode('utf-8')
+        data = encode_json(payload)
         self.send_response(200)
         self.send_header('Content-Type', 'application/json')
         self.send_header('Content-Length', str(len(data)))
@@ -645,8 +1052,150 @@ class UploadHandler(SimpleHTTPRequestHandler):
         self.wfile.write(data)
 
     def do_GET(self):
+        # --- Liveness / readiness for load balancers: 503 until warmup has finished ---
+        if self.path in ('/healthz', '/readyz'):
+            status = _warmup.STARTUP.status()
+            status['database'] = DB_BREAKER.state if DB_ENABLED else STORE.kind if STORE else 'disabled'
+            payload = status if self.path == '/readyz' else { 'ok': status['ready'] }
+            data = encode_json(payload)
+            self.send_response(200 if status['ready'] else 503)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Cache-Control', 'no-store')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        if self.path == '/metrics':
+            if METRICS_TOKEN and self._get_bearer_token() != METRICS_TOKEN:
+                self.send_error(401, 'Unauthorized')
+                return
+            data = _metrics.render_prometheus(_metrics.aggregate()).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        # --- Admin: time-boxed sampling profile of request threads ---
+        if self.path.split('?', 1)[0] == '/api/admin/profile':
+            user = self._get_user_by_token()
+            if not user or not user.get('is_admin'):
+                self.send_error(403, 'Admin authorization required')
+                return
+            params = parse_qs(urlsplit(self.path).query)
+            try:
+                seconds = float((params.get('seconds') or ['10'])[0])
+                hz = int((params.get('hz') or ['200'])[0])
+            except ValueError:
+                self.send_error(400, 'Invalid seconds/hz')
+                return
+            fmt = (params.get('format') or ['collapsed'])[0]
+            if fmt not in ('collapsed', 'pstats'):
+                self.send_error(400, 'format must be collapsed or pstats')
+                return
+            all_threads = (params.get('threads') or [''])[0] == 'all'
+            result = _profiler.capture(seconds, hz=hz, fmt=fmt, request_threads_only=not all_threads,
+                                       exclude={threading.get_ident()})
+            if result is None:
+                self.send_error(409, 'A profile capture is already running')
+                return
+            data, filename = result
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream' if fmt == 'pstats' else 'text/plain; charset=utf-8')
+            self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
         # --- Users: Get profile (by Authorization token) ---
         if self.path.startswith('/api/users/me'):
+            if not STORE:
+                self.send_error(503, 'Database not available')
+                return
+            user = self._get_user_by_token()
+            if not user:
+                self.send_error(401, 'Unauthorized')
+                return
+            data = encode_json(user)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        # --- Bootstrap: profile, catalog, unread count and rank in one response ---
+        if self.path.split('?', 1)[0] == '/api/bootstrap':
+            token = self._get_bearer_token()
+            user = position = None
+            if token:
+                if not STORE:
+                    self.send_error(503, 'Database not available')
+                    return
+                gen = _profiles.generation()
+                # Session, profile and leaderboard position in one statement
+                row = STORE.session_row(token, bootstrap=True)
+                if row:
+                    self._log_user_id = row[0]
+                    user, position = _bootstrap.user_from_row(row), int(row[11])
+                    _profiles.put(token, user, gen)
+                else:
+                    # Degraded mode: cached profile, no leaderboard position
+                    user = self._degraded_user(token)
+                if not user:
+                    self.send_error(401, 'Unauthorized')
+                    return
+            names = _bootstrap.requested(parse_qs(urlsplit(self.path).query), user is not None)
+            body = _bootstrap.build(
+                names, _bootstrap.known_etags(self.headers.get('If-None-Match')), user, position,
+                get_catalog() if 'catalog' in names else None,
+            )
+            data = encode_json(body)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            # Revalidation is per section (If-None-Match above), not for the whole body
+            self.send_header('Cache-Control', 'no-store')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        # --- Live updates: Server-Sent Events, handed off to the stream loop ---
+        if self.path.split('?', 1)[0] == '/api/stream':
+            if not DB_ENABLED:
+                self.send_error(503, 'Database not available')
+                return
+            # EventSource cannot set headers, so the token may come in the query
+            token = self._get_bearer_token() or parse_qs(urlsplit(self.path).query).get('token', [''])[0]
+            user = self._get_user_by_token(token)
+            if not user:
+                self.send_error(401, 'Unauthorized')
+                return
+            if _stream.STREAMS.count() >= _stream.SSE_MAX_CONNECTIONS:
+                self.send_error(503, 'Too many streams')
+                return
+            hello = _pubsub.encode_frame('hello', {
+                'xp_total': user['xp_total'], 'level_idx': user['level_idx'], 'xp_in_level': user['xp_in_level'],
+                'wallet': user['wallet'], 'unread': user.get('unread_notifications') or 0,
+                'catalog': get_catalog().version,
+            })
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-store')
+            self.send_header('X-Accel-Buffering', 'no')
+            self.end_headers()
+            # Detach the socket from this request thread; the loop owns it now
+            self.close_connection = True
+            sock = socket.socket(fileno=self.connection.detach())
+            if not _stream.STREAMS.adopt(sock, (_pubsub.user_topic(user['id']), _pubsub.GLOBAL_TOPIC), hello):
+                sock.close()
+            return
+
+        # --- Notifications: feed (keyset on id) and unread counter ---
+        if self.path.split('?', 1)[0] in ('/api/notifications', '/api/notifications/unread'):
             if not DB_ENABLED:
                 self.send_error(503, 'Database not available')
                 return
@@ -654,32 +1203,214 @@ class UploadHandler(SimpleHTTPRequestHandler):
             if not user:
                 self.send_error(401, 'Unauthorized')
                 return
-            data = json.dumps(user).encode('utf-8')
+            if self.path.startswith('/api/notifications/unread'):
+                # Counter rides along with the session lookup; no extra query
+                body = { 'unread': user.get('unread_notifications') or 0 }
+            else:
+                params = parse_qs(urlsplit(self.path).query)
+                try:
+                    cursor = int(params.get('cursor', ['0'])[0] or 0)
+                    limit = int(params.get('limit', [str(_notify.PAGE_SIZE)])[0])
+                except ValueError:
+                    self.send_error(400, 'cursor and limit must be integers')
+                    return
+                conn = DB_ROUTER.connect_read(user['id'])
+                if not conn:
+                    self.send_error(503, 'Database connection failed')
+                    return
+                try:
+                    body = _notify.feed(conn, user['id'], cursor or None, limit)
+                finally:
+                    conn.close()
+            data = encode_json(body)
             self.send_response(200)
             self.send_header('Content-Type', 'application/json')
+            self.send_header('Cache-Control', 'no-store')
             self.send_header('Content-Length', str(len(data)))
             self.end_headers()
             self.wfile.write(data)
             return
 
-        if self.path == '/api/modules':
-            mods = db_fetch_modules()
+        # --- Rewards: catalog and the caller's wallet history ---
+        if self.path == '/api/rewards':
+            items = sorted(_wallet.get_rewards(DB_ROUTER.connect_read if DB_ENABLED else None).values(), key=lambda r: (r['cost'], r['id']))
+            data = encode_json({ 'rewards': items })
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        if self.path.split('?', 1)[0] == '/api/rewards/history':
+            if not DB_ENABLED:
+                self.send_error(503, 'Database not available')
+                return
+            user = self._get_user_by_token()
+            if not user:
+                self.send_error(401, 'Unauthorized')
+                return
+            try:
+                limit = int(parse_qs(urlsplit(self.path).query).get('limit', ['50'])[0])
+            except ValueError:
+                limit = 50
+            conn = DB_ROUTER.connect_read(user['id'])
+            if not conn:
+                self.send_error(503, 'Database connection failed')
+                return
+            try:
+                entries = _wallet.history(conn, user['id'], limit)
+            finally:
+                conn.close()
+            data = encode_json({ 'wallet': user.get('wallet', 0), 'entries': entries })
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        if self.path.split('?', 1)[0] == '/api/modules':
+            cat = get_catalog()
+            full = parse_qs(urlsplit(self.path).query).get('full', [''])[0] in ('1', 'true')
+            if full:
+                # Admin editor needs the answers to re-publish them
+                user = self._get_user_by_token()
+                if not user or not user.get('is_admin'):
+                    self.send_error(403, 'Admin authorization required')
+                    return
+            etag = f'"{cat.version}{"-full" if full else ""}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
             # If no data in DB, return 200 with empty list (frontend will fallback to localStorage)
-            payload = mods if isinstance(mods, list) else []
-            data = json.dumps(payload).encode('utf-8')
+            data = encode_json(cat.modules if full else cat.public)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        # --- Admin analytics (materialized views, replica when configured) ---
+        if self.path.startswith('/api/admin/stats/'):
+            if not DB_ENABLED:
+                self.send_error(503, 'Database not available')
+                return
+            user = self._get_user_by_token()
+            if not user or not user.get('is_admin'):
+                self.send_error(403, 'Admin authorization required')
+                return
+            parts = urlsplit(self.path)
+            name = parts.path[len('/api/admin/stats/'):].strip('/')
+            if name not in _analytics.STATS:
+                self.send_error(404, 'Unknown stat')
+                return
+            try:
+                params = _analytics.stat_params(parse_qs(parts.query))
+            except ValueError:
+                self.send_error(400, 'limit and days must be integers')
+                return
+            conn = DB_ROUTER.connect_read()
+            if not conn:
+                self.send_error(503, 'Database connection failed')
+                return
+            try:
+                body = _analytics.read_stat(conn, name, params)
+            finally:
+                conn.close()
+            data = encode_json(body)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Cache-Control', 'private, max-age=30')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        # --- Admin export: gzip'd NDJSON/CSV streamed from a named cursor ---
+        if self.path.startswith('/api/admin/export/'):
+            if not DB_ENABLED:
+                self.send_error(503, 'Database not available')
+                return
+            user = self._get_user_by_token()
+            if not user or not user.get('is_admin'):
+                self.send_error(403, 'Admin authorization required')
+                return
+            parts = urlsplit(self.path)
+            dataset = parts.path[len('/api/admin/export/'):].strip('/')
+            if dataset not in _export.DATASETS:
+                self.send_error(404, 'Unknown dataset')
+                return
+            query = parse_qs(parts.query)
+            fmt = (query.get('format', ['ndjson'])[0] or 'ndjson').lower()
+            if fmt not in _export.FORMATS:
+                self.send_error(400, 'format must be ndjson or csv')
+                return
+            # Resume or increment from the created_at,id of the last row already held
+            after = _export.parse_watermark(query.get('after', [''])[0])
+            conn = DB_ROUTER.connect_read()
+            if not conn:
+                self.send_error(503, 'Database connection failed')
+                return
+            rows = _export.batches(conn, dataset, fmt, after)
+            started = time.time()
+            count = 0
+            def body():
+                nonlocal count
+                for data, _mark, n in rows:
+                    count += n
+                    yield data
+            chunks = _export.gzip_stream(body())
+            try:
+                # The query runs here, so a failure can still be a clean 503
+                first = next(chunks)
+            except Exception as e:
+                rows.close()
+                conn.close()
+                log_event('db', 'Export failed', dataset=dataset, error=str(e))
+                self.send_error(503, 'Export failed')
+                return
+            filename = f"{dataset}-{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}.{fmt}.gz"
+            try:
+                self._send_stream(itertools.chain((first,), chunks), (
+                    ('Content-Type', 'application/gzip'),
+                    ('Content-Disposition', f'attachment; filename="{filename}"'),
+                    ('Cache-Control', 'no-store'),
+                ))
+                log_event('db', 'Export streamed', dataset=dataset, rows=count, seconds=round(time.time() - started, 2))
+            except Exception as e:
+                # Headers are already out; dropping the connection without the last chunk marks the body incomplete
+                self.close_connection = True
+                log_event('db', 'Export aborted', dataset=dataset, rows=count, error=str(e))
+            finally:
+                rows.close()
+                conn.close()
+            return
+        # --- Asset manifest for the service worker (docs/sw.js) ---
+        if self.path.split('?', 1)[0] == '/asset-manifest.json':
+            data = get_asset_manifest()
             self.send_response(200)
             self.send_header('Content-Type', 'application/json')
+            self.send_header('Cache-Control', 'no-cache')
             self.send_header('Content-Length', str(len(data)))
             self.end_headers()
             self.wfile.write(data)
             return
         # Fallback to static file serving
+        self._static_cache = _offline.cache_control(self.path)
         return super().do_GET()
 
+    def do_HEAD(self):
+        self._static_cache = _offline.cache_control(self.path)
+        return super().do_HEAD()
+
     def do_PUT(self):
         # --- Users: Update progress (Authorization required) ---
         if self.path == '/api/users/progress':
-            if not DB_ENABLED:
+            if not STORE:
                 self.send_error(503, 'Database not available')
                 return
             try:
@@ -689,36 +1420,25 @@ class UploadHandler(SimpleHTTPRequestHandler):
                 xp_total = int(payload.get('xp_total') or 0)
                 level_idx = int(payload.get('level_idx') or 0)
                 xp_in_level = int(payload.get('xp_in_level') or 0)
-                wallet = int(payload.get('wallet') or 0)
+                _ranks.check(xp_total, level_idx, xp_in_level)
             except Exception as e:
-                self.send_error(400, f'Invalid JSON: {e}')
+                self.send_error(400, f'Invalid progress: {e}')
                 return
             user = self._get_user_by_token()
             if not user:
                 self.send_error(401, 'Unauthorized')
                 return
-            conn = db_connect()
-            if not conn:
+            try:
+                # XP is credited by course awards and the wallet by the ledger;
+                # the client's numbers are not written, it gets the server's back
+                progress = STORE.progress(user['id'])
+            except _storage.Unavailable:
                 self.send_error(503, 'Database connection failed')
                 return
-            ok = False
-            try:
-                with conn:
-                    with conn.cursor() as cur:
-                        cur.execute(
-                            """
-                            UPDATE users
-                            SET xp_total = %s, level_idx = %s, xp_in_level = %s, wallet = %s
-                            WHERE id = %s
-                            """,
-                            (xp_total, level_idx, xp_in_level, wallet, user['id'])
-                        )
-                        ok = cur.rowcount > 0
-            finally:
-                conn.close()
+            ok = progress is not None
 
-            resp = { 'ok': ok }
-            data = json.dumps(resp).encode('utf-8')
+            resp = dict(progress or {}, ok=ok)
+            data = encode_json(resp)
             self.send_response(200 if ok else 404)
             self.send_header('Content-Type', 'application/json')
             self.send_header('Content-Length', str(len(data)))
@@ -728,9 +1448,11 @@ class UploadHandler(SimpleHTTPRequestHandler):
 
         # --- Users: Email verification start ---
         if self.path == '/api/users/verify/start':
-            if not DB_ENABLED:
+            if not STORE:
                 self.send_error(503, 'Database not available')
                 return
+            if self._rate_limited('verify_start'):
+                return
             try:
                 length = int(self.headers.get('Content-Length', '0'))
                 raw = self.rfile.read(length)
@@ -741,20 +1463,15 @@ class UploadHandler(SimpleHTTPRequestHandler):
             except Exception as e:
                 self.send_error(400, f'Invalid JSON: {e}')
                 return
+            if self._rate_limited('verify_start', identity):
+                return
             token = secrets.token_urlsafe(32)
-            conn = db_connect()
-            if not conn:
+            try:
+                ok = STORE.set_verification_token(identity, token)
+            except _storage.Unavailable:
                 self.send_error(503, 'Database connection failed')
                 return
-            ok = False
-            try:
-                with conn:
-                    with conn.cursor() as cur:
-                        cur.execute("UPDATE users SET email_verification_token = %s WHERE email = %s", (token, identity))
-                        ok = cur.rowcount > 0
-            finally:
-                conn.close()
-            data = json.dumps({ 'ok': ok, 'token': token if ok else None }).encode('utf-8')
+            data = encode_json({ 'ok': ok, 'token': token if ok else None })
             self.send_response(200 if ok else 404)
             self.send_header('Content-Type', 'application/json')
             self.send_header('Content-Length', str(len(data)))
@@ -764,7 +1481,7 @@ class UploadHandler(SimpleHTTPRequestHandler):
 
         # --- Users: Email verification complete (by token) ---
         if self.path.startswith('/api/users/verify'):
-            if not DB_ENABLED:
+            if not STORE:
                 self.send_error(503, 'Database not available')
                 return
             try:
@@ -776,19 +1493,12 @@ class UploadHandler(SimpleHTTPRequestHandler):
             except Exception as e:
                 self.send_error(400, f'Invalid request: {e}')
                 return
-            conn = db_connect()
-            if not conn:
+            try:
+                ok = STORE.verify_email(token) is not None
+            except _storage.Unavailable:
                 self.send_error(503, 'Database connection failed')
                 return
-            ok = False
-            try:
-                with conn:
-                    with conn.cursor() as cur:
-                        cur.execute("UPDATE users SET email_verified = TRUE, email_verification_token = NULL WHERE email_verification_token = %s", (token,))
-                        ok = cur.rowcount > 0
-            finally:
-                conn.close()
-            data = json.dumps({ 'ok': ok }).encode('utf-8')
+            data = encode_json({ 'ok': ok })
             self.send_response(200 if ok else 404)
             self.send_header('Content-Type', 'application/json')
             self.send_header('Content-Length', str(len(data)))
@@ -798,9 +1508,11 @@ class UploadHandler(SimpleHTTPRequestHandler):
 
         # --- Users: Password reset start ---
         if self.path == '/api/users/reset/start':
-            if not DB_ENABLED:
+            if not STORE:
                 self.send_error(503, 'Database not available')
                 return
+            if self._rate_limited('reset_start'):
+                return
             try:
                 length = int(self.headers.get('Content-Length', '0'))
                 raw = self.rfile.read(length)
@@ -811,21 +1523,16 @@ class UploadHandler(SimpleHTTPRequestHandler):
             except Exception as e:
                 self.send_error(400, f'Invalid JSON: {e}')
                 return
+            if self._rate_limited('reset_start', identity):
+                return
             token = secrets.token_urlsafe(32)
             expires = datetime.utcnow() + timedelta(hours=1)
-            conn = db_connect()
-            if not conn:
+            try:
+                ok = STORE.set_reset_token(identity, token, expires)
+            except _storage.Unavailable:
                 self.send_error(503, 'Database connection failed')
                 return
-            ok = False
-            try:
-                with conn:
-                    with conn.cursor() as cur:
-                        cur.execute("UPDATE users SET reset_token = %s, reset_token_expires = %s WHERE email = %s", (token, expires, identity))
-                        ok = cur.rowcount > 0
-            finally:
-                conn.close()
-            data = json.dumps({ 'ok': ok, 'token': token if ok else None }).encode('utf-8')
+            data = encode_json({ 'ok': ok, 'token': token if ok else None })
             self.send_response(200 if ok else 404)
             self.send_header('Content-Type', 'application/json')
             self.send_header('Content-Length', str(len(data)))
@@ -835,7 +1542,7 @@ class UploadHandler(SimpleHTTPRequestHandler):
 
         # --- Users: Password reset complete ---
         if self.path == '/api/users/reset/complete':
-            if not DB_ENABLED:
+            if not STORE:
                 self.send_error(503, 'Database not available')
                 return
             try:
@@ -849,31 +1556,14 @@ class UploadHandler(SimpleHTTPRequestHandler):
             except Exception as e:
                 self.send_error(400, f'Invalid JSON: {e}')
                 return
-            # Hash new password
-            if bcrypt:
-                pwd_hash = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-            else:
-                pwd_hash = hashlib.sha256(new_password.encode('utf-8')).hexdigest()
-            conn = db_connect()
-            if not conn:
+            pwd_hash = hash_password(new_password)
+            try:
+                # Also revokes every session of the user
+                ok = STORE.reset_password(token, pwd_hash) is not None
+            except _storage.Unavailable:
                 self.send_error(503, 'Database connection failed')
                 return
-            ok = False
-            try:
-                with conn:
-                    with conn.cursor() as cur:
-                        cur.execute(
-                            """
-                            UPDATE users
-                            SET password_hash = %s, reset_token = NULL, reset_token_expires = NULL
-                            WHERE reset_token = %s AND reset_token_expires > NOW()
-                            """,
-                            (pwd_hash, token)
-                        )
-                        ok = cur.rowcount > 0
-            finally:
-                conn.close()
-            data = json.dumps({ 'ok': ok }).encode('utf-8')
+            data = encode_json({ 'ok': ok })
             self.send_response(200 if ok else 400)
             self.send_header('Content-Type', 'application/json')
             self.send_header('Content-Length', str(len(data)))
@@ -883,7 +1573,7 @@ class UploadHandler(SimpleHTTPRequestHandler):
 
         # --- Users: Activity log create ---
         if self.path == '/api/users/activity':
-            if not DB_ENABLED:
+            if not STORE:
                 self.send_error(503, 'Database not available')
                 return
             user = self._get_user_by_token()
@@ -894,34 +1584,18 @@ class UploadHandler(SimpleHTTPRequestHandler):
                 length = int(self.headers.get('Content-Length', '0'))
                 raw = self.rfile.read(length)
                 payload = json.loads(raw.decode('utf-8'))
-                course_id = (payload.get('course_id') or '').strip()
-                event_type = (payload.get('event_type') or '').strip() or 'course_completed'
-                xp_awarded = int(payload.get('xp_awarded') or 0)
-                coins_awarded = int(payload.get('coins_awarded') or 0)
-                metadata = payload.get('metadata') if isinstance(payload.get('metadata'), (dict, list)) else None
+                log_id, course_id, event_type, xp_awarded, coins_awarded, metadata = \
+                    _offline.activity_fields(str(uuid.uuid4()), payload)
             except Exception as e:
                 self.send_error(400, f'Invalid JSON: {e}')
                 return
-            log_id = str(uuid.uuid4())
-            conn = db_connect()
-            if not conn:
+            try:
+                STORE.log_activity(log_id, user['id'], course_id, event_type, xp_awarded, coins_awarded, metadata)
+            except _storage.Unavailable:
                 self.send_error(503, 'Database connection failed')
                 return
-            ok = False
-            try:
-                with conn:
-                    with conn.cursor() as cur:
-                        cur.execute(
-                            """
-                            INSERT INTO activity_logs(id, user_id, course_id, event_type, xp_awarded, coins_awarded, metadata)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s::jsonb)
-                            """,
-                            (log_id, user['id'], course_id or None, event_type, xp_awarded, coins_awarded, json.dumps(metadata) if metadata is not None else None)
-                        )
-                        ok = True
-            finally:
-                conn.close()
-            data = json.dumps({ 'ok': ok, 'id': log_id }).encode('utf-8')
+            ok = True
+            data = encode_json({ 'ok': ok, 'id': log_id })
             self.send_response(200 if ok else 500)
             self.send_header('Content-Type', 'application/json')
             self.send_header('Content-Length', str(len(data)))
@@ -930,14 +1604,78 @@ class UploadHandler(SimpleHTTPRequestHandler):
             return
 
 
+class AppServer(ThreadingHTTPServer):
+    # Room for reconnect bursts from /api/stream clients (the default backlog is 5)
+    request_queue_size = int(os.environ.get('LISTEN_BACKLOG', '1024'))
+
+
+def warmup():
+    """Open and prepare pooled sessions, load the catalog and hash once, then report ready."""
+    startup = _warmup.STARTUP
+    if DB_ENABLED:
+        for pool in (_primary_pool, _replica_pool):
+            if pool:
+                startup.phase(f'pool_{pool.name}', _warmup.warm_pool, pool, _prepared.prepare_all)
+    if STORE:
+        startup.phase('catalog', get_catalog, True)
+    startup.phase('assets', get_asset_manifest)
+    startup.phase('bcrypt', hash_password, 'warmup')
+    startup.finish()
+
+
+def start_background(singletons: bool = True):
+    """Background threads of one serving process; `singletons` are the ones a single worker runs."""
+    if not DB_ENABLED:
+        return
+    # Cross-instance fan-in for /api/stream events
+    _pubsub.start_bridge(db_connect_direct)
+    if not singletons:
+        return
+    if SMTP_HOST and SMTP_USER and SMTP_PASS and SMTP_FROM:
+        # Sends mail queued in email_outbox (e.g. by scripts/import_users.py)
+        _outbox.start_sender(db_connect, send_email)
+    # New-module announcements queued in notify_fanout
+    _notify.start_fan_out_worker(db_connect)
+    _analytics.start_refresher(db_connect)
+
+
 if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description='Serve docs/ and the API.')
+    ap.add_argument('--workers', type=int, default=_prefork.WEB_CONCURRENCY,
+                    help='Pre-forked worker processes (default: WEB_CONCURRENCY or 1)')
+    args = ap.parse_args()
+    if args.workers > 1 and STORE and STORE.kind == 'sqlite':
+        # One writer thread owns the file (lib/_sqlite.py)
+        ap.error('--workers needs Postgres; SQLite mode runs a single process')
     port = int(os.environ.get('PORT', '8000'))
-    db_init()
-    httpd = ThreadingHTTPServer(('', port), UploadHandler)
+    _warmup.STARTUP.phase('db_init', db_init)
+    _ratelimit.configure(db_connect if DB_ENABLED else None)
+    if args.workers > 1:
+        # Workers must not share the sessions db_init() left in the pools
+        for pool in (_primary_pool, _replica_pool):
+            if pool:
+                pool.close_idle()
+
+        def start_worker(slot):
+            start_background(singletons=slot == 0)
+            warmup()
+
+        supervisor = _prefork.Supervisor(AppServer, UploadHandler, ('', port), args.workers,
+                                         on_worker_start=start_worker)
+        print(f"Serving docs on port {supervisor.address[1]} with {args.workers} workers")
+        sys.exit(supervisor.run())
+    start_background()
+    httpd = AppServer(('', port), UploadHandler)
+    # Listen right away so /healthz and /readyz can say "not yet" while warming up
+    threading.Thread(target=warmup, name='warmup', daemon=True).start()
     print(f"Serving docs on port {port} with upload endpoint at /upload and API /api/modules")
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
         pass
     finally:
-        httpd.server_close()
\ No newline at end of file
+        httpd.server_close()
+        if STORE:
+            STORE.close()
+        _accesslog.ACCESS_LOG.flush()